@@ -4,7 +4,12 @@ from torch import nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 from macad_gym.viz.logger import LOG
+from macad_gym.core.utils.observation import ObservationLayout
+from algs.util.lane_encoder import lane_wise_cross_attention_encoder, FusedLaneEncoder, match_lane_encoder_layout
+from algs.util.target_update import TargetUpdater, soft_update, hard_update
+from algs.util.checkpoint import save_policy, is_policy, load_policy, replay_metadata, restore_replay_metadata
 from algs.pdqn import PolicyNet_multi, PriReplayBuffer
+from algs.util.replay_buffer import stack_field, object_field
 
 class veh_lane_encoder(torch.nn.Module):
     def __init__(self, state_dim, train=True):
@@ -29,55 +34,21 @@ class veh_lane_encoder(torch.nn.Module):
         state_enc = F.relu(self.agg(state_cat))
         return state_enc
 
-class lane_wise_cross_attention_encoder(torch.nn.Module):
-    def __init__(self, state_dim, train=True):
-        super().__init__()
-        self.state_dim = state_dim
-        self.train = train
-        self.hidden_size = 64
-        self.lane_encoder = nn.Linear(state_dim['waypoints'], self.hidden_size)
-        self.veh_encoder = nn.Linear(state_dim['companion_vehicle'] * 2, self.hidden_size)
-        self.light_encoder = nn.Linear(state_dim['light'], self.hidden_size)
-        self.ego_encoder = nn.Linear(state_dim['hero_vehicle'], self.hidden_size)
-        self.w = nn.Linear(self.hidden_size, self.hidden_size)
-        self.ego_a = nn.Linear(self.hidden_size, 1)
-        self.ego_o = nn.Linear(self.hidden_size, 1)
-        self.leaky_relu = nn.LeakyReLU(negative_slope=0.1)
-
-    def forward(self, lane_veh, ego_info):
-        batch_size = lane_veh.shape[0]
-        lane = lane_veh[:, :self.state_dim["waypoints"]]
-        veh = lane_veh[:, self.state_dim["waypoints"]:-self.state_dim['light']]
-        light = lane_veh[:, -self.state_dim['light']:]
-        # print('ego_info.shape: ', ego_info.shape)
-        ego_enc = self.w(F.relu(self.ego_encoder(ego_info)))
-        lane_enc = self.w(F.relu(self.lane_encoder(lane)))
-        veh_enc = self.w(F.relu(self.veh_encoder(veh)))
-        light_enc = self.w(F.relu(self.light_encoder(light)))
-        state_enc = torch.cat((lane_enc, veh_enc, light_enc), 1).reshape(batch_size, 3, self.hidden_size)
-        # _enc: [batch_size, 32]
-        score_lane = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(lane_enc))
-        score_veh = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(veh_enc))
-        score_light = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(light_enc))
-        # score_: [batch_size, 1]
-        score = torch.cat((score_lane, score_veh, score_light), 1)
-        score = F.softmax(score, 1).reshape(batch_size, 1, 3)
-        state_enc = torch.matmul(score, state_enc).reshape(batch_size, self.hidden_size)
-        # state_enc: [N, 64]
-        return state_enc
-
-
 class PolicyNet_multi(torch.nn.Module):
-    def __init__(self, state_dim, action_parameter_size, action_bound, train=True) -> None:
+    def __init__(self, state_dim, action_parameter_size, action_bound, train=True, fused=False) -> None:
         # the action bound and state_dim here are dicts
         super().__init__()
         self.state_dim = state_dim
         self.action_bound = action_bound
         self.action_parameter_size = action_parameter_size
         self.train = train
-        self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+        self.fused = fused
+        if fused:
+            self.fused_encoder = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder = nn.Linear(self.state_dim['hero_vehicle'], 64)
         self.fc = nn.Linear(256, 256)
         self.fc_out = nn.Linear(256, self.action_parameter_size)
@@ -95,11 +66,15 @@ class PolicyNet_multi(torch.nn.Module):
         # print(state.shape, one_state_dim)
         ego_info = state[:, 3*one_state_dim:]
         # print(ego_info.shape)
-        left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
-        center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc = self.fused_encoder(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
+            center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc = torch.cat((left_enc, center_enc, right_enc), dim=1)
         ego_enc = self.ego_encoder(ego_info)
-        state_ = torch.cat((left_enc, center_enc, right_enc, ego_enc), dim=1)
+        state_ = torch.cat((lanes_enc, ego_enc), dim=1)
         hidden = F.relu(self.fc(state_))
         action = torch.tanh(self.fc_out(hidden))
         # steer,throttle_brake=torch.split(out,split_size_or_sections=[1,1],dim=1)
@@ -120,15 +95,19 @@ class PolicyNet_multi(torch.nn.Module):
 
 
 class QValueNet_multi(torch.nn.Module):
-    def __init__(self, state_dim, action_param_dim, num_actions) -> None:
+    def __init__(self, state_dim, action_param_dim, num_actions, fused=False) -> None:
         # parameter state_dim here is a dict
         super().__init__()
         self.state_dim = state_dim
         self.action_param_dim = action_param_dim
         self.num_actions = num_actions
-        self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+        self.fused = fused
+        if fused:
+            self.fused_encoder = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder = nn.Linear(self.state_dim['hero_vehicle'], 32)
         self.action_encoder = nn.Linear(self.action_param_dim, 32)
         self.fc = nn.Linear(256, 256)
@@ -142,35 +121,46 @@ class QValueNet_multi(torch.nn.Module):
     def forward(self, state, action):
         one_state_dim = self.state_dim['waypoints'] + self.state_dim['companion_vehicle'] * 2 + self.state_dim['light']
         ego_info = state[:, 3*one_state_dim:]
-        left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
-        center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc = self.fused_encoder(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
+            center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc = torch.cat((left_enc, center_enc, right_enc), dim=1)
         ego_enc = self.ego_encoder(ego_info)
         action_enc = self.action_encoder(action)
-        state_ = torch.cat((left_enc, center_enc, right_enc, ego_enc, action_enc), dim=1)
+        state_ = torch.cat((lanes_enc, ego_enc, action_enc), dim=1)
         hidden = F.relu(self.fc(state_))
         out = self.fc_out(hidden)
         return out
 
 
 class QValueNet_multi_td3(torch.nn.Module):
-    def __init__(self, state_dim, action_param_dim, num_actions) -> None:
+    def __init__(self, state_dim, action_param_dim, num_actions, fused=False) -> None:
         # parameter state_dim here is a dict
         super().__init__()
         self.state_dim = state_dim
         self.action_param_dim = action_param_dim
         self.num_actions = num_actions
-        self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+        self.fused = fused
+        if fused:
+            self.fused_encoder = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder = nn.Linear(self.state_dim['hero_vehicle'], 32)
         self.action_encoder = nn.Linear(self.action_param_dim, 32)
         self.fc = nn.Linear(256, 256)
         self.fc_out = nn.Linear(256, self.num_actions)
 
-        self.left_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
+        if fused:
+            self.fused_encoder2 = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder2 = nn.Linear(self.state_dim['hero_vehicle'], 32)
         self.action_encoder2 = nn.Linear(self.action_param_dim, 32)
         self.fc2 = nn.Linear(256, 256)
@@ -185,21 +175,29 @@ class QValueNet_multi_td3(torch.nn.Module):
         one_state_dim = self.state_dim['waypoints'] + self.state_dim['companion_vehicle'] * 2 + self.state_dim['light']
         ego_info = state[:, 3*one_state_dim:]
 
-        left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
-        center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc = self.fused_encoder(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
+            center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc = torch.cat((left_enc, center_enc, right_enc), dim=1)
         ego_enc = self.ego_encoder(ego_info)
         action_enc = self.action_encoder(action)
-        state_ = torch.cat((left_enc, center_enc, right_enc, ego_enc, action_enc), dim=1)
+        state_ = torch.cat((lanes_enc, ego_enc, action_enc), dim=1)
         hidden = F.relu(self.fc(state_))
         out = self.fc_out(hidden)
 
-        left_enc2 = self.left_encoder2(state[:, :one_state_dim], ego_info)
-        center_enc2 = self.center_encoder2(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc2 = self.right_encoder2(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc2 = self.fused_encoder2(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc2 = self.left_encoder2(state[:, :one_state_dim], ego_info)
+            center_enc2 = self.center_encoder2(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc2 = self.right_encoder2(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc2 = torch.cat((left_enc2, center_enc2, right_enc2), dim=1)
         ego_enc2 = self.ego_encoder2(ego_info)
         action_enc2 = self.action_encoder2(action)
-        state_2 = torch.cat((left_enc2, center_enc2, right_enc2, ego_enc2, action_enc2), dim=1)
+        state_2 = torch.cat((lanes_enc2, ego_enc2, action_enc2), dim=1)
         hidden2 = F.relu(self.fc(state_2))
         out2 = self.fc_out(hidden2)
         return out, out2
@@ -207,12 +205,14 @@ class QValueNet_multi_td3(torch.nn.Module):
 
 class P_DQN:
     def __init__(self, state_dim, action_dim, action_bound, gamma, tau, sigma, sigma_steer, sigma_acc, theta, epsilon,
-                 buffer_size, batch_size, actor_lr, critic_lr, clip_grad, zero_index_gradients, inverting_gradients, per_flag,device) -> None:
+                 buffer_size, batch_size, actor_lr, critic_lr, clip_grad, zero_index_gradients, inverting_gradients, per_flag,device,
+                 fused_encoder=False, target_update_every=1) -> None:
         self.learn_time = 0
         self.replace_a = 0
         self.replace_c = 0
         self.s_dim = state_dim  # state_dim here is a dict
         self.s_dim['waypoints'] *= 3  # 2 is the feature dim of each waypoint
+        self.obs_layout = ObservationLayout(**self.s_dim)
         self.a_dim, self.a_bound = action_dim, action_bound
         self.theta = theta
         self.num_actions = 3  # left change, lane follow, right change
@@ -231,6 +231,12 @@ class P_DQN:
         self.indexd = zero_index_gradients
         self.zero_index_gradients = zero_index_gradients
         self.inverting_gradients = inverting_gradients
+        # device copies of the action parameter bounds and of the action each parameter belongs to
+        self.action_parameter_max = torch.as_tensor(self.action_parameter_max_numpy, dtype=torch.float32, device=self.device)
+        self.action_parameter_min = torch.as_tensor(self.action_parameter_min_numpy, dtype=torch.float32, device=self.device)
+        self.action_parameter_range = torch.as_tensor(self.action_parameter_range_numpy, dtype=torch.float32, device=self.device)
+        self.action_parameter_action = torch.as_tensor(np.repeat(np.arange(self.num_actions), self.action_parameter_sizes),
+                                                       device=self.device)
         self.add_actor_noise = False
         self.td3 = False
         self.policy_freq = 2
@@ -247,21 +253,24 @@ class P_DQN:
             dtype=torch.float32).to(self.device)"""
         self.pointer = 0  # serve as updating the memory data
         self.train = True
-        self.actor = PolicyNet_multi(self.s_dim, self.action_parameter_size, self.a_bound).to(self.device)
-        self.actor_target = PolicyNet_multi(self.s_dim, self.action_parameter_size, self.a_bound).to(self.device)
+        self.actor = PolicyNet_multi(self.s_dim, self.action_parameter_size, self.a_bound, fused=fused_encoder).to(self.device)
+        self.actor_target = PolicyNet_multi(self.s_dim, self.action_parameter_size, self.a_bound, fused=fused_encoder).to(self.device)
         self.actor_target.load_state_dict(self.actor.state_dict())
         if not self.td3:
-            self.critic = QValueNet_multi(self.s_dim, self.action_parameter_size, self.num_actions).to(self.device)
-            self.critic_target = QValueNet_multi(self.s_dim, self.action_parameter_size, self.num_actions).to(self.device)
+            self.critic = QValueNet_multi(self.s_dim, self.action_parameter_size, self.num_actions, fused=fused_encoder).to(self.device)
+            self.critic_target = QValueNet_multi(self.s_dim, self.action_parameter_size, self.num_actions, fused=fused_encoder).to(self.device)
         else:
-            self.critic = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions).to(self.device)
-            self.critic_target = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions).to(self.device)
+            self.critic = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions, fused=fused_encoder).to(self.device)
+            self.critic_target = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions, fused=fused_encoder).to(self.device)
         # self.actor = PolicyNet(self.s_dim, self.a_bound).to(self.device)
         # self.actor_target = PolicyNet(self.s_dim, self.a_bound).to(self.device)
         # self.actor_target.load_state_dict(self.actor.state_dict())
         # self.critic = QValueNet(self.s_dim, self.a_dim).to(self.device)
         # self.critic_target = QValueNet(self.s_dim, self.a_dim).to(self.device)
         self.critic_target.load_state_dict(self.critic.state_dict())
+        # actor and critic targets are averaged in one fused update every target_update_every actor updates
+        self.target_updater = TargetUpdater([(self.actor, self.actor_target), (self.critic, self.critic_target)],
+                                            self.tau, target_update_every)
 
         self.actor_optimizer = torch.optim.Adam(self.actor.parameters(), lr=actor_lr)
         self.critic_optimizer = torch.optim.Adam(self.critic.parameters(), lr=critic_lr)
@@ -275,20 +284,7 @@ class P_DQN:
 
     def take_action(self, state, lane_id=-2, action_mask=False):
         # print('vehicle_info', state['vehicle_info'])
-        state_left_wps = torch.tensor(state['left_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_center_wps = torch.tensor(state['center_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_right_wps = torch.tensor(state['right_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_left_front = torch.tensor(state['vehicle_info'][0], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_front = torch.tensor(state['vehicle_info'][1], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_right_front = torch.tensor(state['vehicle_info'][2], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_left_rear = torch.tensor(state['vehicle_info'][3], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_rear = torch.tensor(state['vehicle_info'][4], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_right_rear = torch.tensor(state['vehicle_info'][5], dtype=torch.float32).view(1, -1).to(self.device)
-        state_light = torch.tensor(state['light'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_ev = torch.tensor(state['hero_vehicle'],dtype=torch.float32).view(1,-1).to(self.device)
-        state_ = torch.cat((state_left_wps, state_veh_left_front, state_veh_left_rear, state_light,
-                            state_center_wps, state_veh_front, state_veh_rear, state_light,
-                            state_right_wps, state_veh_right_front, state_veh_right_rear, state_light, state_ev), dim=1)
+        state_ = torch.as_tensor(self.obs_layout.flat(state)).view(1, -1).to(self.device)
         # print(state_.shape)
         all_action_param = self.actor(state_)
         if not self.td3:
@@ -331,35 +327,19 @@ class P_DQN:
 
     def _zero_index_gradients(self, grad, batch_action_indices, inplace=True):
         assert grad.shape[0] == batch_action_indices.shape[0]
-        grad = grad.cpu()
-
         if not inplace:
             grad = grad.clone()
         with torch.no_grad():
-            ind = torch.zeros(self.action_parameter_size, dtype=torch.long)
-            for a in range(self.num_actions):
-                ind[self.action_parameter_offsets[a]:self.action_parameter_offsets[a+1]] = a
-            # ind_tile = np.tile(ind, (self.batch_size, 1))
-            ind_tile = ind.repeat(self.batch_size, 1).to(self.device)
-            actual_index = ind_tile != batch_action_indices
-            # print('actual_index: ', actual_index)
-            grad[actual_index] = 0.
+            # zero the gradient of every action parameter that does not belong to the taken action
+            grad.masked_fill_(self.action_parameter_action != batch_action_indices.view(-1, 1), 0.)
         return grad
 
     def _invert_gradients(self, grad, vals, grad_type, inplace=True):
         if grad_type == "action_parameters":
-            max_p = torch.from_numpy(self.action_parameter_max_numpy)
-            min_p = torch.from_numpy(self.action_parameter_min_numpy)
-            rnge = torch.from_numpy(self.action_parameter_range_numpy)
+            max_p, min_p, rnge = self.action_parameter_max, self.action_parameter_min, self.action_parameter_range
         else:
             raise ValueError("Unhandled grad_type: '"+str(grad_type) + "'")
 
-        max_p = max_p.cpu()
-        min_p = min_p.cpu()
-        rnge = rnge.cpu()
-        grad = grad.cpu()
-        vals = vals.cpu()
-
         assert grad.shape == vals.shape
 
         if not inplace:
@@ -367,8 +347,7 @@ class P_DQN:
         with torch.no_grad():
             # index = grad < 0  # actually > but Adam minimises, so reversed (could also double negate the grad)
             index = grad > 0
-            grad[index] *= (index.float() * (max_p - vals) / rnge)[index]
-            grad[~index] *= ((~index).float() * (vals - min_p) / rnge)[~index]
+            grad.mul_(torch.where(index, max_p - vals, vals - min_p) / rnge)
 
         return grad
 
@@ -464,8 +443,7 @@ class P_DQN:
             if self.clip_grad > 0:
                 torch.nn.utils.clip_grad_norm_(self.actor.parameters(), self.clip_grad)
             self.actor_optimizer.step()
-            self.soft_update(self.actor, self.actor_target)
-            self.soft_update(self.critic, self.critic_target)
+            self.target_updater.step()
 
         return loss_q.detach().cpu().numpy()
 
@@ -485,34 +463,15 @@ class P_DQN:
         # self.tb_noise.reset()
 
     def soft_update(self, net, target_net):
-        for param_target, param in zip(target_net.parameters(), net.parameters()):
-            param_target.data.copy_(param_target.data * (1.0 - self.tau) + param.data * self.tau)
+        soft_update(net, target_net, self.tau)
 
     def hard_update(self, net, target_net):
-        net.load_state_dict(target_net.state_dict())
+        hard_update(net, target_net)
 
     def store_transition(self, state, action, action_param, reward, next_state, truncated, done, info):  
         # how to store the episodic data to buffer
-        def _compress(state):
-            # print('state: ', state)
-            state_left_wps = np.array(state['left_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_center_wps = np.array(state['center_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_right_wps = np.array(state['right_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_veh_left_front = np.array(state['vehicle_info'][0], dtype=np.float32).reshape((1, -1))
-            state_veh_front = np.array(state['vehicle_info'][1], dtype=np.float32).reshape((1, -1))
-            state_veh_right_front = np.array(state['vehicle_info'][2], dtype=np.float32).reshape((1, -1))
-            state_veh_left_rear = np.array(state['vehicle_info'][3], dtype=np.float32).reshape((1, -1))
-            state_veh_rear = np.array(state['vehicle_info'][4], dtype=np.float32).reshape((1, -1))
-            state_veh_right_rear = np.array(state['vehicle_info'][5], dtype=np.float32).reshape((1, -1))
-            state_ev = np.array(state['hero_vehicle'], dtype=np.float32).reshape((1, -1))
-            state_light = np.array(state['light'], dtype=np.float32).reshape((1, -1))
-            state_ = np.concatenate((state_left_wps, state_veh_left_front, state_veh_left_rear, state_light,
-                                        state_center_wps, state_veh_front, state_veh_rear, state_light,
-                                        state_right_wps, state_veh_right_front, state_veh_right_rear, state_light, state_ev), axis=1)
-            return state_
-
-        state=_compress(state)
-        next_state=_compress(next_state)
+        state=self.obs_layout.flat(state).reshape((1, -1))
+        next_state=self.obs_layout.flat(next_state).reshape((1, -1))
 
         # if reward_ttc < -0.1 or reward_eff < 3:
         #     self.change_buffer.append((state, action, action_param, reward, next_state, truncated, done))
@@ -530,32 +489,77 @@ class P_DQN:
 
         return
 
+    def _compress_batch(self, states):
+        if isinstance(states, np.ndarray) and states.dtype != object:
+            return states.reshape((len(states), 1, -1))     # flat already
+        return np.stack([self.obs_layout.flat(state).reshape((1, -1)) for state in states])
+
+    def stack_transitions(self, transitions):
+        """
+        One float32 array per field of a batch given as field columns in the order of store_transition's
+        arguments, with flat states and the infos in an object array. This is what store_transitions takes and it
+        is cheaper to send between processes than the observations.
+        """
+        state, action, action_param, reward, next_state, truncated, done, info = transitions
+        return (self._compress_batch(state), stack_field(action), stack_field(action_param), stack_field(reward),
+                self._compress_batch(next_state), stack_field(truncated), stack_field(done), object_field(info))
+
+    def store_transitions(self, transitions):
+        """Store a batch of transitions in one bulk insert, transitions as taken by stack_transitions"""
+        if len(transitions[0]) == 0:
+            return
+        state, action, action_param, reward, next_state, truncated, done, info = self.stack_transitions(transitions)
+        columns = (state, action, action_param, reward, next_state, truncated, done)
+        if not self.per_flag:
+            change = (action == 0) | (action == 2)
+            self.replay_buffer.add_batch([column[change] for column in columns], False)
+            self.replay_buffer.add_batch(columns, True)
+        else:
+            self.replay_buffer.add_batch(columns + (info,))
+
     def save_net(self,file = None):
+        """Full training checkpoint to resume from, see save_policy for workers and evaluators"""
         state = {
             'actor': self.actor.state_dict(),
             'actor_target':self.actor_target.state_dict(),
             'critic': self.critic.state_dict(),
             'critic_target':self.critic_target.state_dict(),
             'actor_optimizer': self.actor_optimizer.state_dict(),
-            'critic_optimizer': self.critic_optimizer.state_dict()
+            'critic_optimizer': self.critic_optimizer.state_dict(),
+            'learn_time': self.learn_time,
+            'target_update_count': self.target_updater.count,
+            'replay_buffer': replay_metadata(self.replay_buffer)
         }
         torch.save(state, file)
 
+    def save_policy(self, file, half=False):
+        """Inference snapshot with the actor and critic weights only, in float16 when half"""
+        save_policy(file, {'actor': self.actor, 'critic': self.critic},
+                    torch.float16 if half else torch.float32, {'learn_time': self.learn_time})
+
     def load_net(self, file = None, map_location = torch.device('cpu')):
+        """Load a training checkpoint of save_net or an inference snapshot of save_policy"""
         if file is not None:
-            state = torch.load(file, map_location=map_location)
-            if 'critic' in state:
-                self.critic.load_state_dict(state['critic'])
-            if 'critic_target' in state:
-                self.critic_target.load_state_dict(state['critic_target'])
-            if 'actor' in state:
-                self.actor.load_state_dict(state['actor'])
-            if 'actor_target' in state:
-                self.actor_target.load_state_dict(state['actor_target'])
-            if 'actor_optimizer' in state:
+            if is_policy(file):
+                state, _ = load_policy(file)
+            else:
+                state = torch.load(file, map_location=map_location)
+            converted = False
+            for name in ('critic', 'critic_target', 'actor', 'actor_target'):
+                if name in state:
+                    # checkpoints saved with the other lane encoder layout (fused or not) are converted on load
+                    net_state, net_converted = match_lane_encoder_layout(state[name], getattr(self, name))
+                    getattr(self, name).load_state_dict(net_state)
+                    converted = converted or net_converted
+            # optimizer states follow the parameter layout they were saved with
+            if 'actor_optimizer' in state and not converted:
                 self.actor_optimizer.load_state_dict(state['actor_optimizer'])
-            if 'critic_optimizer' in state:
+            if 'critic_optimizer' in state and not converted:
                 self.critic_optimizer.load_state_dict(state['critic_optimizer'])
+            if 'learn_time' in state:
+                self.learn_time = state['learn_time']
+                self.target_updater.count = state['target_update_count']
+                restore_replay_metadata(self.replay_buffer, state['replay_buffer'])
 
 class MAPDQN:
     def __init__(self, state_dim, action_dim, action_bound, gamma, tau, sigma, sigma_steer,
@@ -3,6 +3,7 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 from algs.util.replay_buffer import ReplayBuffer
+from algs.util.target_update import soft_update, hard_update
 
 class PolicyNet(torch.nn.Module):
     def __init__(self, state_dim, action_dim, action_bound, train=True) -> None:
@@ -279,11 +280,10 @@ class DDPG:
         self.tb_noise.reset()
 
     def soft_update(self, net, target_net):
-        for param_target, param in zip(target_net.parameters(), net.parameters()):
-            param_target.data.copy_(param_target.data * (1.0 - self.tau) + param.data * self.tau)
+        soft_update(net, target_net, self.tau)
 
     def hard_update(self, net, target_net):
-        net.load_state_dict(target_net.state_dict())
+        hard_update(net, target_net)
 
     def store_transition(self, state, action, reward, next_state, truncated, done,info):  # how to store the episodic data to buffer
         def _compress(state):
@@ -5,74 +5,17 @@ import torch,logging
 from torch import nn
 import torch.nn.functional as F
 from torch.autograd import Variable
-from algs.util.replay_buffer import SumTree,SplitReplayBuffer
+from algs.util.replay_buffer import SplitReplayBuffer,PriReplayBuffer,stack_field,object_field
+from algs.util.batch_staging import BatchStaging
 from macad_gym.viz.logger import LOG
+from macad_gym.core.utils.observation import ObservationLayout
+from algs.util.lane_encoder import lane_wise_cross_attention_encoder, FusedLaneEncoder, match_lane_encoder_layout
+from algs.util.amp import grad_scaler, autocast
+from algs.util.target_update import TargetUpdater, soft_update, hard_update
+from algs.util.checkpoint import save_policy, is_policy, load_policy, replay_metadata, restore_replay_metadata
 
 
 
-class PriReplayBuffer(object):  # stored as ( s, a, r, s_ ) in SumTree
-    """
-    Prioritized experience replay
-    This Memory class is modified based on the original code from:
-    https://github.com/jaara/AI-blog/blob/master/Seaquest-DDQN-PER.py
-    Detailed information:
-    https://yulizi123.github.io/tutorials/machine-learning/reinforcement-learning/4-6-prioritized-replay/
-    """
-    epsilon = 0.01  # small amount to avoid zero priority
-    alpha = 0.6  # [0~1] convert the importance of TD error to priority. If alpha = 0, there is no Importance Sampling.
-    beta = 0.4  # importance-sampling, from initial value increasing to 1
-    beta_increment_per_sampling = 0.001
-    abs_err_upper = 1.  # clipped abs error
-
-    def __init__(self, capacity):
-        self.tree = SumTree(capacity)
-
-    def add(self, transition):
-        max_p = np.max(self.tree.tree[-self.tree.capacity:])
-        if max_p == 0:
-            max_p = self.abs_err_upper
-        self.tree.add(max_p, transition)   # set the max p for new p
-
-    def sample(self, n):
-        #assert self.tree.size==self.tree.capacity
-        b_idx, ISWeights = np.empty((n,), dtype=np.int32), np.empty((n, 1))
-        b_state,b_action,b_action_param,b_reward,b_next_state,b_truncated,b_done,b_info=[],[],[],[],[],[],[],[]
-        pri_seg = self.tree.total_p / n       # priority segment
-        self.beta = np.min([1., self.beta + self.beta_increment_per_sampling])  # max = 1
-
-        min_prob = np.min(self.tree.tree[self.tree.capacity-1:self.tree.capacity-1+self.size()]) / self.tree.total_p
-        #min_prob = np.min(self.tree.tree[-self.tree.capacity:]) / self.tree.total_p     # for later calculate ISweight
-        for i in range(n):
-            a, b = pri_seg * i, pri_seg * (i + 1)
-            v = np.random.uniform(a, b) #sample from  [a, b) 
-            idx, p, data = self.tree.get_leaf(v)
-            prob = p / self.tree.total_p
-            ISWeights[i, 0] = np.power(prob/min_prob, -self.beta)
-            b_idx[i]=idx
-            b_state.append(data[0])
-            b_action.append(data[1])
-            b_action_param.append(data[2])
-            b_reward.append(data[3])
-            b_next_state.append(data[4])
-            b_truncated.append(data[5])
-            b_done.append(data[6])
-            b_info.append(data[7])
-
-        # print(self.tree.tree)
-        # print(b_idx)
-        return b_idx, ISWeights, (b_state,b_action,b_action_param,b_reward,b_next_state,b_truncated,b_done,b_info)
-
-    def batch_update(self, tree_idx, abs_errors):
-        abs_errors += self.epsilon  # convert to abs and avoid 0
-        clipped_errors = np.minimum(abs_errors, self.abs_err_upper)
-        ps = np.power(clipped_errors, self.alpha)
-        for ti, p in zip(tree_idx, ps):
-            self.tree.update(ti, p)
-    
-    def size(self):
-        return self.tree.size
-
-
 class veh_lane_encoder(torch.nn.Module):
     def __init__(self, state_dim, train=True):
         super().__init__()
@@ -95,45 +38,8 @@ class veh_lane_encoder(torch.nn.Module):
         return state_enc
 
 
-class lane_wise_cross_attention_encoder(torch.nn.Module):
-    def __init__(self, state_dim, train=True):
-        super().__init__()
-        self.state_dim = state_dim
-        self.train = train
-        self.hidden_size = 64
-        self.lane_encoder = nn.Linear(state_dim['waypoints'], self.hidden_size)
-        self.veh_encoder = nn.Linear(state_dim['companion_vehicle'] * 2, self.hidden_size)
-        self.light_encoder = nn.Linear(state_dim['light'], self.hidden_size)
-        self.ego_encoder = nn.Linear(state_dim['hero_vehicle'], self.hidden_size)
-        self.w = nn.Linear(self.hidden_size, self.hidden_size)
-        self.ego_a = nn.Linear(self.hidden_size, 1)
-        self.ego_o = nn.Linear(self.hidden_size, 1)
-        self.leaky_relu = nn.LeakyReLU(negative_slope=0.1)
-
-    def forward(self, lane_veh, ego_info):
-        batch_size = lane_veh.shape[0]
-        lane = lane_veh[:, :self.state_dim["waypoints"]]
-        veh = lane_veh[:, self.state_dim["waypoints"]:-self.state_dim['light']]
-        light = lane_veh[:, -self.state_dim['light']:]
-        # print('ego_info.shape: ', ego_info.shape)
-        ego_enc = self.w(F.relu(self.ego_encoder(ego_info)))
-        lane_enc = self.w(F.relu(self.lane_encoder(lane)))
-        veh_enc = self.w(F.relu(self.veh_encoder(veh)))
-        light_enc = self.w(F.relu(self.light_encoder(light)))
-        state_enc = torch.cat((lane_enc, veh_enc, light_enc), 1).reshape(batch_size, 3, self.hidden_size)
-        # _enc: [batch_size, 32]
-        score_lane = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(lane_enc))
-        score_veh = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(veh_enc))
-        score_light = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(light_enc))
-        # score_: [batch_size, 1]
-        score = torch.cat((score_lane, score_veh, score_light), 1)
-        score = F.softmax(score, 1).reshape(batch_size, 1, 3)
-        state_enc = torch.matmul(score, state_enc).reshape(batch_size, self.hidden_size)
-        # state_enc: [N, 64]
-        return state_enc
-
 class PolicyNet_multi(torch.nn.Module):
-    def __init__(self, state_dim, action_parameter_size, action_bound, train=True) -> None:
+    def __init__(self, state_dim, action_parameter_size, action_bound, train=True, fused=False) -> None:
         super().__init__()
         self.log_std_min = -20.0
         self.log_std_max = 2.0
@@ -141,9 +47,13 @@ class PolicyNet_multi(torch.nn.Module):
         self.action_bound = action_bound
         self.action_parameter_size = action_parameter_size
         self.train = train
-        self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+        self.fused = fused
+        if fused:
+            self.fused_encoder = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder = nn.Linear(self.state_dim['hero_vehicle'], 64)
         self.fc = nn.Linear(256, 256)
         self.fc_mu = nn.Linear(256, self.action_parameter_size)
@@ -154,11 +64,15 @@ class PolicyNet_multi(torch.nn.Module):
         one_state_dim = self.state_dim['waypoints'] + self.state_dim['companion_vehicle'] * 2 + self.state_dim['light']
         ego_info = state[:, 3*one_state_dim:]
 
-        left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
-        center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc = self.fused_encoder(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
+            center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc = torch.cat((left_enc, center_enc, right_enc), dim=1)
         ego_enc = self.ego_encoder(ego_info)
-        state_ = torch.cat((left_enc, center_enc, right_enc, ego_enc), dim=1)
+        state_ = torch.cat((lanes_enc, ego_enc), dim=1)
         
         hidden = F.relu(self.fc(state_))
         mu = self.fc_mu(hidden)
@@ -177,15 +91,19 @@ class PolicyNet_multi(torch.nn.Module):
         return action, log_prob
 
 class QValueNet_multi(torch.nn.Module):
-    def __init__(self, state_dim, action_param_dim, num_actions) -> None:
+    def __init__(self, state_dim, action_param_dim, num_actions, fused=False) -> None:
         # parameter state_dim here is a dict
         super().__init__()
         self.state_dim = state_dim
         self.action_param_dim = action_param_dim
         self.num_actions = num_actions
-        self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+        self.fused = fused
+        if fused:
+            self.fused_encoder = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder = nn.Linear(self.state_dim['hero_vehicle'], 32)
         self.action_encoder = nn.Linear(self.action_param_dim, 32)
         self.fc = nn.Linear(256, 256)
@@ -199,35 +117,46 @@ class QValueNet_multi(torch.nn.Module):
     def forward(self, state, action):
         one_state_dim = self.state_dim['waypoints'] + self.state_dim['companion_vehicle'] * 2 + self.state_dim['light']
         ego_info = state[:, 3*one_state_dim:]
-        left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
-        center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc = self.fused_encoder(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
+            center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc = torch.cat((left_enc, center_enc, right_enc), dim=1)
         ego_enc = self.ego_encoder(ego_info)
         action_enc = self.action_encoder(action)
-        state_ = torch.cat((left_enc, center_enc, right_enc, ego_enc, action_enc), dim=1)
+        state_ = torch.cat((lanes_enc, ego_enc, action_enc), dim=1)
         hidden = F.relu(self.fc(state_))
         out = self.fc_out(hidden)
         return out
 
 
 class QValueNet_multi_td3(torch.nn.Module):
-    def __init__(self, state_dim, action_param_dim, num_actions) -> None:
+    def __init__(self, state_dim, action_param_dim, num_actions, fused=False) -> None:
         # parameter state_dim here is a dict
         super().__init__()
         self.state_dim = state_dim
         self.action_param_dim = action_param_dim
         self.num_actions = num_actions
-        self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+        self.fused = fused
+        if fused:
+            self.fused_encoder = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder = nn.Linear(self.state_dim['hero_vehicle'], 32)
         self.action_encoder = nn.Linear(self.action_param_dim, 32)
         self.fc = nn.Linear(256, 256)
         self.fc_out = nn.Linear(256, self.num_actions)
 
-        self.left_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
-        self.center_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
-        self.right_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
+        if fused:
+            self.fused_encoder2 = FusedLaneEncoder(self.state_dim)
+        else:
+            self.left_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
+            self.center_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
+            self.right_encoder2 = lane_wise_cross_attention_encoder(self.state_dim)
         self.ego_encoder2 = nn.Linear(self.state_dim['hero_vehicle'], 32)
         self.action_encoder2 = nn.Linear(self.action_param_dim, 32)
         self.fc2 = nn.Linear(256, 256)
@@ -242,21 +171,29 @@ class QValueNet_multi_td3(torch.nn.Module):
         one_state_dim = self.state_dim['waypoints'] + self.state_dim['companion_vehicle'] * 2 + self.state_dim['light']
         ego_info = state[:, 3*one_state_dim:]
 
-        left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
-        center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc = self.fused_encoder(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc = self.left_encoder(state[:, :one_state_dim], ego_info)
+            center_enc = self.center_encoder(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc = self.right_encoder(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc = torch.cat((left_enc, center_enc, right_enc), dim=1)
         ego_enc = self.ego_encoder(ego_info)
         action_enc = self.action_encoder(action)
-        state_ = torch.cat((left_enc, center_enc, right_enc, ego_enc, action_enc), dim=1)
+        state_ = torch.cat((lanes_enc, ego_enc, action_enc), dim=1)
         hidden = F.relu(self.fc(state_))
         out = self.fc_out(hidden)
 
-        left_enc2 = self.left_encoder2(state[:, :one_state_dim], ego_info)
-        center_enc2 = self.center_encoder2(state[:, one_state_dim:2*one_state_dim], ego_info)
-        right_enc2 = self.right_encoder2(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+        if self.fused:
+            lanes_enc2 = self.fused_encoder2(state[:, :3*one_state_dim], ego_info)
+        else:
+            left_enc2 = self.left_encoder2(state[:, :one_state_dim], ego_info)
+            center_enc2 = self.center_encoder2(state[:, one_state_dim:2*one_state_dim], ego_info)
+            right_enc2 = self.right_encoder2(state[:, 2*one_state_dim:3*one_state_dim], ego_info)
+            lanes_enc2 = torch.cat((left_enc2, center_enc2, right_enc2), dim=1)
         ego_enc2 = self.ego_encoder2(ego_info)
         action_enc2 = self.action_encoder2(action)
-        state_2 = torch.cat((left_enc2, center_enc2, right_enc2, ego_enc2, action_enc2), dim=1)
+        state_2 = torch.cat((lanes_enc2, ego_enc2, action_enc2), dim=1)
         hidden2 = F.relu(self.fc(state_2))
         out2 = self.fc_out(hidden2)
         return out, out2
@@ -265,12 +202,14 @@ class QValueNet_multi_td3(torch.nn.Module):
 class P_SAC:
     def __init__(self, state_dim, action_dim, action_bound, gamma, tau,
                  buffer_size, batch_size, actor_lr, critic_lr, alpha_lr,
-                 clip_grad, zero_index_gradients, inverting_gradients, per_flag, device) -> None:
+                 clip_grad, zero_index_gradients, inverting_gradients, per_flag, device,
+                 fused_encoder=False, target_update_every=1) -> None:
         self.learn_time = 0
         self.replace_a = 0
         self.replace_c = 0
         self.s_dim = state_dim  # state_dim here is a dict
         self.s_dim['waypoints'] *= 3  # 2 is the feature dim of each waypoint
+        self.obs_layout = ObservationLayout(**self.s_dim)
         self.a_dim, self.a_bound = action_dim, action_bound
         self.num_actions = 3  # left change, lane follow, right change
         self.action_parameter_sizes = np.array([self.a_dim, self.a_dim, self.a_dim])
@@ -287,6 +226,12 @@ class P_SAC:
         self.indexd = zero_index_gradients
         self.zero_index_gradients = zero_index_gradients
         self.inverting_gradients = inverting_gradients
+        # device copies of the action parameter bounds and of the action each parameter belongs to
+        self.action_parameter_max = torch.as_tensor(self.action_parameter_max_numpy, dtype=torch.float32, device=self.device)
+        self.action_parameter_min = torch.as_tensor(self.action_parameter_min_numpy, dtype=torch.float32, device=self.device)
+        self.action_parameter_range = torch.as_tensor(self.action_parameter_range_numpy, dtype=torch.float32, device=self.device)
+        self.action_parameter_action = torch.as_tensor(np.repeat(np.arange(self.num_actions), self.action_parameter_sizes),
+                                                       device=self.device)
         self.policy_freq = 2
         self.per_flag=per_flag
         self.learn_time=0
@@ -301,12 +246,15 @@ class P_SAC:
         # self.replay_buffer = offline_replay_buffer()
         """self.memory=torch.tensor((buffer_size,self.s_dim*2+self.a_dim+1+1),
             dtype=torch.float32).to(self.device)"""
+        self.batch_staging = BatchStaging(self.device)
         self.pointer = 0  # serve as updating the memory data
         self.train = True
-        self.actor = PolicyNet_multi(self.s_dim, self.action_parameter_size, self.a_bound).to(self.device)
-        self.critic = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions).to(self.device)
-        self.critic_target = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions).to(self.device)
+        self.actor = PolicyNet_multi(self.s_dim, self.action_parameter_size, self.a_bound, fused=fused_encoder).to(self.device)
+        self.critic = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions, fused=fused_encoder).to(self.device)
+        self.critic_target = QValueNet_multi_td3(self.s_dim, self.action_parameter_size, self.num_actions, fused=fused_encoder).to(self.device)
         self.critic_target.load_state_dict(self.critic.state_dict())
+        # the critic target is averaged in one fused update every target_update_every learn steps
+        self.target_updater = TargetUpdater([(self.critic, self.critic_target)], self.tau, target_update_every)
 
         self.actor_optimizer = torch.optim.Adam(self.actor.parameters(), lr=actor_lr)
         self.critic_optimizer = torch.optim.Adam(self.critic.parameters(), lr=critic_lr)
@@ -315,23 +263,14 @@ class P_SAC:
         self.log_alpha = torch.zeros(1, dtype=torch.float32, requires_grad=True, device=device)
         self.log_alpha_optimizer = torch.optim.Adam([self.log_alpha], lr=alpha_lr)
         self.target_entropy = -np.prod((self.action_parameter_size,)).item() # heuristic
+        # fp32 eager training unless set_performance_mode is called
+        self.amp = False
+        self.amp_dtype = torch.float16 if torch.device(self.device).type == 'cuda' else torch.bfloat16
+        self.grad_scaler = None
 
     def take_action(self, state, lane_id=-2, action_mask=False):
         # print('vehicle_info', state['vehicle_info'])
-        state_left_wps = torch.tensor(state['left_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_center_wps = torch.tensor(state['center_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_right_wps = torch.tensor(state['right_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_left_front = torch.tensor(state['vehicle_info'][0], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_front = torch.tensor(state['vehicle_info'][1], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_right_front = torch.tensor(state['vehicle_info'][2], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_left_rear = torch.tensor(state['vehicle_info'][3], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_rear = torch.tensor(state['vehicle_info'][4], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_right_rear = torch.tensor(state['vehicle_info'][5], dtype=torch.float32).view(1, -1).to(self.device)
-        state_light = torch.tensor(state['light'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_ev = torch.tensor(state['hero_vehicle'],dtype=torch.float32).view(1,-1).to(self.device)
-        state_ = torch.cat((state_left_wps, state_veh_left_front, state_veh_left_rear, state_light,
-                            state_center_wps, state_veh_front, state_veh_rear, state_light,
-                            state_right_wps, state_veh_right_front, state_veh_right_rear, state_light, state_ev), dim=1)
+        state_ = torch.as_tensor(self.obs_layout.flat(state)).view(1, -1).to(self.device)
         # print(state_.shape) 
         all_action_param, log_prob = self.actor(state_)
         q1, q2 = self.critic(state_, all_action_param)
@@ -362,37 +301,84 @@ class P_SAC:
 
         return action, action_param, all_action_param
 
+    def take_action_batch(self, states, lane_ids=None, action_mask=False):
+        """
+        Act for several actors with a single forward pass.
+        states: {actor_id: observation}, lane_ids: {actor_id: lane_id} used with action_mask
+        return {actor_id: (action, action_param, all_action_param)} as take_action does
+        """
+        actor_ids = list(states.keys())
+        state_ = torch.as_tensor(np.stack([self.obs_layout.flat(states[actor_id]) for actor_id in actor_ids])).to(self.device)
+        with torch.no_grad():
+            all_action_param, log_prob = self.actor(state_)
+            q1, q2 = self.critic(state_, all_action_param)
+            q = torch.min(q1, q2)
+        q_a = q.cpu().numpy()
+        all_action_param = all_action_param.cpu().numpy()
+        if action_mask and lane_ids is not None:
+            lane_id = np.array([lane_ids.get(actor_id, -2) for actor_id in actor_ids])
+            q_a[lane_id == -3, 2] = -1000000.0
+            q_a[lane_id == -1, 0] = -1000000.0
+        action = np.argmax(q_a, axis=1)
+        param_index = self.action_parameter_offsets[action][:, None] + np.arange(self.a_dim)
+        action_param = np.take_along_axis(all_action_param, param_index, axis=1)
+
+        LOG.psac_logger.debug("Network Output - Action: %s, Action_param: %s", action, action_param)
+        LOG.psac_logger.debug("q values:%s", q_a)
+
+        return {actor_id: (action[i], action_param[i:i + 1], all_action_param[i:i + 1])
+                for i, actor_id in enumerate(actor_ids)}
+
+    def set_performance_mode(self, amp=False, compile=False):
+        """
+        Opt-in faster training for learn(). amp runs the network passes under torch.autocast:
+        float16 with a GradScaler on a GPU, bfloat16 without loss scaling on the CPU. The
+        alpha update stays in fp32. compile wraps the networks with torch.compile in place;
+        it is skipped with a warning on torch versions without nn.Module.compile.
+        """
+        device_type = torch.device(self.device).type
+        self.amp = amp
+        self.amp_dtype = torch.float16 if device_type == 'cuda' else torch.bfloat16
+        self.grad_scaler = grad_scaler() if amp and device_type == 'cuda' else None
+        if compile:
+            if hasattr(nn.Module, 'compile'):
+                for net in (self.actor, self.critic, self.critic_target):
+                    net.compile()
+            else:
+                LOG.psac_logger.warning("torch.compile is not available, the networks stay in eager mode")
+
+    def _autocast(self):
+        return autocast(torch.device(self.device).type, self.amp_dtype, self.amp)
+
+    def _scale(self, loss):
+        return loss if self.grad_scaler is None else self.grad_scaler.scale(loss)
+
+    def _unscale(self, optimizer):
+        # clip_grad_norm_ has to see the true gradients
+        if self.grad_scaler is not None:
+            self.grad_scaler.unscale_(optimizer)
+
+    def _step(self, optimizer):
+        if self.grad_scaler is None:
+            optimizer.step()
+        else:
+            self.grad_scaler.step(optimizer)
+
     def _zero_index_gradients(self, grad, batch_action_indices, inplace=True):
         assert grad.shape[0] == batch_action_indices.shape[0]
-        grad = grad.cpu()
-
         if not inplace:
             grad = grad.clone()
         with torch.no_grad():
-            ind = torch.zeros(self.action_parameter_size, dtype=torch.long)
-            for a in range(self.num_actions):
-                ind[self.action_parameter_offsets[a]:self.action_parameter_offsets[a+1]] = a
-            # ind_tile = np.tile(ind, (self.batch_size, 1))
-            ind_tile = ind.repeat(self.batch_size, 1).to(self.device)
-            actual_index = ind_tile != batch_action_indices
-            # print('actual_index: ', actual_index)
-            grad[actual_index] = 0.
+            # zero the gradient of every action parameter that does not belong to the taken action
+            grad.masked_fill_(self.action_parameter_action != batch_action_indices.view(-1, 1), 0.)
         return grad
 
     def _invert_gradients(self, grad, vals, grad_type, inplace=True):
         if grad_type == "action_parameters":
-            max_p = torch.from_numpy(self.action_parameter_max_numpy)
-            min_p = torch.from_numpy(self.action_parameter_min_numpy)
-            rnge = torch.from_numpy(self.action_parameter_range_numpy)
+            max_p, min_p, rnge = self.action_parameter_max, self.action_parameter_min, self.action_parameter_range
         else:
             raise ValueError("Unhandled grad_type: '"+str(grad_type) + "'")
 
-        max_p = max_p.cpu()
-        min_p = min_p.cpu()
-        rnge = rnge.cpu()
-        grad = grad.cpu()
-        vals = vals.cpu()
-
         assert grad.shape == vals.shape
 
         if not inplace:
@@ -400,35 +386,67 @@ class P_SAC:
         with torch.no_grad():
             # index = grad < 0  # actually > but Adam minimises, so reversed (could also double negate the grad)
             index = grad > 0
-            grad[index] *= (index.float() * (max_p - vals) / rnge)[index]
-            grad[~index] *= ((~index).float() * (vals - min_p) / rnge)[~index]
+            grad.mul_(torch.where(index, max_p - vals, vals - min_p) / rnge)
 
         return grad
 
     def learn(self):
+        b_idx, staged = self._draw_batch(self.batch_size)
+        loss_q, abs_loss = self._learn_step(staged)
+        if abs_loss is not None:
+            self.replay_buffer.batch_update(b_idx, abs_loss.float().cpu().numpy())
+
+        return loss_q.detach().cpu().numpy()
+
+    def learn_many(self, n_updates, batch_size=None):
+        """
+        Run n_updates optimizer steps on mini-batches drawn from the buffer in one sample and
+        staged on the device with one copy. The PER priorities of all the mini-batches are
+        written back together after the last step. Return the critic loss of every step.
+        """
+        batch_size = self.batch_size if batch_size is None else batch_size
+        b_idx, staged = self._draw_batch(n_updates * batch_size)
+        # PER draws one sample per priority segment, shuffled so that every mini-batch spans the whole buffer
+        order = np.random.permutation(n_updates * batch_size)
+        order_ = torch.as_tensor(order, device=self.device).view(n_updates, batch_size)
+        losses, abs_losses = [], []
+        for index in order_:
+            loss_q, abs_loss = self._learn_step([field[index] for field in staged])
+            losses.append(loss_q.detach().float().view(1))
+            if abs_loss is not None:
+                abs_losses.append(abs_loss.float())
+
+        # losses and TD errors come back to the host in one copy
+        result = torch.cat(losses + abs_losses).cpu().numpy()
+        if abs_losses:
+            self.replay_buffer.batch_update(b_idx[order], result[n_updates:])
+        return result[:n_updates]
+
+    def _draw_batch(self, batch_size):
+        """Sample a batch and stage it on the device, return (tree indices or None, staged fields)"""
+        if not self.per_flag:
+            return None, self.batch_staging.stage(self.replay_buffer.sample(batch_size))
+        b_idx, b_ISWeights, b_transition = self.replay_buffer.sample(batch_size)
+        return b_idx, self.batch_staging.stage(b_transition[:7] + (b_ISWeights,))
+
+    def _learn_step(self, staged):
+        """One critic (and every policy_freq steps actor) update on a staged batch, return (loss_q, |TD error| or None)"""
         self.learn_time += 1
         # if self.learn_time > 100000:
         #     self.train = False
         self.replace_a += 1
         self.replace_c += 1
+        abs_loss = None
         if not self.per_flag:
-            b_s, b_a, b_a_param, b_r, b_ns, b_t, b_d = self.replay_buffer.sample(self.batch_size)
+            batch_s, batch_a, batch_a_param, batch_r, batch_ns, batch_t, batch_d = staged
         else:
-            b_idx,b_ISWeights,b_transition = self.replay_buffer.sample(self.batch_size)
-            b_s, b_a, b_a_param, b_r, b_ns, b_t, b_d, b_i = b_transition[0], b_transition[1], b_transition[2], b_transition[3], b_transition[4], \
-                b_transition[5], b_transition[6],b_transition[7]
-            self.ISWeights=torch.tensor(b_ISWeights,dtype=torch.float32).view((self.batch_size,-1)).to(self.device)
-
-        # 此处得到的batch是否是pytorch.tensor?
-        batch_s = torch.tensor(np.array(b_s), dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_ns = torch.tensor(np.array(b_ns), dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_a = torch.tensor(np.array(b_a), dtype=torch.int64).view((self.batch_size, -1)).to(self.device)
-        batch_a_param = torch.tensor(np.array(b_a_param), dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_r = torch.tensor(np.array(b_r), dtype=torch.float32).view((self.batch_size, -1)).to(self.device).squeeze()
-        batch_d = torch.tensor(np.array(b_d), dtype=torch.float32).view((self.batch_size, -1)).to(self.device).squeeze()
-        batch_t = torch.tensor(np.array(b_t), dtype=torch.float32).view((self.batch_size, -1)).to(self.device).squeeze()
+            batch_s, batch_a, batch_a_param, batch_r, batch_ns, batch_t, batch_d, self.ISWeights = staged
 
-        with torch.no_grad():
+        # all fields arrive on the device as [batch_size, -1] float32 tensors in a single copy
+        batch_a = batch_a.long()
+        batch_r, batch_d, batch_t = batch_r.squeeze(), batch_d.squeeze(), batch_t.squeeze()
+
+        with torch.no_grad(), self._autocast():
             action_param_target, log_prob = self.actor(batch_ns)
             entropy = -log_prob
             q_target_values1, q_target_values2 = self.critic_target(batch_ns, action_param_target)
@@ -438,45 +456,52 @@ class P_SAC:
             q_prime = torch.max(q_target_values, 1, keepdim=True)[0].squeeze()
             q_targets = batch_r + self.gamma * q_prime * (1 - batch_t) * (1 - batch_d)
 
-        q1_values, q2_values = self.critic(batch_s, batch_a_param)
-        q1 = q1_values.gather(1, batch_a.view(-1, 1)).squeeze()
-        q2 = q2_values.gather(1, batch_a.view(-1, 1)).squeeze()
+        with self._autocast():
+            q1_values, q2_values = self.critic(batch_s, batch_a_param)
+            q1 = q1_values.gather(1, batch_a.view(-1, 1)).squeeze()
+            q2 = q2_values.gather(1, batch_a.view(-1, 1)).squeeze()
 
-        if not self.per_flag:
-            loss_q = self.loss(q1, q_targets) + self.loss(q2, q_targets)
-        else:
-            loss = self.loss(q1, q_targets) + self.loss(q2, q_targets)
-            abs_loss = torch.abs(q1 - q_targets) + torch.abs(q1 - q_targets)
-            abs_loss = np.array(abs_loss.detach().cpu().numpy())
-            loss_q = torch.mean(loss * self.ISWeights)
-            self.replay_buffer.batch_update(b_idx, abs_loss)
+            if not self.per_flag:
+                loss_q = self.loss(q1, q_targets) + self.loss(q2, q_targets)
+            else:
+                loss = self.loss(q1, q_targets) + self.loss(q2, q_targets)
+                abs_loss = (torch.abs(q1 - q_targets) + torch.abs(q1 - q_targets)).detach()
+                loss_q = torch.mean(loss * self.ISWeights)
 
         self.critic_optimizer.zero_grad()
-        loss_q.backward()
+        self._scale(loss_q).backward()
         if self.clip_grad > 0:
+            self._unscale(self.critic_optimizer)
             torch.nn.utils.clip_grad_norm_(self.critic.parameters(), self.clip_grad)
-        self.critic_optimizer.step()
+        self._step(self.critic_optimizer)
 
         if self.learn_time % self.policy_freq == 0:
-            with torch.no_grad():
+            with torch.no_grad(), self._autocast():
                 action_param, log_prob= self.actor(batch_s)
+            action_param = action_param.float()
             action_param.requires_grad = True
 
-            Q1, Q2 = self.critic(batch_s, action_param)
-            Q_value = torch.min(Q1, Q2)
-            if self.indexd:
-                Q_indexed = Q_value.gather(1, batch_a.view(-1, 1))
-                Q_loss = torch.mean(Q_indexed)
-            else:
-                Q_loss = torch.mean(torch.sum(Q_value, 1))
+            with self._autocast():
+                Q1, Q2 = self.critic(batch_s, action_param)
+                Q_value = torch.min(Q1, Q2)
+                if self.indexd:
+                    Q_indexed = Q_value.gather(1, batch_a.view(-1, 1))
+                    Q_loss = torch.mean(Q_indexed)
+                else:
+                    Q_loss = torch.mean(torch.sum(Q_value, 1))
 
             self.critic.zero_grad()
-            Q_loss.backward()
+            self._scale(Q_loss).backward()
             from copy import deepcopy
             # print('check batch_s whether has grad: ', batch_s.grad_fn)
             delta_a = deepcopy(action_param.grad.data)
+            if self.grad_scaler is not None:
+                # the gradients are inverted against the bounds on the true dQ/da, out is scaled again below
+                delta_a /= self.grad_scaler.get_scale()
 
-            action_param, log_prob = self.actor(Variable(batch_s))
+            with self._autocast():
+                action_param, log_prob = self.actor(Variable(batch_s))
+            action_param = action_param.float()
             delta_a[:] = self._invert_gradients(delta_a, action_param, grad_type="action_parameters", inplace=True)
             if self.zero_index_gradients:
                 delta_a[:] = self._zero_index_gradients(delta_a, batch_action_indices=batch_a, inplace=True)
@@ -484,10 +509,13 @@ class P_SAC:
             out = torch.mean(-torch.mul(delta_a, action_param))
             #out = torch.mean(-torch.mul(delta_a, action_param) - self.log_alpha.exp() * entropy)
             self.actor.zero_grad()
-            out.backward(torch.ones(out.shape).to(self.device))
+            self._scale(out).backward(torch.ones(out.shape).to(self.device))
             if self.clip_grad > 0:
+                self._unscale(self.actor_optimizer)
                 torch.nn.utils.clip_grad_norm_(self.actor.parameters(), self.clip_grad)
-            self.actor_optimizer.step()
+            self._step(self.actor_optimizer)
+        if self.grad_scaler is not None:
+            self.grad_scaler.update()
 
         # update alpha value
         alpha_loss = torch.mean(
@@ -496,9 +524,9 @@ class P_SAC:
         alpha_loss.backward()
         self.log_alpha_optimizer.step()
 
-        self.soft_update(self.critic, self.critic_target)
+        self.target_updater.step()
 
-        return loss_q.detach().cpu().numpy()
+        return loss_q, abs_loss
 
     def _print_grad(self, model):
         '''Print the grad of each layer'''
@@ -506,34 +534,15 @@ class P_SAC:
             LOG.psac_logger.debug(f"-->name:{name}, -->grad_requires:{parms.requires_grad}, -->grad_value:{parms.grad}")
 
     def soft_update(self, net, target_net):
-        for param_target, param in zip(target_net.parameters(), net.parameters()):
-            param_target.data.copy_(param_target.data * (1.0 - self.tau) + param.data * self.tau)
+        soft_update(net, target_net, self.tau)
 
     def hard_update(self, net, target_net):
-        net.load_state_dict(target_net.state_dict())
+        hard_update(net, target_net)
 
     def store_transition(self, state, action, action_param, reward, next_state, truncated, done, info):  
         # how to store the episodic data to buffer
-        def _compress(state):
-            # print('state: ', state)
-            state_left_wps = np.array(state['left_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_center_wps = np.array(state['center_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_right_wps = np.array(state['right_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_veh_left_front = np.array(state['vehicle_info'][0], dtype=np.float32).reshape((1, -1))
-            state_veh_front = np.array(state['vehicle_info'][1], dtype=np.float32).reshape((1, -1))
-            state_veh_right_front = np.array(state['vehicle_info'][2], dtype=np.float32).reshape((1, -1))
-            state_veh_left_rear = np.array(state['vehicle_info'][3], dtype=np.float32).reshape((1, -1))
-            state_veh_rear = np.array(state['vehicle_info'][4], dtype=np.float32).reshape((1, -1))
-            state_veh_right_rear = np.array(state['vehicle_info'][5], dtype=np.float32).reshape((1, -1))
-            state_ev = np.array(state['hero_vehicle'], dtype=np.float32).reshape((1, -1))
-            state_light = np.array(state['light'], dtype=np.float32).reshape((1, -1))
-            state_ = np.concatenate((state_left_wps, state_veh_left_front, state_veh_left_rear, state_light,
-                                        state_center_wps, state_veh_front, state_veh_rear, state_light,
-                                        state_right_wps, state_veh_right_front, state_veh_right_rear, state_light, state_ev), axis=1)
-            return state_
-
-        state=_compress(state)
-        next_state=_compress(next_state)
+        state=self.obs_layout.flat(state).reshape((1, -1))
+        next_state=self.obs_layout.flat(next_state).reshape((1, -1))
 
         # if reward_ttc < -0.1 or reward_eff < 3:
         #     self.change_buffer.append((state, action, action_param, reward, next_state, truncated, done))
@@ -551,7 +560,36 @@ class P_SAC:
 
         return
 
+    def _compress_batch(self, states):
+        if isinstance(states, np.ndarray) and states.dtype != object:
+            return states.reshape((len(states), 1, -1))     # flat already
+        return np.stack([self.obs_layout.flat(state).reshape((1, -1)) for state in states])
+
+    def stack_transitions(self, transitions):
+        """
+        One float32 array per field of a batch given as field columns in the order of store_transition's
+        arguments, with flat states and the infos in an object array. This is what store_transitions takes and it
+        is cheaper to send between processes than the observations.
+        """
+        state, action, action_param, reward, next_state, truncated, done, info = transitions
+        return (self._compress_batch(state), stack_field(action), stack_field(action_param), stack_field(reward),
+                self._compress_batch(next_state), stack_field(truncated), stack_field(done), object_field(info))
+
+    def store_transitions(self, transitions):
+        """Store a batch of transitions in one bulk insert, transitions as taken by stack_transitions"""
+        if len(transitions[0]) == 0:
+            return
+        state, action, action_param, reward, next_state, truncated, done, info = self.stack_transitions(transitions)
+        columns = (state, action, action_param, reward, next_state, truncated, done)
+        if not self.per_flag:
+            change = (action == 0) | (action == 2)
+            self.replay_buffer.add_batch([column[change] for column in columns], False)
+            self.replay_buffer.add_batch(columns, True)
+        else:
+            self.replay_buffer.add_batch(columns + (info,))
+
     def save_net(self,file = None):
+        """Full training checkpoint to resume from, see save_policy for workers and evaluators"""
         state = {
             'actor': self.actor.state_dict(),
             'critic': self.critic.state_dict(),
@@ -559,21 +597,37 @@ class P_SAC:
             'actor_optimizer': self.actor_optimizer.state_dict(),
             'critic_optimizer': self.critic_optimizer.state_dict(),
             'log_alpha': self.log_alpha.clone().detach(),
-            'log_alpha_optimizer': self.log_alpha_optimizer.state_dict()
+            'log_alpha_optimizer': self.log_alpha_optimizer.state_dict(),
+            'learn_time': self.learn_time,
+            'target_update_count': self.target_updater.count,
+            'replay_buffer': replay_metadata(self.replay_buffer)
         }
         torch.save(state, file)
 
+    def save_policy(self, file, half=False):
+        """Inference snapshot with the actor and critic weights only, in float16 when half"""
+        save_policy(file, {'actor': self.actor, 'critic': self.critic},
+                    torch.float16 if half else torch.float32, {'learn_time': self.learn_time})
+
     def load_net(self, file = None, map_location = torch.device('cpu')):
+        """Load a training checkpoint of save_net or an inference snapshot of save_policy"""
         if file is not None:
-            state = torch.load(file, map_location=map_location)
+            if is_policy(file):
+                state, _ = load_policy(file)
+            else:
+                state = torch.load(file, map_location=map_location)
             if 'actor' in state:
-                self.actor.load_state_dict(state['actor'])
+                self.actor.load_state_dict(match_lane_encoder_layout(state['actor'], self.actor)[0])
                 self.actor_optimizer = torch.optim.Adam(self.actor.parameters(), lr=self.actor_lr)
             if 'critic' in state:
-                self.critic.load_state_dict(state['critic'])
+                self.critic.load_state_dict(match_lane_encoder_layout(state['critic'], self.critic)[0])
                 self.critic_optimizer = torch.optim.Adam(self.critic.parameters(), lr=self.critic_lr)
             if 'critic_target' in state:
-                self.critic_target.load_state_dict(state['critic_target'])
+                self.critic_target.load_state_dict(match_lane_encoder_layout(state['critic_target'], self.critic_target)[0])
             if 'log_alpha' in state:
                 self.log_alpha = state['log_alpha'].clone().detach().requires_grad_(True).to(map_location)
-                self.log_alpha_optimizer = torch.optim.Adam([self.log_alpha], lr=self.alpha_lr)
\ No newline at end of file
+                self.log_alpha_optimizer = torch.optim.Adam([self.log_alpha], lr=self.alpha_lr)
+            if 'learn_time' in state:
+                self.learn_time = state['learn_time']
+                self.target_updater.count = state['target_update_count']
+                restore_replay_metadata(self.replay_buffer, state['replay_buffer'])
\ No newline at end of file
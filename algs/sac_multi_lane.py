@@ -3,7 +3,10 @@ import torch
 import torch.nn.functional as F
 from torch import nn
 from torch.distributions import Normal
-from algs.util.replay_buffer import ReplayBuffer, PriReplayBuffer
+from algs.util.replay_buffer import ReplayBuffer, PriReplayBuffer, stack_field, object_field
+from algs.util.batch_staging import BatchStaging
+from algs.util.target_update import soft_update
+from macad_gym.core.utils.observation import ObservationLayout
 
 
 class lane_wise_cross_attention_encoder(torch.nn.Module):
@@ -129,6 +132,7 @@ class SACContinuous:
         self.replace_c = 0
         self.s_dim = state_dim  # state_dim here is a dict
         self.s_dim['waypoints'] *= 3  # 2 is the feature dim of each waypoint
+        self.obs_layout = ObservationLayout(**self.s_dim)
         self.a_dim, self.a_bound = action_dim, action_bound
         self.gamma, self.tau = gamma, tau
         self.batch_size, self.device = batch_size, device
@@ -142,6 +146,7 @@ class SACContinuous:
         else:
             self.replay_buffer = ReplayBuffer(buffer_size)
             self.loss = nn.MSELoss()
+        self.batch_staging = BatchStaging(device)
         self.actor = PolicyNetContinuous(self.s_dim, self.a_dim, self.a_bound).to(device)
         self.critic_1 = QValueNetContinuous(self.s_dim, self.a_dim).to(device)  # 第一个Q网络
         self.critic_2 = QValueNetContinuous(self.s_dim, self.a_dim).to(device)  # 第二个Q网络
@@ -160,20 +165,7 @@ class SACContinuous:
 
     def take_action(self, state):
         # print('vehicle_info', state['vehicle_info'])
-        state_left_wps = torch.tensor(state['left_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_center_wps = torch.tensor(state['center_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_right_wps = torch.tensor(state['right_waypoints'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_left_front = torch.tensor(state['vehicle_info'][0], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_front = torch.tensor(state['vehicle_info'][1], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_right_front = torch.tensor(state['vehicle_info'][2], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_left_rear = torch.tensor(state['vehicle_info'][3], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_rear = torch.tensor(state['vehicle_info'][4], dtype=torch.float32).view(1, -1).to(self.device)
-        state_veh_right_rear = torch.tensor(state['vehicle_info'][5], dtype=torch.float32).view(1, -1).to(self.device)
-        state_light = torch.tensor(state['light'], dtype=torch.float32).view(1, -1).to(self.device)
-        state_ev = torch.tensor(state['hero_vehicle'],dtype=torch.float32).view(1,-1).to(self.device)
-        state_ = torch.cat((state_left_wps, state_veh_left_front, state_veh_left_rear, state_light,
-                            state_center_wps, state_veh_front, state_veh_rear, state_light,
-                            state_right_wps, state_veh_right_front, state_veh_right_rear, state_light, state_ev), dim=1)
+        state_ = torch.as_tensor(self.obs_layout.flat(state)).view(1, -1).to(self.device)
         # print(state_.shape)
         action, log_prob = self.actor(state_)
         if (action[0, 0].is_cuda):
@@ -182,6 +174,15 @@ class SACContinuous:
             action = np.array([action[:, 0].detach().numpy(), action[:, 1].detach().numpy()]).reshape((-1, 2))
         return  action
 
+    def take_action_batch(self, states):
+        """Act for several actors with a single forward pass, states: {actor_id: observation}, return {actor_id: action}"""
+        actor_ids = list(states.keys())
+        state_ = torch.as_tensor(np.stack([self.obs_layout.flat(states[actor_id]) for actor_id in actor_ids])).to(self.device)
+        with torch.no_grad():
+            action, log_prob = self.actor(state_)
+        action = action.cpu().numpy()
+        return {actor_id: action[i:i + 1] for i, actor_id in enumerate(actor_ids)}
+
     def calc_target(self, rewards, next_states, dones, truncateds):  # 计算目标Q值
         next_actions, log_prob = self.actor(next_states)
         entropy = -log_prob
@@ -192,10 +193,7 @@ class SACContinuous:
         return td_target
 
     def soft_update(self, net, target_net):
-        for param_target, param in zip(target_net.parameters(),
-                                       net.parameters()):
-            param_target.data.copy_(param_target.data * (1.0 - self.tau) +
-                                    param.data * self.tau)
+        soft_update(net, target_net, self.tau)
 
     def learn(self):
         self.learn_time += 1
@@ -204,19 +202,12 @@ class SACContinuous:
 
         if not self.per_flag:
             b_s, b_a, b_r, b_ns, b_t, b_d, b_i = self.replay_buffer.sample(self.batch_size)
+            batch_s, batch_a, batch_r, batch_ns, batch_t, batch_d = self.batch_staging.stage(
+                (b_s, b_a, b_r, b_ns, b_t, b_d))
         else:
             b_idx,b_ISWeights,b_transition = self.replay_buffer.sample(self.batch_size)
-            b_s, b_a, b_r, b_ns, b_t, b_d, b_i = b_transition[0], b_transition[1], b_transition[2], b_transition[3], b_transition[4], \
-                b_transition[5], b_transition[6]
-            self.ISWeights=torch.tensor(b_ISWeights,dtype=torch.float32).view((self.batch_size,-1)).to(self.device)
-            #print(self.ISWeights)
-
-        batch_s = torch.tensor(b_s, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_ns = torch.tensor(b_ns, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_a = torch.tensor(b_a, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_r = torch.tensor(b_r, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_d = torch.tensor(b_d, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
-        batch_t = torch.tensor(b_t, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
+            batch_s, batch_a, batch_r, batch_ns, batch_t, batch_d, self.ISWeights = \
+                self.batch_staging.stage(b_transition[:6] + (b_ISWeights,))
         
         # update both Q network
         td_target = self.calc_target(batch_r, batch_ns, batch_d, batch_t)
@@ -227,7 +218,7 @@ class SACContinuous:
             critic_2_loss = torch.mean(self.loss(q2, td_target.detach()))
         else:
             abs_loss = torch.abs(torch.min(q1, q2) - td_target)
-            abs_loss = np.array(abs_loss.detach().cpu().numpy())
+            abs_loss = abs_loss.detach().cpu().numpy()
             self.replay_buffer.batch_update(b_idx, abs_loss)
 
             critic_1_loss = torch.mean(self.loss(q1, td_target.detach()) * self.ISWeights)
@@ -265,30 +256,29 @@ class SACContinuous:
         return np.mean([loss_1, loss_2])
 
     def store_transition(self, state, action, reward, next_state, truncated, done, info):  # how to store the episodic data to buffer
-        def _compress(state):
-            # print('state: ', state)
-            state_left_wps = np.array(state['left_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_center_wps = np.array(state['center_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_right_wps = np.array(state['right_waypoints'], dtype=np.float32).reshape((1, -1))
-            state_veh_left_front = np.array(state['vehicle_info'][0], dtype=np.float32).reshape((1, -1))
-            state_veh_front = np.array(state['vehicle_info'][1], dtype=np.float32).reshape((1, -1))
-            state_veh_right_front = np.array(state['vehicle_info'][2], dtype=np.float32).reshape((1, -1))
-            state_veh_left_rear = np.array(state['vehicle_info'][3], dtype=np.float32).reshape((1, -1))
-            state_veh_rear = np.array(state['vehicle_info'][4], dtype=np.float32).reshape((1, -1))
-            state_veh_right_rear = np.array(state['vehicle_info'][5], dtype=np.float32).reshape((1, -1))
-            state_ev = np.array(state['hero_vehicle'], dtype=np.float32).reshape((1, -1))
-            state_light = np.array(state['light'], dtype=np.float32).reshape((1, -1))
-            state_ = np.concatenate((state_left_wps, state_veh_left_front, state_veh_left_rear, state_light,
-                                        state_center_wps, state_veh_front, state_veh_rear, state_light,
-                                        state_right_wps, state_veh_right_front, state_veh_right_rear, state_light, state_ev), axis=1)
-            return state_
-
-        state=_compress(state)
-        next_state=_compress(next_state)
+        state=self.obs_layout.flat(state).reshape((1, -1))
+        next_state=self.obs_layout.flat(next_state).reshape((1, -1))
 
         self.replay_buffer.add((state, action, reward, next_state, truncated, done,info))
 
         return
+
+    def _compress_batch(self, states):
+        if isinstance(states, np.ndarray) and states.dtype != object:
+            return states.reshape((len(states), 1, -1))     # flat already
+        return np.stack([self.obs_layout.flat(state).reshape((1, -1)) for state in states])
+
+    def stack_transitions(self, transitions):
+        """One float32 array per field of a batch given as field columns in store_transition's order, with flat states"""
+        state, action, reward, next_state, truncated, done, info = transitions
+        return (self._compress_batch(state), stack_field(action), stack_field(reward), self._compress_batch(next_state),
+                stack_field(truncated), stack_field(done), object_field(info))
+
+    def store_transitions(self, transitions):
+        """Store a batch of transitions in one bulk insert, transitions as taken by stack_transitions"""
+        if len(transitions[0]) == 0:
+            return
+        self.replay_buffer.add_batch(self.stack_transitions(transitions))
     def save_net(self,file = None):
         state = {
             'actor': self.actor.state_dict(),
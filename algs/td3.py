@@ -4,6 +4,7 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 from algs.util.replay_buffer import ReplayBuffer
+from algs.util.target_update import soft_update, hard_update
 
 
 class PolicyNet(torch.nn.Module):
@@ -235,7 +236,7 @@ class TD3:
         #     self.train = False
         self.replace_a += 1
         self.replace_c += 1
-        b_s, b_a, b_r, b_ns, b_t, b_d = self.replay_buffer.sample(self.batch_size)
+        b_s, b_a, b_r, b_ns, b_t, b_d, b_i = self.replay_buffer.sample(self.batch_size)
         # 此处得到的batch是否是pytorch.tensor?
         batch_s = torch.tensor(b_s, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
         batch_ns = torch.tensor(b_ns, dtype=torch.float32).view((self.batch_size, -1)).to(self.device)
@@ -299,11 +300,10 @@ class TD3:
         self.tb_noise.reset()
 
     def soft_update(self, net, target_net):
-        for param_target, param in zip(target_net.parameters(), net.parameters()):
-            param_target.data.copy_(param_target.data * (1.0 - self.tau) + param.data * self.tau)
+        soft_update(net, target_net, self.tau)
 
     def hard_update(self, net, target_net):
-        net.load_state_dict(target_net.state_dict())
+        hard_update(net, target_net)
 
     def store_transition(self, state, action, reward, next_state, truncated, done,info):  # how to store the episodic data to buffer
         def _compress(state):
@@ -0,0 +1,17 @@
+import contextlib
+import torch
+
+
+def grad_scaler():
+    """Loss scaler of float16 training on a GPU, torch.cuda.amp.GradScaler on torch releases without torch.amp.GradScaler"""
+    scaler = getattr(getattr(torch, 'amp', None), 'GradScaler', None)
+    if scaler is not None:
+        return scaler('cuda')
+    return torch.cuda.amp.GradScaler()
+
+
+def autocast(device_type, dtype, enabled):
+    """torch.autocast when enabled, a no-op context otherwise so that fp32 training runs on any torch release"""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, dtype=dtype)
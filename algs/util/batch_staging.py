@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+
+
+class BatchStaging:
+    """
+    Stage sampled replay batches on the learner device.
+
+    All numeric fields of a batch are packed into one reusable float32 host buffer, pinned
+    when the device is a GPU, and moved with a single non-blocking copy. Every field comes
+    back as a [batch_size, -1] view of the device tensor. Two host buffers are used in turn
+    and a buffer is only refilled after its previous copy has completed.
+    """
+
+    def __init__(self, device) -> None:
+        self.device = torch.device(device)
+        self.pin_memory = self.device.type == 'cuda'
+        self.host = [None, None]
+        self.copy_done = [None, None]
+        self.turn = 0
+
+    def _host_buffer(self, numel):
+        if not self.pin_memory:
+            # on the cpu the staged tensors alias the host buffer, so it is never reused
+            return None, torch.empty(numel, dtype=torch.float32)
+        turn, self.turn = self.turn, self.turn ^ 1
+        if self.copy_done[turn] is not None:
+            self.copy_done[turn].synchronize()
+        if self.host[turn] is None or self.host[turn].numel() < numel:
+            self.host[turn] = torch.empty(numel, dtype=torch.float32, pin_memory=True)
+        self.copy_done[turn] = torch.cuda.Event()
+        return turn, self.host[turn][:numel]
+
+    def stage(self, fields):
+        """fields: sequence of arrays sharing the first (batch) dimension, return one float32 tensor per field"""
+        fields = [np.asarray(field) for field in fields]
+        batch_size = fields[0].shape[0]
+        widths = [field.size // batch_size for field in fields]
+        offsets = np.cumsum([0] + widths) * batch_size
+
+        turn, host = self._host_buffer(int(offsets[-1]))
+        host_np = host.numpy()
+        for field, width, start, end in zip(fields, widths, offsets[:-1], offsets[1:]):
+            np.copyto(host_np[start:end].reshape((batch_size, width)), field.reshape((batch_size, width)),
+                      casting='unsafe')
+
+        if self.pin_memory:
+            staged = host.to(self.device, non_blocking=True)
+            self.copy_done[turn].record()
+        else:
+            staged = host.to(self.device)
+        return tuple(staged[start:end].view(batch_size, width)
+                     for width, start, end in zip(widths, offsets[:-1], offsets[1:]))
@@ -0,0 +1,74 @@
+import json
+import numpy as np
+import torch
+
+POLICY_MAGIC = b'NETSNAP1'
+ALIGNMENT = 64
+DTYPES = {torch.float32: np.float32, torch.float16: np.float16}
+
+
+def save_policy(file, nets, dtype=torch.float32, meta=None):
+    """
+    Write an inference snapshot of nets ({name: module}) to file.
+
+    The file is the magic, the length of a JSON header and the header, followed by the raw
+    tensors in dtype, each aligned to 64 bytes. The header lists every tensor's network, name,
+    shape and offset, plus the meta dict. Only the weights are stored, no optimizer state.
+    """
+    np_dtype = DTYPES[dtype]
+    tensors, offset = [], 0
+    for net_name, net in nets.items():
+        for name, value in net.state_dict().items():
+            value = value.detach().to('cpu', dtype).contiguous().numpy()
+            tensors.append(({'net': net_name, 'name': name, 'shape': list(value.shape), 'offset': offset}, value))
+            offset += -(-value.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({'dtype': np.dtype(np_dtype).name, 'meta': meta or {},
+                         'tensors': [entry for entry, _ in tensors]}).encode()
+    data_start = -(-(len(POLICY_MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+    with open(file, 'wb') as f:
+        f.write(POLICY_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for entry, value in tensors:
+            f.seek(data_start + entry['offset'])
+            f.write(value.tobytes())
+        f.truncate(data_start + offset)
+
+
+def is_policy(file):
+    with open(file, 'rb') as f:
+        return f.read(len(POLICY_MAGIC)) == POLICY_MAGIC
+
+
+def load_policy(file, mmap=True):
+    """
+    Read a snapshot written by save_policy, return ({net name: state dict}, meta).
+    With mmap the tensors are copy-on-write views of the mapped file, read on first access.
+    """
+    with open(file, 'rb') as f:
+        assert f.read(len(POLICY_MAGIC)) == POLICY_MAGIC, f"{file} is not a policy snapshot"
+        header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_size))
+    data_start = -(-(len(POLICY_MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+    data = np.memmap(file, dtype=np.uint8, mode='c') if mmap else np.fromfile(file, dtype=np.uint8)
+    dtype = np.dtype(header['dtype'])
+    state = {}
+    for entry in header['tensors']:
+        count = int(np.prod(entry['shape']))
+        start = data_start + entry['offset']
+        value = data[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+        state.setdefault(entry['net'], {})[entry['name']] = torch.from_numpy(value)
+    return state, header['meta']
+
+
+def replay_metadata(replay_buffer):
+    """What a resumed run needs to know about the replay buffer, its transitions are not included"""
+    meta = {'type': type(replay_buffer).__name__, 'size': int(replay_buffer.size())}
+    if hasattr(replay_buffer, 'beta'):
+        meta['beta'] = float(replay_buffer.beta)
+    return meta
+
+
+def restore_replay_metadata(replay_buffer, meta):
+    if 'beta' in meta and hasattr(replay_buffer, 'beta'):
+        replay_buffer.beta = meta['beta']
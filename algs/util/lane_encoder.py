@@ -0,0 +1,145 @@
+import math
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+LANE_PREFIXES = ('left_encoder', 'center_encoder', 'right_encoder')
+# FusedLaneEncoder parameter name -> Linear layer of lane_wise_cross_attention_encoder
+FUSED_LAYERS = (('lane', 'lane_encoder'), ('veh', 'veh_encoder'), ('light', 'light_encoder'),
+                ('ego', 'ego_encoder'), ('w', 'w'))
+
+
+class lane_wise_cross_attention_encoder(torch.nn.Module):
+    def __init__(self, state_dim, train=True):
+        super().__init__()
+        self.state_dim = state_dim
+        self.train = train
+        self.hidden_size = 64
+        self.lane_encoder = nn.Linear(state_dim['waypoints'], self.hidden_size)
+        self.veh_encoder = nn.Linear(state_dim['companion_vehicle'] * 2, self.hidden_size)
+        self.light_encoder = nn.Linear(state_dim['light'], self.hidden_size)
+        self.ego_encoder = nn.Linear(state_dim['hero_vehicle'], self.hidden_size)
+        self.w = nn.Linear(self.hidden_size, self.hidden_size)
+        self.ego_a = nn.Linear(self.hidden_size, 1)
+        self.ego_o = nn.Linear(self.hidden_size, 1)
+        self.leaky_relu = nn.LeakyReLU(negative_slope=0.1)
+
+    def forward(self, lane_veh, ego_info):
+        batch_size = lane_veh.shape[0]
+        lane = lane_veh[:, :self.state_dim["waypoints"]]
+        veh = lane_veh[:, self.state_dim["waypoints"]:-self.state_dim['light']]
+        light = lane_veh[:, -self.state_dim['light']:]
+        # print('ego_info.shape: ', ego_info.shape)
+        ego_enc = self.w(F.relu(self.ego_encoder(ego_info)))
+        lane_enc = self.w(F.relu(self.lane_encoder(lane)))
+        veh_enc = self.w(F.relu(self.veh_encoder(veh)))
+        light_enc = self.w(F.relu(self.light_encoder(light)))
+        state_enc = torch.cat((lane_enc, veh_enc, light_enc), 1).reshape(batch_size, 3, self.hidden_size)
+        # _enc: [batch_size, 32]
+        score_lane = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(lane_enc))
+        score_veh = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(veh_enc))
+        score_light = self.leaky_relu(self.ego_a(ego_enc) + self.ego_o(light_enc))
+        # score_: [batch_size, 1]
+        score = torch.cat((score_lane, score_veh, score_light), 1)
+        score = F.softmax(score, 1).reshape(batch_size, 1, 3)
+        state_enc = torch.matmul(score, state_enc).reshape(batch_size, self.hidden_size)
+        # state_enc: [N, 64]
+        return state_enc
+
+
+class FusedLaneEncoder(torch.nn.Module):
+    """
+    The left, center and right lane_wise_cross_attention_encoder of a network in one module.
+
+    The lanes are stacked on a leading dimension and every Linear layer of the three encoders
+    becomes one batched matmul over stacked [3, in, out] weights. It computes exactly what the
+    three encoders compute and returns their outputs concatenated, [batch_size, 3 * hidden_size].
+    Checkpoints convert between both layouts with fuse_lane_encoders/split_lane_encoders.
+    """
+
+    def __init__(self, state_dim, lanes=3, hidden_size=64):
+        super().__init__()
+        self.state_dim = state_dim
+        self.lanes = lanes
+        self.hidden_size = hidden_size
+        self.lane_size = state_dim['waypoints'] + state_dim['companion_vehicle'] * 2 + state_dim['light']
+        in_features = {'lane': state_dim['waypoints'], 'veh': state_dim['companion_vehicle'] * 2,
+                       'light': state_dim['light'], 'ego': state_dim['hero_vehicle'], 'w': hidden_size}
+        for name, _ in FUSED_LAYERS:
+            self.register_parameter(f'{name}_weight', nn.Parameter(torch.empty(lanes, in_features[name], hidden_size)))
+            self.register_parameter(f'{name}_bias', nn.Parameter(torch.empty(lanes, 1, hidden_size)))
+        # ego_a and ego_o of every lane side by side
+        self.score_weight = nn.Parameter(torch.empty(lanes, hidden_size, 2))
+        self.score_bias = nn.Parameter(torch.empty(lanes, 1, 2))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # same distribution as the default nn.Linear initialization
+        for name, _ in FUSED_LAYERS + (('score', None),):
+            bound = 1 / math.sqrt(getattr(self, f'{name}_weight').shape[1])
+            nn.init.uniform_(getattr(self, f'{name}_weight'), -bound, bound)
+            nn.init.uniform_(getattr(self, f'{name}_bias'), -bound, bound)
+
+    def forward(self, lanes, ego_info):
+        """lanes: [batch_size, lanes * lane_size] lane blocks of the state, ego_info: [batch_size, hero_vehicle]"""
+        batch_size = lanes.shape[0]
+        waypoints, light = self.state_dim['waypoints'], self.state_dim['light']
+        x = lanes.reshape(batch_size, self.lanes, self.lane_size).transpose(0, 1)
+        lane_enc = torch.baddbmm(self.lane_bias, x[:, :, :waypoints], self.lane_weight)
+        veh_enc = torch.baddbmm(self.veh_bias, x[:, :, waypoints:-light], self.veh_weight)
+        light_enc = torch.baddbmm(self.light_bias, x[:, :, -light:], self.light_weight)
+        ego_enc = torch.baddbmm(self.ego_bias, ego_info.expand(self.lanes, -1, -1), self.ego_weight)
+        # [lanes, 4 * batch_size, hidden_size]: ego, lane, vehicle and light encodings of every lane
+        enc = torch.baddbmm(self.w_bias, F.relu(torch.cat((ego_enc, lane_enc, veh_enc, light_enc), dim=1)), self.w_weight)
+        score = torch.baddbmm(self.score_bias, enc, self.score_weight).view(self.lanes, 4, batch_size, 2)
+        score = F.leaky_relu(score[:, :1, :, 0] + score[:, 1:, :, 1], negative_slope=0.1)
+        score = F.softmax(score, dim=1)
+        enc = enc.view(self.lanes, 4, batch_size, self.hidden_size)[:, 1:]
+        state_enc = (score.unsqueeze(-1) * enc).sum(dim=1)
+        return state_enc.transpose(0, 1).reshape(batch_size, self.lanes * self.hidden_size)
+
+
+def fuse_lane_encoders(state_dict, suffix=''):
+    """Convert the left/center/right encoder weights of a network state dict to FusedLaneEncoder weights"""
+    prefixes = [prefix + suffix for prefix in LANE_PREFIXES]
+    fused = 'fused_encoder' + suffix
+    out = {key: value for key, value in state_dict.items() if key.split('.')[0] not in prefixes}
+    for name, layer in FUSED_LAYERS:
+        out[f'{fused}.{name}_weight'] = torch.stack([state_dict[f'{prefix}.{layer}.weight'].t() for prefix in prefixes])
+        out[f'{fused}.{name}_bias'] = torch.stack([state_dict[f'{prefix}.{layer}.bias'] for prefix in prefixes]).unsqueeze(1)
+    out[f'{fused}.score_weight'] = torch.stack([torch.cat((state_dict[f'{prefix}.ego_a.weight'],
+                                                           state_dict[f'{prefix}.ego_o.weight'])).t() for prefix in prefixes])
+    out[f'{fused}.score_bias'] = torch.stack([torch.cat((state_dict[f'{prefix}.ego_a.bias'],
+                                                         state_dict[f'{prefix}.ego_o.bias'])) for prefix in prefixes]).unsqueeze(1)
+    return out
+
+
+def split_lane_encoders(state_dict, suffix=''):
+    """Convert FusedLaneEncoder weights of a network state dict back to left/center/right encoder weights"""
+    fused = 'fused_encoder' + suffix
+    out = {key: value for key, value in state_dict.items() if key.split('.')[0] != fused}
+    for lane, prefix in enumerate(LANE_PREFIXES):
+        prefix += suffix
+        for name, layer in FUSED_LAYERS:
+            out[f'{prefix}.{layer}.weight'] = state_dict[f'{fused}.{name}_weight'][lane].t().contiguous()
+            out[f'{prefix}.{layer}.bias'] = state_dict[f'{fused}.{name}_bias'][lane, 0].clone()
+        for column, layer in enumerate(('ego_a', 'ego_o')):
+            out[f'{prefix}.{layer}.weight'] = state_dict[f'{fused}.score_weight'][lane, :, column].unsqueeze(0).clone()
+            out[f'{prefix}.{layer}.bias'] = state_dict[f'{fused}.score_bias'][lane, 0, column:column + 1].clone()
+    return out
+
+
+def match_lane_encoder_layout(state_dict, net):
+    """
+    Convert a network state dict to the encoder layout of net, fused or not.
+    Return (state_dict, converted), optimizer states saved with a converted network do not apply.
+    """
+    converted = False
+    for suffix in ('', '2'):
+        fused_net = isinstance(getattr(net, 'fused_encoder' + suffix, None), FusedLaneEncoder)
+        fused_dict = f'fused_encoder{suffix}.w_weight' in state_dict
+        if fused_net and not fused_dict and f'left_encoder{suffix}.w.weight' in state_dict:
+            state_dict, converted = fuse_lane_encoders(state_dict, suffix), True
+        elif not fused_net and fused_dict:
+            state_dict, converted = split_lane_encoders(state_dict, suffix), True
+    return state_dict, converted
@@ -0,0 +1,63 @@
+import queue
+import threading
+
+
+class PrefetchSampler:
+    """
+    Background thread keeping a small queue of ready-to-use batches.
+
+    sample_fn(batch_size) draws and stages one batch. It runs in the sampler thread, so it
+    has to hold the same lock the learner takes for buffer writes and priority updates.
+    Batches drawn for a batch size the learner no longer asks for are dropped.
+    """
+
+    def __init__(self, sample_fn, depth=2, ready=None) -> None:
+        self.sample_fn = sample_fn
+        self.ready = ready if ready is not None else (lambda: True)
+        self.batches = queue.Queue(maxsize=depth)
+        self.batch_size = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def start(self, batch_size):
+        self.batch_size = batch_size
+        self.thread = threading.Thread(target=self._run, name='prefetch_sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                if not self.ready():
+                    self.stop_event.wait(0.01)
+                    continue
+                batch_size = self.batch_size
+                batch = self.sample_fn(batch_size)
+                while not self.stop_event.is_set():
+                    try:
+                        self.batches.put((batch_size, batch), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except BaseException as e:
+            self.error = e
+
+    def get(self, batch_size, timeout=1.0):
+        """Return the next prefetched batch of batch_size, None if the sampler can not provide one in time"""
+        self.batch_size = batch_size
+        while self.error is None and self.thread is not None and self.thread.is_alive():
+            try:
+                size, batch = self.batches.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if size == batch_size:
+                return batch
+        if self.error is not None:
+            raise RuntimeError("prefetch sampler thread failed") from self.error
+        return None
@@ -1,76 +1,287 @@
-import random, collections
+import operator
+import os, json, logging, threading
 import numpy as np
 
+
+def _write_json(file, obj):
+    # write then rename, a crash leaves either the old or the new file
+    with open(file + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(file + '.tmp', file)
+
+
+def _read_json(file):
+    with open(file) as f:
+        return json.load(f)
+
+
+def _persist_array(file, array):
+    """Copy array into a new .npy file, return the file mapped in memory"""
+    mapped = np.lib.format.open_memmap(file, mode='w+', dtype=array.dtype, shape=array.shape)
+    mapped[...] = array
+    return mapped
+
+
+def object_field(values):
+    """Object array of a transition field such as the infos"""
+    # element by element, numpy would otherwise turn a list of equally shaped arrays into one array
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def stack_field(values, dtype=np.float32):
+    """One array of a transition field, from a sequence of per-transition values or an array already"""
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values.astype(dtype, copy=False)
+    if len(values) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.stack([np.asarray(value, dtype=dtype) for value in values])
+
+
+def _check_type(path, cls):
+    meta = _read_json(os.path.join(path, 'replay.json'))
+    if meta['type'] != cls.__name__:
+        raise ValueError(f"{path} holds a {meta['type']}, not a {cls.__name__}")
+    return meta
+
+
+class TransitionStorage:
+    """Struct-of-arrays ring storage for transitions.
+
+    One preallocated array per transition field, allocated on the first add from the
+    observed shapes. Numeric fields are stored as float32, anything else (e.g. the info
+    dict) goes to an object array. Sampling is a single fancy-index gather per field.
+
+    After persist(path) the numeric fields and the stamps are .npy files in path mapped in
+    memory, every add writes straight into the files. flush() syncs them and records the ring
+    cursor, open(path) maps them again without reading them into RAM. Object fields are
+    not saved, they come back as None.
+    """
+
+    def __init__(self, capacity) -> None:
+        self.capacity = capacity
+        self.fields = None
+        self.pointer = 0  # next slot to be written
+        self.count = 0
+        self.adds = 0
+        self.stamps = np.zeros(capacity, dtype=np.int64)  # write number of the transition held by each slot
+        self.path = None  # directory of the .npy files once persisted
+
+    def _allocate(self, transition):
+        self.fields = []
+        for i, item in enumerate(transition):
+            item = np.asarray(item)
+            if item.dtype.kind not in 'biuf':
+                self.fields.append(np.empty((self.capacity,), dtype=object))
+            elif self.path is None:
+                self.fields.append(np.zeros((self.capacity,) + item.shape, dtype=np.float32))
+            else:
+                self.fields.append(np.lib.format.open_memmap(self._field_file(i), mode='w+', dtype=np.float32,
+                                                             shape=(self.capacity,) + item.shape))
+
+    def _field_file(self, i):
+        return os.path.join(self.path, f'field_{i}.npy')
+
+    def add(self, transition):
+        """Write one transition into the ring, return the slot it was written to"""
+        if self.fields is None:
+            self._allocate(transition)
+        index = self.pointer
+        for field, item in zip(self.fields, transition):
+            field[index] = item
+        self.adds += 1
+        self.stamps[index] = self.adds
+        self.pointer = (self.pointer + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return index
+
+    def add_batch(self, columns):
+        """
+        Write a batch of transitions given as one array per field, return the slots written to.
+        The batch goes in as at most two contiguous slices, split where the ring wraps around;
+        of a batch longer than the ring only the last capacity transitions are kept.
+        """
+        size = len(columns[0])
+        if size == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.fields is None:
+            self._allocate(tuple(column[0] for column in columns))
+        start = self.pointer
+        if size > self.capacity:
+            # the slots the last capacity transitions would have reached one at a time
+            start = (start + size - self.capacity) % self.capacity
+            self.adds += size - self.capacity
+            columns, size = [column[-self.capacity:] for column in columns], self.capacity
+        first = min(size, self.capacity - start)
+        for field, column in zip(self.fields, columns):
+            if field.dtype == object:
+                column = object_field(column)
+            field[start:start + first] = column[:first]
+            field[:size - first] = column[first:]
+        stamps = self.adds + 1 + np.arange(size)
+        self.stamps[start:start + first] = stamps[:first]
+        self.stamps[:size - first] = stamps[first:]
+        self.adds += size
+        self.pointer = (start + size) % self.capacity
+        self.count = min(self.count + size, self.capacity)
+        return (start + np.arange(size)) % self.capacity
+
+    def gather(self, index):
+        return tuple(field[index] for field in self.fields)
+
+    def __len__(self):
+        return self.count
+
+    def persist(self, path):
+        """Move the storage into .npy files in path, the current transitions are copied over"""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.stamps = _persist_array(os.path.join(path, 'stamps.npy'), self.stamps)
+        if self.fields is not None:
+            self.fields = [field if field.dtype == object else _persist_array(self._field_file(i), field)
+                           for i, field in enumerate(self.fields)]
+        self.flush()
+
+    def flush(self):
+        """
+        Sync the mapped files and record the ring cursor. The cursor is read before the sync, so
+        the recorded transitions are on disk once it is written; only slots overwritten while
+        the flush runs may be left half written by a crash.
+        """
+        meta = {'capacity': self.capacity, 'pointer': self.pointer, 'count': self.count, 'adds': self.adds,
+                'fields': None if self.fields is None else
+                ['object' if field.dtype == object else 'float32' for field in self.fields]}
+        for array in [self.stamps] + (self.fields or []):
+            if isinstance(array, np.memmap):
+                array.flush()
+        _write_json(os.path.join(self.path, 'storage.json'), meta)
+
+    @classmethod
+    def open(cls, path):
+        """Map a storage saved by persist/flush, it keeps writing to the same files"""
+        meta = _read_json(os.path.join(path, 'storage.json'))
+        storage = cls(meta['capacity'])
+        storage.path = path
+        storage.pointer, storage.count, storage.adds = meta['pointer'], meta['count'], meta['adds']
+        storage.stamps = np.load(os.path.join(path, 'stamps.npy'), mmap_mode='r+')
+        if meta['fields'] is not None:
+            storage.fields = [np.empty((storage.capacity,), dtype=object) if kind == 'object' else
+                              np.load(storage._field_file(i), mmap_mode='r+') for i, kind in enumerate(meta['fields'])]
+        return storage
+
+
 class ReplayBuffer:
     """经验回放池"""
 
     def __init__(self, capacity) -> None:
-        self.buffer = collections.deque(maxlen=capacity)  # 队列，先进先出
+        self.buffer = TransitionStorage(capacity)  # 环形数组，先进先出
 
     def add(self, transition):
-        self.buffer.append(transition)
+        self.buffer.add(transition)
+
+    def add_batch(self, columns):
+        """columns: one array per transition field"""
+        self.buffer.add_batch(columns)
 
     def sample(self, batch_size):  # 从buffer中采样数据,数量为batch_size
-        transition = random.sample(self.buffer, batch_size)
-        state, action, reward, next_state, truncated, done,info = zip(*transition)
-        return state, action, reward, next_state, truncated, done,info
+        index = np.random.randint(0, len(self.buffer), size=batch_size)
+        return self.buffer.gather(index)
 
     def size(self):
         return len(self.buffer)
 
+    def persist(self, path):
+        self.buffer.persist(path)
+        self.flush()
+
+    def flush(self):
+        self.buffer.flush()
+        _write_json(os.path.join(self.buffer.path, 'replay.json'), {'type': type(self).__name__})
+
+    @classmethod
+    def open(cls, path):
+        _check_type(path, cls)
+        replay_buffer = cls(1)
+        replay_buffer.buffer = TransitionStorage.open(path)
+        return replay_buffer
+
 
 class SplitReplayBuffer:
 
     def __init__(self, capacity) -> None:
-        self.buffer = collections.deque(maxlen=capacity)  # 队列，先进先出
-        self.change_buffer = collections.deque(maxlen=capacity//10)
+        self.buffer = TransitionStorage(capacity)  # 环形数组，先进先出
+        self.change_buffer = TransitionStorage(capacity//10)
 
     def add(self, transition, buffer=True):
         """Transiton: the rl transition need to sava
         buffer: True, add transition to self.buffer; False, add transition to self.change_buffer"""
         if buffer:
-            self.buffer.append(transition)
+            self.buffer.add(transition)
+        else:
+            self.change_buffer.add(transition)
+
+    def add_batch(self, columns, buffer=True):
+        """columns: one array per transition field, buffer as in add"""
+        if buffer:
+            self.buffer.add_batch(columns)
         else:
-            self.change_buffer.append(transition)
+            self.change_buffer.add_batch(columns)
 
     def sample(self, batch_size):  # 从buffer中采样数据,数量为batch_size
         pri_size = min(batch_size // 2, len(self.change_buffer))
         normal_size = batch_size - pri_size
-        transition = random.sample(self.buffer, normal_size)
-        state, action, action_param, reward, next_state, truncated, done = zip(*transition)
-        pri_transition = random.sample(self.change_buffer, pri_size)
-        pri_state, pri_action, pri_action_param, pri_reward, pri_next_state, pri_truncated, pri_done = zip(*pri_transition)
-        state = np.concatenate((state, pri_state), axis=0)
-        action = np.concatenate((action, pri_action), axis=0)
-        action_param = np.concatenate((action_param, pri_action_param), axis=0)
-        reward = np.concatenate((reward, pri_reward), axis=0)
-        next_state = np.concatenate((next_state, pri_next_state), axis=0)
-        truncated = np.concatenate((truncated, pri_truncated), axis=0)
-        done = np.concatenate((done, pri_done), axis=0)
-        return state, action, action_param, reward, next_state, truncated, done
+        transition = self.buffer.gather(np.random.randint(0, len(self.buffer), size=normal_size))
+        if pri_size == 0:
+            return transition
+        pri_transition = self.change_buffer.gather(np.random.randint(0, len(self.change_buffer), size=pri_size))
+        return tuple(np.concatenate((field, pri_field), axis=0) for field, pri_field in zip(transition, pri_transition))
 
     def size(self):
         return len(self.buffer)
 
+    def persist(self, path):
+        self.path = path
+        self.buffer.persist(os.path.join(path, 'buffer'))
+        self.change_buffer.persist(os.path.join(path, 'change_buffer'))
+        self.flush()
+
+    def flush(self):
+        self.buffer.flush()
+        self.change_buffer.flush()
+        _write_json(os.path.join(self.path, 'replay.json'), {'type': type(self).__name__})
+
+    @classmethod
+    def open(cls, path):
+        _check_type(path, cls)
+        replay_buffer = cls(10)
+        replay_buffer.path = path
+        replay_buffer.buffer = TransitionStorage.open(os.path.join(path, 'buffer'))
+        replay_buffer.change_buffer = TransitionStorage.open(os.path.join(path, 'change_buffer'))
+        return replay_buffer
+
 
 class OfflineReplayBuffer:
     """
     manually adjust the sampling of replay buffer and the replay buffer remains unchanged (1,000,000 buffers)
+
+    The saved transitions are one row of 66 values each: state [28], action [2], next_state [28],
+    reward_list [6] = (reward, reward_ttc, reward_com, reward_eff, reward_lan, reward_yaw),
+    truncated [1], done [1]. The file is mapped read-only, the rows are split into five index
+    arrays of different states and a batch is drawn from all of them with one gather.
     """
-    def __init__(self):
-        file_path = "../out/all_replay_buffer.npy"
+    def __init__(self, file_path="../out/all_replay_buffer.npy"):
         # state: [1, 28], action: [1, 2], next_state: [1, 28], reward_list = [1, 6], truncated = [1, 1], done = [1, 1]
         # reward_list = np.array([[reward, reward_ttc, reward_com, reward_eff, reward_lan, reward_yaw]])
-        self.replay_buffer = np.load(file_path, allow_pickle=True)
+        try:
+            self.replay_buffer = np.load(file_path, mmap_mode='r')
+        except ValueError:
+            # saved as an object array, it can not be mapped and is converted once
+            self.replay_buffer = np.asarray(np.load(file_path, allow_pickle=True).tolist(), dtype=np.float32)
+        self.replay_buffer = self.replay_buffer.reshape(self.replay_buffer.shape[0], -1)
         self.buffer_num = self.replay_buffer.shape[0]
-        # print(replay_buffer.shape)
         # split five buffer of different states: dangerous, large off-center, low-efficiency, on-curve, normal
-        self.dangerous_buffer = collections.deque(maxlen=250000)
-        self.off_center_buffer = collections.deque(maxlen=250000)
-        self.low_efficiency_buffer = collections.deque(maxlen=250000)
-        self.on_curve_buffer = collections.deque(maxlen=250000)
-        self.normal_buffer = collections.deque(maxlen=1000000)
-
         self.ttc_thr = -0.00001
         self.lane_thr = 0.5
         self.eff_thr = 5
@@ -81,89 +292,132 @@ class OfflineReplayBuffer:
         return self.buffer_num
 
     def split_replay_buffer(self):
-        for i in range(self.buffer_num):
-            current_buffer = self.replay_buffer[i]
-            fTTC = current_buffer[59]
-            fLane = current_buffer[62]
-            feff = current_buffer[61]
-            fcurve = abs(current_buffer[1]-current_buffer[19])
-            print("fttc: ", fTTC, "flane: ", fLane, "feff: ", feff, "fcurve: ", fcurve)
-            if fTTC < self.ttc_thr:
-                # print(fTTC)
-                self.dangerous_buffer.append(current_buffer)
-            elif fLane > self.lane_thr:
-                self.off_center_buffer.append(current_buffer)
-            elif feff < self.eff_thr:
-                self.low_efficiency_buffer.append(current_buffer)
-            elif fcurve > self.curve_thr:
-                self.on_curve_buffer.append(current_buffer)
-            else:
-                self.normal_buffer.append(current_buffer)
+        """Row indices of each state, a row belongs to the first state whose condition it meets"""
+        fTTC = self.replay_buffer[:, 59]
+        fLane = self.replay_buffer[:, 62]
+        feff = self.replay_buffer[:, 61]
+        fcurve = np.abs(self.replay_buffer[:, 1] - self.replay_buffer[:, 19])
+        rest = np.ones(self.buffer_num, dtype=bool)
+        buffers = []
+        for condition in (fTTC < self.ttc_thr, fLane > self.lane_thr, feff < self.eff_thr, fcurve > self.curve_thr):
+            buffers.append(np.flatnonzero(rest & condition))
+            rest &= ~condition
+        buffers.append(np.flatnonzero(rest))
+        (self.dangerous_buffer, self.off_center_buffer, self.low_efficiency_buffer,
+         self.on_curve_buffer, self.normal_buffer) = buffers
         print("dangerous_buffer: ", len(self.dangerous_buffer), "off_center_buffer: ", len(self.off_center_buffer),
               "low_efficiency_buffer: ", len(self.low_efficiency_buffer), "on_curve_buffer: ",
               len(self.on_curve_buffer),"normal_buffer: ", len(self.normal_buffer))
 
     def sample(self, batch_size):
-        specific_size = batch_size/6
-        normal_size = batch_size-4*specific_size
-        dangerous_transition = random.sample(self.dangerous_buffer, specific_size)
-        dangerous_transitions = zip(*dangerous_transition)
-        off_center_transition = random.sample(self.off_center_buffer, specific_size)
-        off_center_transitions = zip(*off_center_transition)
-        low_efficiency_transition = random.sample(self.low_efficiency_buffer, specific_size)
-        low_efficiency_transitions = zip(*low_efficiency_transition)
-        on_curve_transition = random.sample(self.on_curve_buffer, specific_size)
-        on_curve_transitions = zip(*on_curve_transition)
-        normal_transition = random.sample(self.normal_buffer, normal_size)
-        normal_transitions = zip(*normal_transition)
-        all_transitions = np.concatenate((dangerous_transitions, off_center_transitions, on_curve_transitions,
-                                          low_efficiency_transitions, normal_transitions), axis=0)
-        state, action, next_state, reward, truncated, done = all_transitions[:, :28], all_transitions[:, 28:30],
-        all_transitions[:, 30:56], all_transitions[:, 56:57], all_transitions[:, -2:-1], all_transitions[:, -1:]
+        """
+        batch_size // 6 rows of each special state, the rest from the normal rows, drawn with
+        replacement. The quota of an empty state goes to the normal rows, or to all rows when
+        there are no normal ones.
+        """
+        specific_size = batch_size // 6
+        normal_size = batch_size
+        index = []
+        for buffer in (self.dangerous_buffer, self.off_center_buffer, self.on_curve_buffer, self.low_efficiency_buffer):
+            if len(buffer) > 0:
+                index.append(buffer[np.random.randint(0, len(buffer), size=specific_size)])
+                normal_size -= specific_size
+        if len(self.normal_buffer) > 0:
+            index.append(self.normal_buffer[np.random.randint(0, len(self.normal_buffer), size=normal_size)])
+        else:
+            index.append(np.random.randint(0, self.buffer_num, size=normal_size))
+        all_transitions = self.replay_buffer[np.concatenate(index)]
+        state, action, next_state = all_transitions[:, :28], all_transitions[:, 28:30], all_transitions[:, 30:58]
+        reward, truncated, done = all_transitions[:, 58:59], all_transitions[:, -2:-1], all_transitions[:, -1:]
         return state, action, reward, next_state, truncated, done
 
 
-class SumTree(object):
+class SegmentTree(object):
+    """
+    Binary tree over the leaf priorities, each parent node stores operation(left kid, right kid).
+    Uses the same array layout as SumTree, SumTree keeps a max and a min companion so that the
+    largest and smallest priority are read from the root instead of scanning all the leaves.
+    """
+
+    def __init__(self, capacity, operation, scalar_operation, neutral):
+        self.capacity = capacity
+        self.operation = operation  # numpy ufunc used by batch updates
+        self.scalar_operation = scalar_operation  # plain python function, much cheaper on single values
+        self.tree = np.full(2 * capacity - 1, neutral, dtype=np.float64)
+
+    def update(self, tree_idx, p):
+        tree, operation = self.tree, self.scalar_operation
+        tree_idx = int(tree_idx)
+        tree[tree_idx] = p
+        # then propagate the change through tree, stop as soon as a parent node is unchanged
+        while tree_idx != 0:
+            tree_idx = (tree_idx - 1) // 2
+            value = operation(tree.item(2 * tree_idx + 1), tree.item(2 * tree_idx + 2))
+            if value == tree.item(tree_idx):
+                break
+            tree[tree_idx] = value
+
+    def batch_update(self, tree_idx, ps):
+        """Set the priorities of a batch of leaves, then recompute their ancestors level by level"""
+        tree_idx = np.asarray(tree_idx, dtype=np.int64)
+        self.tree[tree_idx] = ps
+        nodes = np.unique(tree_idx)
+        while True:
+            nodes = nodes[nodes > 0]
+            if nodes.size == 0:
+                break
+            nodes = np.unique((nodes - 1) // 2)
+            self.tree[nodes] = self.operation(self.tree[2 * nodes + 1], self.tree[2 * nodes + 2])
+
+    @property
+    def root(self):
+        return self.tree[0]
+
+
+class SumTree(SegmentTree):
     """
     This SumTree code is a modified version and the original code is from:
     https://github.com/jaara/AI-blog/blob/master/SumTree.py
 
     Story data with its priority in the tree.
+    Sampling and priority updates are batched: all samples descend the tree together and
+    a batch of updated leaves propagates each tree level once.
     """
-    data_pointer = 0
 
     def __init__(self, capacity):
-        self.capacity = capacity  # for all priority values
-        self.tree = np.zeros(2 * capacity - 1)
+        super().__init__(capacity, np.add, operator.add, 0.)  # for all priority values
         # [--------------Parent nodes-------------][-------leaves to recode priority-------]
         #             size: capacity - 1                       size: capacity
-        #self.data = np.zeros(capacity, dtype=object)  # for all transitions
-        self.data=collections.deque(maxlen=capacity)
+        self.max_tree = SegmentTree(capacity, np.maximum, max, 0.)
+        self.min_tree = SegmentTree(capacity, np.minimum, min, np.inf)   # empty leaves never win the min
+        self.data = TransitionStorage(capacity)  # for all transitions
         # [--------------data frame-------------]
         #             size: capacity
 
+    @property
+    def data_pointer(self):
+        return self.data.pointer
+
     def add(self, p, transition):
-        tree_idx = self.data_pointer + self.capacity - 1
-        #self.data[self.data_pointer] = data  # update data_frame
-        if self.size<self.capacity:
-            self.data.append(transition)
-        else:
-            self.data[self.data_pointer]=transition
-        self.update(tree_idx, p)  # update tree_frame
+        data_idx = self.data.add(transition)
+        self.update(data_idx + self.capacity - 1, p)  # update tree_frame
 
-        self.data_pointer += 1
-        if self.data_pointer >= self.capacity:  # replace when exceed the capacity
-            self.data_pointer = 0
+    def add_batch(self, p, columns):
+        """Write a batch of transitions with priority p, the tree is rebuilt once for the whole batch"""
+        data_idx = self.data.add_batch(columns)
+        self.batch_update(data_idx + self.capacity - 1, np.broadcast_to(p, data_idx.shape))
 
     def update(self, tree_idx, p):
-        change = p - self.tree[tree_idx]
-        self.tree[tree_idx] = p
-        # then propagate the change through tree
-        while tree_idx != 0:    # this method is faster than the recursive loop in the reference code
-            tree_idx = (tree_idx - 1) // 2
-            self.tree[tree_idx] += change
+        super().update(tree_idx, p)
+        self.max_tree.update(tree_idx, p)
+        self.min_tree.update(tree_idx, p)
 
-    def get_leaf(self, v):
+    def batch_update(self, tree_idx, ps):
+        super().batch_update(tree_idx, ps)
+        self.max_tree.batch_update(tree_idx, ps)
+        self.min_tree.batch_update(tree_idx, ps)
+
+    def get_leaves(self, v):
         """
         Tree structure and array storage:
 
@@ -176,36 +430,70 @@ class SumTree(object):
 
         Array type for storing:
         [0,1,2,3,4,5,6]
+
+        All values in v descend the tree together, one level per iteration.
         """
-        parent_idx = 0
-        while True:     # the while loop is faster than the method in the reference code
-            cl_idx = 2 * parent_idx + 1         # this leaf's left and right kids
-            cr_idx = cl_idx + 1
-            if cl_idx >= self.capacity+self.size-1:
-            #if cl_idx >= len(self.tree):        # reach bottom, end search
-                leaf_idx = parent_idx
+        v = np.array(v, dtype=np.float64)
+        leaf_idx = np.zeros(v.shape, dtype=np.int64)
+        while True:
+            cl_idx = 2 * leaf_idx + 1         # this leaf's left and right kids
+            active = cl_idx < len(self.tree)
+            if not active.any():        # reach bottom, end search
                 break
-            else:       # downward search, always search for a higher priority node
-                if v <= self.tree[cl_idx]:
-                    parent_idx = cl_idx
-                else:
-                    v -= self.tree[cl_idx]
-                    parent_idx = cr_idx
-
-        if leaf_idx<self.capacity-1:
-            #not leaf, banch node
-            leaf_idx=self.capacity-1+self.size-1
+            cl_idx = cl_idx[active]
+            cl_p, cr_p = self.tree[cl_idx], self.tree[cl_idx + 1]
+            # downward search, always search for a higher priority node.
+            # never step into an empty subtree, rounding error could otherwise end on an empty leaf
+            go_right = ((v[active] > cl_p) & (cr_p > 0)) | (cl_p <= 0)
+            v[active] -= np.where(go_right, cl_p, 0.)
+            leaf_idx[active] = cl_idx + go_right
+
         data_idx = leaf_idx - self.capacity + 1
-        return leaf_idx, self.tree[leaf_idx], self.data[data_idx]
+        return leaf_idx, self.tree[leaf_idx], data_idx
+
+    def get_leaf(self, v):
+        leaf_idx, p, data_idx = self.get_leaves([v])
+        return leaf_idx[0], p[0], self.data.gather(data_idx[0])
 
     @property
     def total_p(self):
         return self.tree[0]  # the root
 
+    @property
+    def max_p(self):
+        return self.max_tree.root
+
+    @property
+    def min_p(self):
+        return self.min_tree.root
+
     @property
     def size(self):
         return len(self.data)
 
+    def persist(self, path):
+        """Keep the three trees as .npy files in path and the transitions in path/data"""
+        self.data.persist(os.path.join(path, 'data'))
+        self.tree = _persist_array(os.path.join(path, 'sum_tree.npy'), self.tree)
+        self.max_tree.tree = _persist_array(os.path.join(path, 'max_tree.npy'), self.max_tree.tree)
+        self.min_tree.tree = _persist_array(os.path.join(path, 'min_tree.npy'), self.min_tree.tree)
+
+    def flush(self):
+        # a crash during the flush can leave the priorities of the slots written meanwhile stale
+        for tree in (self.tree, self.max_tree.tree, self.min_tree.tree):
+            tree.flush()
+        self.data.flush()
+
+    @classmethod
+    def open(cls, path):
+        data = TransitionStorage.open(os.path.join(path, 'data'))
+        tree = cls(data.capacity)
+        tree.data = data
+        tree.tree = np.load(os.path.join(path, 'sum_tree.npy'), mmap_mode='r+')
+        tree.max_tree.tree = np.load(os.path.join(path, 'max_tree.npy'), mmap_mode='r+')
+        tree.min_tree.tree = np.load(os.path.join(path, 'min_tree.npy'), mmap_mode='r+')
+        return tree
+
 
 class PriReplayBuffer(object):  # stored as ( s, a, r, s_, i ) in SumTree
     """
@@ -225,46 +513,128 @@ class PriReplayBuffer(object):  # stored as ( s, a, r, s_, i ) in SumTree
         self.tree = SumTree(capacity)
 
     def add(self, transition):
-        max_p = np.max(self.tree.tree[-self.tree.capacity:])
+        max_p = self.tree.max_p
         if max_p == 0:
             max_p = self.abs_err_upper
         self.tree.add(max_p, transition)   # set the max p for new p
 
-    def sample(self, n):
-        #assert self.tree.size==self.tree.capacity
-        b_idx, ISWeights = np.empty((n,), dtype=np.int32), np.empty((n, 1))
-        b_state,b_action,b_reward,b_next_state,b_truncated,b_done,b_info=[],[],[],[],[],[],[]
+    def add_batch(self, columns):
+        """columns: one array per transition field, every new transition gets the current max p"""
+        max_p = self.tree.max_p
+        if max_p == 0:
+            max_p = self.abs_err_upper
+        self.tree.add_batch(max_p, columns)
+
+    def sample_index(self, n):
+        """Draw n leaves by stratified sampling, return (tree indices, IS weights, data indices)"""
         pri_seg = self.tree.total_p / n       # priority segment
         self.beta = np.min([1., self.beta + self.beta_increment_per_sampling])  # max = 1
-        
-        min_prob = np.min(self.tree.tree[self.tree.capacity-1:self.tree.capacity-1+self.size()]) / self.tree.total_p
-        #min_prob = np.min(self.tree.tree[-self.tree.capacity:]) / self.tree.total_p     # for later calculate ISweight
-        for i in range(n):
-            a, b = pri_seg * i, pri_seg * (i + 1)
-            v = np.random.uniform(a, b) #sample from  [a, b) 
-            idx, p, data = self.tree.get_leaf(v)
-            prob = p / self.tree.total_p
-            ISWeights[i, 0] = np.power(prob/min_prob, -self.beta)
-            b_idx[i]=idx
-            b_state.append(data[0])
-            b_action.append(data[1])
-            b_reward.append(data[2])
-            b_next_state.append(data[3])
-            b_truncated.append(data[4])
-            b_done.append(data[5])
-            b_info.append(data[6])
-
-        # print(self.tree.tree)
-        # print(b_idx)
-        return b_idx, ISWeights, (np.array(b_state),np.array(b_action),np.array(b_reward),np.array(b_next_state),
-            np.array(b_truncated),np.array(b_done),np.array(b_info))
-
-    def batch_update(self, tree_idx, abs_errors):
-        abs_errors += self.epsilon  # convert to abs and avoid 0
+
+        min_prob = self.tree.min_p / self.tree.total_p
+        # stratified sampling, one value from each segment [a, b)
+        v = np.random.uniform(pri_seg * np.arange(n), pri_seg * np.arange(1, n + 1))
+        b_idx, p, data_idx = self.tree.get_leaves(v)
+        prob = p / self.tree.total_p
+        ISWeights = np.power(prob/min_prob, -self.beta).reshape((n, 1))
+        return b_idx, ISWeights, data_idx
+
+    def sample(self, n):
+        b_idx, ISWeights, data_idx = self.sample_index(n)
+        return b_idx, ISWeights, self.tree.data.gather(data_idx)
+
+    def stamps(self, tree_idx):
+        """Write stamps of the sampled leaves, pass them back to batch_update when it may arrive late"""
+        return self.tree.data.stamps[np.asarray(tree_idx) - self.tree.capacity + 1]
+
+    def batch_update(self, tree_idx, abs_errors, stamps=None):
+        """stamps: the leaves' write stamps at sampling time, updates for leaves overwritten since then are dropped"""
+        tree_idx = np.asarray(tree_idx)
+        abs_errors = np.asarray(abs_errors).reshape(-1) + self.epsilon  # convert to abs and avoid 0
+        if stamps is not None:
+            fresh = self.stamps(tree_idx) == stamps
+            tree_idx, abs_errors = tree_idx[fresh], abs_errors[fresh]
         clipped_errors = np.minimum(abs_errors, self.abs_err_upper)
         ps = np.power(clipped_errors, self.alpha)
-        for ti, p in zip(tree_idx, ps):
-            self.tree.update(ti, p)
+        self.tree.batch_update(tree_idx, ps)
     
     def size(self):
         return self.tree.size
+
+    def persist(self, path):
+        """Keep the transitions and the priorities in memory-mapped .npy files under path"""
+        self.path = path
+        self.tree.persist(path)
+        self.flush()
+
+    def flush(self):
+        self.tree.flush()
+        _write_json(os.path.join(self.path, 'replay.json'), self._replay_meta())
+
+    def _replay_meta(self):
+        return {'type': type(self).__name__, 'beta': float(self.beta)}
+
+    @classmethod
+    def open(cls, path):
+        """Map a buffer saved by persist/flush, sampling can start right away"""
+        replay_buffer = cls(1)
+        replay_buffer._open(path)
+        return replay_buffer
+
+    def _open(self, path):
+        meta = _check_type(path, type(self))
+        self.path = path
+        self.tree = SumTree.open(path)
+        self.beta = meta['beta']
+        return meta
+
+
+def open_or_persist(replay_buffer, path, **open_kwargs):
+    """
+    Return the buffer saved in path when there is one, of the type of replay_buffer.
+    Otherwise replay_buffer is persisted to path and returned.
+    open_kwargs go to open, e.g. the ring of a SharedPriReplayBuffer.
+    """
+    if os.path.exists(os.path.join(path, 'replay.json')):
+        reopened = type(replay_buffer).open(path, **open_kwargs)
+        logging.warning("reusing the replay buffer persisted in %s with %d transitions, "
+                        "delete the directory to start from an empty buffer", path, reopened.size())
+        return reopened
+    replay_buffer.persist(path)
+    return replay_buffer
+
+
+class ReplayFlusher:
+    """
+    Background thread flushing a persisted replay buffer every interval seconds, a restarted
+    learner loses at most the transitions of the last interval. The flush only reads the ring
+    cursor and syncs the mapped files, so it does not need the buffer lock.
+    """
+
+    def __init__(self, replay_buffer, interval=60.) -> None:
+        self.replay_buffer = replay_buffer
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='replay_flusher', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread and flush a last time"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise RuntimeError("replay flusher thread failed") from self.error
+        self.replay_buffer.flush()
+
+    def _run(self):
+        try:
+            while not self.stop_event.wait(self.interval):
+                self.replay_buffer.flush()
+        except BaseException as e:
+            self.error = e
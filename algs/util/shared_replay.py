@@ -0,0 +1,229 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from algs.util.replay_buffer import PriReplayBuffer
+
+
+class SharedTransitionRing:
+    """
+    Transition ring buffer in shared memory, written by the worker processes and sampled in
+    place by the learner.
+
+    Every writer owns a segment of slots_per_worker rows and is the only process writing to
+    it, so it only advances its own cursor. A row is a flat float32 vector whose fields have
+    the given widths. Each slot carries a sequence number used as a seqlock: the writer makes
+    it odd before touching the row and even once the row is complete. A reader keeps a row
+    only if the number was even and unchanged across its copy.
+
+    The learner creates the ring and passes ring.spec to the workers, which attach to it.
+    """
+
+    def __init__(self, spec, shm, owner=False) -> None:
+        self.spec = spec
+        self.shm = shm
+        self.owner = owner
+        self.worker_number = spec['worker_number']
+        self.slots_per_worker = spec['slots_per_worker']
+        self.widths = list(spec['widths'])
+        self.capacity = self.worker_number * self.slots_per_worker
+        self.row_width = sum(self.widths)
+
+        buf, offset = shm.buf, 0
+        # committed: total rows completed by each writer, episode: last episode number each writer reported
+        self.committed = np.ndarray((self.worker_number,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self.committed.nbytes
+        self.episode = np.ndarray((self.worker_number,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self.episode.nbytes
+        self.seq = np.ndarray((self.capacity,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self.seq.nbytes
+        self.rows = np.ndarray((self.capacity, self.row_width), dtype=np.float32, buffer=buf, offset=offset)
+
+    @staticmethod
+    def nbytes(worker_number, slots_per_worker, widths):
+        capacity = worker_number * slots_per_worker
+        return 8 * (2 * worker_number + capacity) + 4 * capacity * sum(widths)
+
+    @classmethod
+    def create(cls, worker_number, slots_per_worker, widths):
+        shm = shared_memory.SharedMemory(create=True, size=cls.nbytes(worker_number, slots_per_worker, widths))
+        spec = {'name': shm.name, 'worker_number': worker_number,
+                'slots_per_worker': slots_per_worker, 'widths': list(widths)}
+        ring = cls(spec, shm, owner=True)
+        ring.committed[:] = 0
+        ring.episode[:] = 0
+        ring.seq[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, spec):
+        shm = shared_memory.SharedMemory(name=spec['name'])
+        # only the creating process may unlink the block, keep the tracker of this process away from it
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(spec, shm)
+
+    def close(self):
+        del self.committed, self.episode, self.seq, self.rows
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def writer(self, worker_index):
+        return RingWriter(self, worker_index)
+
+    def size(self):
+        return int(np.minimum(self.committed, self.slots_per_worker).sum())
+
+    def read(self, slots, retries=100):
+        """Copy the rows of the given slots, return (rows, sequence numbers, valid mask)"""
+        seq = self.seq[slots]
+        rows = self.rows[slots]
+        valid = (seq % 2 == 0) & (self.seq[slots] == seq)
+        while retries > 0 and not valid.all():
+            # a writer is in the middle of these rows, they are complete a few microseconds later
+            torn = np.flatnonzero(~valid)
+            seq[torn] = self.seq[slots[torn]]
+            rows[torn] = self.rows[slots[torn]]
+            valid[torn] = (seq[torn] % 2 == 0) & (self.seq[slots[torn]] == seq[torn])
+            retries -= 1
+        return rows, seq, valid
+
+    def split(self, rows):
+        """Split flat rows into one [batch_size, width] array per field"""
+        return tuple(np.split(rows, np.cumsum(self.widths)[:-1], axis=1))
+
+
+class RingWriter:
+    """Write end of one SharedTransitionRing segment, owned by a single worker process"""
+
+    def __init__(self, ring, worker_index) -> None:
+        self.ring = ring
+        self.worker_index = worker_index
+        self.first_slot = worker_index * ring.slots_per_worker
+
+    def write(self, row):
+        ring = self.ring
+        slot = self.first_slot + int(ring.committed[self.worker_index]) % ring.slots_per_worker
+        # odd while the row is being written, a crashed writer may have left it odd already
+        begin = ring.seq[slot] | 1
+        ring.seq[slot] = begin
+        ring.rows[slot] = row
+        ring.seq[slot] = begin + 1
+        ring.committed[self.worker_index] += 1
+
+    def report_episode(self, episode):
+        self.ring.episode[self.worker_index] = episode
+
+
+class SharedPriReplayBuffer(PriReplayBuffer):
+    """
+    PriReplayBuffer sampling the rows of a SharedTransitionRing in place.
+
+    Rows committed by the workers get the current max priority the next time the buffer is
+    sampled. The sequence number of a slot serves as its write stamp. Rows still torn after
+    the read retries keep their place in the batch with a zero IS weight.
+
+    Shared memory can not be backed by a file, so once persisted each flush copies the rows
+    synced since the previous flush into ring_rows.npy next to the priorities. open copies
+    the file back into a new ring and the workers go on from the saved cursors.
+    """
+
+    def __init__(self, ring):
+        super().__init__(ring.capacity)
+        self.ring = ring
+        self.synced = np.zeros(ring.worker_number, dtype=np.int64)
+
+    def add(self, transition):
+        # the learner only samples, the rows come from the workers
+        raise TypeError("a SharedPriReplayBuffer is filled by the workers, write the transition "
+                        "with ring.writer(worker_index).write(row)")
+
+    def add_batch(self, columns):
+        raise TypeError("a SharedPriReplayBuffer is filled by the workers, write the transitions "
+                        "with ring.writer(worker_index).write(row)")
+
+    def _slots_between(self, since, committed):
+        """Slots written between the per writer row counts since and committed"""
+        ring = self.ring
+        slots = []
+        for worker_index in np.flatnonzero(committed > since):
+            start = max(since[worker_index], committed[worker_index] - ring.slots_per_worker)
+            cursor = np.arange(start, committed[worker_index]) % ring.slots_per_worker
+            slots.append(cursor + worker_index * ring.slots_per_worker)
+        return np.concatenate(slots) if slots else np.zeros(0, dtype=np.int64)
+
+    def sync(self):
+        """Give the rows committed since the last call the max priority"""
+        committed = self.ring.committed.copy()
+        new_slots = self._slots_between(self.synced, committed)
+        self.synced = committed
+        if new_slots.size:
+            max_p = self.tree.max_p
+            if max_p == 0:
+                max_p = self.abs_err_upper
+            tree_idx = new_slots + self.tree.capacity - 1
+            self.tree.batch_update(tree_idx, np.full(len(tree_idx), max_p))
+
+    def sample(self, n):
+        self.sync()
+        b_idx, ISWeights, data_idx = self.sample_index(n)
+        rows, seq, valid = self.ring.read(data_idx)
+        ISWeights[~valid] = 0.
+        return b_idx, ISWeights, self.ring.split(rows)
+
+    def stamps(self, tree_idx):
+        return self.ring.seq[np.asarray(tree_idx) - self.tree.capacity + 1]
+
+    def size(self):
+        return self.ring.size()
+
+    def persist(self, path):
+        os.makedirs(path, exist_ok=True)
+        ring = self.ring
+        self.saved_rows = np.lib.format.open_memmap(os.path.join(path, 'ring_rows.npy'), mode='w+',
+                                                    dtype=np.float32, shape=ring.rows.shape)
+        self.saved_seq = np.lib.format.open_memmap(os.path.join(path, 'ring_seq.npy'), mode='w+',
+                                                   dtype=np.int64, shape=ring.seq.shape)
+        self.flushed = np.zeros(ring.worker_number, dtype=np.int64)
+        super().persist(path)
+
+    def flush(self):
+        """
+        Copy the rows the priorities already cover, the ones synced since the last flush.
+        Rows a writer is overwriting meanwhile are saved with an odd sequence number, the
+        reader then treats them as torn until they are written again.
+        """
+        ring = self.ring
+        synced = self.synced.copy()
+        slots = self._slots_between(self.flushed, synced)
+        if slots.size:
+            seq = ring.seq[slots]
+            self.saved_rows[slots] = ring.rows[slots]
+            torn = (seq % 2 == 1) | (ring.seq[slots] != seq)
+            self.saved_seq[slots] = np.where(torn, seq | 1, seq)
+        self.flushed = synced
+        self.saved_rows.flush()
+        self.saved_seq.flush()
+        super().flush()
+
+    def _replay_meta(self):
+        meta = super()._replay_meta()
+        meta.update(committed=self.flushed.tolist(), slots_per_worker=self.ring.slots_per_worker,
+                    widths=self.ring.widths)
+        return meta
+
+    @classmethod
+    def open(cls, path, ring):
+        """Restore a buffer saved by persist/flush into ring, a freshly created one of the same layout"""
+        replay_buffer = cls(ring)
+        meta = replay_buffer._open(path)
+        if meta['slots_per_worker'] != ring.slots_per_worker or meta['widths'] != ring.widths or \
+                len(meta['committed']) != ring.worker_number:
+            raise ValueError(f"the ring saved in {path} has a different layout")
+        replay_buffer.saved_rows = np.load(os.path.join(path, 'ring_rows.npy'), mmap_mode='r+')
+        replay_buffer.saved_seq = np.load(os.path.join(path, 'ring_seq.npy'), mmap_mode='r+')
+        ring.rows[:] = replay_buffer.saved_rows
+        ring.seq[:] = replay_buffer.saved_seq
+        ring.committed[:] = meta['committed']
+        replay_buffer.synced = ring.committed.copy()
+        replay_buffer.flushed = ring.committed.copy()
+        return replay_buffer
@@ -0,0 +1,58 @@
+import torch
+
+
+def _parameter_lists(pairs):
+    targets, sources = [], []
+    for net, target_net in pairs:
+        target_params, params = list(target_net.parameters()), list(net.parameters())
+        assert len(target_params) == len(params), "net and target_net have different parameters"
+        targets += target_params
+        sources += params
+    return targets, sources
+
+
+@torch.no_grad()
+def soft_update(net, target_net, tau):
+    """target_net = (1 - tau) * target_net + tau * net, in place over all parameter tensors at once"""
+    targets, sources = _parameter_lists([(net, target_net)])
+    torch._foreach_lerp_(targets, sources, tau)
+
+
+@torch.no_grad()
+def hard_update(net, target_net):
+    """Copy the parameters and buffers of target_net into net (the argument order of the agents' hard_update)"""
+    # a plain copy_ loop, buffers may be integer tensors and torch._foreach_copy_ is missing from older releases
+    for dst, src in zip(list(net.parameters()) + list(net.buffers()),
+                        list(target_net.parameters()) + list(target_net.buffers())):
+        dst.copy_(src)
+
+
+class TargetUpdater:
+    """
+    Polyak averaging of (net, target_net) pairs applied every `every` calls to step().
+
+    The parameter tensors of all pairs are gathered once, so a step is a single fused
+    multi-tensor lerp with no temporaries. The modules must not be replaced afterwards,
+    loading state dicts into them is fine.
+    """
+
+    def __init__(self, pairs, tau, every=1) -> None:
+        self.tau = tau
+        self.every = max(int(every), 1)
+        self.count = 0
+        self.targets, self.sources = _parameter_lists(pairs)
+
+    def step(self):
+        """Count one optimization step, return True when the targets were updated"""
+        self.count += 1
+        if self.count % self.every:
+            return False
+        with torch.no_grad():
+            torch._foreach_lerp_(self.targets, self.sources, self.tau)
+        return True
+
+    def sync(self):
+        """Copy the online parameters into the targets"""
+        with torch.no_grad():
+            # a lerp with weight 1 returns the end point exactly
+            torch._foreach_lerp_(self.targets, self.sources, 1.0)
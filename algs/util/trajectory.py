@@ -0,0 +1,112 @@
+import numpy as np
+
+PDQN_LAYOUT = ('state', 'action', 'action_param', 'reward', 'next_state', 'truncated', 'done', 'info')
+SAC_LAYOUT = ('state', 'action', 'reward', 'next_state', 'truncated', 'done', 'info')
+
+
+def impact_correction(info):
+    """Impact of the ego vehicle on the rear vehicle, credited to the step that caused it"""
+    return info['impact'] / 9
+
+
+def n_step_returns(reward, terminal, gamma, n_step):
+    """
+    Discounted sums of reward over windows of up to n_step steps starting at every step, a
+    window stops at the first terminal step. Return (returns, index of the last step of each
+    window, whether each window stopped at a terminal step).
+    """
+    length = len(reward)
+    steps = np.arange(length)
+    returns = np.zeros(length, dtype=np.float64)
+    end = steps.copy()
+    live = np.ones(length, dtype=bool)
+    for j in range(n_step):
+        k = steps + j
+        live &= k < length
+        k = np.minimum(k, length - 1)
+        returns[live] += gamma ** j * reward[k[live]]
+        end[live] = k[live]
+        live &= ~terminal[k]
+    return returns, end, terminal[end]
+
+
+class TrajectoryProcessor:
+    """
+    Per actor post-processing of transitions before they are stored in the replay buffer.
+
+    Transitions are tuples laid out as layout, the order of the agent's store_transition.
+    process(actor, transitions) takes the next chunk of one actor's stream and returns the
+    finished transitions as one array per field, computed over the whole chunk at once:
+    - the reward of a step gets correction(info) of the step after it, unless the step ends
+      the episode (truncated or done);
+    - with n_step > 1 it is then replaced by the discounted n-step return, and next_state,
+      truncated and done come from the last step of the window. A window stops at the end
+      of the episode, where it is not bootstrapped anyway. The learner has to bootstrap the
+      others with gamma ** n_step, e.g. by getting that as its gamma.
+
+    The last steps of a chunk wait for the future steps their window needs, they are
+    finished with the next chunk of the same actor. end_episode(actor) drops them when a
+    stream stops without a terminal step.
+    """
+
+    def __init__(self, gamma, n_step=1, correction=None, layout=PDQN_LAYOUT) -> None:
+        self.gamma = gamma
+        self.n_step = max(int(n_step), 1)
+        self.correction = correction
+        self.layout = layout
+        self.reward_index = layout.index('reward')
+        self.next_state_index = layout.index('next_state')
+        self.truncated_index, self.done_index = layout.index('truncated'), layout.index('done')
+        self.info_index = layout.index('info')
+        self.pending = {}   # actor: columns of the steps still waiting for their window
+
+    def _columns(self, transitions):
+        columns = []
+        for i in range(len(self.layout)):
+            if i == self.reward_index:
+                columns.append(np.array([transition[i] for transition in transitions], dtype=np.float64).reshape(-1))
+            elif i in (self.truncated_index, self.done_index):
+                columns.append(np.array([transition[i] for transition in transitions], dtype=bool).reshape(-1))
+            else:
+                column = np.empty(len(transitions), dtype=object)
+                for j, transition in enumerate(transitions):
+                    column[j] = transition[i]
+                columns.append(column)
+        return columns
+
+    def process(self, actor, transitions):
+        """Add the next transitions of actor, return the finished ones as a tuple of field arrays"""
+        columns = self._columns(transitions)
+        if actor in self.pending:
+            columns = [np.concatenate((pending, column)) for pending, column in zip(self.pending.pop(actor), columns)]
+        length = len(columns[0])
+        reward = columns[self.reward_index]
+        terminal = columns[self.truncated_index] | columns[self.done_index]
+
+        lookahead = 0
+        if self.correction is not None:
+            lookahead = 1
+            correction = np.array([self.correction(info) for info in columns[self.info_index][1:]], dtype=np.float64)
+            reward = reward.copy()
+            reward[:-1] += np.where(terminal[:-1], 0., correction)
+        returns, end, stopped = n_step_returns(reward, terminal, self.gamma, self.n_step)
+
+        # a window is final once it reached a terminal step or its last step's reward is known
+        finished = stopped | (np.arange(length) + self.n_step - 1 + lookahead < length)
+        count = length if finished.all() else int(np.argmin(finished))
+        if count < length:
+            self.pending[actor] = [column[count:] for column in columns]
+
+        result = [column[:count] for column in columns]
+        result[self.reward_index] = returns[:count]
+        for i in (self.next_state_index, self.truncated_index, self.done_index):
+            result[i] = columns[i][end[:count]]
+        return tuple(result)
+
+    def end_episode(self, actor):
+        self.pending.pop(actor, None)
+
+    @staticmethod
+    def rows(columns):
+        """Iterate over the transitions of process' result as tuples"""
+        return zip(*columns)
@@ -0,0 +1,94 @@
+import numpy as np
+import torch
+from multiprocessing import shared_memory, resource_tracker
+
+
+class SharedWeights:
+    """
+    Versioned block of network weights in shared memory, published by the learner and copied
+    in place by the workers.
+
+    The block holds the parameters of the given networks as one float32 vector after a header
+    with a version number, the learner's learn_time and its last critic loss. The version is a
+    seqlock: the learner makes it odd before writing and even once the block is complete. A
+    reader only copies an even version newer than the one it holds, and drops the copy when the
+    version moved meanwhile; it tries again at its next poll.
+
+    The learner creates the block and passes weights.spec to the workers, which attach to it.
+    """
+
+    def __init__(self, spec, shm, owner=False) -> None:
+        self.spec = spec
+        self.shm = shm
+        self.owner = owner
+        # (network name, parameter name, number of elements) in block order
+        self.layout = [tuple(entry) for entry in spec['layout']]
+        self.size = sum(numel for _, _, numel in self.layout)
+        self.read_version, self.read_learn_time = 0, None
+
+        buf = shm.buf
+        self.version = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=0)
+        self.learn_time = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=8)
+        self.q_loss = np.ndarray((1,), dtype=np.float64, buffer=buf, offset=16)
+        self.flat = np.ndarray((self.size,), dtype=np.float32, buffer=buf, offset=24)
+
+    @classmethod
+    def create(cls, nets):
+        """nets: {name: module}, the same names are passed to publish and poll"""
+        layout = [(net_name, name, param.numel()) for net_name, net in nets.items()
+                  for name, param in net.named_parameters()]
+        shm = shared_memory.SharedMemory(create=True, size=24 + 4 * sum(numel for _, _, numel in layout))
+        weights = cls({'name': shm.name, 'layout': layout}, shm, owner=True)
+        weights.version[0], weights.learn_time[0], weights.q_loss[0] = 0, 0, np.nan
+        return weights
+
+    @classmethod
+    def attach(cls, spec):
+        shm = shared_memory.SharedMemory(name=spec['name'])
+        # only the creating process may unlink the block, keep the tracker of this process away from it
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(spec, shm)
+
+    def close(self):
+        del self.version, self.learn_time, self.q_loss, self.flat
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _parameters(self, nets):
+        named = {net_name: dict(net.named_parameters()) for net_name, net in nets.items()}
+        return [named[net_name][name] for net_name, name, _ in self.layout]
+
+    @torch.no_grad()
+    def publish(self, nets, learn_time, q_loss=None):
+        """Write the current weights of nets with a new version"""
+        flat = torch.cat([param.detach().reshape(-1).float() for param in self._parameters(nets)]).cpu().numpy()
+        self.version[0] += 1    # odd, readers leave the block alone
+        self.flat[:] = flat
+        self.learn_time[0] = learn_time
+        self.q_loss[0] = np.nan if q_loss is None else q_loss
+        self.version[0] += 1
+
+    @torch.no_grad()
+    def poll(self, nets, min_steps=0):
+        """
+        Copy a newer version into the parameters of nets, in place. Versions published less than
+        min_steps learn steps after the last copied one are skipped.
+        Return (learn_time, q_loss) when the weights were copied, None otherwise.
+        """
+        version = int(self.version[0])
+        if version % 2 or version == self.read_version:
+            return None
+        learn_time = int(self.learn_time[0])
+        if self.read_learn_time is not None and learn_time - self.read_learn_time < min_steps:
+            return None
+        flat, q_loss = self.flat.copy(), float(self.q_loss[0])
+        if int(self.version[0]) != version:
+            return None
+
+        params = self._parameters(nets)
+        flat = torch.from_numpy(flat).to(params[0].device)
+        for param, chunk in zip(params, flat.split([numel for _, _, numel in self.layout])):
+            param.copy_(chunk.view_as(param))
+        self.read_version, self.read_learn_time = version, learn_time
+        return learn_time, None if np.isnan(q_loss) else q_loss
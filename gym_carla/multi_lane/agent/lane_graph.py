@@ -0,0 +1,180 @@
+import carla
+import os
+import numpy as np
+from gym_carla.multi_lane.settings import ROADS
+
+# graphs are cached here as lane_graph_<map>_<sampling radius>.npz
+LANE_GRAPH_DIR = os.path.join(os.getcwd(), 'out', 'lane_graph')
+
+# graphs already loaded by this process, LocalPlanner is rebuilt on every env reset
+_graphs = {}
+
+
+def _pick(waypoints):
+    """Choose among the branches of next()/previous() the way LocalPlanner always did, prefer the chosen route"""
+    picked = waypoints[0]
+    for wp in waypoints:
+        if wp.road_id in ROADS:
+            picked = wp
+    return picked
+
+
+class LaneGraph:
+    """
+    Every driving lane of a map sampled once at the planner's resolution. Nodes of one lane segment
+    (road, section, lane) are stored contiguously in driving order, the node arrays are
+        location, yaw, s: pose of the node, yaw in degrees
+        road_id, section_id, lane_id: lane segment of the node
+        successor, predecessor, left, right: index of the neighbouring node, -1 if there is none
+    The waypoints ahead or behind a node are a row of a precomputed index table, so the planner
+    no longer chains waypoint.next()/previous() through the server every step.
+    """
+    NODE_FIELDS = ('location', 'yaw', 's', 'road_id', 'section_id', 'lane_id',
+                   'successor', 'predecessor', 'left', 'right')
+
+    def __init__(self, map, sampling_radius, arrays, waypoints=None) -> None:
+        self._map = map
+        self.sampling_radius = sampling_radius
+        for field in LaneGraph.NODE_FIELDS:
+            setattr(self, field, arrays[field])
+        self.size = len(self.s)
+        # node range of every lane segment
+        self._segments = {}
+        for road_id, section_id, lane_id, start, count in zip(
+                arrays['segment_road'].tolist(), arrays['segment_section'].tolist(), arrays['segment_lane'].tolist(),
+                arrays['segment_start'].tolist(), arrays['segment_count'].tolist()):
+            self._segments[(road_id, section_id, lane_id)] = (start, count)
+        # carla.Waypoint of each node, created on first use when the graph comes from the disk cache
+        self._waypoints = waypoints if waypoints is not None else [None] * self.size
+        self._chains = {}
+
+    @classmethod
+    def load(cls, map, sampling_radius, cache_dir=LANE_GRAPH_DIR):
+        """Lane graph of map, from this process, the disk cache or built and cached if neither has it"""
+        name = os.path.basename(map.name)
+        key = (name, float(sampling_radius))
+        if key in _graphs:
+            return _graphs[key]
+        file = os.path.join(cache_dir, f'lane_graph_{name}_{float(sampling_radius):g}.npz')
+        if os.path.exists(file):
+            with np.load(file) as data:
+                graph = cls(map, sampling_radius, {field: data[field] for field in data.files})
+        else:
+            graph = cls.build(map, sampling_radius)
+            graph.save(file)
+        _graphs[key] = graph
+        return graph
+
+    @classmethod
+    def build(cls, map, sampling_radius):
+        """Sample the lanes of map's topology, the only pass that walks waypoints through the server"""
+        segments = {}
+        for entry, _ in map.get_topology():
+            segments.setdefault((entry.road_id, entry.section_id, entry.lane_id), entry)
+
+        lanes, ends = [], []
+        for entry in segments.values():
+            lane = [entry] + list(entry.next_until_lane_end(sampling_radius))
+            following = lane[-1].next(sampling_radius)
+            if len(lane) > 1 and following:
+                # the lane end is the entry of the following segment
+                lane.pop()
+            lanes.append(lane)
+            ends.append(_pick(following) if following else None)
+
+        waypoints = [wp for lane in lanes for wp in lane]
+        counts = np.array([len(lane) for lane in lanes], dtype=np.int32)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int32)
+        transforms = [wp.transform for wp in waypoints]
+        arrays = {
+            'location': np.array([[t.location.x, t.location.y, t.location.z] for t in transforms], dtype=np.float32),
+            'yaw': np.array([t.rotation.yaw for t in transforms], dtype=np.float32),
+            's': np.array([wp.s for wp in waypoints]),
+            'road_id': np.array([wp.road_id for wp in waypoints], dtype=np.int32),
+            'section_id': np.array([wp.section_id for wp in waypoints], dtype=np.int32),
+            'lane_id': np.array([wp.lane_id for wp in waypoints], dtype=np.int32),
+            'segment_road': np.array([key[0] for key in segments], dtype=np.int32),
+            'segment_section': np.array([key[1] for key in segments], dtype=np.int32),
+            'segment_lane': np.array([key[2] for key in segments], dtype=np.int32),
+            'segment_start': starts,
+            'segment_count': counts,
+        }
+        index = np.arange(len(waypoints), dtype=np.int32)
+        for field in ('successor', 'predecessor', 'left', 'right'):
+            arrays[field] = np.full(len(waypoints), -1, dtype=np.int32)
+        graph = cls(map, sampling_radius, arrays, waypoints)
+
+        for lane, start, count, end in zip(lanes, starts, counts, ends):
+            nodes = index[start:start + count]
+            graph.successor[nodes[:-1]] = nodes[1:]
+            graph.predecessor[nodes[1:]] = nodes[:-1]
+            if end is not None:
+                graph.successor[nodes[-1]] = graph.node(end)
+            before = lane[0].previous(sampling_radius)
+            if before:
+                graph.predecessor[nodes[0]] = graph.node(_pick(before))
+            # neighbouring lanes share the s coordinate of the road, map the nodes across by s
+            for field, neighbour in (('left', lane[0].get_left_lane()), ('right', lane[0].get_right_lane())):
+                if neighbour is not None and neighbour.lane_type == carla.LaneType.Driving:
+                    getattr(graph, field)[nodes] = graph._nearest(
+                        (neighbour.road_id, neighbour.section_id, neighbour.lane_id), graph.s[nodes], sampling_radius)
+        return graph
+
+    def save(self, file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        arrays = {field: getattr(self, field) for field in LaneGraph.NODE_FIELDS}
+        keys = list(self._segments)
+        arrays['segment_road'] = np.array([key[0] for key in keys], dtype=np.int32)
+        arrays['segment_section'] = np.array([key[1] for key in keys], dtype=np.int32)
+        arrays['segment_lane'] = np.array([key[2] for key in keys], dtype=np.int32)
+        arrays['segment_start'] = np.array([self._segments[key][0] for key in keys], dtype=np.int32)
+        arrays['segment_count'] = np.array([self._segments[key][1] for key in keys], dtype=np.int32)
+        # write then rename, a crash leaves either no graph or a complete one
+        with open(file + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(file + '.tmp', file)
+
+    def _nearest(self, segment, s, tolerance=np.inf):
+        """Nodes of lane segment closest to each s, -1 where the segment is missing or farther than tolerance"""
+        s = np.atleast_1d(np.asarray(s, dtype=np.float64))
+        if segment not in self._segments:
+            return np.full(s.shape, -1, dtype=np.int32)
+        start, count = self._segments[segment]
+        nodes_s = self.s[start:start + count]
+        if count > 1 and nodes_s[-1] < nodes_s[0]:
+            # lanes driven against the road direction have decreasing s
+            nodes_s, s = -nodes_s, -s
+        right = np.clip(np.searchsorted(nodes_s, s), 0, count - 1)
+        left = np.maximum(right - 1, 0)
+        closest = np.where(np.abs(nodes_s[left] - s) <= np.abs(nodes_s[right] - s), left, right)
+        nodes = (start + closest).astype(np.int32)
+        nodes[np.abs(nodes_s[closest] - s) > tolerance] = -1
+        return nodes
+
+    def node(self, waypoint):
+        """Node closest to waypoint along its lane, -1 if the lane is not in the graph"""
+        return int(self._nearest((waypoint.road_id, waypoint.section_id, waypoint.lane_id), waypoint.s)[0])
+
+    def _chain(self, direction, length):
+        """(size, length) table of the next length nodes of every node along successor or predecessor, -1 padded"""
+        key = (direction, length)
+        if key not in self._chains:
+            link = np.append(self.successor if direction else self.predecessor, -1)
+            table = np.empty((self.size, length), dtype=np.int32)
+            table[:, 0] = link[:-1]
+            for i in range(1, length):
+                # -1 indexes the appended -1, a dead end stays one
+                table[:, i] = link[table[:, i - 1]]
+            self._chains[key] = (table, np.count_nonzero(table >= 0, axis=1))
+        return self._chains[key]
+
+    def waypoints(self, node, length, direction=True):
+        """Waypoints of the length nodes ahead of (direction=True) or behind node, node itself excluded"""
+        table, valid = self._chain(direction, length)
+        return [self.waypoint(i) for i in table[node, :valid[node]].tolist()]
+
+    def waypoint(self, node):
+        if self._waypoints[node] is None:
+            self._waypoints[node] = self._map.get_waypoint_xodr(
+                int(self.road_id[node]), int(self.lane_id[node]), float(self.s[node]))
+        return self._waypoints[node]
@@ -4,6 +4,9 @@ import logging
 from collections import deque
 from shapely.geometry import Polygon
 from gym_carla.multi_lane.agent.global_planner import RoadOption
+from gym_carla.multi_lane.agent.lane_graph import LaneGraph, LANE_GRAPH_DIR
+from gym_carla.multi_lane.agent.vehicle_index import VehicleIndex
+from gym_carla.multi_lane.util.snapshot import TickSnapshot
 from gym_carla.multi_lane.util.wrapper import WaypointWrapper,VehicleWrapper
 from gym_carla.multi_lane.settings import ROADS, STRAIGHT, CURVE, JUNCTION, DOUBLE_DIRECTION, DISTURB_ROADS
 from gym_carla.multi_lane.util.misc import get_lane_center, get_speed, vector, compute_magnitude_angle, \
@@ -23,6 +26,8 @@ class LocalPlanner:
         self._map = self._world.get_map()
 
         self._sampling_radius = opt_dict['sampling_resolution']
+        self._lane_graph_dir = opt_dict.get('lane_graph_dir', LANE_GRAPH_DIR)
+        self._lane_graph = LaneGraph.load(self._map, self._sampling_radius, self._lane_graph_dir)
         self._base_min_distance = 3.0  # This value is tricky
 
         self._target_waypoint = None
@@ -40,6 +45,7 @@ class LocalPlanner:
         self.waypoints_info=None
         self.lights_info=None
         self.vehicles_info=None
+        self._vehicle_index=None
 
         self._waypoints_queue.append((self._current_waypoint, RoadOption.LANEFOLLOW))
         # self._waypoints_queue.append( (self._current_waypoint.next(self._sampling_radius)[0], RoadOption.LANEFOLLOW))
@@ -133,7 +139,11 @@ class LocalPlanner:
                 return 0
             else:
                 if veh:
-                    pre_wps=wps[0].previous(self._sampling_radius)
+                    node=self._lane_graph.node(wps[0])
+                    if node >= 0 and self._lane_graph.predecessor[node] >= 0:
+                        pre_wps=[self._lane_graph.waypoint(self._lane_graph.predecessor[node])]
+                    else:
+                        pre_wps=wps[0].previous(self._sampling_radius)
                     pre_wp=None
                     if len(pre_wps)==1:
                         pre_wp=pre_wps[0]
@@ -141,22 +151,23 @@ class LocalPlanner:
                         for i, wp in enumerate(pre_wps):
                             if wp.road_id in ROADS:
                                 pre_wp = wp
-                    vehicle_len = max(abs(self._vehicle.bounding_box.extent.x),
-                                    abs(self._vehicle.bounding_box.extent.y)) + \
-                                max(abs(veh.bounding_box.extent.x),
-                                    abs(veh.bounding_box.extent.y))
+                    ego_extent = snapshot.get_bounding_box(self._vehicle).extent
+                    veh_extent = snapshot.get_bounding_box(veh).extent
+                    vehicle_len = max(abs(ego_extent.x), abs(ego_extent.y)) + max(abs(veh_extent.x), abs(veh_extent.y))
                     
-                    return max(pre_wp.transform.location.distance(veh.get_location())-vehicle_len,0.0001)
+                    return max(pre_wp.transform.location.distance(snapshot.get_location(veh))-vehicle_len,0.0001)
                 else:
                     return self.vehicle_proximity
 
-        vehicle_list=self._world.get_actors().filter("*vehicle*")
-        left_front_veh=self._get_vehicles_one_lane(vehicle_list,True,-1)
-        left_rear_veh=self._get_vehicles_one_lane(vehicle_list,False,-1)
-        center_front_veh=self._get_vehicles_one_lane(vehicle_list,True,0)
-        center_rear_veh=self._get_vehicles_one_lane(vehicle_list,False,0)
-        right_front_veh=self._get_vehicles_one_lane(vehicle_list,True,1)
-        right_rear_veh=self._get_vehicles_one_lane(vehicle_list,False,1)
+        snapshot=TickSnapshot.capture(self._world)
+        vehicle_index=self._get_vehicle_index()
+        ego_vehicle_lane_center = get_lane_center(self._map, snapshot.get_location(self._vehicle))
+        left_front_veh=self._get_vehicles_one_lane(vehicle_index,ego_vehicle_lane_center,True,-1)
+        left_rear_veh=self._get_vehicles_one_lane(vehicle_index,ego_vehicle_lane_center,False,-1)
+        center_front_veh=self._get_vehicles_one_lane(vehicle_index,ego_vehicle_lane_center,True,0)
+        center_rear_veh=self._get_vehicles_one_lane(vehicle_index,ego_vehicle_lane_center,False,0)
+        right_front_veh=self._get_vehicles_one_lane(vehicle_index,ego_vehicle_lane_center,True,1)
+        right_rear_veh=self._get_vehicles_one_lane(vehicle_index,ego_vehicle_lane_center,False,1)
 
         distance_to_front_vehicles=[]
         distance_to_rear_vehicles=[]
@@ -176,7 +187,14 @@ class LocalPlanner:
                 'dis_to_front_vehs':distance_to_front_vehicles,
                 'dis_to_rear_vehs':distance_to_rear_vehicles}
     
-    def _get_vehicles_one_lane(self,vehicle_list,direction=True,lane_offset=0):
+    def _get_vehicle_index(self):
+        """Lane index of the vehicles at the current tick, built on the first query of the tick"""
+        snapshot = TickSnapshot.capture(self._world)
+        if self._vehicle_index is None or self._vehicle_index.frame != snapshot.frame:
+            self._vehicle_index = VehicleIndex(self._map, snapshot, self._world.get_actors().filter("*vehicle*"))
+        return self._vehicle_index
+
+    def _get_vehicles_one_lane(self,vehicle_index,ego_vehicle_lane_center,direction=True,lane_offset=0):
         """
         Check if a given vehicle is an obstacle in our way. To this end we take
         into account the road and lane the target vehicle is on and run a
@@ -187,60 +205,24 @@ class LocalPlanner:
         vehicles, which center is actually on a different lane but their
         extension falls within the ego vehicle lane.
 
-        :param vehicle_list: list of potential obstacle to check
+        :param vehicle_index: VehicleIndex of the current tick
+        :param ego_vehicle_lane_center: lane center waypoint of ego vehicle
         :param direction: True--detect vehicles in front of ego vehicle
                             False--detec vehicles at the back of ego vehicle
         :param lane_offset: the lane relative to current ego vehicle's lane,
             minus value means left, positive value means right
         """
-        
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_transform = self._vehicle.get_transform()
-        ego_vehicle_lane_center = get_lane_center(self._map, ego_vehicle_location)
         if not test_waypoint(ego_vehicle_lane_center):
             return None
-        
-        min_distance = self.vehicle_proximity
-        vehicle = None
+
         lane_id = ego_vehicle_lane_center.lane_id - lane_offset
         if lane_id != -1 and lane_id != -2 and lane_id != -3:
-            return vehicle
-
-        for target_vehicle in vehicle_list:
-            # do not account for the ego vehicle
-            if target_vehicle.id == self._vehicle.id:
-                continue
-
-            # if the object is not in our lane it's not an obstacle
-            target_vehicle_waypoint = self._map.get_waypoint(target_vehicle.get_location())
-            # check whether in the same road
-            target_lane_center = get_lane_center(self._map, target_vehicle.get_location())
-            if target_lane_center.transform.location.distance(target_vehicle.get_location()) > target_lane_center.lane_width / 2 + 0.1:
-                continue
-            if not test_waypoint(target_vehicle_waypoint):
-                continue
-            # check whether in the specific lane
-            if target_vehicle_waypoint.lane_id != lane_id:
-                continue
-            # if target_vehicle_waypoint.road_id != ego_vehicle_waypoint.road_id or \
-            #         target_vehicle_waypoint.lane_id != ego_vehicle_waypoint.lane_id:
-            #     continue
-
-            loc = target_vehicle.get_location()
-            if direction:
-                if is_within_distance_ahead(loc, ego_vehicle_location, ego_vehicle_transform, self.vehicle_proximity):
-                    if ego_vehicle_location.distance(loc) < min_distance:
-                        # Return the most close vehicel in front of ego vehicle
-                        vehicle = target_vehicle
-                        min_distance = ego_vehicle_location.distance(loc)
-            else:
-                if is_within_distance_rear(loc, ego_vehicle_location, ego_vehicle_transform, self.vehicle_proximity):
-                    if ego_vehicle_location.distance(loc) < min_distance:
-                        # Return the most close vehicel in front of ego vehicle
-                        vehicle = target_vehicle
-                        min_distance = ego_vehicle_location.distance(loc)
+            return None
 
-        return vehicle
+        # Return the most close vehicle in front of or at the back of ego vehicle
+        snapshot = TickSnapshot.capture(self._world)
+        return vehicle_index.nearest(lane_id, snapshot.get_location(self._vehicle), snapshot.get_forward_vector(self._vehicle),
+                                     self.vehicle_proximity, direction, self._vehicle.id)
 
     def _get_waypoints(self):
         left_front_wps=None
@@ -266,12 +248,26 @@ class LocalPlanner:
             lane_center=None
             #logging.error("WAYPOINTS GET BUG")
 
-        left_front_wps=self._get_waypoints_one_lane(left,True)
-        left_rear_wps=self._get_waypoints_one_lane(left,False)
-        center_front_wps=self._get_waypoints_one_lane(center,True)
-        center_rear_wps=self._get_waypoints_one_lane(center,False)
-        right_front_wps=self._get_waypoints_one_lane(right,True)
-        right_rear_wps=self._get_waypoints_one_lane(right,False)
+        center_node = self._lane_graph.node(center)
+        if center_node >= 0:
+            # the lanes ahead and behind come from the precomputed lane graph
+            graph = self._lane_graph
+            left_node = graph.left[center_node] if left is not None else -1
+            right_node = graph.right[center_node] if right is not None else -1
+            left_front_wps=self._get_graph_waypoints(left_node,True)
+            left_rear_wps=self._get_graph_waypoints(left_node,False)
+            center_front_wps=self._get_graph_waypoints(center_node,True)
+            center_rear_wps=self._get_graph_waypoints(center_node,False)
+            right_front_wps=self._get_graph_waypoints(right_node,True)
+            right_rear_wps=self._get_graph_waypoints(right_node,False)
+        else:
+            # not on a driving lane of the graph, walk the waypoints on the server
+            left_front_wps=self._get_waypoints_one_lane(left,True)
+            left_rear_wps=self._get_waypoints_one_lane(left,False)
+            center_front_wps=self._get_waypoints_one_lane(center,True)
+            center_rear_wps=self._get_waypoints_one_lane(center,False)
+            right_front_wps=self._get_waypoints_one_lane(right,True)
+            right_rear_wps=self._get_waypoints_one_lane(right,False)
 
         return {'left_front_wps':list(left_front_wps),
                 'left_rear_wps':list(left_rear_wps),
@@ -280,6 +276,12 @@ class LocalPlanner:
                 'right_front_wps':list(right_front_wps),
                 'right_rear_wps':list(right_rear_wps)}
 
+    def _get_graph_waypoints(self, node, direction=True):
+        """Lane graph counterpart of _get_waypoints_one_lane, node -1 stands for a missing lane"""
+        if node < 0:
+            return []
+        return self._lane_graph.waypoints(node, self._buffer_size, direction)
+
     def _get_waypoints_one_lane(self, waypoint=None, direction=True):
         """Get the  waypoint list according to ego vehicle's current location,
         direction = True: caculated waypoints in front of current location,
@@ -456,6 +458,7 @@ class LocalPlanner:
 
     def set_sampling_redius(self, sampling_resolution):
         self._sampling_radius = sampling_resolution
+        self._lane_graph = LaneGraph.load(self._map, self._sampling_radius, self._lane_graph_dir)
 
     def set_min_distance(self, min_distance):
         self._min_distance = min_distance
@@ -0,0 +1,84 @@
+import carla
+import numpy as np
+from gym_carla.multi_lane.util.misc import get_lane_center, test_waypoint
+
+
+class VehicleIndex:
+    """
+    Lane assignment of the vehicles at one tick, built from the TickSnapshot of the tick with one
+    map projection per vehicle. Rows are sorted by (lane_id, road_id, s), so the vehicles of a
+    lane are one slice found by binary search and every nearest-vehicle query of the tick
+    reuses the projections instead of asking the map again.
+        frame: snapshot frame the index was built for
+        vehicles: the indexed actors, in row order
+        lane_id, road_id, s: lane of the waypoint each vehicle is projected to
+        location: (n, 3) vehicle locations at the snapshot
+    """
+
+    def __init__(self, map, snapshot, vehicle_list) -> None:
+        self.frame = snapshot.frame
+        rows = []
+        for vehicle in vehicle_list:
+            row = snapshot.row(vehicle)
+            if row is None:
+                # spawned after the snapshot was taken
+                continue
+            x, y, z = snapshot.location[row]
+            location = carla.Location(x=x, y=y, z=z)
+            waypoint = map.get_waypoint(location)
+            # only vehicles close to the center of a lane of the chosen route
+            lane_center = get_lane_center(map, location)
+            if lane_center.transform.location.distance(location) > lane_center.lane_width / 2 + 0.1:
+                continue
+            if not test_waypoint(waypoint):
+                continue
+            rows.append((waypoint.lane_id, waypoint.road_id, waypoint.s, location.x, location.y, location.z, vehicle))
+
+        rows.sort(key=lambda row: row[:3])
+        self.vehicles = [row[-1] for row in rows]
+        self.ids = np.array([vehicle.id for vehicle in self.vehicles], dtype=np.int64)
+        self.lane_id = np.array([row[0] for row in rows], dtype=np.int64)
+        self.road_id = np.array([row[1] for row in rows], dtype=np.int64)
+        self.s = np.array([row[2] for row in rows], dtype=np.float64)
+        self.location = np.array([row[3:6] for row in rows], dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def lane(self, lane_id):
+        """Row slice of the vehicles on lanes with lane_id"""
+        return slice(np.searchsorted(self.lane_id, lane_id, side='left'),
+                     np.searchsorted(self.lane_id, lane_id, side='right'))
+
+    def nearest(self, lane_id, location, forward_vector, max_distance, ahead=True, exclude=None):
+        """
+        Closest vehicle on lane_id within max_distance ahead of (or behind) location, the vectorized
+        is_within_distance_ahead / is_within_distance_rear test the planner ran vehicle by vehicle
+
+        :param forward_vector: heading of the reference vehicle
+        :param exclude: id of the reference vehicle itself
+        :return: the vehicle actor or None
+        """
+        rows = self.lane(lane_id)
+        points = self.location[rows]
+        if len(points) == 0:
+            return None
+        target = points[:, :2] - (location.x, location.y)
+        norm = np.hypot(target[:, 0], target[:, 1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cos = np.clip((target[:, 0] * forward_vector.x + target[:, 1] * forward_vector.y) / norm, -1, 1)
+        angle = np.degrees(np.arccos(cos))
+        if ahead:
+            inside = (angle > 0.0) & (angle < 90.0)
+        else:
+            inside = (angle > 90.0) & (angle < 180.0)
+        inside = (norm < 0.001) | ((norm <= max_distance) & inside)
+        if exclude is not None:
+            inside &= self.ids[rows] != exclude
+        distance = np.sqrt(np.sum((points - (location.x, location.y, location.z)) ** 2, axis=1))
+        # the planner only reports vehicles strictly closer than its proximity
+        inside &= distance < max_distance
+        if not inside.any():
+            return None
+        candidates = np.flatnonzero(inside)
+        return self.vehicles[rows.start + candidates[np.argmin(distance[candidates])]]
@@ -19,7 +19,7 @@ from gym_carla.multi_lane.util.sensor import CollisionSensor, LaneInvasionSensor
 from gym_carla.multi_lane.util.wrapper import WaypointWrapper,VehicleWrapper,Action,SpeedState,Truncated,ControlInfo,process_veh, \
     process_steer,recover_steer,fill_action_param,ttc_reward,comfort,lane_center_reward,calculate_guide_lane_center,process_lane_wp
 from gym_carla.multi_lane.util.misc import draw_waypoints, get_speed, get_acceleration, test_waypoint, \
-    get_actor_polygons, get_lane_center, get_yaw_diff,is_within_distance_ahead,get_projection,\
+    get_actor_polygons, get_lane_center, compute_lane_center, get_yaw_diff,is_within_distance_ahead,get_projection,\
     create_vehicle_blueprint
 
 class EgoClient:
@@ -502,7 +502,7 @@ class EgoClient:
         center_wps=self.wps_info.center_front_wps
         right_wps=self.wps_info.right_front_wps
 
-        lane_center = get_lane_center(self.map, self.ego_vehicle.get_location())
+        lane_center = compute_lane_center(self.map, self.ego_vehicle.get_location())
         right_lane_dis = lane_center.get_right_lane().transform.location.distance(self.ego_vehicle.get_location())
         ego_t= lane_center.lane_width / 2 + lane_center.get_right_lane().lane_width / 2 - right_lane_dis
 
@@ -591,7 +591,7 @@ class EgoClient:
 
         ttc,fTTC=ttc_reward(self.ego_vehicle,self.vehs_info.center_front_veh,self.min_distance,self.TTC_THRESHOLD)
 
-        lane_center = get_lane_center(self.map, self.ego_vehicle.get_location())
+        lane_center = compute_lane_center(self.map, self.ego_vehicle.get_location())
         yaw_forward = lane_center.transform.get_forward_vector().make_unit_vector()
         
         v_3d = self.ego_vehicle.get_velocity()
@@ -15,10 +15,11 @@ from gym_carla.multi_lane.agent.global_planner import GlobalPlanner,RoadOption
 from gym_carla.multi_lane.agent.basic_lanechanging_agent import Basic_Lanechanging_Agent
 from gym_carla.single_lane.navigation.constant_velocity_agent import ConstantVelocityAgent
 from gym_carla.multi_lane.util.sensor import CollisionSensor, LaneInvasionSensor, SemanticTags
+from gym_carla.multi_lane.util.snapshot import TickSnapshot
 from gym_carla.multi_lane.util.wrapper import WaypointWrapper,VehicleWrapper,Action,SpeedState,Truncated,ControlInfo,process_veh, \
     process_steer,recover_steer,fill_action_param,ttc_reward,comfort,lane_center_reward,calculate_guide_lane_center,process_lane_wp
 from gym_carla.multi_lane.util.misc import draw_waypoints, get_speed, get_acceleration, test_waypoint, \
-    compute_distance, get_actor_polygons, get_lane_center, remove_unnecessary_objects, get_yaw_diff, \
+    compute_distance, get_actor_polygons, get_lane_center, compute_lane_center, remove_unnecessary_objects, get_yaw_diff, \
     get_trafficlight_trigger_location, is_within_distance, get_sign,is_within_distance_ahead,get_projection,\
     create_vehicle_blueprint
 
@@ -210,6 +211,7 @@ class CarlaEnv:
         get_location() Returns the actor's location the client recieved during last tick. The method does not call the simulator.
         Hence, upon initializing, the world should first tick before calling get_location, or it could cause fatal bug"""
         # self.ego_vehicle.get_location()
+        snapshot = TickSnapshot.capture(self.sim_world)
 
         # add route planner for ego vehicle
         self.local_planner = LocalPlanner(self.ego_vehicle, {'sampling_resolution': self.sampling_resolution,
@@ -218,7 +220,7 @@ class CarlaEnv:
                                                              'traffic_light_proximity':self.traffic_light_proximity})
         # self.local_planner.set_global_plan(self.global_planner.get_route(
         #      self.map.get_waypoint(self.ego_vehicle.get_location())))
-        self.current_lane=get_lane_center(self.map,self.ego_vehicle.get_location()).lane_id
+        self.current_lane=get_lane_center(self.map,snapshot.get_location(self.ego_vehicle)).lane_id
         self.last_lane=self.current_lane
         self.last_target_lane,self.current_target_lane=self.current_lane,self.current_lane
         self.last_action,self.current_action=Action.LANE_FOLLOW,Action.LANE_FOLLOW
@@ -393,10 +395,12 @@ class CarlaEnv:
             # print(self.map.get_waypoint(self.ego_vehicle.get_location(),False),self.ego_vehicle.get_transform(),sep='\n')
             # print(self.sim_world.get_snapshot().timestamp)
             # print()
+            # every state and reward term of the step reads the actors from this snapshot
+            snapshot = TickSnapshot.capture(self.sim_world)
             cont=self.ego_vehicle.get_control()
             self.control.throttle, self.control.brake, self.control.steer=cont.throttle, cont.brake, cont.steer
             self.control.gear, self.control.manual_gear_shift=cont.gear, cont.manual_gear_shift
-            lane_center=get_lane_center(self.map,self.ego_vehicle.get_location())
+            lane_center=get_lane_center(self.map,snapshot.get_location(self.ego_vehicle))
             self.current_lane = lane_center.lane_id
             # print(self.ego_vehicle.get_speed_limit(),get_speed(self.ego_vehicle,False),get_acceleration(self.ego_vehicle,False),sep='\t')
             # route planner
@@ -425,15 +429,15 @@ class CarlaEnv:
 
             temp = []
             if self.vehs_info.left_rear_veh is not None:
-                temp.append(get_speed(self.vehs_info.left_rear_veh, False))
+                temp.append(snapshot.get_speed(self.vehs_info.left_rear_veh, False))
             else:
                 temp.append(-1)
             if self.vehs_info.center_rear_veh is not None:
-                temp.append(get_speed(self.vehs_info.center_rear_veh, False))
+                temp.append(snapshot.get_speed(self.vehs_info.center_rear_veh, False))
             else:
                 temp.append(-1)
             if self.vehs_info.right_rear_veh is not None:
-                temp.append(get_speed(self.vehs_info.right_rear_veh, False))
+                temp.append(snapshot.get_speed(self.vehs_info.right_rear_veh, False))
             else:
                 temp.append(-1)
             self.rear_vel_deque.append(temp)
@@ -447,9 +451,9 @@ class CarlaEnv:
 
             #update last step info
             yaw_forward = lane_center.transform.get_forward_vector().make_unit_vector()
-            a_3d=self.ego_vehicle.get_acceleration()
+            a_3d=snapshot.get_acceleration(self.ego_vehicle)
             self.last_acc,a_t=get_projection(a_3d,yaw_forward)
-            self.last_yaw = self.ego_vehicle.get_transform().get_forward_vector()
+            self.last_yaw = snapshot.get_forward_vector(self.ego_vehicle)
             self.last_action=self.current_action
             self.last_lane=self.current_lane
             self.last_target_lane=self.current_target_lane
@@ -524,17 +528,19 @@ class CarlaEnv:
 
     def _get_state(self):
         """return a tuple: the first element is next waypoints, the second element is vehicle_front information"""
+        snapshot = TickSnapshot.capture(self.sim_world)
 
         left_wps=self.wps_info.left_front_wps
         center_wps=self.wps_info.center_front_wps
         right_wps=self.wps_info.right_front_wps
 
-        lane_center = get_lane_center(self.map, self.ego_vehicle.get_location())
-        right_lane_dis = lane_center.get_right_lane().transform.location.distance(self.ego_vehicle.get_location())
+        # distances to the lane center need the exact projection, not the memoized one of the cell
+        lane_center = compute_lane_center(self.map, snapshot.get_location(self.ego_vehicle))
+        right_lane_dis = lane_center.get_right_lane().transform.location.distance(snapshot.get_location(self.ego_vehicle))
         ego_t= lane_center.lane_width / 2 + lane_center.get_right_lane().lane_width / 2 - right_lane_dis
 
         ego_vehicle_z = lane_center.transform.location.z
-        ego_forward_vector = self.ego_vehicle.get_transform().get_forward_vector()
+        ego_forward_vector = snapshot.get_forward_vector(self.ego_vehicle)
         my_sample_ratio = self.buffer_size // 10
         center_wps_processed = process_lane_wp(center_wps, ego_vehicle_z, ego_forward_vector, my_sample_ratio, 0)
         if len(left_wps) == 0:
@@ -556,16 +562,16 @@ class CarlaEnv:
         right_wall = False
         if len(right_wps) == 0:
             right_wall = True
-        vehicle_inlane_processed = process_veh(self.ego_vehicle,self.vehs_info, left_wall, right_wall,self.vehicle_proximity)
+        vehicle_inlane_processed = process_veh(self.ego_vehicle,self.vehs_info, left_wall, right_wall,self.vehicle_proximity,snapshot)
 
         yaw_diff_ego = math.degrees(get_yaw_diff(lane_center.transform.get_forward_vector(),
-                                               self.ego_vehicle.get_transform().get_forward_vector()))
+                                               snapshot.get_forward_vector(self.ego_vehicle)))
 
         yaw_forward = lane_center.transform.get_forward_vector()
-        v_3d = self.ego_vehicle.get_velocity()
+        v_3d = snapshot.get_velocity(self.ego_vehicle)
         v_s,v_t=get_projection(v_3d,yaw_forward)
 
-        a_3d = self.ego_vehicle.get_acceleration()
+        a_3d = snapshot.get_acceleration(self.ego_vehicle)
         a_s,a_t=get_projection(a_3d,yaw_forward)
 
         if self.lights_info:
@@ -592,11 +598,11 @@ class CarlaEnv:
                 (self.lights_info is not None and self.lights_info.state!=carla.TrafficLightState.Green):
             self.step_info.update({'rear_id':-1, 'rear_v':0, 'rear_a':0, 'time_step':self.time_step+1, 'change_lane':self.current_lane!=self.last_lane})
         else:
-            lane_center=get_lane_center(self.map,self.vehs_info.center_rear_veh.get_location())
+            lane_center=get_lane_center(self.map,snapshot.get_location(self.vehs_info.center_rear_veh))
             yaw_forward=lane_center.transform.get_forward_vector()
-            v_3d=self.vehs_info.center_rear_veh.get_velocity()
+            v_3d=snapshot.get_velocity(self.vehs_info.center_rear_veh)
             v_s,v_t=get_projection(v_3d,yaw_forward)
-            a_3d=self.vehs_info.center_rear_veh.get_acceleration()
+            a_3d=snapshot.get_acceleration(self.vehs_info.center_rear_veh)
             a_s,a_t=get_projection(a_3d,yaw_forward)
             self.step_info.update({'rear_id':self.vehs_info.center_rear_veh.id, 
                 'rear_v':v_s,'rear_a':a_s,'time_step':self.time_step+1, 'change_lane':self.current_lane!=self.last_lane})
@@ -613,6 +619,7 @@ class CarlaEnv:
         Com: Ego vehicle comfort, ego vehicle acceration change rate
         Lcen: Distance between ego vehicle location and lane center
         """
+        snapshot = TickSnapshot.capture(self.sim_world)
         truncated=self._truncated()
         self.step_info['Abandon']=False
         if truncated!=Truncated.FALSE:
@@ -629,12 +636,12 @@ class CarlaEnv:
             else:
                 return -self.penalty
 
-        ttc,fTTC=ttc_reward(self.ego_vehicle,self.vehs_info.center_front_veh,self.min_distance,self.TTC_THRESHOLD)
+        ttc,fTTC=ttc_reward(self.ego_vehicle,self.vehs_info.center_front_veh,self.min_distance,self.TTC_THRESHOLD,snapshot)
 
-        lane_center = get_lane_center(self.map, self.ego_vehicle.get_location())
+        lane_center = compute_lane_center(self.map, snapshot.get_location(self.ego_vehicle))
         yaw_forward = lane_center.transform.get_forward_vector().make_unit_vector()
         
-        v_3d = self.ego_vehicle.get_velocity()
+        v_3d = snapshot.get_velocity(self.ego_vehicle)
         v_s,v_t=get_projection(v_3d,yaw_forward)
         speed_1,speed_2=self.speed_limit, self.speed_limit
         # if self.lights_info and self.lights_info.state!=carla.TrafficLightState.Green:
@@ -653,10 +660,10 @@ class CarlaEnv:
         # if max_speed<self.speed_min:
         #     fEff=1
 
-        a_3d=self.ego_vehicle.get_acceleration()
+        a_3d=snapshot.get_acceleration(self.ego_vehicle)
         cur_acc,a_t=get_projection(a_3d,yaw_forward)
 
-        fCom, yaw_change = comfort(self.fps,self.last_acc, cur_acc, self.last_yaw, self.ego_vehicle.get_transform().get_forward_vector())
+        fCom, yaw_change = comfort(self.fps,self.last_acc, cur_acc, self.last_yaw, snapshot.get_forward_vector(self.ego_vehicle))
         # jerk = (cur_acc.x - self.last_acc.x) ** 2 / (1.0 / self.fps) + (cur_acc.y - self.last_acc.y) ** 2 / (
         #         1.0 / self.fps)
         # jerk = ((cur_acc.x - self.last_acc.x) * self.fps) ** 2 + ((cur_acc.y - self.last_acc.y) * self.fps) ** 2
@@ -664,13 +671,13 @@ class CarlaEnv:
         # fCom = -jerk / ((6 * self.fps) ** 2 + (12 * self.fps) ** 2)
 
         if self.guide_change:
-            Lcen, fLcen = calculate_guide_lane_center(self.ego_vehicle.get_location(),lane_center, self.ego_vehicle.get_location(), 
+            Lcen, fLcen = calculate_guide_lane_center(snapshot.get_location(self.ego_vehicle),lane_center, snapshot.get_location(self.ego_vehicle), 
                     self.vehs_info.distance_to_front_vehicles,self.vehs_info.distance_to_rear_vehicles)
         else:
-            Lcen,fLcen = lane_center_reward(lane_center, self.ego_vehicle.get_location())
+            Lcen,fLcen = lane_center_reward(lane_center, snapshot.get_location(self.ego_vehicle))
 
         yaw_diff = math.degrees(get_yaw_diff(lane_center.transform.get_forward_vector(),
-                                self.ego_vehicle.get_transform().get_forward_vector()))
+                                snapshot.get_forward_vector(self.ego_vehicle)))
         fYaw = -abs(yaw_diff) / 90
 
         impact = 0
@@ -700,6 +707,7 @@ class CarlaEnv:
     def _lane_change_reward(self, last_action, last_lane, current_lane, current_action, distance_to_front_vehicles, distance_to_rear_vehicles):
         print('distance_to_front_vehicles, distance_to_rear_vehicles: ', distance_to_front_vehicles, distance_to_rear_vehicles)
         # still the distances of the last time step
+        snapshot = TickSnapshot.capture(self.sim_world)
         reward = 0
         if current_action == Action.LANE_FOLLOW:
             # if change lane in lane following mode, we set this reward=0, but will be truncated
@@ -716,7 +724,7 @@ class CarlaEnv:
             # else:
             #     reward = max((right_front_dis / center_front_dis - 1) * self.lane_change_reward, -self.lane_change_reward)
                 # reward = 0
-            ttc,rear_ttc_reward = ttc_reward(self.vehs_info.center_rear_veh,self.ego_vehicle,self.min_distance,self.TTC_THRESHOLD)
+            ttc,rear_ttc_reward = ttc_reward(self.vehs_info.center_rear_veh,self.ego_vehicle,self.min_distance,self.TTC_THRESHOLD,snapshot)
             # add rear_ttc_reward?
             print('lane change reward and rear ttc reward: ', reward, rear_ttc_reward)
         elif current_lane - last_lane == 1:
@@ -731,16 +739,17 @@ class CarlaEnv:
             # else:
             #     reward = max((left_front_dis / center_front_dis - 1) * self.lane_change_reward, -self.lane_change_reward)
                 # reward = 0
-            ttc,rear_ttc_reward = ttc_reward(self.vehs_info.center_rear_veh,self.ego_vehicle,self.min_distance,self.TTC_THRESHOLD)
+            ttc,rear_ttc_reward = ttc_reward(self.vehs_info.center_rear_veh,self.ego_vehicle,self.min_distance,self.TTC_THRESHOLD,snapshot)
             print('lane change reward and rear ttc reward: ', reward, rear_ttc_reward)
 
         return reward
 
     def _truncated(self):
         """Calculate whether to terminate the current episode"""
-        lane_center=get_lane_center(self.map,self.ego_vehicle.get_location())
+        snapshot = TickSnapshot.capture(self.sim_world)
+        lane_center=get_lane_center(self.map,snapshot.get_location(self.ego_vehicle))
         yaw_diff = math.degrees(get_yaw_diff(lane_center.transform.get_forward_vector(),
-                        self.ego_vehicle.get_transform().get_forward_vector()))
+                        snapshot.get_forward_vector(self.ego_vehicle)))
 
         if len(self.collision_sensor.get_collision_history()[0]) != 0:
             # Here we judge speed state because there might be collision event when spawning vehicles
@@ -782,7 +791,7 @@ class CarlaEnv:
             wps=self.lights_info.get_stop_waypoints()
             for wp in wps:
                 self.sim_world.debug.draw_point(wp.transform.location,size=0.1,life_time=0)
-                if is_within_distance_ahead(self.ego_vehicle.get_location(),wp.transform.location, wp.transform, self.min_distance):
+                if is_within_distance_ahead(snapshot.get_location(self.ego_vehicle),wp.transform.location, wp.transform, self.min_distance):
                     logging.warn('break traffic light rule')
                     return Truncated.TRAFFIC_LIGHT_BREAK
 
@@ -67,7 +67,14 @@ def draw_waypoints(world, waypoints, life_time=0.0, z=0.5):
         world.debug.draw_arrow(begin, end, arrow_size=0.3, life_time=life_time)
 
 def get_lane_center(map, location):
-    """Project current loction to its lane center, return lane center waypoint"""
+    """
+    Lane center waypoint of the lane current loction is on, memoized by LaneCenterCache. The waypoint is the
+    one of the grid cell, use it for the lane, its width and heading, and compute_lane_center for distances
+    """
+    return LaneCenterCache.of(map).get(location)
+
+def compute_lane_center(map, location):
+    """Project current loction to its lane center on the live map, return lane center waypoint"""
     # test code for junction lane invasion bug
     # if lane_center.is_junction:
     #     test=self.map.get_waypoint(self.ego_vehicle.get_location(),project_to_road=True,lane_type=carla.LaneType.Shoulder)
@@ -137,6 +144,83 @@ def get_lane_center(map, location):
     # print('lane_center.road_id: ', lane_center.road_id)
     return lane_center
 
+# lane center caches by map name, shared by every env and planner of the process
+_lane_center_caches = {}
+
+class LaneCenterCache:
+    """
+    Memoized compute_lane_center of one map on a grid of sub-meter cells. Every cell holds the index
+    of the lane center waypoint found for the cell center, so a location is answered by a dict lookup
+    and the live map is only asked on the first query of a cell. The answer is off the exact one by
+    at most half a cell diagonal along the lane, and the lane can differ when the location is that
+    close to a lane boundary. It serves lane assignment only, the distance terms of the state and
+    the reward measure from compute_lane_center. The cells along the lanes of DISTURB_ROADS, where compute_lane_center
+    walks several extra waypoints, are filled when the cache of a map is created.
+    """
+    def __init__(self, map, resolution=0.25, z_resolution=2.0, precompute_roads=DISTURB_ROADS) -> None:
+        self._map = map
+        self.resolution = resolution
+        self.z_resolution = z_resolution
+        self._grid = {}
+        self._waypoints = []
+        self._index = {}
+        self.hits = 0
+        self.misses = 0
+        if precompute_roads:
+            self.precompute(precompute_roads)
+
+    @classmethod
+    def of(cls, map):
+        """The cache of map, created on first use"""
+        name = map.name
+        cache = _lane_center_caches.get(name)
+        if cache is None:
+            cache = _lane_center_caches[name] = cls(map)
+        else:
+            # envs may hand over a new map object or proxy of the same map
+            cache._map = map
+        return cache
+
+    def _cell(self, location):
+        return (math.floor(location.x / self.resolution), math.floor(location.y / self.resolution),
+                math.floor(location.z / self.z_resolution))
+
+    def get(self, location):
+        cell = self._cell(location)
+        index = self._grid.get(cell)
+        if index is None:
+            self.misses += 1
+            index = self._insert(cell)
+        else:
+            self.hits += 1
+        return self._waypoints[index]
+
+    def _insert(self, cell):
+        center = carla.Location(x=(cell[0] + 0.5) * self.resolution, y=(cell[1] + 0.5) * self.resolution,
+                                z=(cell[2] + 0.5) * self.z_resolution)
+        waypoint = compute_lane_center(self._map, center)
+        index = self._index.get(waypoint.id)
+        if index is None:
+            index = self._index[waypoint.id] = len(self._waypoints)
+            self._waypoints.append(waypoint)
+        self._grid[cell] = index
+        return index
+
+    def precompute(self, road_ids):
+        """Fill the cells on the center lines of the driving lanes of road_ids"""
+        for entry, _ in self._map.get_topology():
+            if entry.road_id not in road_ids:
+                continue
+            for waypoint in [entry] + list(entry.next_until_lane_end(self.resolution)):
+                if waypoint.road_id != entry.road_id:
+                    break
+                cell = self._cell(waypoint.transform.location)
+                if cell not in self._grid:
+                    self._insert(cell)
+
+    def __len__(self):
+        return len(self._grid)
+
 # def get_yaw_diff(rotation1, rotation2):
 #     if abs(rotation1.yaw - rotation2.yaw) < 90:
 #         yaw_diff = rotation1.yaw - rotation2.yaw
@@ -0,0 +1,134 @@
+import carla
+import math
+import numpy as np
+
+# last snapshot by world id, each capture reuses the bounding boxes collected for its world
+_tick_snapshots = {}
+
+
+class TickSnapshot:
+    """
+    State of every actor at one tick, read from a single world.get_snapshot() instead of one
+    get_transform / get_velocity / get_acceleration call per actor and per consumer. The state,
+    reward and planner code of a step all share the snapshot of the tick, so the number of
+    simulator calls per step no longer grows with the number of vehicles they look at.
+    Bounding boxes are not part of a world snapshot and do not change, so they are fetched once
+    per actor with a single get_actors call for the actors new at the tick.
+        frame: frame of the world snapshot
+        ids: (n,) actor ids, rows of the arrays follow this order
+        location: (n, 3) x, y, z in meters
+        rotation: (n, 3) pitch, yaw, roll in degrees, yaw is its second column
+        velocity: (n, 3) in m/s
+        acceleration: (n, 3) in m/s^2
+        extent: (n, 3) half size of the bounding boxes in meters
+    """
+
+    def __init__(self, snapshot) -> None:
+        self.frame = snapshot.frame
+        self.timestamp = snapshot.timestamp
+        ids, rows = [], []
+        for actor in snapshot:
+            transform = actor.get_transform()
+            location, rotation = transform.location, transform.rotation
+            velocity, acceleration = actor.get_velocity(), actor.get_acceleration()
+            ids.append(actor.id)
+            rows.append((location.x, location.y, location.z, rotation.pitch, rotation.yaw, rotation.roll,
+                         velocity.x, velocity.y, velocity.z, acceleration.x, acceleration.y, acceleration.z))
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 12)
+        self.ids = np.array(ids, dtype=np.int64)
+        self._rows = {actor_id: row for row, actor_id in enumerate(ids)}
+        self.location = rows[:, 0:3]
+        self.rotation = rows[:, 3:6]
+        self.yaw = self.rotation[:, 1]
+        self.velocity = rows[:, 6:9]
+        self.acceleration = rows[:, 9:12]
+        self.extent = np.zeros((len(ids), 3))
+        self._bounding_boxes = {}
+
+    @classmethod
+    def capture(cls, world):
+        """The snapshot of the current tick of world, built on the first call of the tick"""
+        snapshot = world.get_snapshot()
+        last = _tick_snapshots.get(world.id)
+        if last is not None and last.frame == snapshot.frame:
+            return last
+        tick_snapshot = _tick_snapshots[world.id] = cls(snapshot)
+        tick_snapshot._fill_bounding_boxes(world, {} if last is None else last._bounding_boxes)
+        return tick_snapshot
+
+    def _fill_bounding_boxes(self, world, known):
+        """Take over the boxes of the actors still alive and fetch the ones of the spawned actors in one call"""
+        boxes = self._bounding_boxes
+        new = []
+        for actor_id in self._rows:
+            if actor_id in known:
+                boxes[actor_id] = known[actor_id]
+            else:
+                new.append(actor_id)
+        if new:
+            boxes.update(dict.fromkeys(new))
+            for actor in world.get_actors(new):
+                boxes[actor.id] = getattr(actor, 'bounding_box', None)
+        for actor_id, box in boxes.items():
+            if box is not None:
+                self.extent[self._rows[actor_id]] = (box.extent.x, box.extent.y, box.extent.z)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, actor):
+        return actor.id in self._rows
+
+    def row(self, actor):
+        """Row of actor in the arrays, None when it was spawned after the tick"""
+        return self._rows.get(actor.id)
+
+    def get_location(self, actor):
+        row = self._rows.get(actor.id)
+        if row is None:
+            return actor.get_location()
+        x, y, z = self.location[row]
+        return carla.Location(x=x, y=y, z=z)
+
+    def get_transform(self, actor):
+        row = self._rows.get(actor.id)
+        if row is None:
+            return actor.get_transform()
+        x, y, z = self.location[row]
+        pitch, yaw, roll = self.rotation[row]
+        return carla.Transform(carla.Location(x=x, y=y, z=z), carla.Rotation(pitch=pitch, yaw=yaw, roll=roll))
+
+    def get_forward_vector(self, actor):
+        row = self._rows.get(actor.id)
+        if row is None:
+            return actor.get_transform().get_forward_vector()
+        pitch, yaw = np.radians(self.rotation[row, :2])
+        return carla.Vector3D(x=math.cos(pitch) * math.cos(yaw), y=math.cos(pitch) * math.sin(yaw), z=math.sin(pitch))
+
+    def get_velocity(self, actor):
+        row = self._rows.get(actor.id)
+        if row is None:
+            return actor.get_velocity()
+        x, y, z = self.velocity[row]
+        return carla.Vector3D(x=x, y=y, z=z)
+
+    def get_acceleration(self, actor):
+        row = self._rows.get(actor.id)
+        if row is None:
+            return actor.get_acceleration()
+        x, y, z = self.acceleration[row]
+        return carla.Vector3D(x=x, y=y, z=z)
+
+    def get_speed(self, actor, unit=True):
+        """Same as misc.get_speed, the z value is ignored, unit True means Km/h and False means m/s"""
+        row = self._rows.get(actor.id)
+        if row is None:
+            vel = actor.get_velocity()
+            speed = math.sqrt(vel.x ** 2 + vel.y ** 2)
+        else:
+            speed = math.hypot(self.velocity[row, 0], self.velocity[row, 1])
+        return 3.6 * speed if unit else speed
+
+    def get_bounding_box(self, actor):
+        box = self._bounding_boxes.get(actor.id)
+        return actor.bounding_box if box is None else box
@@ -123,13 +123,20 @@ def process_lane_wp(wps_list, ego_vehicle_z, ego_forward_vector, my_sample_ratio
     return np.array(wps)
 
 
-def process_veh(ego_vehicle, vehs_info, left_wall, right_wall,vehicle_proximity):
+def process_veh(ego_vehicle, vehs_info, left_wall, right_wall,vehicle_proximity,snapshot=None):
+    """snapshot: TickSnapshot of the current tick, the vehicles are asked directly without it"""
     vehicle_inlane=[vehs_info.left_front_veh,vehs_info.center_front_veh,vehs_info.right_front_veh,
             vehs_info.left_rear_veh,vehs_info.center_rear_veh,vehs_info.right_rear_veh]
-    ego_speed = get_speed(ego_vehicle, False)
-    ego_location = ego_vehicle.get_location()
-    ego_bounding_x = ego_vehicle.bounding_box.extent.x
-    ego_bounding_y = ego_vehicle.bounding_box.extent.y
+    if snapshot is not None:
+        speed_of, location_of = lambda veh: snapshot.get_speed(veh, False), snapshot.get_location
+        extent_of = lambda veh: snapshot.get_bounding_box(veh).extent
+    else:
+        speed_of, location_of = lambda veh: get_speed(veh, False), lambda veh: veh.get_location()
+        extent_of = lambda veh: veh.bounding_box.extent
+    ego_speed = speed_of(ego_vehicle)
+    ego_location = location_of(ego_vehicle)
+    ego_bounding_x = extent_of(ego_vehicle).x
+    ego_bounding_y = extent_of(ego_vehicle).y
     all_v_info = []
     print('vehicle_inlane: ', vehicle_inlane)
     for i in range(6):
@@ -157,12 +164,13 @@ def process_veh(ego_vehicle, vehs_info, left_wall, right_wall,vehicle_proximity)
                 else:
                     v_info = [-1, 0, lane]
             else:
-                veh_speed = get_speed(veh, False)
+                veh_speed = speed_of(veh)
                 rel_speed = ego_speed - veh_speed
 
-                distance = ego_location.distance(veh.get_location())
+                distance = ego_location.distance(location_of(veh))
+                veh_extent = extent_of(veh)
                 vehicle_len = max(abs(ego_bounding_x), abs(ego_bounding_y)) + \
-                    max(abs(veh.bounding_box.extent.x), abs(veh.bounding_box.extent.y))
+                    max(abs(veh_extent.x), abs(veh_extent.y))
                 distance -= vehicle_len
 
                 if distance < 0:
@@ -211,16 +219,20 @@ def fill_action_param(action, steer, throttle_brake, action_param, modify_change
         action_param[0][action*2+1] = throttle_brake
     return action_param
 
-def ttc_reward(ego_veh,target_veh,min_dis,TTC_THRESHOLD):
-    """Caculate the time left before ego vehicle collide with target vehicle"""
+def ttc_reward(ego_veh,target_veh,min_dis,TTC_THRESHOLD,snapshot=None):
+    """Caculate the time left before ego vehicle collide with target vehicle,
+    snapshot: TickSnapshot of the current tick, the vehicles are asked directly without it"""
     #TTC = float('inf')
     TTC=TTC_THRESHOLD
     if target_veh and ego_veh:
-        distance = ego_veh.get_location().distance(target_veh.get_location())
-        vehicle_len = max(abs(ego_veh.bounding_box.extent.x),
-                            abs(ego_veh.bounding_box.extent.y)) + \
-                        max(abs(target_veh.bounding_box.extent.x),
-                            abs(target_veh.bounding_box.extent.y))
+        if snapshot is not None:
+            distance = snapshot.get_location(ego_veh).distance(snapshot.get_location(target_veh))
+            ego_extent = snapshot.get_bounding_box(ego_veh).extent
+            target_extent = snapshot.get_bounding_box(target_veh).extent
+        else:
+            distance = ego_veh.get_location().distance(target_veh.get_location())
+            ego_extent, target_extent = ego_veh.bounding_box.extent, target_veh.bounding_box.extent
+        vehicle_len = max(abs(ego_extent.x), abs(ego_extent.y)) + max(abs(target_extent.x), abs(target_extent.y))
         distance -= vehicle_len
         # rel_speed = get_speed(ego_veh,False) - get_speed(target_veh, False)
         # if abs(rel_speed) > float(0.0000001):
@@ -229,7 +241,10 @@ def ttc_reward(ego_veh,target_veh,min_dis,TTC_THRESHOLD):
             TTC = 0.01
         else:
             distance -= min_dis
-            rel_speed = get_speed(ego_veh,False) - get_speed(target_veh, False)
+            if snapshot is not None:
+                rel_speed = snapshot.get_speed(ego_veh, False) - snapshot.get_speed(target_veh, False)
+            else:
+                rel_speed = get_speed(ego_veh,False) - get_speed(target_veh, False)
             if abs(rel_speed) > float(0.0000001):
                 TTC = distance / rel_speed
     # fTTC=-math.exp(-TTC)
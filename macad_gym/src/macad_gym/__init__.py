@@ -20,17 +20,17 @@ if not os.path.exists(LOG_PATH):
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)), "carla", "PythonAPI"))
 
-# Set this to the path of your Carla binary
+# Set this to the path of your Carla binary, or to "mock" to run on the offline
+# mock_carla simulator (repository root on sys.path) instead of a CARLA server
 SERVER_BINARY = os.environ.get(
     "CARLA_SERVER", os.path.expanduser(
         os.path.join('~', 'ProgramFiles', 'Carla', 'CarlaUE4.sh'))
 )
-assert os.path.exists(SERVER_BINARY), (
-    "Make sure CARLA_SERVER environment"
-    " variable is set & is pointing to the"
-    " CARLA server startup script (Carla"
-    "UE4.sh). Refer to the README file/docs."
-)
+MOCK_SERVER = SERVER_BINARY == "mock"
+if MOCK_SERVER:
+    import mock_carla
+    mock_carla.install()
+# The binary is only needed to launch a server, CarlaConnector.connect checks it
 
 # Check if is using on Windows
 IS_WINDOWS_PLATFORM = "win" in sys.platform
@@ -4,6 +4,7 @@ from collections import deque
 from shapely.geometry import Polygon
 from macad_gym.core.scenarios import ROADS
 from macad_gym.core.controllers.route_planner import RoadOption
+from macad_gym.core.utils.snapshot import TickSnapshot
 from macad_gym.core.utils.wrapper import WaypointWrapper,VehicleWrapper
 from macad_gym.core.utils.misc import get_lane_center, vector, compute_magnitude_angle, \
     is_within_distance_ahead, is_within_distance_rear, draw_waypoints, compute_distance, is_within_distance, test_waypoint,\
@@ -140,15 +141,15 @@ class LocalPlanner(object):
                         for i, wp in enumerate(pre_wps):
                             if wp.road_id in ROADS:
                                 pre_wp = wp
-                    vehicle_len = max(abs(self._vehicle.bounding_box.extent.x),
-                                    abs(self._vehicle.bounding_box.extent.y)) + \
-                                max(abs(veh.bounding_box.extent.x),
-                                    abs(veh.bounding_box.extent.y))
+                    ego_extent = snapshot.get_bounding_box(self._vehicle).extent
+                    veh_extent = snapshot.get_bounding_box(veh).extent
+                    vehicle_len = max(abs(ego_extent.x), abs(ego_extent.y)) + max(abs(veh_extent.x), abs(veh_extent.y))
                     
-                    return max(pre_wp.transform.location.distance(veh.get_location())-vehicle_len,0.0001)
+                    return max(pre_wp.transform.location.distance(snapshot.get_location(veh))-vehicle_len,0.0001)
                 else:
                     return self.vehicle_proximity
 
+        snapshot=TickSnapshot.capture(self._world)
         vehicle_list=self._world.get_actors().filter("*vehicle*")
         left_front_veh=self._get_vehicles_one_lane(vehicle_list,True,-1)
         left_rear_veh=self._get_vehicles_one_lane(vehicle_list,False,-1)
@@ -193,8 +194,9 @@ class LocalPlanner(object):
             minus value means left, positive value means right
         """
         
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_transform = self._vehicle.get_transform()
+        snapshot = TickSnapshot.capture(self._world)
+        ego_vehicle_location = snapshot.get_location(self._vehicle)
+        ego_vehicle_transform = snapshot.get_transform(self._vehicle)
         ego_vehicle_lane_center = get_lane_center(self._map, ego_vehicle_location)
         if not test_waypoint(ego_vehicle_lane_center):
             return None
@@ -211,10 +213,11 @@ class LocalPlanner(object):
                 continue
 
             # if the object is not in our lane it's not an obstacle
-            target_vehicle_waypoint = self._map.get_waypoint(target_vehicle.get_location())
+            loc = snapshot.get_location(target_vehicle)
+            target_vehicle_waypoint = self._map.get_waypoint(loc)
             # check whether in the same road
-            target_lane_center = get_lane_center(self._map, target_vehicle.get_location())
-            if target_lane_center.transform.location.distance(target_vehicle.get_location()) > target_lane_center.lane_width / 2 + 0.1:
+            target_lane_center = get_lane_center(self._map, loc)
+            if target_lane_center.transform.location.distance(loc) > target_lane_center.lane_width / 2 + 0.1:
                 continue
             if not test_waypoint(target_vehicle_waypoint):
                 continue
@@ -225,7 +228,6 @@ class LocalPlanner(object):
             #         target_vehicle_waypoint.lane_id != ego_vehicle_waypoint.lane_id:
             #     continue
 
-            loc = target_vehicle.get_location()
             if direction:
                 if is_within_distance_ahead(loc, ego_vehicle_location, ego_vehicle_transform, self.vehicle_proximity):
                     if ego_vehicle_location.distance(loc) < min_distance:
@@ -11,7 +11,7 @@ import signal
 import psutil
 import numpy as np
 from typing import Any, Dict, List, Optional, Tuple
-from macad_gym import IS_WINDOWS_PLATFORM, SERVER_BINARY
+from macad_gym import IS_WINDOWS_PLATFORM, SERVER_BINARY, MOCK_SERVER
 from macad_gym.viz.logger import LOG
 
 
@@ -39,15 +39,16 @@ class CarlaConnector(object):
         # self._connected_carla.append(CarlaConnector(self._server_port, self._server_map, self._env_config))
         # self._carla = weakref.proxy(self._connected_carla[-1])
         self._server_port, server_process =  CarlaConnector.connect(LOG.multi_env_logger, env_config)
-        self.server_pid = server_process.pid
-
-        if IS_WINDOWS_PLATFORM:
+        if server_process is not None:
             self.server_pid = server_process.pid
-        else:
-            # The carla setup procedure start a process group in Linux.
-            self.server_pid = os.getpgid(server_process.pid)
 
-        CarlaConnector.live_carla_processes.add(self.server_pid)
+            if IS_WINDOWS_PLATFORM:
+                self.server_pid = server_process.pid
+            else:
+                # The carla setup procedure start a process group in Linux.
+                self.server_pid = os.getpgid(server_process.pid)
+
+            CarlaConnector.live_carla_processes.add(self.server_pid)
 
         while self._client is None:
             try:
@@ -201,6 +202,15 @@ class CarlaConnector(object):
             f"2. Map: {env_config['server_map']}\n"
             f"3. Binary: {SERVER_BINARY}"
         )
+        if MOCK_SERVER:
+            # mock_carla simulates the server inside the client, there is nothing to launch
+            return server_port, None
+        assert os.path.exists(SERVER_BINARY), (
+            "Make sure CARLA_SERVER environment"
+            " variable is set & is pointing to the"
+            " CARLA server startup script (Carla"
+            "UE4.sh). Refer to the README file/docs."
+        )
         multigpu_success = False
         server_process = None
         gpus = GPUtil.getGPUs()
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class ObservationLayout(object):
+    """
+    Layout of the flat float32 observation vector fed to the agents.
+
+    The vector holds one block per lane (left, center, right), each made of the lane's
+    waypoints, its front and rear vehicle and the traffic light, followed by the hero vehicle:
+        [left_wps, veh[0], veh[3], light, center_wps, veh[1], veh[4], light,
+         right_wps, veh[2], veh[5], light, hero_vehicle]
+    Widths follow the agents' state_dim dict, waypoints being the flattened width of one lane.
+    """
+    LANE_KEYS = ('left_waypoints', 'center_waypoints', 'right_waypoints')
+
+    def __init__(self, waypoints=30, companion_vehicle=4, light=3, hero_vehicle=6):
+        self.waypoints = waypoints
+        self.companion_vehicle = companion_vehicle
+        self.light = light
+        self.hero_vehicle = hero_vehicle
+        self.lane_size = waypoints + 2 * companion_vehicle + light
+        self.size = 3 * self.lane_size + hero_vehicle
+
+        lane_start = np.arange(3) * self.lane_size
+        self.waypoint_slices = [slice(start, start + waypoints) for start in lane_start]
+        # vehicle_info slots: 0/1/2 left/center/right front, 3/4/5 left/center/right rear
+        self.vehicle_slices = [slice(start, start + companion_vehicle) for start in
+                               [lane_start[slot % 3] + waypoints + slot // 3 * companion_vehicle for slot in range(6)]]
+        self.light_slices = [slice(start, start + light) for start in lane_start + waypoints + 2 * companion_vehicle]
+        self.hero_slice = slice(3 * self.lane_size, self.size)
+
+    def empty(self):
+        return np.zeros(self.size, dtype=np.float32)
+
+    def write_waypoints(self, out, lane, wps):
+        """lane: 0 left, 1 center, 2 right"""
+        out[self.waypoint_slices[lane]] = np.reshape(wps, -1)
+
+    def write_vehicles(self, out, vehicle_info):
+        vehicle_info = np.reshape(vehicle_info, (6, self.companion_vehicle))
+        for slot, vehicle_slice in enumerate(self.vehicle_slices):
+            out[vehicle_slice] = vehicle_info[slot]
+
+    def write_light(self, out, light):
+        light = np.reshape(light, -1)
+        for light_slice in self.light_slices:
+            out[light_slice] = light
+
+    def write_hero(self, out, hero_vehicle):
+        out[self.hero_slice] = np.reshape(hero_vehicle, -1)
+
+    def views(self, out):
+        """
+        Observation dict whose entries are views of the vector out, as written by the write_* methods,
+        plus out itself as 'flat'. vehicle_info is left out, its slots are not contiguous in out.
+        """
+        state = {key: out[waypoint_slice].reshape(-1, 3) for key, waypoint_slice in
+                 zip(self.LANE_KEYS, self.waypoint_slices)}
+        state['light'] = out[self.light_slices[0]]
+        state['hero_vehicle'] = out[self.hero_slice]
+        state['flat'] = out
+        return state
+
+    def encode(self, state, out=None):
+        """Write an observation dict into out (a new vector when None) and return it"""
+        out = self.empty() if out is None else out
+        for lane, key in enumerate(self.LANE_KEYS):
+            self.write_waypoints(out, lane, state[key])
+        self.write_vehicles(out, state['vehicle_info'])
+        self.write_light(out, state['light'])
+        self.write_hero(out, state['hero_vehicle'])
+        return out
+
+    def flat(self, state):
+        """Flat vector of an observation, reusing the one the environment already wrote when it is there"""
+        if isinstance(state, np.ndarray):
+            return state
+        flat = state.get('flat')
+        if flat is not None:
+            return flat
+        return self.encode(state)
@@ -3,13 +3,15 @@ import carla
 import numpy as np
 from macad_gym.viz.logger import LOG
 from macad_gym.core.utils.misc import (get_speed, get_yaw_diff, get_sign, test_waypoint,
-                                       get_lane_center, get_projection, compute_signed_distance)
+                                       compute_lane_center, get_projection, compute_signed_distance)
+from macad_gym.core.utils.snapshot import TickSnapshot
 from macad_gym.core.utils.wrapper import SemanticTags, Truncated, Action
 
 
-def get_len_wid(vehicle):
-    proj_s, proj_t = get_projection(vehicle.bounding_box.extent, 
-                                vehicle.bounding_box.rotation.get_forward_vector())
+def get_len_wid(vehicle, snapshot=None):
+    bounding_box = vehicle.bounding_box if snapshot is None else snapshot.get_bounding_box(vehicle)
+    proj_s, proj_t = get_projection(bounding_box.extent, 
+                                bounding_box.rotation.get_forward_vector())
     
     return abs(proj_s), abs(proj_t)
 
@@ -125,11 +127,14 @@ class SACReward(Reward):
         self.curr = {}
         self.state = {}
         self.vehicle = None
+        self.snapshot = None
 
     def set_state(self, actor, state, map):
         self.vehicle = actor
         self.state = state
         self.map = map
+        # the reward terms read the vehicles from the snapshot of the tick
+        self.snapshot = TickSnapshot.capture(actor.get_world())
 
     def compute_reward(self, actor_id, prev_measurement, curr_measurement, flag):
         self.reward = None
@@ -149,7 +154,7 @@ class SACReward(Reward):
             else:
                 self.reward = -self._rl_configs["penalty"]
 
-        lane_center = get_lane_center(self.map, self.vehicle.get_location())
+        lane_center = compute_lane_center(self.map, self.snapshot.get_location(self.vehicle))
         yaw_forward = lane_center.transform.get_forward_vector().make_unit_vector()
 
         ttc, self.ttc_reward = self._ttc_reward(self.state["vehs"].center_front_veh)
@@ -162,6 +167,7 @@ class SACReward(Reward):
                 self.efficiency_reward
         
         self.vehicle = None
+        self.snapshot = None
         self.state = {}
         self.prev = {}
         self.curr = {}
@@ -178,7 +184,7 @@ class SACReward(Reward):
         }
 
     def _comfort_reward(self, yaw_forward):
-        a_3d = self.vehicle.get_acceleration()
+        a_3d = self.snapshot.get_acceleration(self.vehicle)
         cur_acc, a_t = get_projection(a_3d, yaw_forward)
         fps = 1 / self._env_config["fixed_delta_seconds"]
         acc_jerk = - \
@@ -192,7 +198,7 @@ class SACReward(Reward):
         return np.clip(acc_jerk * 0.5 + Yaw_jerk, -0.5, 0), yaw_diff
 
     def _efficiency_reward(self, yaw_forward):
-        v_3d = self.vehicle.get_velocity()
+        v_3d = self.snapshot.get_velocity(self.vehicle)
         v_s, v_t = get_projection(v_3d, yaw_forward)
         speed_1, speed_2 = self._actor_configs[self.actor_id]["speed_limit"], \
             self._actor_configs[self.actor_id]["speed_limit"]
@@ -220,9 +226,9 @@ class SACReward(Reward):
         TTC = self.TTC_THRESHOLD
         ego_veh = self.vehicle
         if target_veh and ego_veh:
-            distance = ego_veh.get_location().distance(target_veh.get_location())
-            ego_half_len, ego_half_wid = get_len_wid(ego_veh)
-            veh_half_len, veh_half_wid = get_len_wid(target_veh)
+            distance = self.snapshot.get_location(ego_veh).distance(self.snapshot.get_location(target_veh))
+            ego_half_len, ego_half_wid = get_len_wid(ego_veh, self.snapshot)
+            veh_half_len, veh_half_wid = get_len_wid(target_veh, self.snapshot)
             # vehicle_len = max(abs(ego_veh.bounding_box.extent.x),
             #                   abs(ego_veh.bounding_box.extent.y)) + \
             #     max(abs(target_veh.bounding_box.extent.x),
@@ -235,8 +241,8 @@ class SACReward(Reward):
                 TTC = 0.01
             else:
                 distance -= self._env_config["min_distance"]
-                rel_speed = get_speed(ego_veh, False) - \
-                    get_speed(target_veh, False)
+                rel_speed = self.snapshot.get_speed(ego_veh, False) - \
+                    self.snapshot.get_speed(target_veh, False)
                 if abs(rel_speed) > float(0.0000001):
                     TTC = distance / rel_speed
         # fTTC=-math.exp(-TTC)
@@ -257,7 +263,7 @@ class SACReward(Reward):
                          f"flcen:{fLcen}, lane_wid/2:{lane_center.lane_width / 2}")
         else:
             Lcen = compute_signed_distance(lane_center.transform.location, 
-                                           self.vehicle.get_location(),
+                                           self.snapshot.get_location(self.vehicle),
                                            lane_center.transform.get_forward_vector())
             fLcen = -abs(Lcen)/(lane_center.lane_width/2)
             # if self.current_action == Action.LANE_CHANGE_LEFT and self.current_lane == self.last_lane:
@@ -354,11 +360,14 @@ class PDQNReward(Reward):
         self.curr = {}
         self.state = {}
         self.vehicle = None
+        self.snapshot = None
 
     def set_state(self, actor, state, map):
         self.vehicle = actor
         self.state = state
         self.map = map
+        # the reward terms read the vehicles from the snapshot of the tick
+        self.snapshot = TickSnapshot.capture(actor.get_world())
 
     def compute_reward(self, actor_id, prev_measurement, curr_measurement, flag):
         self.reward = None
@@ -380,7 +389,7 @@ class PDQNReward(Reward):
             else:
                 self.reward = -self._rl_configs["penalty"]
 
-        lane_center = get_lane_center(self.map, self.vehicle.get_location())
+        lane_center = compute_lane_center(self.map, self.snapshot.get_location(self.vehicle))
         yaw_forward = lane_center.transform.get_forward_vector().make_unit_vector()
 
         ttc, self.ttc_reward = self._ttc_reward(self.state["vehs"].center_front_veh)
@@ -393,6 +402,7 @@ class PDQNReward(Reward):
                 self.efficiency_reward
         
         self.vehicle = None
+        self.snapshot = None
         self.state = {}
         self.prev = {}
         self.curr = {}
@@ -409,7 +419,7 @@ class PDQNReward(Reward):
         }
 
     def _comfort_reward(self, yaw_forward):
-        a_3d = self.vehicle.get_acceleration()
+        a_3d = self.snapshot.get_acceleration(self.vehicle)
         cur_acc, a_t = get_projection(a_3d, yaw_forward)
         fps = 1 / self._env_config["fixed_delta_seconds"]
         acc_jerk = - \
@@ -423,7 +433,7 @@ class PDQNReward(Reward):
         return np.clip(acc_jerk * 0.5 + Yaw_jerk, -0.5, 0), yaw_diff
 
     def _efficiency_reward(self, yaw_forward):
-        v_3d = self.vehicle.get_velocity()
+        v_3d = self.snapshot.get_velocity(self.vehicle)
         v_s, v_t = get_projection(v_3d, yaw_forward)
         speed_1, speed_2 = self._actor_configs[self.actor_id]["speed_limit"], \
             self._actor_configs[self.actor_id]["speed_limit"]
@@ -451,9 +461,9 @@ class PDQNReward(Reward):
         TTC = self.TTC_THRESHOLD
         ego_veh = self.vehicle
         if target_veh and ego_veh:
-            distance = ego_veh.get_location().distance(target_veh.get_location())
-            ego_half_len, ego_half_wid = get_len_wid(ego_veh)
-            veh_half_len, veh_half_wid = get_len_wid(target_veh)
+            distance = self.snapshot.get_location(ego_veh).distance(self.snapshot.get_location(target_veh))
+            ego_half_len, ego_half_wid = get_len_wid(ego_veh, self.snapshot)
+            veh_half_len, veh_half_wid = get_len_wid(target_veh, self.snapshot)
             # vehicle_len = max(abs(ego_veh.bounding_box.extent.x),
             #                   abs(ego_veh.bounding_box.extent.y)) + \
             #     max(abs(target_veh.bounding_box.extent.x),
@@ -466,8 +476,8 @@ class PDQNReward(Reward):
                 TTC = 0.01
             else:
                 distance -= self._env_config["min_distance"]
-                rel_speed = get_speed(ego_veh, False) - \
-                    get_speed(target_veh, False)
+                rel_speed = self.snapshot.get_speed(ego_veh, False) - \
+                    self.snapshot.get_speed(target_veh, False)
                 if abs(rel_speed) > float(0.0000001):
                     TTC = distance / rel_speed
         # fTTC=-math.exp(-TTC)
@@ -488,7 +498,7 @@ class PDQNReward(Reward):
                          f"flcen:{fLcen}, lane_wid/2:{lane_center.lane_width / 2}")
         else:
             Lcen = compute_signed_distance(lane_center.transform.location, 
-                                           self.vehicle.get_location(),
+                                           self.snapshot.get_location(self.vehicle),
                                            lane_center.transform.get_forward_vector())
             fLcen = -abs(Lcen)/(lane_center.lane_width/2)
             # if self.current_action == Action.LANE_CHANGE_LEFT and self.current_lane == self.last_lane:
@@ -2,8 +2,10 @@ import carla
 import math, random
 import numpy as np
 from macad_gym.core.controllers.local_planner import LocalPlanner
+from macad_gym.core.utils.observation import ObservationLayout
+from macad_gym.core.utils.snapshot import TickSnapshot
 from macad_gym.core.utils.misc import (get_speed, get_yaw_diff, draw_waypoints, get_lane_center,
-                                       get_projection, compute_signed_distance)
+                                       compute_lane_center, get_projection, compute_signed_distance)
 
 class StateDAO(object):
     # class for gettting surrounding information
@@ -17,6 +19,11 @@ class StateDAO(object):
         self.world = configs["world"]
         self.map = configs["map"]
         self._cur_measurement = {}
+        self._obs_layout = ObservationLayout()
+        # two observation vectors per actor written in turn, the agent still holds the state of
+        # the previous step while the one of the current step is written
+        self._obs_buffers = {actor_id: [self._obs_layout.empty(), self._obs_layout.empty()]
+                             for actor_id in self._actor_configs}
         for actor_id, actor_config in self._actor_configs.items():
             self._local_planner[actor_id] = LocalPlanner(
                 self._actors[actor_id], {
@@ -27,6 +34,11 @@ class StateDAO(object):
 
     def get_state(self, actor_id):
         wps_info, lights_info, vehs_info = self._local_planner[actor_id].run_step()
+        # every actor of the tick is read from one world snapshot, shared by all ego vehicles
+        snapshot = TickSnapshot.capture(self.world)
+        ego_vehicle = self._actors[actor_id]
+        ego_location = snapshot.get_location(ego_vehicle)
+        ego_forward_vector = snapshot.get_forward_vector(ego_vehicle)
         if self._rl_configs["debug"]:
             draw_waypoints(self.world, wps_info.center_front_wps+wps_info.center_rear_wps+\
                 wps_info.left_front_wps+wps_info.left_rear_wps+wps_info.right_front_wps+wps_info.right_rear_wps, 
@@ -37,16 +49,16 @@ class StateDAO(object):
         center_wps=wps_info.center_front_wps
         right_wps=wps_info.right_front_wps
 
-        lane_center = get_lane_center(self.map, self._actors[actor_id].get_location())
+        # distances to the lane center need the exact projection, not the memoized one of the cell
+        lane_center = compute_lane_center(self.map, ego_location)
         ego_t = compute_signed_distance(lane_center.transform.location,
-                                        self._actors[actor_id].get_location(),
+                                        ego_location,
                                         lane_center.transform.get_forward_vector())
         # right_lane_dis = lane_center.get_right_lane(
         #     ).transform.location.distance(self._actors[actor_id].get_location())
         # ego_t= lane_center.lane_width / 2 + lane_center.get_right_lane().lane_width / 2 - right_lane_dis
 
         hero_vehicle_z = lane_center.transform.location.z
-        ego_forward_vector = self._actors[actor_id].get_transform().get_forward_vector()
         my_sample_ratio = self._env_config["buffer_size"] // 10
         center_wps_processed = process_lane_wp(center_wps, hero_vehicle_z, ego_forward_vector, my_sample_ratio, 0)
         if len(left_wps) == 0:
@@ -68,17 +80,17 @@ class StateDAO(object):
         right_wall = False
         if len(right_wps) == 0:
             right_wall = True
-        vehicle_inlane_processed = self._process_veh(self._actors[actor_id
-                    ],vehs_info, left_wall, right_wall, self._env_config["vehicle_proximity"])
+        vehicle_inlane_processed = self._process_veh(ego_vehicle, vehs_info, left_wall, right_wall,
+                    self._env_config["vehicle_proximity"], snapshot)
 
         yaw_diff_ego = math.degrees(get_yaw_diff(lane_center.transform.get_forward_vector(),
-                                    self._actors[actor_id].get_transform().get_forward_vector()))
+                                    ego_forward_vector))
 
         yaw_forward = lane_center.transform.get_forward_vector()
-        v_3d = self._actors[actor_id].get_velocity()
+        v_3d = snapshot.get_velocity(ego_vehicle)
         v_s,v_t=get_projection(v_3d,yaw_forward)
 
-        a_3d = self._actors[actor_id].get_acceleration()
+        a_3d = snapshot.get_acceleration(ego_vehicle)
         a_s,a_t=get_projection(a_3d,yaw_forward)
 
         if lights_info:
@@ -110,34 +122,41 @@ class StateDAO(object):
             self._cur_measurement["rear_a"] = 0
             self._cur_measurement["change_lane"] = None
         else:
-            lane_center=get_lane_center(self.map, vehs_info.center_rear_veh.get_location())
+            lane_center=get_lane_center(self.map, snapshot.get_location(vehs_info.center_rear_veh))
             yaw_forward=lane_center.transform.get_forward_vector()
-            v_3d=vehs_info.center_rear_veh.get_velocity()
+            v_3d=snapshot.get_velocity(vehs_info.center_rear_veh)
             v_s,v_t=get_projection(v_3d,yaw_forward)
-            a_3d=vehs_info.center_rear_veh.get_acceleration()
+            a_3d=snapshot.get_acceleration(vehs_info.center_rear_veh)
             a_s,a_t=get_projection(a_3d,yaw_forward)
             self._cur_measurement["rear_id"] = vehs_info.center_rear_veh.id
             self._cur_measurement["rear_v"] = v_s
             self._cur_measurement["rear_a"] = a_s
             self._cur_measurement["change_lane"] = None
 
+        # the state is written straight into the flat vector the agents read, the dict entries are views of it
+        buffers = self._obs_buffers[actor_id]
+        buffers.reverse()
+        flat = buffers[0]
+        layout = self._obs_layout
+        layout.write_waypoints(flat, 0, left_wps_processed)
+        layout.write_waypoints(flat, 1, center_wps_processed)
+        layout.write_waypoints(flat, 2, right_wps_processed)
+        layout.write_vehicles(flat, vehicle_inlane_processed)
+        layout.write_light(flat, light)
+        layout.write_hero(flat, (v_s/10, v_t/10, a_s/3, a_t/3, ego_t, yaw_diff_ego/90))
+        state_np = layout.views(flat)
+        state_np["vehicle_info"] = vehicle_inlane_processed
+
         return ({
                 "wps": wps_info,
                 "lights": lights_info,
                 "vehs": vehs_info
             },
             self._cur_measurement,
-            {
-                "left_waypoints": left_wps_processed, 
-                "center_waypoints": center_wps_processed,
-                "right_waypoints": right_wps_processed, 
-                "vehicle_info": vehicle_inlane_processed,
-                "hero_vehicle": [v_s/10, v_t/10, a_s/3, a_t/3, ego_t, yaw_diff_ego/90],
-                "light":light
-            }
+            state_np
         ) 
     
-    def _process_veh(self, ego_vehicle, vehs_info, left_wall, right_wall,vehicle_proximity):        
+    def _process_veh(self, ego_vehicle, vehs_info, left_wall, right_wall,vehicle_proximity, snapshot):
         vehicle_inlane=[vehs_info.left_front_veh,vehs_info.center_front_veh,vehs_info.right_front_veh,
                 vehs_info.left_rear_veh,vehs_info.center_rear_veh,vehs_info.right_rear_veh]
         vehicle_distance_s=[vehs_info.distance_to_front_vehicles[0], vehs_info.distance_to_front_vehicles[1],
@@ -175,9 +194,9 @@ class StateDAO(object):
                         #v_info = [-1, 0, lane]
                         v_info = [-1, 1, 0, lane]
                 else:
-                    ego_speed = get_speed(ego_vehicle, False)
-                    ego_half_len, ego_half_wid = get_len_wid(ego_vehicle)
-                    veh_speed = get_speed(veh, False)
+                    ego_speed = snapshot.get_speed(ego_vehicle, False)
+                    ego_half_len, ego_half_wid = get_len_wid(ego_vehicle, snapshot)
+                    veh_speed = snapshot.get_speed(veh, False)
                     rel_speed = ego_speed - veh_speed
 
                     # ego_bounding_x = ego_vehicle.bounding_box.extent.x
@@ -187,18 +206,20 @@ class StateDAO(object):
                     #     max(abs(veh.bounding_box.extent.x), abs(veh.bounding_box.extent.y))
                     # distance -= vehicle_len
                     distance = vehicle_distance_s[i]
-                    veh_half_len, veh_half_wid = get_len_wid(veh)
+                    veh_half_len, veh_half_wid = get_len_wid(veh, snapshot)
                     distance -= veh_half_len + ego_half_len
                     
                     # compute lateral distance -- distance_t
-                    veh_lane_center = get_lane_center(self.map, vehicle_inlane[i].get_location())
+                    veh_location = snapshot.get_location(veh)
+                    veh_lane_center = compute_lane_center(self.map, veh_location)
                     veh_lcen = compute_signed_distance(veh_lane_center.transform.location,
-                                                       vehicle_inlane[i].get_location(),
+                                                       veh_location,
                                                        veh_lane_center.transform.get_forward_vector())
-                    ego_lane_center = get_lane_center(self.map, ego_vehicle.get_location())
+                    ego_location = snapshot.get_location(ego_vehicle)
+                    ego_lane_center = compute_lane_center(self.map, ego_location)
                     lane_wid = ego_lane_center.lane_width
                     ego_lcen = compute_signed_distance(ego_lane_center.transform.location, 
-                                                       ego_vehicle.get_location(),
+                                                       ego_location,
                                                        ego_lane_center.transform.get_forward_vector())
                     if i == 0 or i == 3:
                         distance_t = (lane_wid - (veh_lcen + veh_half_wid - ego_lcen + ego_half_wid)) / lane_wid
@@ -248,8 +269,9 @@ def process_lane_wp(wps_list, ego_vehicle_z, ego_forward_vector, my_sample_ratio
         wps.append([delta_z/3, yaw_diff, lane_offset])
     return np.array(wps)
 
-def get_len_wid(vehicle):
-    proj_s, proj_t = get_projection(vehicle.bounding_box.extent, 
-                                vehicle.bounding_box.rotation.get_forward_vector())
+def get_len_wid(vehicle, snapshot=None):
+    bounding_box = vehicle.bounding_box if snapshot is None else snapshot.get_bounding_box(vehicle)
+    proj_s, proj_t = get_projection(bounding_box.extent, 
+                                bounding_box.rotation.get_forward_vector())
     
     return abs(proj_s), abs(proj_t)
\ No newline at end of file
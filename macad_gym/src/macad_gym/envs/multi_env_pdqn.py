@@ -29,6 +29,7 @@ from gym.spaces import Box, Discrete, Tuple, Dict
 from macad_gym import LOG_PATH, RETRIES_ON_ERROR
 from macad_gym.viz.logger import LOG
 from macad_gym.core.utils.state import StateDAO
+from macad_gym.core.utils.observation import ObservationLayout
 from macad_gym.core.controllers.traffic import apply_traffic, hero_autopilot
 from macad_gym.multi_actor_env import MultiActorEnv
 from macad_gym.core.maps.nodeid_coord_map import MAP_TO_COORDS_MAPPING
@@ -228,6 +229,7 @@ class PDQNMultiCarlaEnv(*MultiAgentEnvBases):
                                 "vehicle_info": Box(-np.inf, np.inf,shape=(6, 4), dtype=np.float32),
                                 "hero_vehicle": Box(-2.0, 2.0, shape=(1, 6), dtype=np.float32),
                                 "light":Box(-np.inf, np.inf, shape=(1, 3), dtype=np.float32),
+                                "flat": Box(-np.inf, np.inf, shape=(ObservationLayout().size,), dtype=np.float32),
                             })
                         ]
                     )
@@ -0,0 +1,53 @@
+import numpy as np
+from macad_gym.core.utils.observation import ObservationLayout
+
+
+def make_state(rng):
+    return {
+        "left_waypoints": rng.normal(size=(10, 3)),
+        "center_waypoints": rng.normal(size=(10, 3)),
+        "right_waypoints": rng.normal(size=(10, 3)),
+        "vehicle_info": rng.normal(size=(6, 4)),
+        "hero_vehicle": list(rng.normal(size=6)),
+        "light": [1, 0, 0.5],
+    }
+
+
+def test_observation_layout_matches_lane_wise_concatenation():
+    layout = ObservationLayout()
+    state = make_state(np.random.default_rng(0))
+    veh = state["vehicle_info"]
+    expected = np.concatenate([
+        np.reshape(state["left_waypoints"], -1), veh[0], veh[3], state["light"],
+        np.reshape(state["center_waypoints"], -1), veh[1], veh[4], state["light"],
+        np.reshape(state["right_waypoints"], -1), veh[2], veh[5], state["light"],
+        state["hero_vehicle"]]).astype(np.float32)
+    flat = layout.encode(state)
+    assert flat.dtype == np.float32 and flat.shape == (layout.size,) == (129,)
+    np.testing.assert_array_equal(flat, expected)
+
+
+def test_observation_layout_reuses_the_env_vector():
+    layout = ObservationLayout()
+    state = make_state(np.random.default_rng(1))
+    state["flat"] = layout.encode(state)
+    assert layout.flat(state) is state["flat"]
+    assert layout.flat(state["flat"]) is state["flat"]
+
+
+def test_views_of_written_vector_match_encode():
+    layout = ObservationLayout()
+    state = make_state(np.random.default_rng(2))
+    out = layout.empty()
+    for lane, key in enumerate(layout.LANE_KEYS):
+        layout.write_waypoints(out, lane, state[key])
+    layout.write_vehicles(out, state["vehicle_info"])
+    layout.write_light(out, state["light"])
+    layout.write_hero(out, tuple(state["hero_vehicle"]))
+    np.testing.assert_array_equal(out, layout.encode(state))
+
+    views = layout.views(out)
+    for key in layout.LANE_KEYS + ("light", "hero_vehicle"):
+        np.testing.assert_allclose(views[key], np.asarray(state[key], dtype=np.float32).reshape(views[key].shape))
+        assert np.shares_memory(views[key], out)
+    assert layout.flat(views) is out
@@ -0,0 +1,63 @@
+"""Benchmark writing and loading P-DQN checkpoints on the CPU.
+
+Run from the repository root:
+    python main/benchmark/checkpoint_benchmark.py
+"training" is the full save_net checkpoint (four networks and both Adam states), "policy"
+the save_policy inference snapshot of the actor and critic, read with and without mmap.
+Loading times are for load_net into a fresh agent, as a worker or an evaluator does.
+"""
+import os, sys
+import time
+import tempfile
+import numpy as np
+import torch
+sys.path.append(os.getcwd())
+from algs.pdqn import P_DQN
+from algs.util.checkpoint import load_policy
+
+REPEAT = 50
+S_DIM = {'waypoints': 10, 'hero_vehicle': 6, 'companion_vehicle': 4, 'light': 3}
+
+
+def make_agent():
+    return P_DQN(dict(S_DIM), 2, {'steer': 1.0, 'throttle': 1.0, 'brake': 1.0}, 0.9, 0.01, 0.3, 0.5, 0.5,
+                 0.05, 0.5, 1000, 256, 0.0002, 0.0002, 10, True, True, True, torch.device('cpu'))
+
+
+def bench(function, repeat=REPEAT):
+    function()
+    latency = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        latency[i] = time.perf_counter() - start
+    return np.median(latency) * 1e3
+
+
+def main():
+    torch.set_num_threads(1)
+    learner, worker = make_agent(), make_agent()
+    # one optimizer step so that the Adam states are populated as in a real checkpoint
+    for optimizer, net in ((learner.actor_optimizer, learner.actor), (learner.critic_optimizer, learner.critic)):
+        sum(param.sum() for param in net.parameters()).backward()
+        optimizer.step()
+
+    with tempfile.TemporaryDirectory() as path:
+        files = {'training': os.path.join(path, 'training.pth'), 'policy fp32': os.path.join(path, 'policy.pth'),
+                 'policy fp16': os.path.join(path, 'policy_half.pth')}
+        saves = {'training': lambda: learner.save_net(files['training']),
+                 'policy fp32': lambda: learner.save_policy(files['policy fp32']),
+                 'policy fp16': lambda: learner.save_policy(files['policy fp16'], half=True)}
+
+        print(f"{'checkpoint':>20} {'size KB':>10} {'save ms':>10} {'load_net ms':>12}")
+        for name, save in saves.items():
+            save_ms = bench(save)
+            load_ms = bench(lambda: worker.load_net(files[name]))
+            print(f"{name:>20} {os.path.getsize(files[name]) / 1024:>10.1f} {save_ms:>10.2f} {load_ms:>12.2f}")
+        for mmap in (True, False):
+            load_ms = bench(lambda: load_policy(files['policy fp32'], mmap=mmap))
+            print(f"{'read policy' + (' mmap' if mmap else ''):>20} {'':>10} {'':>10} {load_ms:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark the memoized get_lane_center against the live compute_lane_center.
+
+Run from the repository root:
+    python main/benchmark/lane_center_benchmark.py
+Replays the query pattern of an env step on the mock_carla map: every tick, each of NPCS
+autopilot vehicles is projected QUERIES_PER_TICK times, as the planner, the state and the reward
+code each ask for the same vehicles. The grid starts empty, so the first lap pays the misses.
+"map calls" counts map.get_waypoint calls per tick, each one a round trip against a CARLA server.
+"""
+import os, sys
+import random
+import time
+sys.path.append(os.getcwd())
+import mock_carla
+carla = mock_carla.install()
+from gym_carla.multi_lane.util.misc import LaneCenterCache, compute_lane_center
+
+NPCS = [10, 50]
+RESOLUTIONS = [0.1, 0.25, 0.5]
+TICKS = 600
+QUERIES_PER_TICK = 3
+
+
+def record_traffic(npcs):
+    """Vehicle locations of every tick of an autopilot run"""
+    client = carla.Client('localhost', 2000)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    spawn_points = world.get_map().get_spawn_points()
+    random.Random(0).shuffle(spawn_points)
+    library = world.get_blueprint_library()
+    vehicles = [world.spawn_actor(library.find('vehicle.audi.etron'), transform) for transform in spawn_points[:npcs]]
+    for vehicle in vehicles:
+        vehicle.set_autopilot(True)
+    ticks = []
+    for _ in range(TICKS):
+        world.tick()
+        ticks.append([vehicle.get_location() for vehicle in vehicles])
+    return world.get_map(), ticks
+
+
+def bench(town, ticks, lane_center):
+    calls = [0]
+    get_waypoint = town.get_waypoint
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return get_waypoint(*args, **kwargs)
+    town.get_waypoint = counted
+    start = time.perf_counter()
+    for locations in ticks:
+        for _ in range(QUERIES_PER_TICK):
+            for location in locations:
+                lane_center(location)
+    elapsed = time.perf_counter() - start
+    del town.get_waypoint
+    return elapsed / len(ticks) * 1e3, calls[0] / len(ticks)
+
+
+def main():
+    print(f"{'npcs':>6} {'cell m':>7} {'ms/tick':>8} {'speedup':>8} {'map calls':>10} {'hit rate':>9}")
+    for npcs in NPCS:
+        town, ticks = record_traffic(npcs)
+        live, live_calls = bench(town, ticks, lambda location: compute_lane_center(town, location))
+        print(f"{npcs:>6} {'live':>7} {live:>8.2f} {1.:>7.1f}x {live_calls:>10.0f} {'':>9}")
+        for resolution in RESOLUTIONS:
+            cache = LaneCenterCache(town, resolution)
+            cached, cached_calls = bench(town, ticks, cache.get)
+            hit_rate = cache.hits / (cache.hits + cache.misses)
+            print(f"{npcs:>6} {resolution:>7} {cached:>8.2f} {live / cached:>7.1f}x {cached_calls:>10.1f} {hit_rate:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Benchmark the three lane_wise_cross_attention_encoder modules against FusedLaneEncoder on the CPU.
+
+Run from the repository root:
+    python main/benchmark/lane_encoder_benchmark.py
+Batch size 1 is the take_action case, batch size 256 a learn step (forward and backward).
+"""
+import os, sys
+import time
+import numpy as np
+import torch
+sys.path.append(os.getcwd())
+from algs.pdqn import PolicyNet_multi
+
+STEP_NUMBER = 1000
+S_DIM = {'waypoints': 30, 'hero_vehicle': 6, 'companion_vehicle': 4, 'light': 3}
+STATE_WIDTH = 3 * (30 + 2 * 4 + 3) + 6
+
+
+def bench(net, batch_size, backward, step_number=STEP_NUMBER):
+    state = torch.randn(batch_size, STATE_WIDTH)
+    latency = np.empty(step_number)
+    for i in range(-100, step_number):
+        start = time.perf_counter()
+        if backward:
+            net(state).sum().backward()
+        else:
+            with torch.inference_mode():
+                net(state)
+        if i >= 0:
+            latency[i] = time.perf_counter() - start
+    return np.median(latency) * 1e6
+
+
+def main():
+    torch.set_num_threads(1)
+    torch.manual_seed(0)
+    a_bound = {'steer': 1.0, 'throttle': 1.0, 'brake': 1.0}
+    nets = {'three encoders': PolicyNet_multi(dict(S_DIM), 6, a_bound),
+            'fused': PolicyNet_multi(dict(S_DIM), 6, a_bound, fused=True)}
+    print(f"{'encoder':>16} {'B=1 us':>10} {'B=256 fwd+bwd us':>18}")
+    for name, net in nets.items():
+        print(f"{name:>16} {bench(net, 1, False):>10.1f} {bench(net, 256, True):>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
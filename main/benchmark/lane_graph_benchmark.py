@@ -0,0 +1,88 @@
+"""Benchmark LocalPlanner._get_waypoints with the precomputed lane graph against the waypoint walk.
+
+Run from the repository root:
+    python main/benchmark/lane_graph_benchmark.py
+Runs on the mock_carla map, where waypoint.next()/previous() are local calls. Against a CARLA
+server each of the 6 * BUFFER_SIZE calls of the walk is a round trip, which the "calls" column
+counts, so the gap only widens there. The graph is built once per map and sampling radius,
+later processes load it from the .npz cache.
+"""
+import os, sys
+import tempfile
+import time
+import numpy as np
+sys.path.append(os.getcwd())
+import mock_carla
+carla = mock_carla.install()
+from gym_carla.multi_lane.agent import lane_graph
+from gym_carla.multi_lane.agent.lane_graph import LaneGraph
+from gym_carla.multi_lane.agent.local_planner import LocalPlanner
+
+BUFFER_SIZES = [10, 50, 100]
+RADIUS = 1.0
+POSES = 200
+
+
+def make_planner(world, buffer_size, cache_dir):
+    town = world.get_map()
+    ego = world.spawn_actor(world.get_blueprint_library().find('vehicle.tesla.model3'), town.get_spawn_points()[0])
+    world.tick()
+    return ego, LocalPlanner(ego, {'sampling_resolution': RADIUS, 'buffer_size': buffer_size, 'vehicle_proximity': 50.,
+                                   'traffic_light_proximity': 50., 'lane_graph_dir': cache_dir})
+
+
+def bench_waypoints(world, ego, planner, walk):
+    town = world.get_map()
+    rng = np.random.default_rng(0)
+    poses = []
+    for _ in range(POSES):
+        road = town.roads[rng.integers(len(town.roads))]
+        lane = town.driving_lanes[rng.integers(len(town.driving_lanes))]
+        poses.append(carla.Waypoint(town, road, lane, rng.uniform(0., road.length)).transform)
+    graph = planner._lane_graph
+    if walk:
+        # a lane missing from the graph sends the planner back to the waypoint walk
+        graph.node = lambda waypoint: -1
+    # one untimed pass, the graph creates its waypoints and index tables on first use
+    for pose in poses:
+        ego.set_transform(pose)
+        world.tick()
+        planner._get_waypoints()
+    elapsed = 0.
+    for pose in poses:
+        ego.set_transform(pose)
+        world.tick()
+        start = time.perf_counter()
+        planner._get_waypoints()
+        elapsed += time.perf_counter() - start
+    if walk:
+        del graph.node
+    return elapsed / POSES * 1e6
+
+
+def main():
+    world = carla.Client('localhost', 2000).load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    world.apply_settings(settings)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        graph = LaneGraph.load(world.get_map(), RADIUS, cache_dir)
+        built = time.perf_counter() - start
+        lane_graph._graphs.clear()
+        start = time.perf_counter()
+        LaneGraph.load(world.get_map(), RADIUS, cache_dir)
+        loaded = time.perf_counter() - start
+        print(f"graph of {graph.size} nodes: built in {built * 1e3:.1f} ms, loaded from cache in {loaded * 1e3:.1f} ms\n")
+
+        print(f"{'buffer':>8} {'calls':>7} {'walk us':>10} {'graph us':>10} {'speedup':>8}")
+        for buffer_size in BUFFER_SIZES:
+            ego, planner = make_planner(world, buffer_size, cache_dir)
+            walk = bench_waypoints(world, ego, planner, True)
+            fast = bench_waypoints(world, ego, planner, False)
+            print(f"{buffer_size:>8} {6 * buffer_size:>7} {walk:>10.1f} {fast:>10.1f} {walk / fast:>7.1f}x")
+            ego.destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark the offline mock CARLA simulator and the gym_carla env loop running on it.
+
+Run from the repository root:
+    python main/benchmark/mock_carla_benchmark.py
+The first table times bare world ticks with NPCS autopilot vehicles and one manually driven
+ego, the second steps the multi lane CarlaEnv on the mock with its printing and logging
+muted. The env numbers are what the server-free profiling of the planner and reward code starts from.
+"""
+import os, sys
+import contextlib
+import io
+import logging
+import random
+import time
+import numpy as np
+sys.path.append(os.getcwd())
+import mock_carla
+mock_carla.install()
+import carla
+
+NPCS = [0, 20, 45, 90]
+TICKS = 1000
+ENV_STEPS = 300
+
+
+def bench_world(npcs, ticks=TICKS):
+    client = carla.Client('localhost', 2000)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    spawn_points = world.get_map().get_spawn_points()
+    random.Random(0).shuffle(spawn_points)
+    library = world.get_blueprint_library()
+    batch = [carla.command.SpawnActor(library.find('vehicle.audi.etron'), transform)
+             .then(carla.command.SetAutopilot(carla.command.FutureActor, True, 8000))
+             for transform in spawn_points[1:npcs + 1]]
+    client.apply_batch_sync(batch, True)
+    ego = world.spawn_actor(library.find('vehicle.tesla.model3'), spawn_points[0])
+    world.spawn_actor(library.find('sensor.other.collision'), carla.Transform(), attach_to=ego).listen(
+        lambda event: None)
+    control = carla.VehicleControl(throttle=0.3)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        ego.apply_control(control)
+        world.tick()
+    return ticks / (time.perf_counter() - start)
+
+
+def bench_env(steps=ENV_STEPS):
+    from gym_carla.multi_lane.settings import ARGS
+    from gym_carla.multi_lane.carla_env import CarlaEnv
+    args = ARGS.parse_args([])
+    args.pre_train_steps = 0
+    random.seed(0)
+    action_param = np.array([[0.0, 0.3, 0.0, 0.3, 0.0, 0.3]])
+    logging.disable(logging.WARNING)
+    with contextlib.redirect_stdout(io.StringIO()):
+        env = CarlaEnv(args)
+        env.reset()
+        start = time.perf_counter()
+        for _ in range(steps):
+            _, _, truncated, done, _ = env.step(1, action_param)
+            if truncated or done:
+                env.reset()
+        elapsed = time.perf_counter() - start
+    logging.disable(logging.NOTSET)
+    return steps / elapsed
+
+
+def main():
+    print(f"{'npcs':>6} {'ticks/s':>10}")
+    for npcs in NPCS:
+        print(f"{npcs:>6} {bench_world(npcs):>10.0f}")
+    print(f"\nCarlaEnv on the mock: {bench_env():.1f} steps/s (resets included)")
+
+
+if __name__ == '__main__':
+    main()
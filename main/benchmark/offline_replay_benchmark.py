@@ -0,0 +1,46 @@
+"""Benchmark loading, splitting and sampling the offline replay buffer.
+
+Run from the repository root:
+    python main/benchmark/offline_replay_benchmark.py
+A synthetic file of ROWS transitions in the layout of out/all_replay_buffer.npy is written to
+a temporary directory first. "load + split" maps it and builds the five state index arrays,
+sampling reports transitions per second at a few batch sizes.
+"""
+import os, sys
+import time
+import tempfile
+import numpy as np
+sys.path.append(os.getcwd())
+from algs.util.replay_buffer import OfflineReplayBuffer
+
+ROWS = 1000000
+REPEAT = 200
+BATCH_SIZES = [256, 4096, 65536]
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rows = rng.standard_normal((ROWS, 66)).astype(np.float32)
+    rows[:, 61] = rng.uniform(0, 10, ROWS)
+
+    with tempfile.TemporaryDirectory() as path:
+        file = os.path.join(path, 'all_replay_buffer.npy')
+        np.save(file, rows)
+        del rows
+        start = time.perf_counter()
+        buffer = OfflineReplayBuffer(file)
+        print(f"{'load + split':>20} {(time.perf_counter() - start) * 1e3:>10.1f} ms")
+
+        print(f"{'batch size':>20} {'ms':>10} {'samples/s':>14}")
+        for batch_size in BATCH_SIZES:
+            buffer.sample(batch_size)
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                buffer.sample(batch_size)
+            elapsed = (time.perf_counter() - start) / REPEAT
+            print(f"{batch_size:>20d} {elapsed * 1e3:>10.3f} {batch_size / elapsed:>14.3e}")
+        del buffer
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark PriReplayBuffer.add throughput across buffer capacities.
+
+Run from the repository root:
+    python main/benchmark/per_add_benchmark.py
+With the max/min companion trees the cost of an insert only depends on the tree depth,
+so adds/s should stay flat while the capacity grows by orders of magnitude. The "leaf scan"
+column replays the previous behaviour, an np.max over all the leaves before every insert.
+"add_batch" inserts the same transitions in chunks of CHUNK with one tree rebuild per chunk.
+"""
+import os, sys
+import time
+import numpy as np
+sys.path.append(os.getcwd())
+from algs.util.replay_buffer import PriReplayBuffer
+
+CAPACITIES = [1000, 10000, 160000, 1000000]
+ADD_NUMBER = 20000
+CHUNK = 256
+STATE_DIM = 97
+
+
+def bench_add(capacity, add_number=ADD_NUMBER, leaf_scan=False):
+    buffer = PriReplayBuffer(capacity)
+    state = np.zeros((1, STATE_DIM), dtype=np.float32)
+    action_param = np.zeros((1, 6), dtype=np.float32)
+    transition = (state, 1, action_param, 0., state, False, False, {})
+    # fill the ring first so that every timed add overwrites an old leaf
+    for _ in range(min(capacity, add_number)):
+        buffer.add(transition)
+    start = time.perf_counter()
+    for _ in range(add_number):
+        if leaf_scan:
+            np.max(buffer.tree.tree[-buffer.tree.capacity:])
+        buffer.add(transition)
+    return add_number / (time.perf_counter() - start)
+
+
+def bench_add_batch(capacity, add_number=ADD_NUMBER, chunk=CHUNK):
+    buffer = PriReplayBuffer(capacity)
+    columns = (np.zeros((chunk, 1, STATE_DIM), dtype=np.float32), np.ones(chunk, dtype=np.float32),
+               np.zeros((chunk, 1, 6), dtype=np.float32), np.zeros(chunk, dtype=np.float32),
+               np.zeros((chunk, 1, STATE_DIM), dtype=np.float32), np.zeros(chunk, dtype=np.float32),
+               np.zeros(chunk, dtype=np.float32), [{}] * chunk)
+    for _ in range(min(capacity, add_number) // chunk):
+        buffer.add_batch(columns)
+    start = time.perf_counter()
+    for _ in range(add_number // chunk):
+        buffer.add_batch(columns)
+    return add_number // chunk * chunk / (time.perf_counter() - start)
+
+
+def main():
+    print(f"{'capacity':>10} {'adds/s':>12} {'leaf scan adds/s':>18} {'add_batch adds/s':>18}")
+    for capacity in CAPACITIES:
+        print(f"{capacity:>10} {bench_add(capacity):>12.0f} {bench_add(capacity, leaf_scan=True):>18.0f} "
+              f"{bench_add_batch(capacity):>18.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark persisting and reopening a full prioritized replay buffer.
+
+Run from the repository root:
+    python main/benchmark/replay_persist_benchmark.py
+The buffer holds CAPACITY transitions with P-DQN sized states. "flush" is the periodic flush
+after FLUSH_ADDS new transitions, "open" maps the saved buffer as a restarted learner does,
+"np.load" reads the same arrays into RAM for comparison. The first sample after open pays
+for the pages it touches.
+"""
+import os, sys
+import time
+import tempfile
+import numpy as np
+sys.path.append(os.getcwd())
+from algs.util.replay_buffer import PriReplayBuffer
+
+CAPACITY = 160000
+FLUSH_ADDS = 1000
+STATE_WIDTH = 99
+
+
+def make_transition(rng):
+    state = rng.standard_normal((1, STATE_WIDTH)).astype(np.float32)
+    return (state, int(rng.integers(3)), rng.standard_normal((1, 3)), float(rng.standard_normal()),
+            rng.standard_normal((1, STATE_WIDTH)).astype(np.float32), False, False, {})
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1e3
+
+
+def main():
+    rng = np.random.default_rng(0)
+    buffer = PriReplayBuffer(CAPACITY)
+    for _ in range(CAPACITY):
+        buffer.add(make_transition(rng))
+
+    with tempfile.TemporaryDirectory() as path:
+        _, persist_ms = timed(lambda: buffer.persist(path))
+        for _ in range(FLUSH_ADDS):
+            buffer.add(make_transition(rng))
+        _, flush_ms = timed(buffer.flush)
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+        reopened, open_ms = timed(lambda: PriReplayBuffer.open(path))
+        _, sample_ms = timed(lambda: reopened.sample(256))
+        files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith('.npy')]
+        _, load_ms = timed(lambda: [np.load(file) for file in files])
+
+    print(f"{'buffer':>20} {CAPACITY:>10d} transitions {size / 2 ** 20:>10.1f} MB")
+    print(f"{'persist':>20} {persist_ms:>10.1f} ms")
+    print(f"{'flush':>20} {flush_ms:>10.1f} ms")
+    print(f"{'open':>20} {open_ms:>10.1f} ms")
+    print(f"{'first sample':>20} {sample_ms:>10.1f} ms")
+    print(f"{'np.load':>20} {load_ms:>10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark the per-step decision latency of P_DQN.take_action on the CPU.
+
+Run from the repository root:
+    python main/benchmark/take_action_benchmark.py
+"legacy" replays the previous path: eleven tensors concatenated per call and one host copy per
+action parameter column. The other rows go through take_action with autograd on, with
+torch.inference_mode, and with the TorchScript traces built by compile_policy.
+"""
+import os, sys
+import time
+import numpy as np
+import torch
+sys.path.append(os.getcwd())
+from algs.pdqn import P_DQN
+
+STEP_NUMBER = 2000
+S_DIM = {'waypoints': 10, 'hero_vehicle': 6, 'companion_vehicle': 4, 'light': 3}
+
+
+def make_agent():
+    return P_DQN(dict(S_DIM), 2, {'steer': 1.0, 'throttle': 1.0, 'brake': 1.0}, 0.9, 0.01, 0.3, 0.5, 0.5,
+                 0.05, 0.5, 1000, 256, 0.0002, 0.0002, 10, True, True, True, torch.device('cpu'))
+
+
+def make_state(rng):
+    return {'left_waypoints': rng.normal(size=(10, 3)), 'center_waypoints': rng.normal(size=(10, 3)),
+            'right_waypoints': rng.normal(size=(10, 3)), 'vehicle_info': rng.normal(size=(6, 4)),
+            'light': [1, 0, 1.0], 'hero_vehicle': list(rng.normal(size=6))}
+
+
+def legacy_take_action(agent, state):
+    device = agent.device
+    parts = [state['left_waypoints'], state['vehicle_info'][0], state['vehicle_info'][3], state['light'],
+             state['center_waypoints'], state['vehicle_info'][1], state['vehicle_info'][4], state['light'],
+             state['right_waypoints'], state['vehicle_info'][2], state['vehicle_info'][5], state['light'],
+             state['hero_vehicle']]
+    state_ = torch.cat([torch.tensor(part, dtype=torch.float32).view(1, -1).to(device) for part in parts], dim=1)
+    all_action_param = agent.actor(state_)
+    q_a = torch.squeeze(agent.critic(state_, all_action_param)).detach().cpu().numpy()
+    action = np.argmax(q_a)
+    action_param = all_action_param[:, agent.action_parameter_offsets[action]:agent.action_parameter_offsets[action+1]]
+    f"{action_param[0][0]} {action_param[0][1]}"    # the eager debug f-string
+    action_param = np.array([action_param[:, i].detach().cpu().numpy() for i in range(2)]).reshape((-1, 2))
+    all_action_param = np.array([all_action_param[:, i].detach().cpu().numpy() for i in range(6)]).reshape((-1, 6))
+    return action, action_param, all_action_param
+
+
+def bench(take_action, states, step_number=STEP_NUMBER):
+    for state in states[:100]:
+        take_action(state)
+    latency = np.empty(step_number)
+    for i in range(step_number):
+        start = time.perf_counter()
+        take_action(states[i % len(states)])
+        latency[i] = time.perf_counter() - start
+    return np.median(latency) * 1e6, np.percentile(latency, 99) * 1e6
+
+
+def main():
+    torch.set_num_threads(1)
+    rng = np.random.default_rng(0)
+    states = [make_state(rng) for _ in range(256)]
+    agent = make_agent()
+
+    print(f"{'path':>16} {'median us':>10} {'p99 us':>10}")
+    median, p99 = bench(lambda state: legacy_take_action(agent, state), states)
+    print(f"{'legacy':>16} {median:>10.1f} {p99:>10.1f}")
+    for name, inference_mode, script in [('autograd', False, False), ('inference_mode', True, False),
+                                         ('torchscript', True, True)]:
+        agent.inference_mode = inference_mode
+        if script:
+            agent.compile_policy()
+        median, p99 = bench(agent.take_action, states)
+        print(f"{name:>16} {median:>10.1f} {p99:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
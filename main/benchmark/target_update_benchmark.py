@@ -0,0 +1,55 @@
+"""Benchmark the target network soft update on the P-DQN actor and critic on the CPU.
+
+Run from the repository root:
+    python main/benchmark/target_update_benchmark.py
+"loop" is the per parameter copy_ the agents used, "fused" is TargetUpdater's single
+multi-tensor lerp over both network pairs.
+"""
+import os, sys
+import time
+import copy
+import numpy as np
+import torch
+sys.path.append(os.getcwd())
+from algs.pdqn import PolicyNet_multi, QValueNet_multi
+from algs.util.target_update import TargetUpdater
+
+STEP_NUMBER = 2000
+S_DIM = {'waypoints': 30, 'hero_vehicle': 6, 'companion_vehicle': 4, 'light': 3}
+TAU = 0.01
+
+
+def loop_update(pairs):
+    for net, target_net in pairs:
+        for param_target, param in zip(target_net.parameters(), net.parameters()):
+            param_target.data.copy_(param_target.data * (1.0 - TAU) + param.data * TAU)
+
+
+def bench(update, step_number=STEP_NUMBER):
+    for _ in range(100):
+        update()
+    latency = np.empty(step_number)
+    for i in range(step_number):
+        start = time.perf_counter()
+        update()
+        latency[i] = time.perf_counter() - start
+    return np.median(latency) * 1e6, np.percentile(latency, 99) * 1e6
+
+
+def main():
+    torch.set_num_threads(1)
+    actor = PolicyNet_multi(dict(S_DIM), 6, {'steer': 1.0, 'throttle': 1.0, 'brake': 1.0})
+    critic = QValueNet_multi(dict(S_DIM), 6, 3)
+    pairs = [(actor, copy.deepcopy(actor)), (critic, copy.deepcopy(critic))]
+    updater = TargetUpdater(pairs, TAU)
+    tensors = sum(len(list(net.parameters())) for net, _ in pairs)
+
+    print(f"{tensors} parameter tensors")
+    print(f"{'update':>8} {'median us':>10} {'p99 us':>10}")
+    for name, update in [('loop', lambda: loop_update(pairs)), ('fused', updater.step)]:
+        median, p99 = bench(update)
+        print(f"{name:>8} {median:>10.1f} {p99:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
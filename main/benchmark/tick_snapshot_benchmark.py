@@ -0,0 +1,115 @@
+"""Benchmark the per-tick TickSnapshot against reading every actor through its own getters.
+
+Run from the repository root:
+    python main/benchmark/tick_snapshot_benchmark.py
+The first table reads the transform, velocity, acceleration and bounding box of every vehicle
+of a tick, once through one get_* call per actor and once with TickSnapshot.capture, on the
+mock_carla world with NPCS autopilot vehicles. A getter of the mock is a local attribute read,
+so this table only shows what building the arrays costs, not the round trips a server would
+charge for the getters. The second steps the multi lane CarlaEnv with its printing and logging
+muted and counts the actor get_* calls the env code makes per step, each one a round trip
+against a CARLA server. With the snapshot the count no longer grows with the traffic.
+"""
+import os, sys
+import contextlib
+import io
+import logging
+import random
+import time
+import numpy as np
+sys.path.append(os.getcwd())
+import mock_carla
+carla = mock_carla.install()
+from mock_carla import world as mock_world
+from gym_carla.multi_lane.util.snapshot import TickSnapshot
+
+NPCS = [15, 45, 90]
+TICKS = 200
+ENV_STEPS = 300
+GETTERS = ['get_transform', 'get_location', 'get_velocity', 'get_acceleration']
+
+
+def bench_read(npcs):
+    client = carla.Client('localhost', 2000)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    spawn_points = world.get_map().get_spawn_points()
+    random.Random(0).shuffle(spawn_points)
+    library = world.get_blueprint_library()
+    vehicles = [world.spawn_actor(library.find('vehicle.audi.etron'), transform) for transform in spawn_points[:npcs]]
+    for vehicle in vehicles:
+        vehicle.set_autopilot(True)
+    getters = snapshot = 0.
+    for _ in range(TICKS):
+        world.tick()
+        start = time.perf_counter()
+        for vehicle in vehicles:
+            vehicle.get_transform(), vehicle.get_velocity(), vehicle.get_acceleration(), vehicle.bounding_box
+        getters += time.perf_counter() - start
+        start = time.perf_counter()
+        TickSnapshot.capture(world)
+        snapshot += time.perf_counter() - start
+    return getters / TICKS * 1e3, snapshot / TICKS * 1e3
+
+
+def count_getter_calls():
+    """Patch the actor getters of the mock to count the calls made from outside the mock itself"""
+    calls = [0]
+
+    def counted(getter):
+        def wrapper(self, *args, **kwargs):
+            if not sys._getframe(1).f_globals.get('__name__', '').startswith('mock_carla'):
+                calls[0] += 1
+            return getter(self, *args, **kwargs)
+        return wrapper
+    for cls in (mock_world.Actor, mock_world.Vehicle):
+        for name in GETTERS:
+            if name in vars(cls):
+                setattr(cls, name, counted(vars(cls)[name]))
+    return calls
+
+
+def bench_env(npcs, calls):
+    from gym_carla.multi_lane.settings import ARGS
+    from gym_carla.multi_lane.carla_env import CarlaEnv
+    args = ARGS.parse_args([])
+    args.pre_train_steps = 0
+    args.num_of_vehicles = [npcs]
+    random.seed(0)
+    action_param = np.array([[0.0, 0.3, 0.0, 0.3, 0.0, 0.3]])
+    logging.disable(logging.WARNING)
+    with contextlib.redirect_stdout(io.StringIO()):
+        env = CarlaEnv(args)
+        env.reset()
+        steps, total = 0, 0
+        start = time.perf_counter()
+        for _ in range(ENV_STEPS):
+            calls[0] = 0
+            _, _, truncated, done, _ = env.step(1, action_param)
+            if truncated or done:
+                env.reset()
+            else:
+                steps += 1
+                total += calls[0]
+        elapsed = time.perf_counter() - start
+    logging.disable(logging.NOTSET)
+    return ENV_STEPS / elapsed, total / max(steps, 1)
+
+
+def main():
+    print(f"{'npcs':>6} {'getters ms':>11} {'snapshot ms':>12} {'speedup':>8}")
+    for npcs in NPCS:
+        getters, snapshot = bench_read(npcs)
+        print(f"{npcs:>6} {getters:>11.3f} {snapshot:>12.3f} {getters / snapshot:>7.1f}x")
+    calls = count_getter_calls()
+    print(f"\n{'npcs':>6} {'steps/s':>8} {'actor get_* calls/step':>23}")
+    for npcs in NPCS:
+        steps, per_step = bench_env(npcs, calls)
+        print(f"{npcs:>6} {steps:>8.1f} {per_step:>23.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark the nearest-vehicle queries of LocalPlanner._get_vehicles with and without the VehicleIndex.
+
+Run from the repository root:
+    python main/benchmark/vehicle_index_benchmark.py
+Runs on the mock_carla map with NPCS autopilot vehicles around the ego. The "scan" columns replay
+the previous behaviour, where each of the six lane queries projected every vehicle on the map
+again. The index projects each vehicle once per tick. The "map calls" columns count
+map.get_waypoint calls per tick, each one a round trip against a CARLA server.
+"""
+import os, sys
+import random
+import tempfile
+import time
+sys.path.append(os.getcwd())
+import mock_carla
+carla = mock_carla.install()
+from gym_carla.multi_lane.agent.local_planner import LocalPlanner
+from gym_carla.multi_lane.util.misc import get_lane_center, test_waypoint, is_within_distance_ahead, \
+    is_within_distance_rear
+
+NPCS = [10, 50, 100]
+TICKS = 100
+PROXIMITY = 50.
+QUERIES = [(True, -1), (False, -1), (True, 0), (False, 0), (True, 1), (False, 1)]
+
+
+def scan_one_lane(planner, vehicle_list, direction, lane_offset):
+    """LocalPlanner._get_vehicles_one_lane before the index, every vehicle projected on every query"""
+    town, ego = planner._map, planner._vehicle
+    ego_location, ego_transform = ego.get_location(), ego.get_transform()
+    ego_lane_center = get_lane_center(town, ego_location)
+    if not test_waypoint(ego_lane_center):
+        return None
+    lane_id = ego_lane_center.lane_id - lane_offset
+    if lane_id not in (-1, -2, -3):
+        return None
+    within = is_within_distance_ahead if direction else is_within_distance_rear
+    vehicle, min_distance = None, PROXIMITY
+    for target in vehicle_list:
+        if target.id == ego.id:
+            continue
+        location = target.get_location()
+        waypoint = town.get_waypoint(location)
+        lane_center = get_lane_center(town, location)
+        if lane_center.transform.location.distance(location) > lane_center.lane_width / 2 + 0.1:
+            continue
+        if not test_waypoint(waypoint) or waypoint.lane_id != lane_id:
+            continue
+        if within(location, ego_location, ego_transform, PROXIMITY) and ego_location.distance(location) < min_distance:
+            vehicle, min_distance = target, ego_location.distance(location)
+    return vehicle
+
+
+def bench(npcs, cache_dir):
+    client = carla.Client('localhost', 2000)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    town = world.get_map()
+    spawn_points = town.get_spawn_points()
+    random.Random(0).shuffle(spawn_points)
+    library = world.get_blueprint_library()
+    ego = world.spawn_actor(library.find('vehicle.tesla.model3'), spawn_points[0])
+    for transform in spawn_points[1:npcs + 1]:
+        world.spawn_actor(library.find('vehicle.audi.etron'), transform).set_autopilot(True)
+    world.tick()
+    planner = LocalPlanner(ego, {'sampling_resolution': 1.0, 'buffer_size': 50, 'vehicle_proximity': PROXIMITY,
+                                 'traffic_light_proximity': 50., 'lane_graph_dir': cache_dir})
+    planner.waypoints_info = planner._get_waypoints()
+
+    calls = [0]
+    get_waypoint = town.get_waypoint
+
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return get_waypoint(*args, **kwargs)
+    town.get_waypoint = counted
+
+    scan_time = index_time = 0.
+    scan_calls = index_calls = 0
+    ego.set_autopilot(True)
+    for _ in range(TICKS):
+        world.tick()
+        calls[0] = 0
+        start = time.perf_counter()
+        vehicle_list = world.get_actors().filter('*vehicle*')
+        for direction, lane_offset in QUERIES:
+            scan_one_lane(planner, vehicle_list, direction, lane_offset)
+        scan_time += time.perf_counter() - start
+        scan_calls += calls[0]
+        calls[0] = 0
+        start = time.perf_counter()
+        planner._get_vehicles()
+        index_time += time.perf_counter() - start
+        index_calls += calls[0]
+    return scan_time / TICKS * 1e3, index_time / TICKS * 1e3, scan_calls / TICKS, index_calls / TICKS
+
+
+def main():
+    print(f"{'npcs':>6} {'scan ms':>9} {'index ms':>9} {'speedup':>8} {'scan map calls':>15} {'index map calls':>16}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for npcs in NPCS:
+            scan, index, scan_calls, index_calls = bench(npcs, cache_dir)
+            print(f"{npcs:>6} {scan:>9.2f} {index:>9.2f} {scan / index:>7.1f}x {scan_calls:>15.0f} {index_calls:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
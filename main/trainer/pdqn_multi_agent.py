@@ -23,6 +23,9 @@ from macad_gym.core.simulator.carla_provider import CarlaError
 from macad_gym.core.utils.wrapper import (fill_action_param, recover_steer, Action, 
     SpeedState, Truncated)
 from algs.pdqn import P_DQN
+from algs.util.shared_replay import SharedTransitionRing, SharedPriReplayBuffer
+from algs.util.replay_buffer import open_or_persist, ReplayFlusher
+from algs.util.weight_broadcast import SharedWeights
 os.environ['PYTHONWARNINGS'] = 'ignore:semaphore_tracker:UserWarning'
 
 # neural network hyper parameters
@@ -45,6 +48,17 @@ AGENT_PARAM = {
     "minimal_size": 10000,
     "batch_size": 256,
     "per_flag": True,
+    "prefetch": False,   # sample the next batches in a background thread while the learner steps
+    "shared_replay": False,  # workers write transitions into a shared memory ring sampled in place, needs per_flag
+    "script_policy": False, # workers act through TorchScript traces of the actor and critic
+    "shared_weights": False, # the learner publishes actor/critic weights in shared memory instead of worker checkpoints
+    "fused_encoder": False, # run the three lane encoders as one batched module, loads either checkpoint layout
+    "target_update_every": 1,   # soft update the target networks every N learner updates
+    "amp": False,   # learner trains under autocast, float16 + GradScaler on a GPU, bfloat16 on the CPU
+    "compile": False,   # learner networks go through torch.compile
+    "learn_many": False,    # k updates of batch_size per learner step instead of one update of k * batch_size
+    "persist_replay": False, # keep the replay buffer in .npy files under REPLAY_PATH, a restarted learner reopens it
+    "traj_chunk": 32,   # without shared_replay, workers send their transitions to the learner in chunks of this many
     "device": torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu'),
     "sigma": 0.5,
     "sigma_steer": 0.3,
@@ -65,6 +79,7 @@ UPDATE_FREQ = 500
 WORKER_NUMBER = 3
 modify_change_steer=False
 MODEL_PATH = os.path.join(os.getcwd(), 'out', 'model_params', 'pdqn_ma_net_params.pth')
+REPLAY_PATH = os.path.join(os.getcwd(), 'out', 'replay', 'pdqn_ma')
 
 def main():
     SAVE_PATH = os.path.join(os.getcwd(), 'out', 'multi_agent', 'pdqn', 
@@ -81,10 +96,34 @@ def main():
                         param["tau"], param["sigma_steer"], param["sigma"], param["sigma_acc"], 
                         param["theta"], param["epsilon"], param["buffer_size"], param["batch_size"], 
                         param["lr_actor"], param["lr_critic"], param["clip_grad"], param["zero_index_gradients"],
-                        param["inverting_gradients"], param["per_flag"], param["device"])
+                        param["inverting_gradients"], param["per_flag"], param["device"],
+                        fused_encoder=param["fused_encoder"], target_update_every=param["target_update_every"])
     if TRAIN and os.path.exists(MODEL_PATH):
         # load pre-trained model
         learner.load_net(MODEL_PATH, map_location=learner.device)
+    learner.set_performance_mode(amp=param["amp"], compile=param["compile"])
+    ring = None
+    if param["shared_replay"] and param["per_flag"]:
+        # one ring segment per worker plus the last one for the evaluator
+        ring = SharedTransitionRing.create(WORKER_NUMBER + 1, param["buffer_size"] // (WORKER_NUMBER + 1),
+                                           learner.transition_layout())
+        learner.replay_buffer = SharedPriReplayBuffer(ring)
+    ring_spec = ring.spec if ring is not None else None
+    flusher = None
+    if TRAIN and param["persist_replay"]:
+        # resume from the transitions of the previous run instead of collecting minimal_size again
+        if ring is not None:
+            learner.replay_buffer = open_or_persist(learner.replay_buffer, REPLAY_PATH, ring=ring)
+        else:
+            learner.replay_buffer = open_or_persist(learner.replay_buffer, REPLAY_PATH)
+        flusher = ReplayFlusher(learner.replay_buffer).start()
+    weights = None
+    if param["shared_weights"]:
+        weights = SharedWeights.create({'actor': learner.actor, 'critic': learner.critic})
+        weights.publish({'actor': learner.actor, 'critic': learner.critic}, learner.learn_time)
+    weights_spec = weights.spec if weights is not None else None
+    if TRAIN and param["prefetch"]:
+        learner.start_prefetch(minimal_size=param["minimal_size"])
 
     process = list()
     worker_proc, eval_proc = [None for i in range(WORKER_NUMBER)], None
@@ -111,7 +150,8 @@ def main():
                         process.remove(eval_proc)
                     agent_q = manager.Queue(maxsize=1)
                     eval_proc = mp.Process(target=worker_mp, args=
-                                            (traj_q, agent_q, deepcopy(AGENT_PARAM), episode_offset, deepcopy(SAVE_PATH), -1))
+                                            (traj_q, agent_q, deepcopy(AGENT_PARAM), episode_offset, deepcopy(SAVE_PATH), -1, ring_spec,
+                                             weights_spec))
                     eval_proc.start()
                     with open(os.path.join(SAVE_PATH, 'log_file.txt'),'a') as file:
                         file.write(f"{datetime.datetime.today().strftime('%Y-%m-%d_%H-%M')} evaluator \n")
@@ -127,7 +167,8 @@ def main():
                         process.remove(worker_proc)
                     agent_q = manager.Queue(maxsize=1)
                     worker_proc = mp.Process(target=worker_mp, args=
-                                            (traj_q, agent_q, deepcopy(AGENT_PARAM), 0, deepcopy(SAVE_PATH), index))
+                                            (traj_q, agent_q, deepcopy(AGENT_PARAM), 0, deepcopy(SAVE_PATH), index, ring_spec,
+                                             weights_spec))
                     worker_proc.start()
                     with open(os.path.join(SAVE_PATH, 'log_file.txt'),'a') as file:
                         file.write(f"{datetime.datetime.today().strftime('%Y-%m-%d_%H-%M')} worker_{i} \n")
@@ -145,26 +186,39 @@ def main():
             #reference: https://zhuanlan.zhihu.com/p/345353294, https://arxiv.org/abs/1711.00489
             k = max(learner.replay_buffer.size()// param["minimal_size"], 1)
             learner.batch_size = k * param["batch_size"]
-            for i in range(WORKER_NUMBER + 1):
-                if traj_q.qsize() >= learner.batch_size // (WORKER_NUMBER * 2):
-                    for _ in range(learner.batch_size // (WORKER_NUMBER * 2)):
-                        trajectory=traj_q.get(block=True,timeout=None)
-                        state, next_state, action, saved_action_param, reward, done, truncated, info, offset, eval \
-                            = trajectory[0], trajectory[1], trajectory[2], trajectory[3], trajectory[4], \
-                            trajectory[5], trajectory[6], trajectory[7], trajectory[8], trajectory[9]
-                        if eval:
-                            episode_offset = offset
-
-                        learner.store_transition(state, action, saved_action_param, reward, next_state,
-                                                truncated, done, info)   
+            if ring is not None:
+                # transitions are already in the ring, the learner only follows the evaluator's episode count
+                episode_offset = int(ring.episode[WORKER_NUMBER])
+            if ring is None:
+                # drain the chunks sent so far, bounded like the single transitions drained before
+                chunks, drained = [], 0
+                while drained < learner.batch_size // (WORKER_NUMBER * 2) * (WORKER_NUMBER + 1):
+                    try:
+                        chunk, offset, eval = traj_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if eval:
+                        episode_offset = offset
+                    chunks.append(chunk)
+                    drained += len(chunk[0])
+                if chunks:
+                    learner.store_transitions([np.concatenate(column) for column in zip(*chunks)])
             if TRAIN and learner.replay_buffer.size()>=param["minimal_size"]:
-                q_loss = learner.learn()
+                if param["learn_many"]:
+                    q_loss = learner.learn_many(k, param["batch_size"]).mean()
+                else:
+                    q_loss = learner.learn()
                 worker_update_count += 1
                 eval_update_count += 1
 
-                if eval_update_count // UPDATE_FREQ > 0:
+                if weights is not None:
+                    if eval_update_count // UPDATE_FREQ > 0:
+                        # the evaluator copies every version, the workers every other one (UPDATE_FREQ * 2 steps)
+                        weights.publish({'actor': learner.actor, 'critic': learner.critic}, learner.learn_time, q_loss)
+                        eval_update_count %= UPDATE_FREQ
+                elif eval_update_count // UPDATE_FREQ > 0:
                     if not eval_agent_q.full():
-                        learner.save_net(os.path.join(SAVE_PATH, 'eval.pth'))
+                        learner.save_policy(os.path.join(SAVE_PATH, 'eval.pth'))
                     try:
                         eval_agent_q.put((deepcopy(learner.learn_time), deepcopy(q_loss)), block=True, timeout=10)
                     except queue.Full as e:
@@ -175,10 +229,10 @@ def main():
                     #eval_lock.release()
                     eval_update_count %= UPDATE_FREQ
 
-                if worker_update_count // (UPDATE_FREQ * 2)> 0:
+                if weights is None and worker_update_count // (UPDATE_FREQ * 2)> 0:
                     for i in range(WORKER_NUMBER):
                         if not worker_agent_q[i].full():
-                            learner.save_net(os.path.join(SAVE_PATH, f'worker_{i}.pth'))
+                            learner.save_policy(os.path.join(SAVE_PATH, f'worker_{i}.pth'))
                         try:
                             worker_agent_q[i].put((deepcopy(learner.learn_time), deepcopy(q_loss)), block=True, timeout=10)
                         except queue.Full as e:
@@ -200,13 +254,21 @@ def main():
         logger.exception(e.args)
         logger.exception(traceback.format_exc())
     finally:
+        learner.stop_prefetch()
         [p.join() for p in process]
         episode_writer.close()
         manager.shutdown()
+        if flusher is not None:
+            flusher.stop()
+        if ring is not None:
+            ring.close()
+        if weights is not None:
+            weights.close()
         learner.save_net(os.path.join(SAVE_PATH, 'ipdqn_final.pth'))
         logger.info('\nDone.')
 
-def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offset:int, save_path:str, index:int):
+def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offset:int, save_path:str, index:int,
+              ring_spec:dict=None, weights_spec:dict=None):
     env = gym.make("PDQNHomoNcomIndePoHiwaySAFR2CTWN5-v0")
     TOTAL_EPISODE = 1000
     if index == -1:
@@ -226,12 +288,21 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                         param["tau"], param["sigma_steer"], param["sigma"], param["sigma_acc"], 
                         param["theta"], param["epsilon"], param["buffer_size"], param["batch_size"], 
                         param["lr_actor"], param["lr_critic"], param["clip_grad"], param["zero_index_gradients"],
-                        param["inverting_gradients"], param["per_flag"], param["device"])
+                        param["inverting_gradients"], param["per_flag"], param["device"],
+                        fused_encoder=param["fused_encoder"], target_update_every=param["target_update_every"])
     if eval and os.path.exists(os.path.join(save_path, 'eval.pth')):
         # make sure the evaluator excute the newest model
         worker.load_net(os.path.join(save_path, 'eval.pth'), map_location=worker.device)
     if TRAIN and os.path.exists(MODEL_PATH):
         worker.load_net(MODEL_PATH, map_location=worker.device)
+    if param["script_policy"]:
+        worker.compile_policy()
+    # with a shared ring, transitions bypass traj_q and go straight into this process's ring segment
+    ring_writer = None
+    if ring_spec is not None:
+        ring_writer = SharedTransitionRing.attach(ring_spec).writer(WORKER_NUMBER if eval else index)
+    # with shared weights, the learner's newest actor and critic are copied in place instead of loaded from disk
+    weights = SharedWeights.attach(weights_spec) if weights_spec is not None else None
 
     # training part
     max_score = np.float32('-30')
@@ -246,6 +317,15 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
     losses_episode = []
     total_reward, avg_reward = {}, {}
     ttc, efficiency, comfort, lcen, lane_change_reward = {}, {}, {}, {}, {}  # part objective scores
+    chunk = []  # transitions not sent to the learner yet
+
+    def send_chunk():
+        try:
+            # XXX Do not set timeout=None here, otherwise the process might end in a perpetual blocked state.
+            traj_q.put_nowait((worker.stack_transitions(tuple(zip(*chunk))), episodes, eval))
+        except queue.Full as e:
+            logger.exception(f"SAC {'evaluator' if eval else 'worker_'+str(index)} put traj to full traj_q, {e.args}")
+        chunk.clear()
 
     try:
         for i in range(TOTAL_EPISODE//500):
@@ -262,26 +342,33 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                 
                     while not done and not truncated:
                         action_dict, actions, action_params, all_action_params={}, {}, {}, {}
-                        if TRAIN and not agent_q.empty():
+                        update = None
+                        if TRAIN and weights is not None:
+                            update = weights.poll({'actor': worker.actor, 'critic': worker.critic},
+                                                  min_steps=0 if eval else UPDATE_FREQ * 2)
+                        elif TRAIN and not agent_q.empty():
                             #lock.acquire()
                             if eval:
                                 worker.load_net(os.path.join(save_path, 'eval.pth'), map_location=worker.device)
                             else:
                                 worker.load_net(os.path.join(save_path, f'worker_{index}.pth'), map_location=worker.device)
                             try:
-                                learn_time, q_loss = agent_q.get_nowait()
+                                update = agent_q.get_nowait()
                             except queue.Empty as e:
                                 logger.exception(f"SAC {'evaluator' if eval else 'worker_'+str(index)} get from empty agent_q, {e.args}")
                                 continue
                             #lock.release()
+                        if update is not None:
+                            learn_time, q_loss = update
                             worker.learn_time=learn_time
                             if q_loss is not None:
                                 env.log(f"PDQN LEARN TIME:{learn_time}, Q_loss:{q_loss}", "INFO")
                                 losses_episode.append(q_loss)
 
+                        # one forward pass for all the actors of the scenario
+                        results = worker.take_action_batch({actor_id: states[actor_id][1] for actor_id in states.keys()})
                         for actor_id in states.keys():
-                            actions[actor_id], action_params[actor_id], all_action_params[actor_id
-                                                    ] = worker.take_action(states[actor_id][1])
+                            actions[actor_id], action_params[actor_id], all_action_params[actor_id] = results[actor_id]
                             action_dict[actor_id]={
                                 "action_index": actions[actor_id], "action_param": action_params[actor_id]}
                             
@@ -316,13 +403,16 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                                     f"\nPDQN Control In Replay Buffer: actor_id: {actor_id} action: {action}, action_parameter: {saved_action_param}", "DEBUG")
 
                                 
-                                try:
-                                    # XXX Do not set timeout=None here, otherwise the process might end in a perpetual blocked state.
-                                    traj_q.put_nowait((state, next_state, action, saved_action_param,
-                                        reward, done, truncated, info, episodes, eval))
-                                except queue.Full as e:
-                                    logger.exception(f"SAC {'evaluator' if eval else 'worker_'+str(index)} put traj to full traj_q, {e.args}")
-                                    continue
+                                if ring_writer is not None:
+                                    ring_writer.write(worker.pack_transition(state, action, saved_action_param,
+                                                                             reward, next_state, truncated, done))
+                                    if eval:
+                                        ring_writer.report_episode(episodes)
+                                else:
+                                    chunk.append((state, action, saved_action_param, reward, next_state,
+                                                  truncated, done, info))
+                                    if len(chunk) >= param["traj_chunk"]:
+                                        send_chunk()
                                 
                                 env.log(
                                     f"PDQN\n"
@@ -361,6 +451,8 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                             env.log(f"PDQN Agent Sigma {param['sigma_steer']} {param['sigma_acc']}", "INFO")
                     
                     
+                    if chunk:
+                        send_chunk()
                     if done or truncated:
                         # restart the training
                         done = False
@@ -409,6 +501,10 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
     finally:
         if eval:
             episode_writer.close()
+        if ring_writer is not None:
+            ring_writer.ring.close()
+        if weights is not None:
+            weights.close()
         logger.info(f"PDQN Exit {'evaluator' if eval else 'worker_'+str(index)} process")
         sys.exit(1)
 
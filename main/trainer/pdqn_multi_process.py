@@ -9,6 +9,7 @@ from tqdm import tqdm
 from copy import deepcopy
 from collections import deque
 from algs.pdqn import P_DQN
+from algs.util.trajectory import TrajectoryProcessor, impact_correction
 from tensorboardX import SummaryWriter
 from multiprocessing import Process,Queue,Pipe,connection
 from gym_carla.multi_lane.settings import ARGS
@@ -25,6 +26,7 @@ DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device('cp
 LR_ACTOR = 0.0002
 LR_CRITIC = 0.0002
 GAMMA = 0.9  # q值更新系数
+N_STEP = 1  # n-step returns, the learner bootstraps with GAMMA ** N_STEP
 TAU = 0.01  # 软更新参数
 EPSILON = 0.5  # epsilon-greedy
 BUFFER_SIZE = 160000
@@ -275,11 +277,11 @@ def process_safely_terminate(process: list):
 
 #Queue vesion multiprocess
 def learner_mp(traj_q: Queue, agent_q:Queue, agent_param):
-    learner_agent=P_DQN(deepcopy(agent_param[0]), agent_param[1], agent_param[2], GAMMA, TAU, SIGMA_STEER, SIGMA, SIGMA_ACC, THETA, EPSILON, BUFFER_SIZE, BATCH_SIZE, LR_ACTOR,
+    learner_agent=P_DQN(deepcopy(agent_param[0]), agent_param[1], agent_param[2], GAMMA ** N_STEP, TAU, SIGMA_STEER, SIGMA, SIGMA_ACC, THETA, EPSILON, BUFFER_SIZE, BATCH_SIZE, LR_ACTOR,
                      LR_CRITIC, clip_grad, zero_index_gradients, inverting_gradients,PER_FLAG, DEVICE)
     temp_agent=P_DQN(deepcopy(agent_param[0]), agent_param[1], agent_param[2], GAMMA, TAU, SIGMA_STEER, SIGMA, SIGMA_ACC, THETA, EPSILON, BUFFER_SIZE, BATCH_SIZE, LR_ACTOR,
                      LR_CRITIC, clip_grad, zero_index_gradients, inverting_gradients,PER_FLAG, torch.device('cpu'))
-    impact_deque=deque(maxlen=2)
+    processor=TrajectoryProcessor(GAMMA, N_STEP, correction=impact_correction)
     pid=os.getpid()
     actor,actor_t,critic,critic_t=None,None,None,None
     a,a_t,c,c_t=None,None,None,None
@@ -288,15 +290,19 @@ def learner_mp(traj_q: Queue, agent_q:Queue, agent_param):
         #reference: https://zhuanlan.zhihu.com/p/345353294, https://arxiv.org/abs/1711.00489
         k=max(learner_agent.replay_buffer.size()//MINIMAL_SIZE, 1)
         learner_agent.batch_size=k*BATCH_SIZE
+        chunk=[]
         for _ in range(BATCH_SIZE):
             trajectory=traj_q.get(block=True,timeout=None)
             state, next_state, action, saved_action_param, reward, truncated, done, info=trajectory[0],trajectory[1],trajectory[2],trajectory[3],\
                     trajectory[4],trajectory[5],trajectory[6],trajectory[7]
-            replay_buffer_adder(learner_agent,impact_deque,state,next_state, action,saved_action_param,reward,truncated,done,info)        
+            if 'Throttle' in info:
+                chunk.append((state, action, saved_action_param, reward, next_state, truncated, done, info))
+        # impact of the next step and n-step returns over the whole chunk, there is a single worker stream
+        learner_agent.store_transitions(processor.process(0, chunk))
         if learner_agent.replay_buffer.size()>=MINIMAL_SIZE:
             logging.info("LEARN BEGIN")
             #print(f"LEARN TIME:{learner_agent.learn_time}")
-            [learner_agent.learn() for _ in range(k)]
+            learner_agent.learn_many(k)
             if not agent_q.full():
                 actor=deepcopy(learner_agent.actor).to('cpu')
                 actor_t=deepcopy(learner_agent.actor_target).to('cpu')
@@ -311,46 +317,6 @@ def learner_mp(traj_q: Queue, agent_q:Queue, agent_param):
                 agent_q.put((actor,critic,learner_agent.learn_time),block=True,timeout=None)
                 #agent_q.put((temp_agent,learner_agent.learn_time),block=True,timeout=None)
 
-def replay_buffer_adder(agent,impact_deque, state, next_state, action, saved_action_param,reward, truncated, done, info):
-    """Input all the state info into agent's replay buffer"""
-    if 'Throttle' in info:
-        if info['control_state']:
-            # under rl control
-            if truncated:
-                agent.store_transition(state, action, saved_action_param, reward, next_state,
-                                    truncated, done, info)
-            else:
-                impact = info['impact'] / 9
-                impact_deque.append([state, action, saved_action_param, reward, next_state,
-                                        truncated, done, info])
-                if len(impact_deque) == 2:
-                    experience = impact_deque[0]
-                    agent.store_transition(experience[0], experience[1], experience[2],
-                                            experience[3] + impact, experience[4], experience[5],
-                                            experience[6], experience[7])
-                # agent.replay_buffer.add(state, action, saved_action_param, reward, next_state,
-                #                         truncated, done, info)
-        else:
-            # Input the guided action to replay buffer
-            if truncated:
-                agent.store_transition(state,action,saved_action_param,reward,next_state,
-                    truncated,done,info)
-            else:
-                impact = info['impact'] / 9
-                impact_deque.append([state, action, saved_action_param, reward, next_state,
-                                        truncated, done, info])
-                if len(impact_deque) == 2:
-                    experience = impact_deque[0]
-                    agent.store_transition(experience[0], experience[1], experience[2],
-                                            experience[3] + impact, experience[4], experience[5],
-                                            experience[6], experience[7])
-                # agent.replay_buffer.add(state, action, saved_action_param, reward, next_state,
-                #                         truncated, done, info)
-    # else:
-    #     # not work
-    #     # Input the agent action to replay buffer
-    #     agent.replay_buffer.add(state, action, all_action_param, reward, next_state, truncated, done, info)
-
 if __name__ == '__main__':
     try:
         start_process()
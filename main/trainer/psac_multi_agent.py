@@ -1,4 +1,5 @@
 import torch
+import queue
 import logging
 import datetime,time, os
 import gym, macad_gym
@@ -43,6 +44,12 @@ AGENT_PARAM = {
     "minimal_size": 10000,
     "batch_size": 128,
     "per_flag": True,
+    "fused_encoder": False, # run the three lane encoders as one batched module, loads either checkpoint layout
+    "target_update_every": 1,   # soft update the target networks every N learner updates
+    "amp": False,   # learner trains under autocast, float16 + GradScaler on a GPU, bfloat16 on the CPU
+    "compile": False,   # learner networks go through torch.compile
+    "learn_many": False,    # k updates of batch_size per learner step instead of one update of k * batch_size
+    "traj_chunk": 32,   # workers send their transitions to the learner in chunks of this many
     "device": torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu'),
     "lr_actor": 0.0002,
     "lr_critic": 0.0002,
@@ -72,10 +79,12 @@ def main():
                         param["tau"], param["buffer_size"], param["batch_size"], 
                         param["lr_actor"], param["lr_critic"], param["lr_alpha"],
                         param["clip_grad"], param["zero_index_gradients"],
-                        param["inverting_gradients"], param["per_flag"], param["device"])
+                        param["inverting_gradients"], param["per_flag"], param["device"],
+                        fused_encoder=param["fused_encoder"], target_update_every=param["target_update_every"])
     if TRAIN and os.path.exists(MODEL_PATH):
         # load pre-trained model
         learner.load_net(MODEL_PATH, map_location=learner.device)
+    learner.set_performance_mode(amp=param["amp"], compile=param["compile"])
 
     process = list()
     #worker_lock = Lock()
@@ -127,19 +136,24 @@ def main():
             #reference: https://zhuanlan.zhihu.com/p/345353294, https://arxiv.org/abs/1711.00489
             k = max(learner.replay_buffer.size()// param["minimal_size"], 1)
             learner.batch_size = k * param["batch_size"]
-            if traj_q.qsize() >= learner.batch_size // 10:
-                for _ in range(learner.batch_size // 10):
-                    trajectory=traj_q.get(block=True,timeout=None)
-                    state, next_state, action, saved_action_param, reward, done, truncated, info, offset, eval \
-                        = trajectory[0], trajectory[1], trajectory[2], trajectory[3], trajectory[4], \
-                        trajectory[5], trajectory[6], trajectory[7], trajectory[8], trajectory[9]
-                    if eval:
-                        episode_offset = offset
-
-                    learner.store_transition(state, action, saved_action_param, reward, next_state,
-                                            truncated, done, info)   
+            # drain the chunks sent so far, bounded like the single transitions drained before
+            chunks, drained = [], 0
+            while drained < learner.batch_size // 10:
+                try:
+                    chunk, offset, eval = traj_q.get_nowait()
+                except queue.Empty:
+                    break
+                if eval:
+                    episode_offset = offset
+                chunks.append(chunk)
+                drained += len(chunk[0])
+            if chunks:
+                learner.store_transitions([np.concatenate(column) for column in zip(*chunks)])
             if TRAIN and learner.replay_buffer.size()>=param["minimal_size"]:
-                q_loss = learner.learn()
+                if param["learn_many"]:
+                    q_loss = learner.learn_many(k, param["batch_size"]).mean()
+                else:
+                    q_loss = learner.learn()
                 worker_update_count += 1
                 eval_update_count += 1
                 # if not worker_agent_q.full() and worker_update_count//UPDATE_FREQ > 0:
@@ -152,7 +166,7 @@ def main():
                 if not eval_agent_q.full() and eval_update_count//(UPDATE_FREQ * 2) > 0:
                     eval_lock.acquire()
                     eval_agent_q.put((deepcopy(learner.learn_time), deepcopy(q_loss)), block=True, timeout=None)
-                    learner.save_net(os.path.join(SAVE_PATH, 'eval.pth'))
+                    learner.save_policy(os.path.join(SAVE_PATH, 'eval.pth'))
                     eval_lock.release()
                     eval_update_count %= UPDATE_FREQ * 2
 
@@ -193,7 +207,8 @@ def worker_mp(lock:Lock, traj_q:Queue, agent_q:Queue, agent_param:dict, episode_
                         param["tau"], param["buffer_size"], param["batch_size"], 
                         param["lr_actor"], param["lr_critic"], param["lr_alpha"],
                         param["clip_grad"], param["zero_index_gradients"],
-                        param["inverting_gradients"], param["per_flag"], param["device"])
+                        param["inverting_gradients"], param["per_flag"], param["device"],
+                        fused_encoder=param["fused_encoder"], target_update_every=param["target_update_every"])
     if TRAIN and os.path.exists(MODEL_PATH):
         worker.load_net(MODEL_PATH, map_location=worker.device)
 
@@ -210,6 +225,15 @@ def worker_mp(lock:Lock, traj_q:Queue, agent_q:Queue, agent_param:dict, episode_
     losses_episode = []
     total_reward, avg_reward = {}, {}
     ttc, efficiency, comfort, lcen, lane_change_reward = {}, {}, {}, {}, {}  # part objective scores
+    chunk = []  # transitions not sent to the learner yet
+
+    def send_chunk():
+        try:
+            # XXX Do not set timeout=None here, otherwise the process might end in a perpetual blocked state.
+            traj_q.put_nowait((worker.stack_transitions(tuple(zip(*chunk))), episodes, eval))
+        except queue.Full as e:
+            LOG.rl_trainer_logger.exception(f"PSAC {'evaluator' if eval else 'worker'} put traj to full traj_q, {e.args}")
+        chunk.clear()
 
     try:
         for i in range(TOTAL_EPISODE//1000):
@@ -239,9 +263,10 @@ def worker_mp(lock:Lock, traj_q:Queue, agent_q:Queue, agent_param:dict, episode_
                                     LOG.rl_trainer_logger.info(f"PSAC LEARN TIME:{learn_time}, Q_loss:{q_loss}")
                                     losses_episode.append(q_loss)
 
+                            # one forward pass for all the actors of the scenario
+                            results = worker.take_action_batch({actor_id: states[actor_id][1] for actor_id in states.keys()})
                             for actor_id in states.keys():
-                                actions[actor_id], action_params[actor_id], all_action_params[actor_id
-                                                        ] = worker.take_action(states[actor_id][1])
+                                actions[actor_id], action_params[actor_id], all_action_params[actor_id] = results[actor_id]
                                 action_dict[actor_id]={
                                     "action_index": actions[actor_id], "action_param": action_params[actor_id]}
                                 
@@ -275,8 +300,10 @@ def worker_mp(lock:Lock, traj_q:Queue, agent_q:Queue, agent_param:dict, episode_
                                     LOG.rl_trainer_logger.debug(
                                         f"\nPSAC Control In Replay Buffer: actor_id: {actor_id} action: {action}, action_parameter: {saved_action_param}")
 
-                                    traj_q.put((state, next_state, action, saved_action_param,
-                                            reward, done, truncated, info, episodes, eval), block=True, timeout=None)
+                                    chunk.append((state, action, saved_action_param, reward, next_state,
+                                                  truncated, done, info))
+                                    if len(chunk) >= param["traj_chunk"]:
+                                        send_chunk()
                                     
                                     LOG.rl_trainer_logger.debug(
                                         f"PSAC\n"
@@ -305,7 +332,9 @@ def worker_mp(lock:Lock, traj_q:Queue, agent_q:Queue, agent_param:dict, episode_
                             #only record the first vehicle reward
                             if env.unwrapped._total_steps == env.unwrapped.pre_train_steps:
                                 worker.save_net(os.path.join(save_path, 'ipdqn_pre_trained.pth'))
-                                            
+
+                        if chunk:
+                            send_chunk()
                         if done or truncated:
                             # restart the training
                             done = False
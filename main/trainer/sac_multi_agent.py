@@ -22,6 +22,7 @@ from macad_gym.viz.logger import Logger
 from macad_gym.core.simulator.carla_provider import CarlaError
 from macad_gym.core.utils.wrapper import (SpeedState, Truncated)
 from algs.sac_multi_lane import SACContinuous
+from algs.util.replay_buffer import open_or_persist, ReplayFlusher
 os.environ['PYTHONWARNINGS'] = 'ignore:semaphore_tracker:UserWarning'
 
 # neural network hyper parameters
@@ -43,6 +44,8 @@ AGENT_PARAM = {
     "minimal_size": 10000,
     "batch_size": 256,
     "per_flag": True,
+    "persist_replay": False, # keep the replay buffer in .npy files under REPLAY_PATH, a restarted learner reopens it
+    "traj_chunk": 32,   # workers send their transitions to the learner in chunks of this many
     "device": torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu'),
     "lr_actor": 0.0002,
     "lr_critic": 0.0002,
@@ -54,6 +57,7 @@ TRAIN = True
 UPDATE_FREQ = 500
 WORKER_NUMBER = 3
 MODEL_PATH = os.path.join(os.getcwd(), 'out', 'model_params', 'sac_ma_net_params.pth')
+REPLAY_PATH = os.path.join(os.getcwd(), 'out', 'replay', 'sac_ma')
 
 def main():
     SAVE_PATH = os.path.join(os.getcwd(), 'out', 'multi_agent', 'sac', 
@@ -73,6 +77,11 @@ def main():
     if TRAIN and os.path.exists(MODEL_PATH):
         # load pre-trained model
         learner.load_net(MODEL_PATH, map_location=learner.device)
+    flusher = None
+    if TRAIN and param["persist_replay"]:
+        # resume from the transitions of the previous run instead of collecting minimal_size again
+        learner.replay_buffer = open_or_persist(learner.replay_buffer, REPLAY_PATH)
+        flusher = ReplayFlusher(learner.replay_buffer).start()
 
     process = list()
     worker_proc, eval_proc = [None for i in range(WORKER_NUMBER)], None
@@ -133,18 +142,19 @@ def main():
             #reference: https://zhuanlan.zhihu.com/p/345353294, https://arxiv.org/abs/1711.00489
             k = max(learner.replay_buffer.size()// param["minimal_size"], 1)
             learner.batch_size = k * param["batch_size"]
-            for i in range(WORKER_NUMBER + 1):
-                if traj_q.qsize() >= learner.batch_size // (WORKER_NUMBER * 2):
-                    for _ in range(learner.batch_size // (WORKER_NUMBER * 2)):
-                        trajectory=traj_q.get(block=True,timeout=None)
-                        state, next_state, action, reward, done, truncated, info, offset, eval= \
-                            trajectory[0], trajectory[1], trajectory[2], trajectory[3], \
-                            trajectory[4], trajectory[5], trajectory[6], trajectory[7], trajectory[8]
-                        if eval:
-                            episode_offset = offset
-
-                        learner.store_transition(state, action, reward, next_state,
-                                                truncated, done, info)       
+            # drain the chunks sent so far, bounded like the single transitions drained before
+            chunks, drained = [], 0
+            while drained < learner.batch_size // (WORKER_NUMBER * 2) * (WORKER_NUMBER + 1):
+                try:
+                    chunk, offset, eval = traj_q.get_nowait()
+                except queue.Empty:
+                    break
+                if eval:
+                    episode_offset = offset
+                chunks.append(chunk)
+                drained += len(chunk[0])
+            if chunks:
+                learner.store_transitions([np.concatenate(column) for column in zip(*chunks)])
             if TRAIN and learner.replay_buffer.size()>=param["minimal_size"]:
                 q_loss = learner.learn()
                 worker_update_count += 1
@@ -191,6 +201,8 @@ def main():
         [p.join() for p in process]
         episode_writer.close()
         manager.shutdown()
+        if flusher is not None:
+            flusher.stop()
         learner.save_net(os.path.join(SAVE_PATH, 'isac_final.pth'))
         logger.info('\nDone.')
 
@@ -232,6 +244,15 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
     losses_episode = []
     total_reward, avg_reward = {}, {}
     ttc, efficiency, comfort, lcen, lane_change_reward = {}, {}, {}, {}, {}  # part objective scores
+    chunk = []  # transitions not sent to the learner yet
+
+    def send_chunk():
+        try:
+            # XXX Do not set timeout=None here, otherwise the process might end in a perpetual blocked state.
+            traj_q.put_nowait((worker.stack_transitions(tuple(zip(*chunk))), episodes, eval))
+        except queue.Full as e:
+            logger.exception(f"SAC {'evaluator' if eval else 'worker_'+str(index)} put traj to full traj_q, {e.args}")
+        chunk.clear()
 
     try:
         for i in range(TOTAL_EPISODE//500):
@@ -264,8 +285,8 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                                 env.log(f"SAC LEARN TIME:{learn_time}, Q_loss:{q_loss}", "INFO")
                                 losses_episode.append(q_loss)
 
-                        for actor_id in states.keys():
-                            actions[actor_id] = worker.take_action(states[actor_id][1])
+                        # one forward pass for all the actors of the scenario
+                        actions = worker.take_action_batch({actor_id: states[actor_id][1] for actor_id in states.keys()})
                             
                         next_states, rewards, dones, truncateds, infos = env.step(actions)
                         for actor_id in next_states.keys():
@@ -290,13 +311,9 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                                 env.log(
                                     f"\nSAC Control In Replay Buffer: actor_id: {actor_id} action: {action}", "DEBUG")
                                 
-                                try:
-                                    # XXX Do not set timeout=None here, otherwise the process might end in a perpetual blocked state.
-                                    traj_q.put_nowait((state, next_state, action, reward, done, 
-                                                       truncated, info, episodes, eval))
-                                except queue.Full as e:
-                                    logger.exception(f"SAC {'evaluator' if eval else 'worker_'+str(index)} put traj to full traj_q, {e.args}")
-                                    continue
+                                chunk.append((state, action, reward, next_state, truncated, done, info))
+                                if len(chunk) >= param["traj_chunk"]:
+                                    send_chunk()
                                 
                                 env.log(
                                     f"SAC\n"
@@ -325,6 +342,8 @@ def worker_mp(traj_q:queue.Queue, agent_q:queue.Queue, param:dict, episode_offse
                         if env.unwrapped._total_steps == env.unwrapped.pre_train_steps:
                             worker.save_net(os.path.join(save_path, 'isac_pre_trained.pth'))
                     
+                    if chunk:
+                        send_chunk()
                     if done or truncated:
                         # restart the training
                         done = False
@@ -0,0 +1,30 @@
+"""
+Offline stand-in for the CARLA 0.9.14 Python API.
+
+Implements the subset of carla.Client / World / Map / Waypoint / Vehicle / TrafficManager the
+envs in gym_carla and macad_gym call, on a synthetic three lane highway loop with kinematic
+vehicle dynamics and no rendering, so env loops can be run, profiled and benchmarked without
+a CARLA server. install() registers it as the carla module:
+
+    import mock_carla
+    mock_carla.install()
+    import carla    # the mock from here on
+"""
+import sys
+from mock_carla import command
+from mock_carla.geometry import Vector2D, Vector3D, Location, Rotation, Transform, BoundingBox, Color, GeoLocation
+from mock_carla.map import (LaneType, LaneChange, LaneMarkingType, LaneMarkingColor, LaneMarking, Waypoint, Map)
+from mock_carla.world import (TrafficLightState, CityObjectLabel, MapLayer, AttachmentType, ColorConverter,
+                              VehicleLightState, VehicleControl, WalkerControl, WeatherParameters, WorldSettings,
+                              Timestamp, ActorAttribute, ActorBlueprint, BlueprintLibrary, Actor, Vehicle, Sensor,
+                              CollisionEvent, LaneInvasionEvent, ActorList, ActorSnapshot, WorldSnapshot, DebugHelper,
+                              World)
+from mock_carla.client import Client, TrafficManager
+
+
+def install():
+    """Make `import carla` return this module, call it before anything imports carla"""
+    module = sys.modules[__name__]
+    sys.modules['carla'] = module
+    sys.modules['carla.command'] = command
+    return module
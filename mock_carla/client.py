@@ -0,0 +1,164 @@
+import os
+from mock_carla import command
+from mock_carla.map import SPEED_LIMIT
+from mock_carla.world import World, MapLayer
+
+VERSION = '0.9.14'
+DEFAULT_MAP = 'Town05'
+AVAILABLE_MAPS = ('Town05', 'Town05_Opt')
+
+# one simulated server per port, shared by every client connecting to it like the real one
+_servers = {}
+
+
+class _Server:
+    def __init__(self) -> None:
+        self.world = None
+        self.traffic_managers = {}
+
+
+class Client:
+    def __init__(self, host='127.0.0.1', port=2000, worker_threads=0) -> None:
+        self.host = host
+        self.port = port
+        self._server = _servers.setdefault(port, _Server())
+
+    def set_timeout(self, seconds):
+        pass
+
+    def get_server_version(self):
+        return VERSION
+
+    def get_client_version(self):
+        return VERSION
+
+    def get_available_maps(self):
+        return [f'/Game/Carla/Maps/{name}' for name in AVAILABLE_MAPS]
+
+    def get_world(self):
+        if self._server.world is None:
+            self.load_world(DEFAULT_MAP)
+        return self._server.world
+
+    def load_world(self, map_name, reset_settings=True, map_layers=MapLayer.All):
+        # every map name loads the same synthetic highway loop
+        name = os.path.basename(map_name)
+        previous = self._server.world
+        settings = None if reset_settings or previous is None else previous.get_settings()
+        self._server.world = World(f'Carla/Maps/{name}', settings)
+        return self._server.world
+
+    def reload_world(self, reset_settings=True):
+        return self.load_world(self.get_world().get_map().name, reset_settings)
+
+    def get_trafficmanager(self, client_connection=8000):
+        managers = self._server.traffic_managers
+        if client_connection not in managers:
+            managers[client_connection] = TrafficManager(self, client_connection)
+        return managers[client_connection]
+
+    def apply_batch(self, commands):
+        world = self.get_world()
+        for batch_command in commands:
+            command.execute(world, batch_command)
+
+    def apply_batch_sync(self, commands, due_tick_cue=False):
+        world = self.get_world()
+        responses = [command.execute(world, batch_command) for batch_command in commands]
+        if due_tick_cue:
+            world.tick()
+        return responses
+
+
+class TrafficManager:
+    """
+    Traffic manager settings of the simulated autopilot. Target speed and distance to the
+    leading vehicle drive the autopilot, lane change, routing, light and sign settings are
+    accepted and ignored since the autopilot keeps its lane on a map without traffic lights.
+    """
+
+    def __init__(self, client, port) -> None:
+        self._client = client
+        self._port = port
+
+    @property
+    def _world(self):
+        return self._client.get_world()
+
+    def get_port(self):
+        return self._port
+
+    def global_percentage_speed_difference(self, percentage):
+        self._world._tm_speed_difference = float(percentage)
+
+    def vehicle_percentage_speed_difference(self, actor, percentage):
+        self._world._speed_difference[actor.slot] = float(percentage)
+
+    def set_desired_speed(self, actor, speed):
+        self._world._speed_difference[actor.slot] = (1. - speed / SPEED_LIMIT) * 100.
+
+    def set_global_distance_to_leading_vehicle(self, distance):
+        self._world._tm_distance = float(distance)
+
+    def distance_to_leading_vehicle(self, actor, distance):
+        self._world._distance[actor.slot] = float(distance)
+
+    def set_synchronous_mode(self, mode=True):
+        pass
+
+    def set_hybrid_physics_mode(self, enabled=False):
+        pass
+
+    def set_hybrid_physics_radius(self, r=50.0):
+        pass
+
+    def set_random_device_seed(self, value):
+        pass
+
+    def set_respawn_dormant_vehicles(self, mode_switch=True):
+        pass
+
+    def set_boundaries_respawn_dormant_vehicles(self, lower_bound=25.0, upper_bound=100.0):
+        pass
+
+    def set_osm_mode(self, mode_switch=True):
+        pass
+
+    def auto_lane_change(self, actor, enable):
+        pass
+
+    def force_lane_change(self, actor, direction):
+        pass
+
+    def random_left_lanechange_percentage(self, actor, percentage):
+        pass
+
+    def random_right_lanechange_percentage(self, actor, percentage):
+        pass
+
+    def keep_right_rule_percentage(self, actor, perc):
+        pass
+
+    def ignore_lights_percentage(self, actor, perc):
+        pass
+
+    def ignore_signs_percentage(self, actor, perc):
+        pass
+
+    def ignore_walkers_percentage(self, actor, perc):
+        pass
+
+    def ignore_vehicles_percentage(self, actor, perc):
+        pass
+
+    def set_route(self, actor, path):
+        pass
+
+    def set_path(self, actor, path):
+        pass
+
+    def update_vehicle_lights(self, actor, do_update):
+        pass
+
+    def shut_down(self):
+        self._client._server.traffic_managers.pop(self._port, None)
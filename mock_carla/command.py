@@ -0,0 +1,105 @@
+"""Batch commands of carla.command, executed by Client.apply_batch / apply_batch_sync"""
+
+FutureActor = 0     # placeholder for the actor spawned by the enclosing SpawnActor
+
+
+class Command:
+    def __init__(self) -> None:
+        self.chained = []
+
+    def then(self, command):
+        self.chained.append(command)
+        return self
+
+
+class SpawnActor(Command):
+    def __init__(self, blueprint, transform, parent=None) -> None:
+        super().__init__()
+        self.blueprint = blueprint
+        self.transform = transform
+        self.parent_id = parent.id if hasattr(parent, 'id') else parent
+
+
+class DestroyActor(Command):
+    def __init__(self, actor) -> None:
+        super().__init__()
+        self.actor_id = getattr(actor, 'id', actor)
+
+
+class SetAutopilot(Command):
+    def __init__(self, actor, enabled, tm_port=8000) -> None:
+        super().__init__()
+        self.actor_id = getattr(actor, 'id', actor)
+        self.enabled = enabled
+        self.tm_port = tm_port
+
+
+class ApplyVehicleControl(Command):
+    def __init__(self, actor, control) -> None:
+        super().__init__()
+        self.actor_id = getattr(actor, 'id', actor)
+        self.control = control
+
+
+class ApplyTransform(Command):
+    def __init__(self, actor, transform) -> None:
+        super().__init__()
+        self.actor_id = getattr(actor, 'id', actor)
+        self.transform = transform
+
+
+class ApplyTargetVelocity(Command):
+    def __init__(self, actor, velocity) -> None:
+        super().__init__()
+        self.actor_id = getattr(actor, 'id', actor)
+        self.velocity = velocity
+
+
+class SetSimulatePhysics(Command):
+    def __init__(self, actor, enabled) -> None:
+        super().__init__()
+        self.actor_id = getattr(actor, 'id', actor)
+        self.enabled = enabled
+
+
+class Response:
+    def __init__(self, actor_id=0, error='') -> None:
+        self.actor_id = actor_id
+        self.error = error
+
+    def has_error(self):
+        return bool(self.error)
+
+
+def execute(world, command, future_id=FutureActor):
+    """Run one command and its chained ones on world, return the Response"""
+    if isinstance(command, SpawnActor):
+        parent = None if command.parent_id is None else world.get_actor(command.parent_id)
+        try:
+            actor = world.spawn_actor(command.blueprint, command.transform, attach_to=parent)
+        except RuntimeError as e:
+            return Response(error=str(e))
+        response = Response(actor.id)
+    else:
+        actor_id = future_id if command.actor_id == FutureActor else command.actor_id
+        actor = world.get_actor(actor_id)
+        if actor is None:
+            return Response(actor_id, f"actor {actor_id} not found")
+        if isinstance(command, DestroyActor):
+            actor.destroy()
+        elif isinstance(command, SetAutopilot):
+            actor.set_autopilot(command.enabled, command.tm_port)
+        elif isinstance(command, ApplyVehicleControl):
+            actor.apply_control(command.control)
+        elif isinstance(command, ApplyTransform):
+            actor.set_transform(command.transform)
+        elif isinstance(command, ApplyTargetVelocity):
+            actor.set_target_velocity(command.velocity)
+        elif isinstance(command, SetSimulatePhysics):
+            actor.set_simulate_physics(command.enabled)
+        response = Response(actor_id)
+    for chained in command.chained:
+        result = execute(world, chained, response.actor_id)
+        if result.has_error():
+            return Response(response.actor_id, result.error)
+    return response
@@ -0,0 +1,213 @@
+import math
+
+
+class Vector3D:
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0.0, y=0.0, z=0.0) -> None:
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return self.__class__(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return self.__class__(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k):
+        return self.__class__(self.x * k, self.y * k, self.z * k)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, k):
+        return self.__class__(self.x / k, self.y / k, self.z / k)
+
+    def __neg__(self):
+        return self.__class__(-self.x, -self.y, -self.z)
+
+    def __eq__(self, other):
+        return isinstance(other, Vector3D) and self.x == other.x and self.y == other.y and self.z == other.z
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __abs__(self):
+        return self.__class__(abs(self.x), abs(self.y), abs(self.z))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(x={self.x:.6f}, y={self.y:.6f}, z={self.z:.6f})"
+
+    def length(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def squared_length(self):
+        return self.x * self.x + self.y * self.y + self.z * self.z
+
+    def make_unit_vector(self):
+        length = self.length()
+        if length == 0.:
+            return self.__class__()
+        return self / length
+
+    def dot(self, other):
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+    def dot_2d(self, other):
+        return self.x * other.x + self.y * other.y
+
+    def cross(self, other):
+        return self.__class__(self.y * other.z - self.z * other.y,
+                              self.z * other.x - self.x * other.z,
+                              self.x * other.y - self.y * other.x)
+
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+    def distance_squared(self, other):
+        return (self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2
+
+    def distance_2d(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2)
+
+    def get_vector_angle(self, other):
+        norm = self.length() * other.length()
+        if norm == 0.:
+            return 0.
+        return math.acos(max(-1., min(1., self.dot(other) / norm)))
+
+
+class Location(Vector3D):
+    __slots__ = ()
+
+
+class Vector2D:
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x=0.0, y=0.0) -> None:
+        self.x = float(x)
+        self.y = float(y)
+
+    def length(self):
+        return math.hypot(self.x, self.y)
+
+    def __repr__(self):
+        return f"Vector2D(x={self.x:.6f}, y={self.y:.6f})"
+
+
+class Rotation:
+    """Euler angles in degrees, CARLA's (pitch, yaw, roll) order"""
+    __slots__ = ('pitch', 'yaw', 'roll')
+
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0) -> None:
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def __eq__(self, other):
+        return isinstance(other, Rotation) and \
+            (self.pitch, self.yaw, self.roll) == (other.pitch, other.yaw, other.roll)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Rotation(pitch={self.pitch:.6f}, yaw={self.yaw:.6f}, roll={self.roll:.6f})"
+
+    def get_forward_vector(self):
+        cp, sp = math.cos(math.radians(self.pitch)), math.sin(math.radians(self.pitch))
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        return Vector3D(cp * cy, cp * sy, sp)
+
+    def get_right_vector(self):
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        cp, sp = math.cos(math.radians(self.pitch)), math.sin(math.radians(self.pitch))
+        cr, sr = math.cos(math.radians(self.roll)), math.sin(math.radians(self.roll))
+        return Vector3D(cy * sp * sr - sy * cr, sy * sp * sr + cy * cr, -cp * sr)
+
+    def get_up_vector(self):
+        cy, sy = math.cos(math.radians(self.yaw)), math.sin(math.radians(self.yaw))
+        cp, sp = math.cos(math.radians(self.pitch)), math.sin(math.radians(self.pitch))
+        cr, sr = math.cos(math.radians(self.roll)), math.sin(math.radians(self.roll))
+        return Vector3D(-cy * sp * cr - sy * sr, -sy * sp * cr + cy * sr, cp * cr)
+
+
+class Transform:
+    """Location and rotation, both copied on construction as the C++ value types are"""
+    __slots__ = ('location', 'rotation')
+
+    def __init__(self, location=None, rotation=None) -> None:
+        self.location = Location() if location is None else Location(location.x, location.y, location.z)
+        self.rotation = Rotation() if rotation is None else Rotation(rotation.pitch, rotation.yaw, rotation.roll)
+
+    def __eq__(self, other):
+        return isinstance(other, Transform) and self.location == other.location and self.rotation == other.rotation
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Transform({self.location}, {self.rotation})"
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+    def get_right_vector(self):
+        return self.rotation.get_right_vector()
+
+    def get_up_vector(self):
+        return self.rotation.get_up_vector()
+
+    def transform(self, in_point):
+        """Map a point from the local frame of this transform to the world frame"""
+        forward, right, up = self.get_forward_vector(), self.get_right_vector(), self.get_up_vector()
+        return Location(self.location.x + forward.x * in_point.x + right.x * in_point.y + up.x * in_point.z,
+                        self.location.y + forward.y * in_point.x + right.y * in_point.y + up.y * in_point.z,
+                        self.location.z + forward.z * in_point.x + right.z * in_point.y + up.z * in_point.z)
+
+    def inverse_transform(self, in_point):
+        """Map a point from the world frame to the local frame of this transform"""
+        delta = in_point - self.location
+        return Location(delta.dot(self.get_forward_vector()), delta.dot(self.get_right_vector()),
+                        delta.dot(self.get_up_vector()))
+
+    def get_matrix(self):
+        forward, right, up = self.get_forward_vector(), self.get_right_vector(), self.get_up_vector()
+        return [[forward.x, right.x, up.x, self.location.x],
+                [forward.y, right.y, up.y, self.location.y],
+                [forward.z, right.z, up.z, self.location.z],
+                [0., 0., 0., 1.]]
+
+
+class BoundingBox:
+    __slots__ = ('location', 'extent', 'rotation')
+
+    def __init__(self, location=None, extent=None) -> None:
+        self.location = Location() if location is None else Location(location.x, location.y, location.z)
+        self.extent = Vector3D() if extent is None else Vector3D(extent.x, extent.y, extent.z)
+        self.rotation = Rotation()
+
+    def __repr__(self):
+        return f"BoundingBox({self.location}, Extent({self.extent.x}, {self.extent.y}, {self.extent.z}))"
+
+    def get_local_vertices(self):
+        e = self.extent
+        return [self.location + Location(sx * e.x, sy * e.y, sz * e.z)
+                for sx in (-1, 1) for sy in (-1, 1) for sz in (-1, 1)]
+
+    def get_world_vertices(self, transform):
+        return [transform.transform(vertex) for vertex in self.get_local_vertices()]
+
+
+class Color:
+    __slots__ = ('r', 'g', 'b', 'a')
+
+    def __init__(self, r=0, g=0, b=0, a=255) -> None:
+        self.r, self.g, self.b, self.a = int(r), int(g), int(b), int(a)
+
+
+class GeoLocation:
+    __slots__ = ('latitude', 'longitude', 'altitude')
+
+    def __init__(self, latitude=0.0, longitude=0.0, altitude=0.0) -> None:
+        self.latitude, self.longitude, self.altitude = float(latitude), float(longitude), float(altitude)
@@ -0,0 +1,411 @@
+import math
+import enum
+import numpy as np
+from mock_carla.geometry import Location, Rotation, Transform
+
+
+class LaneType(enum.IntFlag):
+    NONE = 0x1
+    Driving = 0x2
+    Stop = 0x4
+    Shoulder = 0x8
+    Biking = 0x10
+    Sidewalk = 0x20
+    Border = 0x40
+    Restricted = 0x80
+    Parking = 0x100
+    Bidirectional = 0x200
+    Median = 0x400
+    Special1 = 0x800
+    Special2 = 0x1000
+    Special3 = 0x2000
+    RoadWorks = 0x4000
+    Tram = 0x8000
+    Rail = 0x10000
+    Entry = 0x20000
+    Exit = 0x40000
+    OffRamp = 0x80000
+    OnRamp = 0x100000
+    Any = 0xFFFFFFFE
+
+
+class LaneChange(enum.IntFlag):
+    NONE = 0
+    Right = 1
+    Left = 2
+    Both = 3
+
+
+class LaneMarkingType(enum.IntEnum):
+    NONE = 0
+    Other = 1
+    Broken = 2
+    Solid = 3
+    SolidSolid = 4
+    SolidBroken = 5
+    BrokenSolid = 6
+    BrokenBroken = 7
+    BottsDots = 8
+    Grass = 9
+    Curb = 10
+
+
+class LaneMarkingColor(enum.IntEnum):
+    Standard = 0
+    White = 0
+    Blue = 1
+    Green = 2
+    Red = 3
+    Yellow = 4
+    Other = 5
+
+
+class LaneMarking:
+    __slots__ = ('type', 'color', 'lane_change', 'width')
+
+    def __init__(self, type, color=LaneMarkingColor.White, lane_change=LaneChange.NONE, width=0.15) -> None:
+        self.type = type
+        self.color = color
+        self.lane_change = lane_change
+        self.width = width
+
+
+class Lane:
+    """One lane of the cross section shared by all roads, inner/outer are its edges as offsets to the right of the reference line"""
+
+    def __init__(self, index, lane_id, lane_type, width, inner, lane_change, left_marking, right_marking) -> None:
+        self.index = index
+        self.id = lane_id
+        self.type = lane_type
+        self.mask = int(lane_type)
+        self.width = width
+        self.inner = inner
+        self.outer = inner + width
+        self.offset = inner + width / 2
+        self.lane_change = lane_change
+        self.left_marking = left_marking
+        self.right_marking = right_marking
+
+
+# lane id, type and width from the reference line to the outside, the three driving lanes of the Town05 highway
+CROSS_SECTION = ((-1, LaneType.Driving, 3.5), (-2, LaneType.Driving, 3.5), (-3, LaneType.Driving, 3.5),
+                 (-4, LaneType.Shoulder, 1.5), (-5, LaneType.Sidewalk, 3.0))
+# road id, length and turning radius (None for a straight) in driving order, the road ids are the route of settings.py
+HIGHWAY_LOOP = ((12, 200., None), (37, 120 * math.pi / 180 * 60., 60.), (35, 200., None),
+                (38, 120 * math.pi / 180 * 60., 60.), (36, 200., None), (34, 120 * math.pi / 180 * 60., 60.))
+SPEED_LIMIT = 30.       # km/h, CARLA's default for roads without a speed sign
+SPAWN_SPACING = 20.     # m between two spawn points of a lane
+
+
+def _build_lanes(cross_section):
+    lanes, inner = [], 0.
+    driving = [i for i, (_, lane_type, _) in enumerate(cross_section) if lane_type == LaneType.Driving]
+    for i, (lane_id, lane_type, width) in enumerate(cross_section):
+        if lane_type == LaneType.Driving:
+            lane_change = (LaneChange.Left if i > driving[0] else LaneChange.NONE) | \
+                (LaneChange.Right if i < driving[-1] else LaneChange.NONE)
+            left = LaneMarking(LaneMarkingType.Broken if i > driving[0] else LaneMarkingType.Solid,
+                               LaneMarkingColor.White if i > driving[0] else LaneMarkingColor.Yellow,
+                               LaneChange.Both if i > driving[0] else LaneChange.NONE)
+            right = LaneMarking(LaneMarkingType.Broken if i < driving[-1] else LaneMarkingType.Solid,
+                                lane_change=LaneChange.Both if i < driving[-1] else LaneChange.NONE)
+        else:
+            lane_change = LaneChange.NONE
+            left = LaneMarking(LaneMarkingType.Solid if lane_type == LaneType.Shoulder else LaneMarkingType.Curb)
+            right = LaneMarking(LaneMarkingType.Curb if lane_type == LaneType.Shoulder else LaneMarkingType.NONE)
+        lanes.append(Lane(i, lane_id, lane_type, width, inner, lane_change, left, right))
+        inner += width
+    return lanes
+
+
+class Road:
+    """
+    A straight or a right turn of constant radius. Lanes lie on the right of the reference
+    line, s is measured along the reference line as in OpenDRIVE.
+    """
+
+    def __init__(self, road_id, index, x, y, yaw, length, radius=None) -> None:
+        self.id = road_id
+        self.index = index
+        self.x, self.y, self.yaw = x, y, yaw     # start of the reference line, yaw in radians
+        self.length = length
+        self.radius = radius
+        self.curvature = 0. if radius is None else 1. / radius
+        if radius is not None:
+            self.cx = x - math.sin(yaw) * radius
+            self.cy = y + math.cos(yaw) * radius
+        self.start = 0.     # s of the road start along the whole loop
+        self.next = None
+        self.previous = None
+
+    def point(self, s, t):
+        """Position and yaw (radians) at s along the reference line, t to its right"""
+        if self.radius is None:
+            c, si = math.cos(self.yaw), math.sin(self.yaw)
+            return self.x + s * c - t * si, self.y + s * si + t * c, self.yaw
+        yaw = self.yaw + s / self.radius
+        r = self.radius - t
+        return self.cx + r * math.sin(yaw), self.cy - r * math.cos(yaw), yaw
+
+    def project(self, x, y):
+        """(s, t) of a point, s may fall outside [0, length]"""
+        if self.radius is None:
+            dx, dy = x - self.x, y - self.y
+            c, si = math.cos(self.yaw), math.sin(self.yaw)
+            return dx * c + dy * si, dy * c - dx * si
+        vx, vy = x - self.cx, y - self.cy
+        angle = (math.atan2(vx, -vy) - self.yaw) % (2 * math.pi)
+        s = angle * self.radius
+        if s > self.length and 2 * math.pi * self.radius - s < s - self.length:
+            s -= 2 * math.pi * self.radius
+        return s, self.radius - math.hypot(vx, vy)
+
+    def end_point(self):
+        return self.point(self.length, 0.)
+
+
+class Waypoint:
+    """A lane center point, computed from (road, lane, s) on first access"""
+    __slots__ = ('_map', '_road', '_lane', 's', '_pose')
+
+    def __init__(self, map, road, lane, s) -> None:
+        self._map = map
+        self._road = road
+        self._lane = lane
+        self.s = s
+        self._pose = None
+
+    def __repr__(self):
+        return f"Waypoint(road_id={self.road_id}, lane_id={self.lane_id}, s={self.s:.3f})"
+
+    @property
+    def id(self):
+        return (self._road.id * 16 + self._lane.index) << 32 | int(round(self.s * 1000))
+
+    @property
+    def road_id(self):
+        return self._road.id
+
+    @property
+    def section_id(self):
+        return 0
+
+    @property
+    def lane_id(self):
+        return self._lane.id
+
+    @property
+    def lane_width(self):
+        return self._lane.width
+
+    @property
+    def lane_type(self):
+        return self._lane.type
+
+    @property
+    def lane_change(self):
+        return self._lane.lane_change
+
+    @property
+    def left_lane_marking(self):
+        return self._lane.left_marking
+
+    @property
+    def right_lane_marking(self):
+        return self._lane.right_marking
+
+    @property
+    def is_junction(self):
+        return False
+
+    @property
+    def is_intersection(self):
+        return False
+
+    @property
+    def junction_id(self):
+        return -1
+
+    @property
+    def transform(self):
+        if self._pose is None:
+            self._pose = self._road.point(self.s, self._lane.offset)
+        x, y, yaw = self._pose
+        return Transform(Location(x, y, 0.), Rotation(yaw=math.degrees(yaw)))
+
+    def next(self, distance):
+        road, s = self._map._advance(self._road, self.s, distance)
+        return [Waypoint(self._map, road, self._lane, s)]
+
+    def previous(self, distance):
+        road, s = self._map._advance(self._road, self.s, -distance)
+        return [Waypoint(self._map, road, self._lane, s)]
+
+    def next_until_lane_end(self, distance):
+        steps = np.arange(self.s + distance, self._road.length, distance)
+        return [Waypoint(self._map, self._road, self._lane, s) for s in steps] + \
+            [Waypoint(self._map, self._road, self._lane, self._road.length)]
+
+    def previous_until_lane_start(self, distance):
+        steps = np.arange(self.s - distance, 0., -distance)
+        return [Waypoint(self._map, self._road, self._lane, s) for s in steps] + \
+            [Waypoint(self._map, self._road, self._lane, 0.)]
+
+    def get_left_lane(self):
+        if self._lane.index == 0:
+            return None
+        return Waypoint(self._map, self._road, self._map.lanes[self._lane.index - 1], self.s)
+
+    def get_right_lane(self):
+        if self._lane.index + 1 == len(self._map.lanes):
+            return None
+        return Waypoint(self._map, self._road, self._map.lanes[self._lane.index + 1], self.s)
+
+    def get_landmarks(self, distance, stop_at_junction=False):
+        return []
+
+    def get_landmarks_of_type(self, distance, type, stop_at_junction=False):
+        return []
+
+    def get_junction(self):
+        return None
+
+
+class Map:
+    """
+    Synthetic stand-in for a CARLA map: a closed loop of one-way roads with the same cross
+    section. The default layout is a three lane highway loop made of the road ids the route
+    in gym_carla/multi_lane/settings.py is built from, with a shoulder and a sidewalk on the right.
+    """
+
+    def __init__(self, name, layout=HIGHWAY_LOOP, cross_section=CROSS_SECTION) -> None:
+        self.name = name
+        self.lanes = _build_lanes(cross_section)
+        self.driving_lanes = [lane for lane in self.lanes if lane.type == LaneType.Driving]
+        self.width = self.lanes[-1].outer
+        self.roads = []
+        x = y = yaw = start = 0.
+        for index, (road_id, length, radius) in enumerate(layout):
+            road = Road(road_id, index, x, y, yaw, length, radius)
+            road.start = start
+            self.roads.append(road)
+            x, y, yaw = road.end_point()
+            start += length
+        for road in self.roads:
+            road.next = self.roads[(road.index + 1) % len(self.roads)]
+            road.previous = self.roads[road.index - 1]
+        self.length = start
+        self._road_by_id = {road.id: road for road in self.roads}
+        self._lane_by_id = {lane.id: lane for lane in self.lanes}
+
+        # per road parameters for the vectorized evaluation of many points at once
+        self.road_starts = np.array([road.start for road in self.roads])
+        self._x = np.array([road.x for road in self.roads])
+        self._y = np.array([road.y for road in self.roads])
+        self._yaw = np.array([road.yaw for road in self.roads])
+        self._curve = np.array([road.radius is not None for road in self.roads])
+        self._radius = np.array([road.radius or 1. for road in self.roads])
+        self._cx = np.array([getattr(road, 'cx', 0.) for road in self.roads])
+        self._cy = np.array([getattr(road, 'cy', 0.) for road in self.roads])
+        self.curvature = np.array([road.curvature for road in self.roads])
+        self.lane_offsets = np.array([lane.offset for lane in self.lanes])
+
+    def __repr__(self):
+        return f"Map(name={self.name})"
+
+    def _advance(self, road, s, distance):
+        s += distance
+        while s > road.length:
+            s -= road.length
+            road = road.next
+        while s < 0.:
+            road = road.previous
+            s += road.length
+        return road, s
+
+    def _locate(self, x, y):
+        """Nearest road to a point, and the point's (s, t) on it with s clamped to the road"""
+        best = None
+        for road in self.roads:
+            s, t = road.project(x, y)
+            ds = max(0., -s, s - road.length)
+            dt = max(0., -t, t - self.width)
+            distance = ds * ds + dt * dt
+            if best is None or distance < best[0]:
+                best = (distance, road, s, t)
+                if distance == 0.:
+                    break
+        _, road, s, t = best
+        return road, min(max(s, 0.), road.length), t
+
+    def _lane_at(self, t, lane_type=LaneType.Driving, project_to_road=True):
+        mask = int(lane_type)   # plain int, IntFlag operators are slow
+        for lane in self.lanes:
+            if lane.inner <= t < lane.outer and lane.mask & mask:
+                return lane
+        if not project_to_road:
+            return None
+        candidates = [lane for lane in self.lanes if lane.mask & mask]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda lane: (max(0., lane.inner - t, t - lane.outer), abs(t - lane.offset)))
+
+    def _evaluate(self, road_index, s, t):
+        """Vectorized Road.point over arrays of road indices, s and t"""
+        yaw0 = self._yaw[road_index]
+        curve = self._curve[road_index]
+        radius = self._radius[road_index]
+        yaw = np.where(curve, yaw0 + s / radius, yaw0)
+        r = radius - t
+        x = np.where(curve, self._cx[road_index] + r * np.sin(yaw),
+                     self._x[road_index] + s * np.cos(yaw0) - t * np.sin(yaw0))
+        y = np.where(curve, self._cy[road_index] - r * np.cos(yaw),
+                     self._y[road_index] + s * np.sin(yaw0) + t * np.cos(yaw0))
+        return x, y, yaw
+
+    def _road_at(self, loop_s):
+        """Road index and road s of positions along the whole loop"""
+        road_index = np.searchsorted(self.road_starts, loop_s, side='right') - 1
+        return road_index, loop_s - self.road_starts[road_index]
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=LaneType.Driving):
+        road, s, t = self._locate(location.x, location.y)
+        lane = self._lane_at(t, lane_type, project_to_road)
+        if lane is None:
+            return None
+        return Waypoint(self, road, lane, s)
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        road, lane = self._road_by_id.get(road_id), self._lane_by_id.get(lane_id)
+        if road is None or lane is None or not 0. <= s <= road.length:
+            return None
+        return Waypoint(self, road, lane, s)
+
+    def get_topology(self):
+        """(entry, exit) pairs of every driving lane of every road, the exit is the successor's entry"""
+        return [(Waypoint(self, road, lane, 0.), Waypoint(self, road.next, lane, 0.))
+                for road in self.roads for lane in self.driving_lanes]
+
+    def generate_waypoints(self, distance):
+        return [Waypoint(self, road, lane, s) for road in self.roads for lane in self.driving_lanes
+                for s in np.arange(0., road.length, distance)]
+
+    def get_spawn_points(self):
+        """Every SPAWN_SPACING along the whole loop on each driving lane, slightly above the road"""
+        spawn_points = []
+        road_index, s = self._road_at(np.arange(0., self.length, SPAWN_SPACING))
+        for i, road_s in zip(road_index, s):
+            for lane in self.driving_lanes:
+                transform = Waypoint(self, self.roads[i], lane, road_s).transform
+                transform.location.z = 0.5
+                spawn_points.append(transform)
+        return spawn_points
+
+    def get_all_landmarks(self):
+        return []
+
+    def get_all_landmarks_of_type(self, type):
+        return []
+
+    def get_crosswalks(self):
+        return []
@@ -0,0 +1,1004 @@
+import math
+import enum
+import fnmatch
+import itertools
+import time
+import numpy as np
+from mock_carla.geometry import Vector3D, Location, Rotation, Transform, BoundingBox
+from mock_carla.map import Map, LaneType, SPEED_LIMIT
+
+DEFAULT_DELTA = 0.05                # s, simulation step when fixed_delta_seconds is not set
+MAX_ACCELERATION = 4.0              # m/s^2 at full throttle
+MAX_DECELERATION = 8.0              # m/s^2 at full brake
+ROLLING_RESISTANCE = 0.1            # m/s^2
+DRAG = 0.0011                       # 1/m, top speed of about 60 m/s at full throttle
+MAX_STEER_ANGLE = math.radians(70)  # front wheel angle at steer 1.0
+MAX_LATERAL_ACCELERATION = 8.0      # m/s^2, tire grip bounding the yaw rate
+IDM_ACCELERATION = 2.0              # m/s^2, autopilot comfortable acceleration
+IDM_DECELERATION = 3.0              # m/s^2, autopilot comfortable deceleration
+IDM_HEADWAY = 1.0                   # s, autopilot time gap to the leading vehicle
+OFF_ROAD_MARGIN = 0.5               # m past the left road edge or the outer sidewalk edge that counts as hitting the barrier
+
+
+class TrafficLightState(enum.IntEnum):
+    Red = 0
+    Yellow = 1
+    Green = 2
+    Off = 3
+    Unknown = 4
+
+
+class CityObjectLabel(enum.IntEnum):
+    NONE = 0
+    Roads = 1
+    Sidewalks = 2
+    Buildings = 3
+    Walls = 4
+    Fences = 5
+    Poles = 6
+    TrafficLight = 7
+    TrafficSigns = 8
+    Vegetation = 9
+    Terrain = 10
+    Sky = 11
+    Pedestrians = 12
+    Rider = 13
+    Car = 14
+    Truck = 15
+    Bus = 16
+    Train = 17
+    Motorcycle = 18
+    Bicycle = 19
+    Static = 20
+    Dynamic = 21
+    Other = 22
+    Water = 23
+    RoadLines = 24
+    Ground = 25
+    Bridge = 26
+    RailTrack = 27
+    GuardRail = 28
+    Any = 255
+
+
+class MapLayer(enum.IntFlag):
+    NONE = 0x0
+    Buildings = 0x1
+    Decals = 0x2
+    Foliage = 0x4
+    Ground = 0x8
+    ParkedVehicles = 0x10
+    Particles = 0x20
+    Props = 0x40
+    StreetLights = 0x80
+    Walls = 0x100
+    All = 0xFFFF
+
+
+class AttachmentType(enum.IntEnum):
+    Rigid = 0
+    SpringArm = 1
+    SpringArmGhost = 2
+
+
+class ColorConverter(enum.IntEnum):
+    Raw = 0
+    Depth = 1
+    LogarithmicDepth = 2
+    CityScapesPalette = 3
+
+
+class VehicleLightState(enum.IntFlag):
+    NONE = 0x0
+    Position = 0x1
+    LowBeam = 0x2
+    HighBeam = 0x4
+    Brake = 0x8
+    RightBlinker = 0x10
+    LeftBlinker = 0x20
+    Reverse = 0x40
+    Fog = 0x80
+    Interior = 0x100
+    Special1 = 0x200
+    Special2 = 0x400
+    All = 0xFFFFFFFF
+
+
+class VehicleControl:
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False,
+                 manual_gear_shift=False, gear=0) -> None:
+        self.throttle = float(throttle)
+        self.steer = float(steer)
+        self.brake = float(brake)
+        self.hand_brake = bool(hand_brake)
+        self.reverse = bool(reverse)
+        self.manual_gear_shift = bool(manual_gear_shift)
+        self.gear = int(gear)
+
+    def __eq__(self, other):
+        return isinstance(other, VehicleControl) and vars(self) == vars(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"VehicleControl(throttle={self.throttle:.6f}, steer={self.steer:.6f}, brake={self.brake:.6f}, "
+                f"hand_brake={self.hand_brake}, reverse={self.reverse}, manual_gear_shift={self.manual_gear_shift}, "
+                f"gear={self.gear})")
+
+
+class WalkerControl:
+    def __init__(self, direction=None, speed=0.0, jump=False) -> None:
+        self.direction = Vector3D(1., 0., 0.) if direction is None else direction
+        self.speed = float(speed)
+        self.jump = bool(jump)
+
+
+class WeatherParameters:
+    def __init__(self, cloudiness=0.0, precipitation=0.0, precipitation_deposits=0.0, wind_intensity=0.0,
+                 sun_azimuth_angle=0.0, sun_altitude_angle=0.0, fog_density=0.0, fog_distance=0.0, wetness=0.0,
+                 fog_falloff=0.0, scattering_intensity=0.0, mie_scattering_scale=0.0,
+                 rayleigh_scattering_scale=0.0331, dust_storm=0.0) -> None:
+        self.cloudiness = cloudiness
+        self.precipitation = precipitation
+        self.precipitation_deposits = precipitation_deposits
+        self.wind_intensity = wind_intensity
+        self.sun_azimuth_angle = sun_azimuth_angle
+        self.sun_altitude_angle = sun_altitude_angle
+        self.fog_density = fog_density
+        self.fog_distance = fog_distance
+        self.wetness = wetness
+        self.fog_falloff = fog_falloff
+        self.scattering_intensity = scattering_intensity
+        self.mie_scattering_scale = mie_scattering_scale
+        self.rayleigh_scattering_scale = rayleigh_scattering_scale
+        self.dust_storm = dust_storm
+
+
+WeatherParameters.Default = WeatherParameters(sun_altitude_angle=45.)
+WeatherParameters.ClearNoon = WeatherParameters(cloudiness=5., sun_altitude_angle=45.)
+WeatherParameters.CloudyNoon = WeatherParameters(cloudiness=60., sun_altitude_angle=45.)
+WeatherParameters.WetNoon = WeatherParameters(cloudiness=5., precipitation_deposits=50., wetness=50., sun_altitude_angle=45.)
+WeatherParameters.HardRainNoon = WeatherParameters(cloudiness=100., precipitation=100., precipitation_deposits=90.,
+                                                   wetness=100., sun_altitude_angle=45.)
+WeatherParameters.ClearSunset = WeatherParameters(cloudiness=5., sun_altitude_angle=15.)
+
+
+class WorldSettings:
+    def __init__(self, synchronous_mode=False, no_rendering_mode=False, fixed_delta_seconds=None) -> None:
+        self.synchronous_mode = synchronous_mode
+        self.no_rendering_mode = no_rendering_mode
+        self.fixed_delta_seconds = fixed_delta_seconds
+        self.substepping = True
+        self.max_substep_delta_time = 0.01
+        self.max_substeps = 10
+        self.max_culling_distance = 0.0
+        self.deterministic_ragdolls = False
+        self.tile_stream_distance = 3000.0
+        self.actor_active_distance = 2000.0
+        self.spectator_as_ego = True
+
+    def copy(self):
+        settings = WorldSettings()
+        settings.__dict__.update(self.__dict__)
+        return settings
+
+
+class Timestamp:
+    def __init__(self, frame, elapsed_seconds, delta_seconds) -> None:
+        self.frame = frame
+        self.frame_count = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = time.time()
+
+
+class ActorAttribute:
+    def __init__(self, id, value, recommended_values=(), is_modifiable=True) -> None:
+        self.id = id
+        self.value = str(value)
+        self.recommended_values = list(recommended_values)
+        self.is_modifiable = is_modifiable
+
+    def as_bool(self):
+        return self.value.lower() == 'true'
+
+    def as_int(self):
+        return int(self.value)
+
+    def as_float(self):
+        return float(self.value)
+
+    def as_str(self):
+        return self.value
+
+    __int__ = as_int
+    __float__ = as_float
+    __str__ = as_str
+
+    def __eq__(self, other):
+        if isinstance(other, ActorAttribute):
+            return self.value == other.value
+        if isinstance(other, bool):
+            return self.as_bool() == other
+        if isinstance(other, (int, float)):
+            return self.as_float() == other
+        return self.value == str(other)
+
+    __hash__ = None
+
+
+class ActorBlueprint:
+    def __init__(self, id, tags, attributes) -> None:
+        self.id = id
+        self.tags = list(tags)
+        self._attributes = {attribute.id: attribute for attribute in attributes}
+
+    def __repr__(self):
+        return f"ActorBlueprint(id={self.id}, tags={self.tags})"
+
+    def __iter__(self):
+        return iter(self._attributes.values())
+
+    def __len__(self):
+        return len(self._attributes)
+
+    def has_tag(self, tag):
+        return tag in self.tags
+
+    def match_tags(self, wildcard_pattern):
+        return any(fnmatch.fnmatch(tag, wildcard_pattern) for tag in self.tags)
+
+    def has_attribute(self, id):
+        return id in self._attributes
+
+    def get_attribute(self, id):
+        return self._attributes[id]
+
+    def set_attribute(self, id, value):
+        attribute = self._attributes.get(id)
+        if attribute is None:
+            raise IndexError(f"blueprint '{self.id}' does not have attribute '{id}'")
+        if not attribute.is_modifiable:
+            raise RuntimeError(f"attribute '{id}' of blueprint '{self.id}' is not modifiable")
+        attribute.value = str(value)
+
+    def copy(self):
+        return ActorBlueprint(self.id, self.tags, [ActorAttribute(a.id, a.value, a.recommended_values, a.is_modifiable)
+                                                   for a in self._attributes.values()])
+
+
+class BlueprintLibrary:
+    def __init__(self, blueprints) -> None:
+        self._blueprints = list(blueprints)
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+    def __getitem__(self, index):
+        return self._blueprints[index]
+
+    def find(self, id):
+        for blueprint in self._blueprints:
+            if blueprint.id == id:
+                return blueprint
+        raise IndexError(f"blueprint '{id}' not found")
+
+    def filter(self, wildcard_pattern):
+        return BlueprintLibrary(blueprint for blueprint in self._blueprints
+                                if fnmatch.fnmatch(blueprint.id, wildcard_pattern) or blueprint.match_tags(wildcard_pattern))
+
+
+# id, bounding box extent, wheelbase, number of wheels and base type of the vehicle blueprints
+VEHICLES = (('vehicle.tesla.model3', (2.396, 1.082, 0.744), 2.9, 4, 'car'),
+            ('vehicle.audi.etron', (2.428, 1.030, 0.826), 2.9, 4, 'car'),
+            ('vehicle.audi.tt', (2.091, 0.998, 0.693), 2.5, 4, 'car'),
+            ('vehicle.lincoln.mkz_2020', (2.443, 1.032, 0.746), 2.9, 4, 'car'),
+            ('vehicle.mercedes.coupe_2020', (2.337, 1.010, 0.710), 2.8, 4, 'car'),
+            ('vehicle.toyota.prius', (2.257, 1.003, 0.763), 2.7, 4, 'car'),
+            ('vehicle.carlamotors.carlacola', (2.602, 1.308, 1.245), 3.5, 4, 'truck'),
+            ('vehicle.yamaha.yzf', (1.105, 0.433, 0.625), 1.4, 2, 'motorcycle'))
+VEHICLE_TAGS = {'car': CityObjectLabel.Car, 'truck': CityObjectLabel.Truck, 'motorcycle': CityObjectLabel.Motorcycle}
+SENSORS = ('sensor.other.collision', 'sensor.other.lane_invasion', 'sensor.other.gnss', 'sensor.other.imu',
+           'sensor.other.obstacle', 'sensor.camera.rgb', 'sensor.camera.depth', 'sensor.camera.semantic_segmentation')
+COLORS = ('0,0,0', '255,255,255', '17,37,103', '140,0,0', '79,79,79')
+
+
+def _build_blueprints():
+    blueprints = []
+    for id, extent, wheelbase, wheels, base_type in VEHICLES:
+        _, make, model = id.split('.')
+        blueprints.append(ActorBlueprint(id, ['vehicle', make, model], [
+            ActorAttribute('number_of_wheels', wheels, is_modifiable=False),
+            ActorAttribute('base_type', base_type, is_modifiable=False),
+            ActorAttribute('generation', 2, is_modifiable=False),
+            ActorAttribute('color', COLORS[0], COLORS),
+            ActorAttribute('role_name', 'autopilot', ('autopilot', 'scenario', 'ego', 'hero')),
+            ActorAttribute('sticky_control', 'true', ('true', 'false'))]))
+    for id in SENSORS:
+        blueprints.append(ActorBlueprint(id, id.split('.'), [
+            ActorAttribute('role_name', 'front'), ActorAttribute('sensor_tick', 0.0),
+            ActorAttribute('image_size_x', 800), ActorAttribute('image_size_y', 600), ActorAttribute('fov', 90.0)]))
+    return blueprints
+
+
+class Actor:
+    def __init__(self, world, actor_id, type_id, attributes=None, semantic_tags=(), parent=None, transform=None) -> None:
+        self._world = world
+        self.id = actor_id
+        self.type_id = type_id
+        self.attributes = dict(attributes or {})
+        self.semantic_tags = list(semantic_tags)
+        self.parent = parent
+        self.is_alive = True
+        self.is_active = True
+        self._transform = Transform() if transform is None else Transform(transform.location, transform.rotation)
+        self.bounding_box = BoundingBox()
+
+    def __eq__(self, other):
+        return isinstance(other, Actor) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"Actor(id={self.id}, type={self.type_id})"
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        return Transform(self._transform.location, self._transform.rotation)
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        return Vector3D()
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return Vector3D()
+
+    def set_transform(self, transform):
+        self._transform = Transform(transform.location, transform.rotation)
+
+    def set_location(self, location):
+        self._transform = Transform(location, self._transform.rotation)
+
+    def set_simulate_physics(self, enabled=True):
+        pass
+
+    def set_enable_gravity(self, enabled=True):
+        pass
+
+    def destroy(self):
+        if not self.is_alive:
+            return False
+        self._world._remove(self)
+        self.is_alive = False
+        return True
+
+
+class Vehicle(Actor):
+    """Vehicle whose state lives in the world's arrays at row slot"""
+
+    def __init__(self, world, actor_id, type_id, attributes, semantic_tags, slot, extent) -> None:
+        super().__init__(world, actor_id, type_id, attributes, semantic_tags)
+        self.slot = slot
+        self.bounding_box = BoundingBox(Location(0., 0., extent[2]), Vector3D(*extent))
+        self._light_state = VehicleLightState.NONE
+
+    def get_transform(self):
+        x, y, z = self._world._position[self.slot]
+        return Transform(Location(x, y, z), Rotation(yaw=_degrees(self._world._yaw[self.slot])))
+
+    def get_location(self):
+        x, y, z = self._world._position[self.slot]
+        return Location(x, y, z)
+
+    def get_velocity(self):
+        return Vector3D(*self._world._velocity[self.slot])
+
+    def get_angular_velocity(self):
+        return Vector3D(0., 0., math.degrees(self._world._yaw_rate[self.slot]))
+
+    def get_acceleration(self):
+        return Vector3D(*self._world._acceleration[self.slot])
+
+    def set_transform(self, transform):
+        self._world._place(self.slot, transform)
+
+    def set_location(self, location):
+        self._world._place(self.slot, Transform(location, self.get_transform().rotation))
+
+    def set_target_velocity(self, velocity):
+        self._world._set_speed(self.slot, velocity)
+
+    def set_simulate_physics(self, enabled=True):
+        self._world._physics[self.slot] = enabled
+
+    def apply_control(self, control):
+        self._world._control[self.slot] = (control.throttle, control.steer, control.brake,
+                                           control.hand_brake, control.reverse)
+
+    def get_control(self):
+        throttle, steer, brake, hand_brake, reverse = self._world._control[self.slot]
+        return VehicleControl(throttle, steer, brake, bool(hand_brake), bool(reverse))
+
+    def set_autopilot(self, enabled=True, tm_port=8000):
+        self._world._set_autopilot(self.slot, enabled)
+
+    def get_speed_limit(self):
+        return SPEED_LIMIT
+
+    def get_traffic_light_state(self):
+        return TrafficLightState.Green
+
+    def is_at_traffic_light(self):
+        return False
+
+    def get_traffic_light(self):
+        return None
+
+    def set_light_state(self, light_state):
+        self._light_state = light_state
+
+    def get_light_state(self):
+        return self._light_state
+
+
+class CollisionEvent:
+    def __init__(self, frame, timestamp, transform, actor, other_actor, normal_impulse) -> None:
+        self.frame = frame
+        self.timestamp = timestamp
+        self.transform = transform
+        self.actor = actor
+        self.other_actor = other_actor
+        self.normal_impulse = normal_impulse
+
+
+class LaneInvasionEvent:
+    def __init__(self, frame, timestamp, transform, actor, crossed_lane_markings) -> None:
+        self.frame = frame
+        self.timestamp = timestamp
+        self.transform = transform
+        self.actor = actor
+        self.crossed_lane_markings = crossed_lane_markings
+
+
+class Sensor(Actor):
+    """
+    Sensor attached to a parent actor. Collision and lane invasion sensors report events to
+    their callback at the end of every tick, the other sensor types never produce data.
+    """
+
+    def __init__(self, world, actor_id, type_id, attributes, parent, transform) -> None:
+        super().__init__(world, actor_id, type_id, attributes, parent=parent, transform=transform)
+        self._callback = None
+        self._lane = None
+
+    def get_transform(self):
+        if self.parent is None:
+            return super().get_transform()
+        parent = self.parent.get_transform()
+        rotation = Rotation(parent.rotation.pitch + self._transform.rotation.pitch,
+                            parent.rotation.yaw + self._transform.rotation.yaw,
+                            parent.rotation.roll + self._transform.rotation.roll)
+        return Transform(parent.transform(self._transform.location), rotation)
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    def listen(self, callback):
+        self._callback = callback
+        self._lane = None
+
+    def stop(self):
+        self._callback = None
+
+    def destroy(self):
+        self._callback = None
+        return super().destroy()
+
+    def _on_tick(self, world, timestamp):
+        if self._callback is None or not isinstance(self.parent, Vehicle):
+            return
+        if self.type_id == 'sensor.other.collision':
+            for other_actor, impulse in world._collisions(self.parent):
+                self._callback(CollisionEvent(timestamp.frame, timestamp.elapsed_seconds, self.get_transform(),
+                                              self, other_actor, impulse))
+        elif self.type_id == 'sensor.other.lane_invasion':
+            location = self.parent.get_location()
+            _, _, t = world._map._locate(location.x, location.y)
+            lane = world._map._lane_at(t, LaneType.Any)
+            if self._lane is not None and lane is not self._lane:
+                lanes = world._map.lanes
+                low, high = sorted((self._lane.index, lane.index))
+                markings = [lanes[i].right_marking for i in range(low, high)]
+                self._callback(LaneInvasionEvent(timestamp.frame, timestamp.elapsed_seconds, self.get_transform(),
+                                                 self, markings))
+            self._lane = lane
+
+
+class ActorList(list):
+    def filter(self, wildcard_pattern):
+        return ActorList(actor for actor in self if fnmatch.fnmatch(actor.type_id, wildcard_pattern))
+
+    def find(self, actor_id):
+        for actor in self:
+            if actor.id == actor_id:
+                return actor
+        return None
+
+
+class ActorSnapshot:
+    def __init__(self, actor_id, transform, velocity, angular_velocity, acceleration) -> None:
+        self.id = actor_id
+        self._transform = transform
+        self._velocity = velocity
+        self._angular_velocity = angular_velocity
+        self._acceleration = acceleration
+
+    def get_transform(self):
+        return Transform(self._transform.location, self._transform.rotation)
+
+    def get_velocity(self):
+        return Vector3D(self._velocity.x, self._velocity.y, self._velocity.z)
+
+    def get_angular_velocity(self):
+        return Vector3D(self._angular_velocity.x, self._angular_velocity.y, self._angular_velocity.z)
+
+    def get_acceleration(self):
+        return Vector3D(self._acceleration.x, self._acceleration.y, self._acceleration.z)
+
+
+class WorldSnapshot:
+    """State of every actor at one frame, rows of the arrays follow the order of ids"""
+
+    def __init__(self, world_id, timestamp, ids, position, yaw, velocity, yaw_rate, acceleration) -> None:
+        self.id = world_id
+        self.frame = timestamp.frame
+        self.timestamp = timestamp
+        self._ids = ids
+        self._rows = {actor_id: row for row, actor_id in enumerate(ids)}
+        self._position, self._yaw = position, yaw
+        self._velocity, self._yaw_rate, self._acceleration = velocity, yaw_rate, acceleration
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return (self._actor_snapshot(row) for row in range(len(self._ids)))
+
+    def has_actor(self, actor_id):
+        return actor_id in self._rows
+
+    def find(self, actor_id):
+        row = self._rows.get(actor_id)
+        return None if row is None else self._actor_snapshot(row)
+
+    def _actor_snapshot(self, row):
+        x, y, z = self._position[row]
+        return ActorSnapshot(self._ids[row], Transform(Location(x, y, z), Rotation(yaw=_degrees(self._yaw[row]))),
+                             Vector3D(*self._velocity[row]), Vector3D(0., 0., math.degrees(self._yaw_rate[row])),
+                             Vector3D(*self._acceleration[row]))
+
+
+class DebugHelper:
+    """Drawing calls are accepted and ignored, nothing is rendered"""
+
+    def draw_point(self, location, size=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+    def draw_line(self, begin, end, thickness=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+    def draw_arrow(self, begin, end, thickness=0.1, arrow_size=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+    def draw_box(self, box, rotation, thickness=0.1, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+    def draw_string(self, location, text, draw_shadow=False, color=None, life_time=-1.0, persistent_lines=True):
+        pass
+
+
+def _degrees(yaw):
+    return math.degrees(math.remainder(yaw, 2 * math.pi))
+
+
+def _boxes_overlap(center, yaw, extent, other_center, other_yaw, other_extent):
+    """Separating axis test of two oriented rectangles"""
+    dx, dy = other_center[0] - center[0], other_center[1] - center[1]
+    axes = [(math.cos(yaw), math.sin(yaw)), (-math.sin(yaw), math.cos(yaw)),
+            (math.cos(other_yaw), math.sin(other_yaw)), (-math.sin(other_yaw), math.cos(other_yaw))]
+    for ax, ay in axes:
+        reach = 0.
+        for (fx, fy), half in zip(axes[:2], extent[:2]):
+            reach += half * abs(fx * ax + fy * ay)
+        for (fx, fy), half in zip(axes[2:], other_extent[:2]):
+            reach += half * abs(fx * ax + fy * ay)
+        if abs(dx * ax + dy * ay) > reach:
+            return False
+    return True
+
+
+class World:
+    """
+    Headless world on a synthetic map. Vehicles are rows of NumPy arrays advanced together by
+    tick(): manually controlled vehicles with a kinematic bicycle model driven by their last
+    VehicleControl, autopilot vehicles by lane following at the traffic manager's target speed
+    with an intelligent driver model gap to the vehicle ahead in their lane. Autopilot vehicles
+    never change lanes and there are no traffic lights or walkers.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, map_name, settings=None) -> None:
+        self.id = next(World._ids)
+        self._map = Map(map_name)
+        self._settings = WorldSettings() if settings is None else settings.copy()
+        self._weather = WeatherParameters.Default
+        self._blueprints = BlueprintLibrary(_build_blueprints())
+        self.debug = DebugHelper()
+        self._frame = 0
+        self._elapsed = 0.
+        self._delta = 0.
+        self._snapshot = None
+        self._on_tick = {}
+        self._on_tick_ids = itertools.count(1)
+        self._actor_ids = itertools.count(1)
+        self._actors = {}
+        self._sensors = []
+        self._spectator = self._add(Actor(self, next(self._actor_ids), 'spectator'))
+        self._barrier = Actor(self, 0, 'static.prop.guardrail', semantic_tags=[CityObjectLabel.GuardRail])
+        # traffic manager defaults: 30% below the speed limit, 2.5m to the leading vehicle
+        self._tm_speed_difference = 30.
+        self._tm_distance = 2.5
+
+        self._free = []
+        self._size = 0
+        self._position = np.zeros((0, 3))
+        self._yaw = np.zeros(0)
+        self._speed = np.zeros(0)
+        self._yaw_rate = np.zeros(0)
+        self._velocity = np.zeros((0, 3))
+        self._acceleration = np.zeros((0, 3))
+        self._extent = np.zeros((0, 3))
+        self._wheelbase = np.zeros(0)
+        # throttle, steer, brake, hand_brake, reverse
+        self._control = np.zeros((0, 5))
+        self._alive = np.zeros(0, dtype=bool)
+        self._physics = np.zeros(0, dtype=bool)
+        self._autopilot = np.zeros(0, dtype=bool)
+        # autopilot position: lane index and s along the whole loop
+        self._lane = np.zeros(0, dtype=np.int64)
+        self._loop_s = np.zeros(0)
+        # per vehicle traffic manager settings, nan falls back to the global ones
+        self._speed_difference = np.zeros(0)
+        self._distance = np.zeros(0)
+        self._vehicles = []
+        self._allocate(64)
+
+    def _allocate(self, capacity):
+        """Grow the vehicle arrays to capacity rows"""
+        def grow(array, fill=0.):
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+        self._position, self._yaw, self._speed = grow(self._position), grow(self._yaw), grow(self._speed)
+        self._yaw_rate, self._velocity = grow(self._yaw_rate), grow(self._velocity)
+        self._acceleration, self._extent = grow(self._acceleration), grow(self._extent)
+        self._wheelbase, self._control = grow(self._wheelbase), grow(self._control)
+        self._alive, self._physics, self._autopilot = grow(self._alive), grow(self._physics), grow(self._autopilot)
+        self._lane, self._loop_s = grow(self._lane), grow(self._loop_s)
+        self._speed_difference, self._distance = grow(self._speed_difference, np.nan), grow(self._distance, np.nan)
+        self._vehicles += [None] * (capacity - len(self._vehicles))
+
+    def __repr__(self):
+        return f"World(id={self.id})"
+
+    # ---------------------------------------------------------------- carla.World API
+
+    def get_map(self):
+        return self._map
+
+    def get_settings(self):
+        return self._settings.copy()
+
+    def apply_settings(self, settings):
+        self._settings = settings.copy()
+        return self._frame
+
+    def get_weather(self):
+        return self._weather
+
+    def set_weather(self, weather):
+        self._weather = weather
+
+    def get_blueprint_library(self):
+        return self._blueprints
+
+    def get_spectator(self):
+        return self._spectator
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return ActorList(self._actors.values())
+        return ActorList(self._actors[i] for i in actor_ids if i in self._actors)
+
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def try_spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        try:
+            return self.spawn_actor(blueprint, transform, attach_to, attachment_type)
+        except RuntimeError:
+            return None
+
+    def spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        attributes = {attribute.id: attribute.value for attribute in blueprint}
+        if blueprint.id.startswith('vehicle.'):
+            return self._spawn_vehicle(blueprint, transform, attributes)
+        if blueprint.id.startswith('sensor.'):
+            sensor = self._add(Sensor(self, next(self._actor_ids), blueprint.id, attributes, attach_to, transform))
+            self._sensors.append(sensor)
+            return sensor
+        return self._add(Actor(self, next(self._actor_ids), blueprint.id, attributes, parent=attach_to,
+                               transform=transform))
+
+    def tick(self, seconds=10.0):
+        delta = self._settings.fixed_delta_seconds or DEFAULT_DELTA
+        self._step(delta)
+        self._frame += 1
+        self._elapsed += delta
+        self._delta = delta
+        self._snapshot = None
+        timestamp = self._timestamp()
+        for sensor in self._sensors:
+            sensor._on_tick(self, timestamp)
+        if self._on_tick:
+            snapshot = self.get_snapshot()
+            for callback in list(self._on_tick.values()):
+                callback(snapshot)
+        return self._frame
+
+    def wait_for_tick(self, seconds=10.0):
+        """Nothing runs the world in the background, so in asynchronous mode this ticks it"""
+        if not self._settings.synchronous_mode:
+            self.tick(seconds)
+        return self.get_snapshot()
+
+    def on_tick(self, callback):
+        callback_id = next(self._on_tick_ids)
+        self._on_tick[callback_id] = callback
+        return callback_id
+
+    def remove_on_tick(self, callback_id):
+        self._on_tick.pop(callback_id, None)
+
+    def get_snapshot(self):
+        if self._snapshot is None:
+            slots = [vehicle.slot for vehicle in self._actors.values() if isinstance(vehicle, Vehicle)]
+            others = [actor for actor in self._actors.values() if not isinstance(actor, Vehicle)]
+            ids = [self._vehicles[slot].id for slot in slots] + [actor.id for actor in others]
+            position, yaw = self._position[slots], self._yaw[slots]
+            if others:
+                transforms = [actor.get_transform() for actor in others]
+                position = np.concatenate((position, [(t.location.x, t.location.y, t.location.z) for t in transforms]))
+                yaw = np.concatenate((yaw, [math.radians(t.rotation.yaw) for t in transforms]))
+            zeros = np.zeros((len(others), 3))
+            self._snapshot = WorldSnapshot(self.id, self._timestamp(), ids, position, yaw,
+                                           np.concatenate((self._velocity[slots], zeros)),
+                                           np.concatenate((self._yaw_rate[slots], zeros[:, 0])),
+                                           np.concatenate((self._acceleration[slots], zeros)))
+        return self._snapshot
+
+    def unload_map_layer(self, map_layers):
+        pass
+
+    def load_map_layer(self, map_layers):
+        pass
+
+    def get_environment_objects(self, object_type=CityObjectLabel.Any):
+        return []
+
+    def enable_environment_objects(self, env_objects_ids, enable):
+        pass
+
+    def get_traffic_lights_from_waypoint(self, waypoint, distance):
+        return []
+
+    def get_random_location_from_navigation(self):
+        return None
+
+    def set_pedestrians_cross_factor(self, percentage):
+        pass
+
+    def freeze_all_traffic_lights(self, frozen):
+        pass
+
+    def reset_all_traffic_lights(self):
+        pass
+
+    # ---------------------------------------------------------------- simulation
+
+    def _timestamp(self):
+        return Timestamp(self._frame, self._elapsed, self._delta)
+
+    def _add(self, actor):
+        self._actors[actor.id] = actor
+        return actor
+
+    def _remove(self, actor):
+        self._actors.pop(actor.id, None)
+        self._snapshot = None
+        if isinstance(actor, Sensor):
+            self._sensors.remove(actor)
+        elif isinstance(actor, Vehicle):
+            self._alive[actor.slot] = False
+            self._autopilot[actor.slot] = False
+            self._vehicles[actor.slot] = None
+            self._free.append(actor.slot)
+            for sensor in [sensor for sensor in self._sensors if sensor.parent is actor]:
+                sensor.destroy()
+
+    def _spawn_vehicle(self, blueprint, transform, attributes):
+        _, extent, wheelbase, _, base_type = next(v for v in VEHICLES if v[0] == blueprint.id)
+        yaw = math.radians(transform.rotation.yaw)
+        position = (transform.location.x, transform.location.y)
+        n = self._size
+        for j in np.flatnonzero(self._alive[:n]):
+            if _boxes_overlap(position, yaw, extent, self._position[j], self._yaw[j], self._extent[j]):
+                raise RuntimeError("Spawn failed because of collision at spawn position")
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._size == len(self._alive):
+                self._allocate(2 * len(self._alive))
+            slot = self._size
+            self._size += 1
+        self._extent[slot] = extent
+        self._wheelbase[slot] = wheelbase
+        self._control[slot] = 0.
+        self._speed[slot] = self._yaw_rate[slot] = 0.
+        self._velocity[slot] = self._acceleration[slot] = 0.
+        self._alive[slot] = self._physics[slot] = True
+        self._autopilot[slot] = False
+        self._speed_difference[slot] = self._distance[slot] = np.nan
+        self._place(slot, transform)
+        vehicle = Vehicle(self, next(self._actor_ids), blueprint.id, attributes, [VEHICLE_TAGS[base_type]], slot, extent)
+        self._vehicles[slot] = vehicle
+        self._snapshot = None
+        return self._add(vehicle)
+
+    def _place(self, slot, transform):
+        self._position[slot] = (transform.location.x, transform.location.y, transform.location.z)
+        self._yaw[slot] = math.radians(transform.rotation.yaw)
+        if self._autopilot[slot]:
+            self._attach_to_lane(slot)
+
+    def _set_speed(self, slot, velocity):
+        yaw = self._yaw[slot]
+        self._speed[slot] = velocity.x * math.cos(yaw) + velocity.y * math.sin(yaw)
+        self._velocity[slot] = (self._speed[slot] * math.cos(yaw), self._speed[slot] * math.sin(yaw), 0.)
+
+    def _set_autopilot(self, slot, enabled):
+        self._autopilot[slot] = enabled
+        if enabled:
+            self._speed[slot] = abs(self._speed[slot])
+            self._attach_to_lane(slot)
+
+    def _attach_to_lane(self, slot):
+        road, s, t = self._map._locate(*self._position[slot, :2])
+        self._lane[slot] = self._map._lane_at(t, LaneType.Driving).index
+        self._loop_s[slot] = road.start + s
+
+    def _step(self, dt):
+        n = self._size
+        moving = self._alive[:n] & self._physics[:n]
+        velocity = self._velocity[:n].copy()
+        manual = np.flatnonzero(moving & ~self._autopilot[:n])
+        autopilot = np.flatnonzero(moving & self._autopilot[:n])
+        if len(manual):
+            self._step_manual(manual, dt)
+        if len(autopilot):
+            self._step_autopilot(autopilot, manual, dt)
+        moving = np.flatnonzero(moving)
+        self._acceleration[moving] = (self._velocity[moving] - velocity[moving]) / dt
+
+    def _step_manual(self, slots, dt):
+        throttle, steer, brake, hand_brake, reverse = self._control[slots].T
+        speed = self._speed[slots] + np.where(reverse > 0, -1., 1.) * throttle * MAX_ACCELERATION * dt
+        resistance = (brake * MAX_DECELERATION + hand_brake * MAX_DECELERATION + ROLLING_RESISTANCE +
+                      DRAG * speed * speed) * dt
+        speed = np.sign(speed) * np.maximum(np.abs(speed) - resistance, 0.)
+        limit = MAX_LATERAL_ACCELERATION / np.maximum(np.abs(speed), 1.)
+        yaw_rate = np.clip(speed / self._wheelbase[slots] * np.tan(steer * MAX_STEER_ANGLE), -limit, limit)
+        yaw = self._yaw[slots] + yaw_rate * dt
+        self._velocity[slots] = np.stack((speed * np.cos(yaw), speed * np.sin(yaw), np.zeros_like(speed)), axis=1)
+        self._position[slots, :2] += self._velocity[slots, :2] * dt
+        self._position[slots, 2] = 0.
+        self._speed[slots], self._yaw[slots], self._yaw_rate[slots] = speed, yaw, yaw_rate
+
+    def _manual_lanes(self, slots):
+        """Lane index and loop s of manually driven vehicles that are on a driving lane"""
+        kept, lanes, loop_s = [], [], []
+        for slot in slots:
+            road, s, t = self._map._locate(*self._position[slot, :2])
+            lane = self._map._lane_at(t, LaneType.Driving, project_to_road=False)
+            if lane is not None:
+                kept.append(slot)
+                lanes.append(lane.index)
+                loop_s.append(road.start + s)
+        return np.array(kept, dtype=np.int64), np.array(lanes, dtype=np.int64), np.array(loop_s)
+
+    def _step_autopilot(self, slots, manual, dt):
+        map = self._map
+        manual, manual_lane, manual_s = self._manual_lanes(manual)
+        lane = np.concatenate((self._lane[slots], manual_lane))
+        loop_s = np.concatenate((self._loop_s[slots], manual_s))
+        rows = np.concatenate((slots, manual))
+        # the leader of a vehicle is the next one along its lane, wrapping around the loop
+        order = np.lexsort((loop_s, lane))
+        sorted_lane = lane[order]
+        position = np.arange(len(order))
+        group_start = np.searchsorted(sorted_lane, sorted_lane, side='left')
+        group_end = np.searchsorted(sorted_lane, sorted_lane, side='right')
+        leader = np.empty_like(order)
+        leader[order] = order[np.where(position + 1 < group_end, position + 1, group_start)]
+        leader = leader[:len(slots)]
+        own = np.arange(len(slots))
+        gap = (loop_s[leader] - loop_s[own]) % map.length - \
+            self._extent[slots, 0] - self._extent[rows[leader], 0]
+        gap = np.where(leader == own, map.length, np.maximum(gap, 0.1))
+
+        speed = self._speed[slots]
+        lead_speed = np.abs(self._speed[rows[leader]])
+        difference = np.where(np.isnan(self._speed_difference[slots]), self._tm_speed_difference,
+                              self._speed_difference[slots])
+        target = np.maximum(SPEED_LIMIT / 3.6 * (1. - difference / 100.), 0.1)
+        distance = np.where(np.isnan(self._distance[slots]), self._tm_distance, self._distance[slots])
+        desired_gap = distance + speed * IDM_HEADWAY + \
+            speed * (speed - lead_speed) / (2 * math.sqrt(IDM_ACCELERATION * IDM_DECELERATION))
+        acceleration = IDM_ACCELERATION * (1. - (speed / target) ** 4 - (np.maximum(desired_gap, 0.) / gap) ** 2)
+        acceleration = np.clip(acceleration, -MAX_DECELERATION, MAX_ACCELERATION)
+        speed = np.maximum(speed + acceleration * dt, 0.)
+
+        # advance along the lane, on a curve the lane is shorter or longer than the reference line
+        offset = map.lane_offsets[self._lane[slots]]
+        road_index, _ = map._road_at(self._loop_s[slots])
+        self._loop_s[slots] = (self._loop_s[slots] + speed * dt / (1. - map.curvature[road_index] * offset)) % map.length
+        road_index, s = map._road_at(self._loop_s[slots])
+        x, y, yaw = map._evaluate(road_index, s, offset)
+        yaw_rate = np.remainder(yaw - self._yaw[slots] + np.pi, 2 * np.pi) - np.pi
+        self._position[slots] = np.stack((x, y, np.zeros_like(x)), axis=1)
+        self._velocity[slots] = np.stack((speed * np.cos(yaw), speed * np.sin(yaw), np.zeros_like(x)), axis=1)
+        self._speed[slots], self._yaw[slots], self._yaw_rate[slots] = speed, yaw, yaw_rate / dt
+        # report what the autopilot applied
+        self._control[slots] = 0.
+        self._control[slots, 0] = np.clip(acceleration / MAX_ACCELERATION, 0., 1.)
+        self._control[slots, 2] = np.clip(-acceleration / MAX_DECELERATION, 0., 1.)
+
+    def _collisions(self, vehicle):
+        """(other actor, normal impulse) of everything the vehicle's box overlaps"""
+        slot, n = vehicle.slot, self._size
+        center, yaw, extent = self._position[slot], self._yaw[slot], self._extent[slot]
+        reach = np.hypot(self._extent[:n, 0], self._extent[:n, 1]) + math.hypot(extent[0], extent[1])
+        near = self._alive[:n] & (np.sum((self._position[:n, :2] - center[:2]) ** 2, axis=1) < reach ** 2)
+        near[slot] = False
+        collisions = []
+        for j in np.flatnonzero(near):
+            if _boxes_overlap(center, yaw, extent, self._position[j], self._yaw[j], self._extent[j]):
+                impulse = 1500. * (self._velocity[slot] - self._velocity[j])
+                collisions.append((self._vehicles[j], Vector3D(*impulse)))
+        _, _, t = self._map._locate(center[0], center[1])
+        if t < -OFF_ROAD_MARGIN or t > self._map.width + OFF_ROAD_MARGIN:
+            collisions.append((self._barrier, Vector3D(*(1500. * self._velocity[slot]))))
+        return collisions
@@ -0,0 +1,43 @@
+"""Unit tests for the inference snapshots in algs.util.checkpoint"""
+import torch
+from torch import nn
+
+from algs.util.checkpoint import save_policy, is_policy, load_policy
+
+
+def make_nets(seed):
+    torch.manual_seed(seed)
+    return {'actor': nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 6)),
+            'critic': nn.Sequential(nn.Linear(14, 32), nn.BatchNorm1d(32), nn.Linear(32, 3))}
+
+
+def test_policy_snapshot_round_trip(tmp_path):
+    nets = make_nets(0)
+    file = tmp_path / 'policy.pth'
+    save_policy(file, nets, meta={'learn_time': 42})
+    assert is_policy(file)
+    for mmap in (True, False):
+        state, meta = load_policy(file, mmap=mmap)
+        assert meta == {'learn_time': 42}
+        for name, net in nets.items():
+            assert state[name].keys() == net.state_dict().keys()
+            for key, value in net.state_dict().items():
+                assert torch.equal(state[name][key], value.float())
+
+    other = make_nets(1)
+    for name, net in other.items():
+        net.load_state_dict(state[name])
+    assert torch.equal(other['actor'][0].weight, nets['actor'][0].weight)
+
+
+def test_half_policy_snapshot_is_smaller(tmp_path):
+    nets = {'actor': nn.Linear(64, 256)}
+    save_policy(tmp_path / 'full.pth', nets)
+    save_policy(tmp_path / 'half.pth', nets, dtype=torch.float16)
+    assert (tmp_path / 'half.pth').stat().st_size < 0.6 * (tmp_path / 'full.pth').stat().st_size
+    state, _ = load_policy(tmp_path / 'half.pth')
+    assert state['actor']['weight'].dtype == torch.float16
+    torch.testing.assert_close(state['actor']['weight'].float(), nets['actor'].weight.detach(),
+                               rtol=1e-3, atol=1e-3)
+    torch.save({}, tmp_path / 'torch.pth')
+    assert not is_policy(tmp_path / 'torch.pth')
@@ -0,0 +1,109 @@
+"""Unit tests for the memoized get_lane_center of gym_carla, run on the mock_carla map"""
+import contextlib
+import io
+import logging
+
+import numpy as np
+import pytest
+
+import mock_carla
+carla = mock_carla.install()
+
+from gym_carla.multi_lane.util import misc
+from gym_carla.multi_lane.util.misc import LaneCenterCache, compute_lane_center
+from gym_carla.multi_lane.util.wrapper import lane_center_reward
+
+
+@pytest.fixture
+def town():
+    return carla.Client('localhost', 2400).load_world('Town05_Opt').get_map()
+
+
+def sample_locations(town, number, seed=0):
+    """Points spread over the driving lanes and the shoulder, with their distance to the closest lane boundary"""
+    rng = np.random.default_rng(seed)
+    locations, margins = [], []
+    boundaries = np.cumsum([0.] + [lane.width for lane in town.lanes])
+    for _ in range(number):
+        road = town.roads[rng.integers(len(town.roads))]
+        s, t = rng.uniform(0., road.length), rng.uniform(0., town.width - 3.)
+        x, y, _ = road.point(s, t)
+        locations.append(carla.Location(x=x, y=y, z=rng.uniform(0., 0.5)))
+        margins.append(np.min(np.abs(boundaries - t)))
+    return locations, np.array(margins)
+
+
+def test_cache_matches_live_lane_center(town):
+    cache = LaneCenterCache(town)
+    locations, margins = sample_locations(town, 2000)
+    tolerance = cache.resolution * np.sqrt(0.5)
+    mismatched = 0
+    for location, margin in zip(locations, margins):
+        expected = compute_lane_center(town, location)
+        cached = cache.get(location)
+        assert cached.road_id == expected.road_id or cached.transform.location.distance(
+            expected.transform.location) < tolerance
+        if cached.lane_id != expected.lane_id:
+            # only a location about one cell from a lane boundary may land on the neighbouring lane
+            assert margin < tolerance
+            mismatched += 1
+            continue
+        assert cached.transform.location.distance(expected.transform.location) < tolerance + 1e-6
+    assert mismatched < 0.05 * len(locations)
+    # the second pass is served from the grid
+    misses = cache.misses
+    for location in locations:
+        cache.get(location)
+    assert cache.misses == misses and cache.hits >= len(locations)
+
+
+def test_cache_is_shared_per_map(town, monkeypatch):
+    monkeypatch.setattr(misc, '_lane_center_caches', {})
+    location = carla.Location(x=50., y=-2., z=0.3)
+    lane_center = misc.get_lane_center(town, location)
+    cache = LaneCenterCache.of(town)
+    assert lane_center is cache.get(location) and len(cache) >= 1
+    # the same map loaded again reuses the filled grid
+    reloaded = carla.Client('localhost', 2401).load_world('Town05_Opt').get_map()
+    assert LaneCenterCache.of(reloaded) is cache
+    assert misc.get_lane_center(reloaded, location) is lane_center
+
+
+def test_precompute_fills_lane_center_lines(town):
+    cache = LaneCenterCache(town, precompute_roads={12})
+    assert len(cache) > 3 * town.roads[0].length / cache.resolution * 0.9
+    misses = cache.misses
+    waypoint = town.get_waypoint(carla.Location(x=100., y=0., z=0.))
+    assert waypoint.road_id == 12
+    cache.get(waypoint.transform.location)
+    assert cache.misses == misses
+
+
+def test_lane_center_reward_is_not_memoized(monkeypatch):
+    from gym_carla.multi_lane.settings import ARGS
+    from gym_carla.multi_lane.carla_env import CarlaEnv
+    monkeypatch.setattr(misc, '_lane_center_caches', {})
+    args = ARGS.parse_args(['--port', '2402'])
+    args.pre_train_steps = 0
+    args.num_of_vehicles = [10]
+    action_param = np.array([[0.0, 0.3, 0.0, 0.3, 0.0, 0.3]])
+    logging.disable(logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = CarlaEnv(args)
+            env.reset()
+            checked = 0
+            for _ in range(30):
+                _, _, truncated, done, _ = env.step(1, action_param)
+                if truncated or done:
+                    env.reset()
+                    continue
+                location = env.ego_vehicle.get_location()
+                # the step filled the cell of the ego, the reward still measures from the exact lane center
+                assert LaneCenterCache.of(env.map).get(location).lane_id == env.current_lane
+                expected, _ = lane_center_reward(compute_lane_center(env.map, location), location)
+                assert env.step_info['offlane'] == pytest.approx(expected, abs=1e-6)
+                checked += 1
+    finally:
+        logging.disable(logging.NOTSET)
+    assert checked > 10
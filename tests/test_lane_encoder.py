@@ -0,0 +1,52 @@
+"""Unit tests for the fused lane encoder in algs.util.lane_encoder"""
+import torch
+
+from algs.util.lane_encoder import (lane_wise_cross_attention_encoder, FusedLaneEncoder, fuse_lane_encoders,
+                                    split_lane_encoders, match_lane_encoder_layout)
+
+S_DIM = {'waypoints': 30, 'hero_vehicle': 6, 'companion_vehicle': 4, 'light': 3}
+LANE_SIZE = 30 + 2 * 4 + 3
+
+
+class ThreeLanes(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.left_encoder = lane_wise_cross_attention_encoder(S_DIM)
+        self.center_encoder = lane_wise_cross_attention_encoder(S_DIM)
+        self.right_encoder = lane_wise_cross_attention_encoder(S_DIM)
+
+    def forward(self, lanes, ego_info):
+        return torch.cat([encoder(lanes[:, i * LANE_SIZE:(i + 1) * LANE_SIZE], ego_info) for i, encoder in
+                          enumerate((self.left_encoder, self.center_encoder, self.right_encoder))], dim=1)
+
+
+class Fused(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.fused_encoder = FusedLaneEncoder(S_DIM)
+
+
+def test_fused_encoder_matches_three_lane_encoders():
+    torch.manual_seed(0)
+    lanes_net, fused_net = ThreeLanes(), Fused()
+    fused_net.load_state_dict(fuse_lane_encoders(lanes_net.state_dict()))
+    lanes, ego_info = torch.randn(17, 3 * LANE_SIZE), torch.randn(17, 6)
+    torch.testing.assert_close(fused_net.fused_encoder(lanes, ego_info), lanes_net(lanes, ego_info),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_lane_encoder_layouts_round_trip():
+    torch.manual_seed(1)
+    lanes_net, fused_net = ThreeLanes(), Fused()
+    state_dict = lanes_net.state_dict()
+    round_trip = split_lane_encoders(fuse_lane_encoders(state_dict))
+    assert round_trip.keys() == state_dict.keys()
+    for key in state_dict:
+        torch.testing.assert_close(round_trip[key], state_dict[key], rtol=0, atol=0)
+
+    fused_dict, converted = match_lane_encoder_layout(state_dict, fused_net)
+    assert converted
+    fused_net.load_state_dict(fused_dict)
+    assert match_lane_encoder_layout(fused_dict, fused_net) == (fused_dict, False)
+    lanes_dict, converted = match_lane_encoder_layout(fused_net.state_dict(), lanes_net)
+    assert converted and lanes_dict.keys() == state_dict.keys()
@@ -0,0 +1,89 @@
+"""Unit tests for the precomputed lane graph of LocalPlanner, run on the mock_carla map"""
+import numpy as np
+import pytest
+
+import mock_carla
+carla = mock_carla.install()
+
+from gym_carla.multi_lane.agent import lane_graph
+from gym_carla.multi_lane.agent.lane_graph import LaneGraph
+from gym_carla.multi_lane.agent.local_planner import LocalPlanner
+
+RADIUS = 1.0
+
+
+@pytest.fixture
+def world():
+    client = carla.Client('localhost', 2200)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    world.apply_settings(settings)
+    return world
+
+
+def test_graph_links_lanes(world):
+    town = world.get_map()
+    graph = LaneGraph.build(town, RADIUS)
+    assert set(np.unique(graph.lane_id).tolist()) == {-1, -2, -3}
+    for node in range(0, graph.size, 97):
+        assert graph.waypoint(node).transform.location.distance(carla.Location(*graph.location[node].tolist())) < 1e-3
+    assert np.all(graph.successor >= 0) and np.all(graph.predecessor >= 0)
+    # following the successors goes around the loop with about RADIUS spacing
+    visited = []
+    node = 0
+    while node not in visited:
+        visited.append(node)
+        node = graph.successor[node]
+    lap = len(visited) - visited.index(node)
+    assert abs(lap - town.length / RADIUS) < len(town.roads)
+    # left and right are inverse of each other and stay on the same road
+    has_right = np.flatnonzero(graph.right >= 0)
+    assert np.all(graph.left[graph.right[has_right]] == has_right)
+    assert np.all(graph.road_id[graph.right[has_right]] == graph.road_id[has_right])
+    assert np.all(graph.lane_id[graph.right[has_right]] == graph.lane_id[has_right] - 1)
+
+
+def test_graph_disk_cache(world, tmp_path, monkeypatch):
+    town = world.get_map()
+    monkeypatch.setattr(lane_graph, '_graphs', {})
+    built = LaneGraph.load(town, RADIUS, str(tmp_path))
+    assert (tmp_path / 'lane_graph_Town05_Opt_1.npz').exists()
+    assert LaneGraph.load(town, RADIUS, str(tmp_path)) is built
+
+    monkeypatch.setattr(lane_graph, '_graphs', {})
+    loaded = LaneGraph.load(town, RADIUS, str(tmp_path))
+    assert loaded is not built
+    for field in LaneGraph.NODE_FIELDS:
+        assert np.array_equal(getattr(loaded, field), getattr(built, field))
+    ahead = [wp.transform.location for wp in loaded.waypoints(123, 20)]
+    expected = [wp.transform.location for wp in built.waypoints(123, 20)]
+    assert len(ahead) == 20 and all(a.distance(b) < 1e-6 for a, b in zip(ahead, expected))
+
+
+def test_planner_matches_waypoint_walk(world, tmp_path, monkeypatch):
+    town = world.get_map()
+    monkeypatch.setattr(lane_graph, '_graphs', {})
+    ego = world.spawn_actor(world.get_blueprint_library().find('vehicle.tesla.model3'), town.get_spawn_points()[0])
+    world.tick()
+    planner = LocalPlanner(ego, {'sampling_resolution': RADIUS, 'buffer_size': 50, 'vehicle_proximity': 50.,
+                                 'traffic_light_proximity': 50., 'lane_graph_dir': str(tmp_path)})
+    graph = planner._lane_graph
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        road = town.roads[rng.integers(len(town.roads))]
+        lane = town.driving_lanes[rng.integers(len(town.driving_lanes))]
+        pose = carla.Waypoint(town, road, lane, rng.uniform(0., road.length)).transform
+        ego.set_transform(pose)
+        world.tick()
+        fast = planner._get_waypoints()
+        # a lane missing from the graph makes the planner walk the waypoints on the server
+        monkeypatch.setattr(graph, 'node', lambda waypoint: -1)
+        walked = planner._get_waypoints()
+        monkeypatch.undo()
+        for key, wps in walked.items():
+            assert len(fast[key]) == len(wps)
+            for a, b in zip(fast[key], wps):
+                assert a.lane_id == b.lane_id
+                # nodes sit on a fixed grid, the walk starts from the exact lane center
+                assert a.transform.location.distance(b.transform.location) < 1.5 * RADIUS
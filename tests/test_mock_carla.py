@@ -0,0 +1,143 @@
+"""Unit tests for the offline CARLA stand-in in mock_carla"""
+import math
+
+import numpy as np
+import pytest
+
+import mock_carla as carla
+from mock_carla import command
+
+
+@pytest.fixture
+def world():
+    client = carla.Client('localhost', 2100)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    return world
+
+
+def test_waypoint_round_trip(world):
+    town = world.get_map()
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        road = town.roads[rng.integers(len(town.roads))]
+        lane = town.lanes[rng.integers(len(town.lanes))]
+        wp = carla.Waypoint(town, road, lane, rng.uniform(1e-3, road.length - 1e-3))
+        back = town.get_waypoint(wp.transform.location, lane_type=carla.LaneType.Any)
+        assert (back.road_id, back.lane_id) == (wp.road_id, wp.lane_id)
+        assert back.s == pytest.approx(wp.s, abs=1e-6)
+    # the driving lane default projects shoulder and sidewalk points onto the outer driving lane
+    sidewalk = town.get_waypoint(town.get_spawn_points()[0].location)
+    while sidewalk.get_right_lane() is not None:
+        sidewalk = sidewalk.get_right_lane()
+    assert sidewalk.lane_type == carla.LaneType.Sidewalk
+    assert town.get_waypoint(sidewalk.transform.location).lane_id == -3
+
+
+def test_waypoint_navigation(world):
+    town = world.get_map()
+    wp = town.get_waypoint(town.get_spawn_points()[0].location)
+    assert wp.lane_id == -1 and wp.get_left_lane() is None
+    right = wp.get_right_lane()
+    assert right.lane_id == -2 and right.transform.location.distance(wp.transform.location) == pytest.approx(3.5)
+    # walking the whole loop forward comes back to the start, backward undoes forward
+    steps = int(town.length)
+    walker = wp
+    for _ in range(steps):
+        walker = walker.next(1.)[0]
+    walker = walker.next(town.length - steps)[0]
+    assert walker.transform.location.distance(wp.transform.location) < 1e-6
+    assert wp.next(7.)[0].previous(7.)[0].transform.location.distance(wp.transform.location) < 1e-6
+    # topology segments chain into each other
+    topology = town.get_topology()
+    entries = {entry.id for entry, _ in topology}
+    assert all(exit.id in entries for _, exit in topology)
+
+
+def test_autopilot_keeps_lane_and_speed(world):
+    client = carla.Client('localhost', 2100)
+    tm = client.get_trafficmanager(8000)
+    tm.global_percentage_speed_difference(-100)
+    tm.set_global_distance_to_leading_vehicle(10)
+    town = world.get_map()
+    blueprint = world.get_blueprint_library().find('vehicle.audi.etron')
+    batch = [command.SpawnActor(blueprint, transform).then(command.SetAutopilot(command.FutureActor, True, 8000))
+             for transform in town.get_spawn_points()[::9]]
+    responses = client.apply_batch_sync(batch, True)
+    assert not any(response.has_error() for response in responses)
+    for _ in range(300):
+        world.tick()
+    vehicles = world.get_actors([response.actor_id for response in responses])
+    assert len(vehicles) == len(batch)
+    for vehicle in vehicles:
+        location = vehicle.get_location()
+        assert town.get_waypoint(location).transform.location.distance(location) < 0.05
+        assert vehicle.get_control().throttle + vehicle.get_control().brake > 0.
+    speeds = [3.6 * math.hypot(v.get_velocity().x, v.get_velocity().y) for v in vehicles]
+    assert max(speeds) <= 2 * 30. + 1e-3 and np.median(speeds) > 40.
+
+
+def test_manual_control_and_sensors(world):
+    town = world.get_map()
+    library = world.get_blueprint_library()
+    spawn = town.get_spawn_points()[0]
+    ego = world.spawn_actor(library.find('vehicle.tesla.model3'), spawn)
+    with pytest.raises(RuntimeError):
+        world.spawn_actor(library.find('vehicle.tesla.model3'), spawn)
+    collisions, invasions = [], []
+    world.spawn_actor(library.find('sensor.other.collision'), carla.Transform(), attach_to=ego).listen(
+        collisions.append)
+    world.spawn_actor(library.find('sensor.other.lane_invasion'), carla.Transform(), attach_to=ego).listen(
+        invasions.append)
+
+    ego.apply_control(carla.VehicleControl(throttle=1.))
+    for _ in range(20):
+        world.tick()
+    forward = spawn.get_forward_vector()
+    moved = ego.get_location() - spawn.location
+    assert moved.dot(forward) > 5. and ego.get_velocity().length() > 5.
+    assert not collisions and not invasions
+
+    # steering right crosses the lane markings
+    ego.apply_control(carla.VehicleControl(throttle=.5, steer=.3))
+    for _ in range(20):
+        world.tick()
+    assert invasions and all(event.crossed_lane_markings for event in invasions)
+
+    # a parked car right ahead of another vehicle triggers its collision sensor
+    rear = town.get_spawn_points()[1]
+    follower = world.spawn_actor(library.find('vehicle.audi.tt'), rear)
+    ahead = carla.Transform(rear.location + 12. * rear.get_forward_vector(), rear.rotation)
+    parked = world.spawn_actor(library.find('vehicle.toyota.prius'), ahead)
+    hits = []
+    world.spawn_actor(library.find('sensor.other.collision'), carla.Transform(), attach_to=follower).listen(
+        hits.append)
+    follower.apply_control(carla.VehicleControl(throttle=1.))
+    for _ in range(40):
+        world.tick()
+        if hits:
+            break
+    assert hits and hits[0].other_actor.id == parked.id and hits[0].normal_impulse.length() > 0.
+
+
+def test_snapshot_matches_actors(world):
+    town = world.get_map()
+    library = world.get_blueprint_library()
+    vehicles = [world.spawn_actor(library.find('vehicle.lincoln.mkz_2020'), transform)
+                for transform in town.get_spawn_points()[:5]]
+    for vehicle in vehicles:
+        vehicle.set_autopilot(True)
+    world.tick()
+    snapshot = world.get_snapshot()
+    assert snapshot is world.get_snapshot() and snapshot.frame == world.get_snapshot().timestamp.frame
+    for vehicle in vehicles:
+        assert snapshot.has_actor(vehicle.id)
+        actor = snapshot.find(vehicle.id)
+        assert actor.get_transform().location.distance(vehicle.get_location()) < 1e-9
+        assert actor.get_velocity().x == pytest.approx(vehicle.get_velocity().x)
+    vehicles[0].destroy()
+    world.tick()
+    assert not world.get_snapshot().has_actor(vehicles[0].id)
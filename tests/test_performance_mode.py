@@ -0,0 +1,65 @@
+"""Mixed precision training of the P-DQN / P-SAC learners against fp32, runs on the CPU (bfloat16 autocast)"""
+import copy
+import random
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("macad_gym.viz.logger")
+from algs.pdqn import P_DQN
+from algs.psac import P_SAC
+
+S_DIM = {'waypoints': 10, 'hero_vehicle': 6, 'companion_vehicle': 4, 'light': 3}
+A_BOUND = {'steer': 1.0, 'throttle': 1.0, 'brake': 1.0}
+CPU = torch.device('cpu')
+
+
+def make_pdqn():
+    return P_DQN(copy.deepcopy(S_DIM), 2, A_BOUND, 0.9, 0.01, 0.5, 0.3, 0.5, 0.05, 0.5,
+                 1000, 64, 2e-4, 2e-4, 10, True, True, False, CPU)
+
+
+def make_psac():
+    return P_SAC(copy.deepcopy(S_DIM), 2, A_BOUND, 0.9, 0.01, 1000, 64, 2e-4, 2e-4, 2e-4,
+                 10, True, True, False, CPU)
+
+
+def make_state(rng):
+    return {'left_waypoints': rng.normal(size=(10, 3)), 'center_waypoints': rng.normal(size=(10, 3)),
+            'right_waypoints': rng.normal(size=(10, 3)), 'vehicle_info': rng.normal(size=(6, 4)),
+            'light': rng.normal(size=3), 'hero_vehicle': rng.normal(size=6)}
+
+
+def loss_trajectory(make_agent, amp, learn_steps=20):
+    torch.manual_seed(0)
+    agent = make_agent()
+    rng = np.random.default_rng(0)
+    for i in range(300):
+        agent.store_transition(make_state(rng), int(rng.integers(3)), rng.uniform(-1, 1, size=(1, 6)),
+                               float(rng.normal()), make_state(rng), False, bool(rng.random() < 0.05), {})
+    agent.set_performance_mode(amp=amp)
+    losses = []
+    for i in range(learn_steps):
+        # both runs sample the same batches
+        np.random.seed(i)
+        random.seed(i)
+        torch.manual_seed(i)
+        losses.append(float(agent.learn()))
+    return np.array(losses)
+
+
+@pytest.mark.parametrize("make_agent", [make_pdqn, make_psac])
+def test_amp_loss_trajectory_follows_fp32(make_agent):
+    fp32 = loss_trajectory(make_agent, amp=False)
+    amp = loss_trajectory(make_agent, amp=True)
+    assert np.all(np.isfinite(amp))
+    np.testing.assert_allclose(amp, fp32, rtol=2e-2, atol=1e-3)
+
+
+@pytest.mark.parametrize("make_agent", [make_pdqn, make_psac])
+def test_fp32_training_without_torch_amp(make_agent, monkeypatch):
+    # torch releases before torch.amp.GradScaler / torch.autocast
+    monkeypatch.delattr(torch.amp, 'GradScaler')
+    monkeypatch.delattr(torch, 'autocast')
+    losses = loss_trajectory(make_agent, amp=False, learn_steps=3)
+    assert np.all(np.isfinite(losses))
@@ -0,0 +1,264 @@
+"""Unit tests for the replay buffers in algs.util.replay_buffer"""
+import numpy as np
+import pytest
+
+from algs.util.replay_buffer import (ReplayBuffer, SplitReplayBuffer, SumTree, PriReplayBuffer,
+                                     open_or_persist, ReplayFlusher)
+
+
+def make_transition(i):
+    state = np.full((1, 5), i, dtype=np.float32)
+    next_state = state + 1
+    return (state, i % 3, np.ones((1, 2)) * i, float(i), next_state, False, i % 7 == 0, {'step': i})
+
+
+def test_replay_buffer_sample_shapes():
+    buffer = ReplayBuffer(100)
+    for i in range(50):
+        buffer.add(make_transition(i))
+    b_s, b_a, b_a_param, b_r, b_ns, b_t, b_d, b_i = buffer.sample(32)
+    assert b_s.shape == (32, 1, 5) and b_s.dtype == np.float32
+    assert b_a_param.shape == (32, 1, 2)
+    assert b_r.shape == (32,)
+    assert b_i.dtype == object
+    # every field of a sampled row belongs to the same transition
+    np.testing.assert_array_equal(b_ns, b_s + 1)
+    np.testing.assert_array_equal(b_r, b_s[:, 0, 0])
+    assert [info['step'] for info in b_i] == list(b_r.astype(int))
+
+
+def test_replay_buffer_ring_overwrite():
+    buffer = ReplayBuffer(10)
+    for i in range(25):
+        buffer.add(make_transition(i))
+    assert buffer.size() == 10
+    b_s = buffer.sample(200)[0]
+    assert set(b_s[:, 0, 0].astype(int)) <= set(range(15, 25))
+
+
+def test_split_replay_buffer_mixes_change_buffer():
+    buffer = SplitReplayBuffer(100)
+    for i in range(100):
+        transition = make_transition(i)[:7]
+        if i % 10 == 0:
+            buffer.add(transition, False)
+        buffer.add(transition, True)
+    b_s, b_a, b_a_param, b_r, b_ns, b_t, b_d = buffer.sample(20)
+    assert b_s.shape == (20, 1, 5)
+    # the second half of the batch comes from the change buffer
+    assert np.all(b_r[10:] % 10 == 0)
+
+
+def test_split_replay_buffer_empty_change_buffer():
+    buffer = SplitReplayBuffer(100)
+    for i in range(20):
+        buffer.add(make_transition(i)[:7], True)
+    assert buffer.sample(8)[0].shape == (8, 1, 5)
+
+
+def test_sum_tree_batch_update_keeps_sums():
+    tree = SumTree(13)
+    for i in range(9):
+        tree.add(1., make_transition(i))
+    leaf_idx = np.array([12, 14, 14, 20])
+    tree.batch_update(leaf_idx, np.array([0.5, 3., 2., 4.]))
+    leaves = tree.tree[tree.capacity - 1:]
+    np.testing.assert_allclose(tree.total_p, 9 - 3 + 0.5 + 2. + 4.)
+    np.testing.assert_allclose(tree.total_p, leaves.sum())
+    for node in range(tree.capacity - 1):
+        assert tree.tree[node] == tree.tree[2 * node + 1] + tree.tree[2 * node + 2]
+
+
+def test_sum_tree_get_leaves_matches_cumsum():
+    tree = SumTree(37)
+    rng = np.random.default_rng(0)
+    for i in range(30):
+        tree.add(rng.uniform(0.1, 1.), make_transition(i))
+
+    def in_order(node):
+        if node >= tree.capacity - 1:
+            return [node]
+        return in_order(2 * node + 1) + in_order(2 * node + 2)
+
+    # leaves are not stored left to right when the capacity is not a power of two
+    order = np.array([node for node in in_order(0) if tree.tree[node] > 0])
+    v = rng.uniform(0., tree.total_p, size=500)
+    leaf_idx, p, data_idx = tree.get_leaves(v)
+    expected = order[np.searchsorted(np.cumsum(tree.tree[order]), v)]
+    np.testing.assert_array_equal(leaf_idx, expected)
+    np.testing.assert_array_equal(p, tree.tree[expected])
+    np.testing.assert_array_equal(data_idx, expected - tree.capacity + 1)
+
+
+def test_pri_replay_buffer_sample_and_update():
+    buffer = PriReplayBuffer(64)
+    for i in range(40):
+        buffer.add(make_transition(i))
+    b_idx, ISWeights, (b_s, b_a, b_a_param, b_r, b_ns, b_t, b_d, b_i) = buffer.sample(16)
+    assert b_idx.shape == (16,) and ISWeights.shape == (16, 1)
+    np.testing.assert_array_equal(b_r, b_s[:, 0, 0])
+    np.testing.assert_array_equal(b_idx - buffer.tree.capacity + 1, b_r.astype(int))
+    buffer.batch_update(b_idx, np.zeros(16))
+    np.testing.assert_allclose(buffer.tree.tree[b_idx], buffer.epsilon ** buffer.alpha)
+
+
+def test_sum_tree_tracks_max_and_min_priority():
+    tree = SumTree(10)
+    rng = np.random.default_rng(1)
+    for i in range(25):
+        tree.add(rng.uniform(0.1, 2.), make_transition(i))
+        leaves = tree.tree[tree.capacity - 1:tree.capacity - 1 + tree.size]
+        assert tree.max_p == leaves.max() and tree.min_p == leaves.min()
+    leaf_idx = np.array([9, 12, 18])
+    tree.batch_update(leaf_idx, np.array([5., 0.01, 1.]))
+    leaves = tree.tree[tree.capacity - 1:]
+    assert tree.max_p == leaves.max() == 5. and tree.min_p == leaves.min() == 0.01
+    np.testing.assert_allclose(tree.total_p, leaves.sum())
+
+
+def test_pri_replay_buffer_drops_late_updates_of_overwritten_leaves():
+    buffer = PriReplayBuffer(4)
+    for i in range(4):
+        buffer.add(make_transition(i))
+    b_idx = np.arange(4) + buffer.tree.capacity - 1
+    b_stamp = buffer.stamps(b_idx)
+    buffer.add(make_transition(4))   # overwrites the first slot before its priority comes back
+    buffer.batch_update(b_idx, np.full(4, 0.5), b_stamp)
+    np.testing.assert_allclose(buffer.tree.tree[b_idx[1:]], 0.51 ** buffer.alpha)
+    assert buffer.tree.tree[b_idx[0]] == buffer.abs_err_upper
+
+
+def test_pri_replay_buffer_persist_and_reopen(tmp_path):
+    buffer = PriReplayBuffer(16)
+    for i in range(10):
+        buffer.add(make_transition(i))
+    buffer.persist(str(tmp_path))
+    # transitions and priorities written after persist go straight to the files
+    for i in range(10, 20):
+        buffer.add(make_transition(i))
+    b_idx = np.arange(4) + buffer.tree.capacity - 1
+    buffer.batch_update(b_idx, np.array([0.1, 0.2, 0.3, 0.4]))
+    buffer.sample(8)
+    buffer.flush()
+
+    reopened = PriReplayBuffer.open(str(tmp_path))
+    assert isinstance(reopened.tree.tree, np.memmap)
+    assert reopened.size() == buffer.size() == 16 and reopened.beta == buffer.beta
+    assert reopened.tree.data_pointer == buffer.tree.data_pointer
+    for attr in ('tree', 'max_tree', 'min_tree'):
+        tree, reopened_tree = getattr(buffer.tree, attr), getattr(reopened.tree, attr)
+        np.testing.assert_array_equal(getattr(tree, 'tree', tree), getattr(reopened_tree, 'tree', reopened_tree))
+    np.testing.assert_array_equal(reopened.stamps(b_idx), buffer.stamps(b_idx))
+    for field, reopened_field in zip(buffer.tree.data.fields[:-1], reopened.tree.data.fields[:-1]):
+        np.testing.assert_array_equal(field, reopened_field)
+    assert reopened.tree.data.fields[-1][0] is None     # the info dicts are not saved
+
+    np.random.seed(3)
+    expected = buffer.sample(8)
+    np.random.seed(3)
+    result = reopened.sample(8)
+    np.testing.assert_array_equal(expected[0], result[0])
+    np.testing.assert_allclose(expected[1], result[1])
+    for field, reopened_field in zip(expected[2][:-1], result[2][:-1]):
+        np.testing.assert_array_equal(field, reopened_field)
+
+
+@pytest.mark.parametrize('buffer_type', [ReplayBuffer, SplitReplayBuffer, PriReplayBuffer])
+def test_open_or_persist_resumes_the_ring(tmp_path, buffer_type):
+    path = str(tmp_path / 'replay')
+    buffer = open_or_persist(buffer_type(100), path)
+    for i in range(30):
+        buffer.add(make_transition(i))
+    flusher = ReplayFlusher(buffer, interval=0.01).start()
+    flusher.stop()
+
+    reopened = open_or_persist(buffer_type(100), path)
+    assert reopened.size() == 30
+    reopened.add(make_transition(30))
+    assert reopened.size() == 31
+    with pytest.raises(ValueError):
+        open_or_persist(ReplayBuffer(100) if buffer_type is not ReplayBuffer else PriReplayBuffer(100), path)
+
+
+def make_offline_rows(n, rng):
+    rows = rng.uniform(0, 1, size=(n, 66)).astype(np.float32)
+    rows[:, 0] = np.arange(n)   # row number in the first state value
+    rows[:, 61] = 10.       # efficient
+    rows[:, 19] = rows[:, 1]  # straight
+    rows[:, 59] = 0.
+    rows[:, 62] = 0.
+    rows[0:10, 59] = -1.    # dangerous
+    rows[5:20, 62] = 1.     # off center, the first five are dangerous already
+    rows[20:30, 61] = 1.    # low efficiency
+    rows[30:40, 19] += 1.   # on curve
+    return rows
+
+
+def test_offline_replay_buffer_categories_and_quotas(tmp_path):
+    from algs.util.replay_buffer import OfflineReplayBuffer
+    rows = make_offline_rows(200, np.random.default_rng(0))
+    np.save(tmp_path / 'all_replay_buffer.npy', rows)
+    buffer = OfflineReplayBuffer(str(tmp_path / 'all_replay_buffer.npy'))
+    assert isinstance(buffer.replay_buffer, np.memmap) and buffer.size() == 200
+    np.testing.assert_array_equal(buffer.dangerous_buffer, np.arange(10))
+    np.testing.assert_array_equal(buffer.off_center_buffer, np.arange(10, 20))
+    np.testing.assert_array_equal(buffer.low_efficiency_buffer, np.arange(20, 30))
+    np.testing.assert_array_equal(buffer.on_curve_buffer, np.arange(30, 40))
+    np.testing.assert_array_equal(buffer.normal_buffer, np.arange(40, 200))
+
+    state, action, reward, next_state, truncated, done = buffer.sample(64)
+    assert state.shape == (64, 28) and action.shape == (64, 2) and next_state.shape == (64, 28)
+    assert reward.shape == truncated.shape == done.shape == (64, 1)
+    row = state[:, 0].astype(int)
+    np.testing.assert_array_equal(reward[:, 0], rows[row, 58])
+    # 64 // 6 rows of each special state, the rest normal ones
+    assert np.all(row[:40] < 40) and np.all(row[40:] >= 40)
+    assert np.bincount(row[:40] // 10, minlength=4).tolist() == [10, 10, 10, 10]
+
+
+def test_offline_replay_buffer_gives_empty_quotas_to_normal_rows(tmp_path):
+    from algs.util.replay_buffer import OfflineReplayBuffer
+    rows = make_offline_rows(100, np.random.default_rng(1))
+    rows[:, 59] = 0.    # no dangerous rows
+    np.save(tmp_path / 'all_replay_buffer.npy', rows)
+    buffer = OfflineReplayBuffer(str(tmp_path / 'all_replay_buffer.npy'))
+    assert len(buffer.dangerous_buffer) == 0
+    state = buffer.sample(60)[0]
+    assert state.shape == (60, 28)
+
+
+def columns_of(transitions):
+    return [np.array([transition[i] for transition in transitions]) if i != 7 else [transition[i] for transition in transitions]
+            for i in range(len(transitions[0]))]
+
+
+@pytest.mark.parametrize('batches', [[5, 7, 30], [3, 70]])
+def test_add_batch_matches_single_adds(batches):
+    transitions = [make_transition(i) for i in range(sum(batches))]
+    single, batched = PriReplayBuffer(16), PriReplayBuffer(16)
+    for transition in transitions:
+        single.add(transition)
+    start = 0
+    for size in batches:
+        batched.add_batch(columns_of(transitions[start:start + size]))
+        start += size
+    assert batched.size() == single.size() and batched.tree.data_pointer == single.tree.data_pointer
+    np.testing.assert_array_equal(batched.tree.data.stamps, single.tree.data.stamps)
+    for field, batched_field in zip(single.tree.data.fields[:-1], batched.tree.data.fields[:-1]):
+        np.testing.assert_array_equal(field, batched_field)
+    assert [info['step'] for info in batched.tree.data.fields[-1]] == [info['step'] for info in single.tree.data.fields[-1]]
+    for attr in ('tree', 'max_tree', 'min_tree'):
+        tree, batched_tree = getattr(single.tree, attr), getattr(batched.tree, attr)
+        np.testing.assert_allclose(getattr(batched_tree, 'tree', batched_tree), getattr(tree, 'tree', tree))
+
+
+def test_add_batch_of_split_and_uniform_buffers():
+    transitions = [make_transition(i) for i in range(30)]
+    buffer = ReplayBuffer(20)
+    buffer.add_batch(columns_of(transitions))
+    assert buffer.size() == 20
+    assert set(buffer.sample(100)[0][:, 0, 0].astype(int)) <= set(range(10, 30))
+    split = SplitReplayBuffer(100)
+    split.add_batch(columns_of([transition[:7] for transition in transitions]))
+    split.add_batch(columns_of([transition[:7] for transition in transitions[:5]]), False)
+    assert split.size() == 30 and len(split.change_buffer) == 5
@@ -0,0 +1,125 @@
+"""Unit tests for the shared memory replay ring in algs.util.shared_replay"""
+import multiprocessing as mp
+import numpy as np
+import pytest
+
+from algs.util.shared_replay import SharedTransitionRing, SharedPriReplayBuffer
+
+WIDTHS = [4, 1, 2, 1, 4, 1, 1]
+
+
+def make_row(worker_index, i):
+    # every field of a row encodes the writer and its write count, so torn rows are easy to spot
+    return np.full(sum(WIDTHS), worker_index * 10000 + i, dtype=np.float32)
+
+
+def write_rows(spec, worker_index, number):
+    ring = SharedTransitionRing.attach(spec)
+    writer = ring.writer(worker_index)
+    for i in range(number):
+        writer.write(make_row(worker_index, i))
+    writer.report_episode(number)
+    ring.close()
+
+
+def test_ring_writes_wrap_per_worker():
+    ring = SharedTransitionRing.create(2, 8, WIDTHS)
+    try:
+        writer = ring.writer(1)
+        for i in range(11):
+            writer.write(make_row(1, i))
+        assert ring.size() == 8
+        assert list(ring.committed) == [0, 11]
+        # the writer wrapped around its own segment and left the first one alone
+        np.testing.assert_array_equal(ring.rows[8:11, 0], [10008, 10009, 10010])
+        assert np.all(ring.rows[:8] == 0)
+        rows, seq, valid = ring.read(np.arange(8, 16))
+        assert valid.all() and np.all(seq % 2 == 0)
+        fields = ring.split(rows)
+        assert [field.shape[1] for field in fields] == WIDTHS
+    finally:
+        ring.close()
+
+
+def test_ring_read_rejects_rows_being_written():
+    ring = SharedTransitionRing.create(1, 4, WIDTHS)
+    try:
+        ring.writer(0).write(make_row(0, 1))
+        ring.seq[0] += 1     # the writer is half way through the next row of slot 0
+        rows, seq, valid = ring.read(np.array([0]), retries=3)
+        assert not valid[0]
+    finally:
+        ring.close()
+
+
+def test_shared_pri_replay_buffer_samples_rows_of_worker_processes():
+    ring = SharedTransitionRing.create(3, 50, WIDTHS)
+    try:
+        buffer = SharedPriReplayBuffer(ring)
+        processes = [mp.get_context('spawn').Process(target=write_rows, args=(ring.spec, w, 80)) for w in range(3)]
+        for p in processes:
+            p.start()
+        for _ in range(20):
+            # sample while the workers are writing, every row handed out has to be complete
+            b_idx, ISWeights, fields = buffer.sample(16) if ring.size() > 0 else (None, None, None)
+            if fields is not None:
+                rows = np.concatenate(fields, axis=1)
+                complete = ISWeights[:, 0] > 0
+                assert np.all(rows[complete] == rows[complete, :1])
+        for p in processes:
+            p.join()
+            assert p.exitcode == 0
+        assert buffer.size() == 150 and list(ring.episode) == [80, 80, 80]
+
+        b_idx, ISWeights, (b_s, b_a, b_a_param, b_r, b_ns, b_t, b_d) = buffer.sample(32)
+        assert b_s.shape == (32, 4) and b_a_param.shape == (32, 2)
+        assert np.all(ISWeights > 0)
+        # only the last 50 rows of each writer survive in its segment
+        assert np.all(b_r[:, 0] % 10000 >= 30)
+        b_stamp = buffer.stamps(b_idx)
+        buffer.batch_update(b_idx, np.zeros(32), b_stamp)
+        np.testing.assert_allclose(buffer.tree.tree[b_idx], buffer.epsilon ** buffer.alpha)
+    finally:
+        ring.close()
+
+
+def test_shared_pri_replay_buffer_persist_and_restore(tmp_path):
+    ring = SharedTransitionRing.create(2, 8, WIDTHS)
+    try:
+        buffer = SharedPriReplayBuffer(ring)
+        buffer.persist(str(tmp_path))
+        writer = ring.writer(0)
+        for i in range(5):
+            writer.write(make_row(0, i))
+        buffer.sample(4)
+        writer.write(make_row(0, 5))   # not synced yet, so not part of the next flush
+        buffer.flush()
+        tree, rows = buffer.tree.tree.copy(), ring.rows.copy()
+    finally:
+        ring.close()
+
+    ring = SharedTransitionRing.create(2, 8, WIDTHS)
+    try:
+        buffer = SharedPriReplayBuffer.open(str(tmp_path), ring)
+        assert list(ring.committed) == [5, 0] and buffer.size() == 5
+        np.testing.assert_array_equal(buffer.tree.tree, tree)
+        np.testing.assert_array_equal(ring.rows[:5], rows[:5])
+        b_idx, ISWeights, fields = buffer.sample(16)
+        assert np.all(ISWeights > 0) and set(fields[0][:, 0].astype(int)) <= set(range(5))
+        # the workers go on from the saved cursor
+        ring.writer(0).write(make_row(0, 5))
+        assert ring.rows[5, 0] == 5
+    finally:
+        ring.close()
+
+
+def test_shared_pri_replay_buffer_rejects_learner_inserts():
+    ring = SharedTransitionRing.create(1, 4, WIDTHS)
+    try:
+        replay_buffer = SharedPriReplayBuffer(ring)
+        with pytest.raises(TypeError, match="writer"):
+            replay_buffer.add(make_row(0, 0))
+        with pytest.raises(TypeError, match="writer"):
+            replay_buffer.add_batch([np.zeros((2, width), dtype=np.float32) for width in WIDTHS])
+    finally:
+        ring.close()
@@ -0,0 +1,52 @@
+"""Unit tests for the fused target network updates in algs.util.target_update"""
+import copy
+import torch
+from torch import nn
+
+from algs.util.target_update import soft_update, hard_update, TargetUpdater
+
+
+def make_pair(seed):
+    torch.manual_seed(seed)
+    net = nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 3))
+    target_net = copy.deepcopy(net)
+    for param in target_net.parameters():
+        param.data.normal_()
+    return net, target_net
+
+
+def loop_soft_update(net, target_net, tau):
+    for param_target, param in zip(target_net.parameters(), net.parameters()):
+        param_target.data.copy_(param_target.data * (1.0 - tau) + param.data * tau)
+
+
+def test_soft_update_matches_the_parameter_loop():
+    net, target_net = make_pair(0)
+    expected = copy.deepcopy(target_net)
+    loop_soft_update(net, expected, 0.01)
+    soft_update(net, target_net, 0.01)
+    for param, expected_param in zip(target_net.parameters(), expected.parameters()):
+        torch.testing.assert_close(param, expected_param)
+    assert all(param.requires_grad for param in target_net.parameters())
+
+
+def test_hard_update_copies_target_into_net():
+    net, target_net = make_pair(1)
+    hard_update(net, target_net)
+    for param, target_param in zip(net.parameters(), target_net.parameters()):
+        assert torch.equal(param, target_param)
+
+
+def test_target_updater_runs_every_n_steps_over_all_pairs():
+    (actor, actor_target), (critic, critic_target) = make_pair(2), make_pair(3)
+    expected = [copy.deepcopy(actor_target), copy.deepcopy(critic_target)]
+    updater = TargetUpdater([(actor, actor_target), (critic, critic_target)], 0.1, every=3)
+    assert [updater.step() for _ in range(6)] == [False, False, True, False, False, True]
+    for _ in range(2):
+        loop_soft_update(actor, expected[0], 0.1)
+        loop_soft_update(critic, expected[1], 0.1)
+    for target_net, expected_net in zip((actor_target, critic_target), expected):
+        for param, expected_param in zip(target_net.parameters(), expected_net.parameters()):
+            torch.testing.assert_close(param, expected_param)
+    updater.sync()
+    assert all(torch.equal(a, b) for a, b in zip(actor.parameters(), actor_target.parameters()))
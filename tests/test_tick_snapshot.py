@@ -0,0 +1,93 @@
+"""Unit tests for the per-tick TickSnapshot of gym_carla, run on the mock_carla world"""
+import random
+
+import numpy as np
+import pytest
+
+import mock_carla
+carla = mock_carla.install()
+
+from gym_carla.multi_lane.util.snapshot import TickSnapshot
+from gym_carla.multi_lane.util.wrapper import VehicleWrapper, ttc_reward, process_veh
+
+
+@pytest.fixture
+def traffic():
+    client = carla.Client('localhost', 2500)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    spawn_points = world.get_map().get_spawn_points()
+    random.Random(0).shuffle(spawn_points)
+    library = world.get_blueprint_library()
+    vehicles = [world.spawn_actor(library.find('vehicle.audi.etron'), transform) for transform in spawn_points[:30]]
+    for vehicle in vehicles:
+        vehicle.set_autopilot(True)
+    for _ in range(20):
+        world.tick()
+    return world, vehicles
+
+
+def test_snapshot_matches_actor_getters(traffic):
+    world, vehicles = traffic
+    snapshot = TickSnapshot.capture(world)
+    assert len(snapshot) == len(world.get_actors())
+    for vehicle in vehicles:
+        row = snapshot.row(vehicle)
+        transform, velocity, acceleration = vehicle.get_transform(), vehicle.get_velocity(), vehicle.get_acceleration()
+        assert snapshot.ids[row] == vehicle.id
+        assert snapshot.location[row] == pytest.approx([transform.location.x, transform.location.y, transform.location.z])
+        assert snapshot.yaw[row] == pytest.approx(transform.rotation.yaw)
+        assert snapshot.velocity[row] == pytest.approx([velocity.x, velocity.y, velocity.z])
+        assert snapshot.acceleration[row] == pytest.approx([acceleration.x, acceleration.y, acceleration.z])
+        extent = vehicle.bounding_box.extent
+        assert snapshot.extent[row] == pytest.approx([extent.x, extent.y, extent.z])
+        assert snapshot.get_location(vehicle).distance(transform.location) < 1e-9
+        forward, expected = snapshot.get_forward_vector(vehicle), transform.get_forward_vector()
+        assert [forward.x, forward.y, forward.z] == pytest.approx([expected.x, expected.y, expected.z])
+        assert snapshot.get_speed(vehicle, False) == pytest.approx(np.hypot(velocity.x, velocity.y))
+    assert np.abs(snapshot.velocity).max() > 1.
+
+
+def test_capture_once_per_tick(traffic, monkeypatch):
+    world, vehicles = traffic
+    first = TickSnapshot.capture(world)
+    assert TickSnapshot.capture(world) is first
+    library = world.get_blueprint_library()
+    spawned = world.spawn_actor(library.find('vehicle.tesla.model3'), world.get_map().get_spawn_points()[-1])
+    # spawned after the tick, the actor answers for itself
+    assert spawned not in first and first.get_location(spawned).distance(spawned.get_location()) < 1e-9
+    vehicles[0].destroy()
+
+    calls = []
+    get_actors = world.get_actors
+
+    def counted(actor_ids=None):
+        calls.append(actor_ids)
+        return get_actors(actor_ids)
+    monkeypatch.setattr(world, 'get_actors', counted)
+    world.tick()
+    second = TickSnapshot.capture(world)
+    assert second is not first and second.frame == first.frame + 1
+    # only the box of the spawned actor is fetched, the one of the destroyed actor is dropped
+    assert calls == [[spawned.id]]
+    assert spawned in second and vehicles[0] not in second
+    assert vehicles[0].id not in second._bounding_boxes
+    world.tick()
+    TickSnapshot.capture(world)
+    assert len(calls) == 1
+
+
+def test_rewards_read_the_snapshot(traffic):
+    world, vehicles = traffic
+    snapshot = TickSnapshot.capture(world)
+    ego, others = vehicles[0], vehicles[1:7]
+    vehs_info = VehicleWrapper()
+    (vehs_info.left_front_veh, vehs_info.center_front_veh, vehs_info.right_front_veh,
+     vehs_info.left_rear_veh, vehs_info.center_rear_veh, vehs_info.right_rear_veh) = others
+    for target in others:
+        assert ttc_reward(ego, target, 1., 4., snapshot) == pytest.approx(ttc_reward(ego, target, 1., 4.))
+    assert process_veh(ego, vehs_info, False, False, 50., snapshot) == pytest.approx(
+        process_veh(ego, vehs_info, False, False, 50.))
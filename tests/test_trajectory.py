@@ -0,0 +1,75 @@
+"""Unit tests for the transition post-processing in algs.util.trajectory"""
+import numpy as np
+
+from algs.util.trajectory import TrajectoryProcessor, impact_correction, n_step_returns
+
+
+def make_stream(n, rng, episode_length=7):
+    transitions = []
+    for i in range(n):
+        terminal = i % episode_length == episode_length - 1
+        transitions.append(({'step': i}, i % 3, np.full((1, 3), i), float(rng.uniform(-1, 1)), {'step': i + 1},
+                            terminal and i % 2 == 0, terminal and i % 2 == 1, {'impact': float(rng.uniform(0, 9))}))
+    return transitions
+
+
+def reference(transitions, gamma, n_step):
+    """Plain loop version: impact of the next step, then the n-step window of every step"""
+    reward = []
+    for i, transition in enumerate(transitions):
+        terminal = transition[5] or transition[6]
+        reward.append(transition[3] + (0 if terminal else transitions[i + 1][7]['impact'] / 9))
+    result = []
+    for t in range(len(transitions)):
+        total, k = 0., t
+        for j in range(n_step):
+            k = t + j
+            total += gamma ** j * reward[k]
+            if transitions[k][5] or transitions[k][6]:
+                break
+        result.append((transitions[t][0]['step'], total, transitions[k][4]['step'], transitions[k][5], transitions[k][6]))
+    return result
+
+
+def finished(columns):
+    return [(state['step'], reward, next_state['step'], truncated, done)
+            for state, _, _, reward, next_state, truncated, done, _ in TrajectoryProcessor.rows(columns)]
+
+
+def test_n_step_returns_stop_at_terminal_steps():
+    reward = np.array([1., 2., 3., 4.])
+    terminal = np.array([False, True, False, False])
+    returns, end, stopped = n_step_returns(reward, terminal, 0.5, 3)
+    np.testing.assert_allclose(returns, [1 + 0.5 * 2, 2, 3 + 0.5 * 4, 4])
+    np.testing.assert_array_equal(end, [1, 1, 3, 3])
+    np.testing.assert_array_equal(stopped, [True, True, False, False])
+
+
+def test_processor_matches_reference_across_chunks():
+    rng = np.random.default_rng(0)
+    transitions = make_stream(42, rng)
+    for n_step in (1, 3):
+        processor = TrajectoryProcessor(0.9, n_step, correction=impact_correction)
+        result = []
+        for start in range(0, 42, 5):
+            result += finished(processor.process(0, transitions[start:start + 5]))
+        # the stream ends with a terminal step, so every transition is finished
+        expected = reference(transitions, 0.9, n_step)
+        assert [row[0] for row in result] == [row[0] for row in expected]
+        np.testing.assert_allclose([row[1] for row in result], [row[1] for row in expected])
+        assert [row[2:] for row in result] == [row[2:] for row in expected]
+
+
+def test_processor_keeps_actors_apart():
+    rng = np.random.default_rng(1)
+    first, second = make_stream(6, rng, episode_length=100), make_stream(6, rng, episode_length=100)
+    processor = TrajectoryProcessor(0.9, 2, correction=impact_correction)
+    assert len(processor.process(0, first[:3])[0]) == 1
+    assert len(processor.process(1, second[:3])[0]) == 1
+    columns = processor.process(0, first[3:])
+    # step 1 of actor 0 needs the impact of its own step 3, not the one of actor 1
+    assert columns[0][0]['step'] == 1
+    np.testing.assert_allclose(columns[3][0], first[1][3] + first[2][7]['impact'] / 9 +
+                               0.9 * (first[2][3] + first[3][7]['impact'] / 9))
+    processor.end_episode(1)
+    assert 1 not in processor.pending and len(processor.pending[0][0]) == 2
@@ -0,0 +1,93 @@
+"""Unit tests for the per-tick VehicleIndex of LocalPlanner, run on the mock_carla map"""
+import random
+
+import numpy as np
+import pytest
+
+import mock_carla
+carla = mock_carla.install()
+
+from gym_carla.multi_lane.agent.local_planner import LocalPlanner
+from gym_carla.multi_lane.util import misc
+
+PROXIMITY = 50.
+
+
+def nearest_vehicle(planner, vehicle_list, direction, lane_offset):
+    """The vehicle by vehicle search LocalPlanner._get_vehicles_one_lane ran before the index"""
+    town = planner._map
+    ego = planner._vehicle
+    ego_location, ego_transform = ego.get_location(), ego.get_transform()
+    ego_lane_center = misc.get_lane_center(town, ego_location)
+    if not misc.test_waypoint(ego_lane_center):
+        return None
+    lane_id = ego_lane_center.lane_id - lane_offset
+    if lane_id not in (-1, -2, -3):
+        return None
+    within = misc.is_within_distance_ahead if direction else misc.is_within_distance_rear
+    vehicle, min_distance = None, PROXIMITY
+    for target in vehicle_list:
+        if target.id == ego.id:
+            continue
+        location = target.get_location()
+        waypoint = town.get_waypoint(location)
+        lane_center = misc.get_lane_center(town, location)
+        if lane_center.transform.location.distance(location) > lane_center.lane_width / 2 + 0.1:
+            continue
+        if not misc.test_waypoint(waypoint) or waypoint.lane_id != lane_id:
+            continue
+        if within(location, ego_location, ego_transform, PROXIMITY) and ego_location.distance(location) < min_distance:
+            vehicle, min_distance = target, ego_location.distance(location)
+    return vehicle
+
+
+@pytest.fixture
+def traffic(tmp_path):
+    client = carla.Client('localhost', 2300)
+    world = client.load_world('Town05_Opt')
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = 0.1
+    world.apply_settings(settings)
+    town = world.get_map()
+    spawn_points = town.get_spawn_points()
+    random.Random(0).shuffle(spawn_points)
+    library = world.get_blueprint_library()
+    ego = world.spawn_actor(library.find('vehicle.tesla.model3'), spawn_points[0])
+    for transform in spawn_points[1:60]:
+        world.spawn_actor(library.find('vehicle.audi.etron'), transform).set_autopilot(True)
+    world.tick()
+    planner = LocalPlanner(ego, {'sampling_resolution': 1.0, 'buffer_size': 50, 'vehicle_proximity': PROXIMITY,
+                                 'traffic_light_proximity': 50., 'lane_graph_dir': str(tmp_path)})
+    return world, ego, planner
+
+
+def test_index_matches_vehicle_scan(traffic):
+    world, ego, planner = traffic
+    ego.apply_control(carla.VehicleControl(throttle=.6, steer=.02))
+    found = 0
+    for _ in range(60):
+        world.tick()
+        vehicle_list = world.get_actors().filter('*vehicle*')
+        planner.run_step()
+        info = planner.vehicles_info
+        for name, direction, lane_offset in (('left_front_veh', True, -1), ('left_rear_veh', False, -1),
+                                             ('center_front_veh', True, 0), ('center_rear_veh', False, 0),
+                                             ('right_front_veh', True, 1), ('right_rear_veh', False, 1)):
+            expected = nearest_vehicle(planner, vehicle_list, direction, lane_offset)
+            assert info[name] == expected, name
+            found += expected is not None
+    assert found > 60
+
+
+def test_index_is_built_once_per_tick(traffic):
+    world, ego, planner = traffic
+    first = planner._get_vehicle_index()
+    assert planner._get_vehicle_index() is first
+    assert len(first) == len(world.get_actors().filter('*vehicle*'))
+    assert np.all(np.diff(first.lane_id) >= 0)
+    world.tick()
+    second = planner._get_vehicle_index()
+    assert second is not first and second.frame == first.frame + 1
+    rows = second.lane(-2)
+    assert np.all(second.lane_id[rows] == -2) and np.all(np.delete(second.lane_id, np.r_[rows]) != -2)
@@ -0,0 +1,65 @@
+"""Unit tests for the shared memory weight block in algs.util.weight_broadcast"""
+import multiprocessing as mp
+import torch
+from torch import nn
+
+from algs.util.weight_broadcast import SharedWeights
+
+
+def make_nets(seed):
+    torch.manual_seed(seed)
+    return {'actor': nn.Sequential(nn.Linear(8, 16), nn.ReLU(), nn.Linear(16, 6)), 'critic': nn.Linear(14, 3)}
+
+
+def assert_same_weights(nets, other):
+    for name in nets:
+        for param, other_param in zip(nets[name].parameters(), other[name].parameters()):
+            assert torch.equal(param, other_param)
+
+
+def read_weights(spec, queue):
+    weights = SharedWeights.attach(spec)
+    nets = make_nets(1)
+    update = weights.poll(nets)
+    queue.put((update, [param.sum().item() for param in nets['actor'].parameters()]))
+    weights.close()
+
+
+def test_workers_copy_only_new_versions():
+    learner, worker = make_nets(0), make_nets(1)
+    weights = SharedWeights.create(learner)
+    try:
+        assert weights.poll(worker) is None     # nothing published yet
+        weights.publish(learner, 10, 0.5)
+        assert weights.poll(worker) == (10, 0.5)
+        assert_same_weights(learner, worker)
+        assert weights.poll(worker) is None     # same version
+
+        with torch.no_grad():
+            learner['critic'].weight.add_(1.)
+        weights.publish(learner, 20)
+        assert weights.poll(worker, min_steps=50) is None
+        weights.version[0] += 1                 # the learner is half way through the next version
+        assert weights.poll(worker) is None
+        weights.version[0] += 1
+        assert weights.poll(worker) == (20, None)
+        assert_same_weights(learner, worker)
+    finally:
+        weights.close()
+
+
+def test_weights_reach_another_process():
+    learner = make_nets(0)
+    weights = SharedWeights.create(learner)
+    try:
+        weights.publish(learner, 7, 1.5)
+        ctx = mp.get_context('spawn')
+        queue = ctx.Queue()
+        process = ctx.Process(target=read_weights, args=(weights.spec, queue))
+        process.start()
+        update, sums = queue.get(timeout=60)
+        process.join()
+        assert process.exitcode == 0 and update == (7, 1.5)
+        assert sums == [param.sum().item() for param in learner['actor'].parameters()]
+    finally:
+        weights.close()